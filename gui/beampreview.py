@@ -0,0 +1,321 @@
+'''
+How many beams felix will use for each pixel, before running it
+
+Every pixel of a felix simulation is an eigenproblem in the beams of
+the reflection pool that are close to the Ewald sphere, chosen by
+StrongAndWeakBeamsDetermination, and diagonalising it goes as the cube
+of the number of strong beams.  BeamPreview works out the pool that
+felix.inp and felix.cif give (IMinReflectionPool, RAcceptanceAngle,
+IHolzFLAG) and the strong and weak beams felix would pick for each
+pixel (IMinStrongBeams, IMinWeakBeams), so the beam counts and the
+n^3 cost of each pixel can be seen before a run is submitted.
+
+The g-vectors of the pool are kept in a KD-tree, scipy's cKDTree if it
+is installed and a brute-force search if not.  Since |Sg| <= s means
+|k + g|^2 is within 2Ks of K^2, a shell around -k, each pixel only
+works out Sg for the g-vectors in that shell, and for the few with the
+largest |Ug| that can be strong far from it, instead of the whole
+pool.  The shell is widened for the pixels that turn out to need
+beams from outside it, so the beams are exactly those of felix's
+loops, with Sg and Ug as blochpreview has them.
+
+    preview = BeamPreview.read('samples/GaAs_long')
+    strong, weak = preview.beam_counts()    # 2*IPixelCount square maps
+    cost = strong.astype(float)**3
+
+    python beampreview.py samples/GaAs_long --pool 1000 --strong 150 \\
+        -o beams.png
+
+prints the pool and the range of strong and weak beams and writes the
+strong beam and n^3 maps side by side.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+import blochpreview
+import felixcif
+import inpfile
+from blochpreview import PreviewError, SG_STEP, STRONG_PERTURBATION
+
+# StrongAndWeakBeamsDetermination: the weak beam perturbation strength
+# starts at 0.9 of the strong one and falls by 0.9 until there are enough
+WEAK_FACTOR = 0.9
+# reflections with the largest |Ug| checked at every pixel
+LOUD_BEAMS = 32
+# felix.inp values the command line can change
+OPTIONS = (('pool', 'IMinReflectionPool', int),
+           ('strong', 'IMinStrongBeams', int),
+           ('weak', 'IMinWeakBeams', int),
+           ('acceptance', 'RAcceptanceAngle', float),
+           ('pixels', 'IPixelCount', int))
+
+
+class BruteForceTree(object):
+    '''cKDTree.query_ball_point by checking every point, without scipy'''
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=float)
+
+    def query_ball_point(self, x, r):
+        return [np.flatnonzero(((self.points - p)**2).sum(axis=1) <= r*r)
+                for p in np.atleast_2d(x)]
+
+
+def kth_smallest(pixel, values, k, count):
+    '''k-th smallest finite value of each of count pixels, nan if fewer.
+
+    pixel and values are flat arrays of the same length; k may be an
+    array with one value per pixel.
+    '''
+    k = np.broadcast_to(np.asarray(k), (count,))
+    order = np.lexsort((values, pixel))
+    starts = np.searchsorted(pixel[order], np.arange(count))
+    finite = np.bincount(pixel[np.isfinite(values)], minlength=count)
+    found = (k >= 1) & (finite >= k)
+    result = np.full(count, np.nan)
+    result[found] = values[order][starts[found] + k[found] - 1]
+    return result
+
+
+class BeamPreview(object):
+    '''Reflection pool of a felix.inp and felix.cif and its beams per pixel.
+
+    pool is the (n, 3) hkl of the pool in order of |g|, g their vectors
+    in the microscope frame (1/Angstrom) and ug the Ug of each with the
+    000 beam, including proportional absorption.  loud are the
+    LOUD_BEAMS of the pool with the largest |Ug|, and quiet the largest
+    |Ug| of the others.
+    '''
+
+    def __init__(self, inp, cif):
+        self.inp = inp
+        self.big_k, correction = blochpreview.electron(
+            inp['RAcceleratingVoltage'])
+        recip = blochpreview.microscope_frame(
+            cif, np.array(inp['IIncidentBeamDirection']), inp['IXDirection'])
+        self.pool = blochpreview.accepted_pool(inp, cif, recip, self.big_k)
+        self.g = self.pool.dot(recip)
+        self.g_magnitude = np.linalg.norm(self.g, axis=1)
+        self.ug = blochpreview.structure_factors(
+            self.pool, recip, blochpreview.cell_atoms(cif, inp),
+            correction/(math.pi*cif.volume))
+        if inp['IAbsorbFLAG'] in (1, 2):
+            self.ug = self.ug*(1 + 1j*inp['RAbsorptionPer']/100)
+        self.tree = (cKDTree if cKDTree is not None
+                     else BruteForceTree)(self.g)
+        # the loud beams go into every shell, so the quiet ones can be
+        # left out of it sooner
+        size = np.abs(self.ug)
+        size[0] = 0.0
+        order = np.argsort(-size, kind='mergesort')
+        self.loud = np.sort(order[:min(LOUD_BEAMS, len(order) - 1)])
+        self.is_loud = np.zeros(len(self.pool), dtype=bool)
+        self.is_loud[self.loud] = True
+        self.quiet = size[~self.is_loud].max()
+        if inp['IMinStrongBeams'] + inp['IMinWeakBeams'] > len(self.pool):
+            raise PreviewError('a pool of %d reflections has too few for %d '
+                               'strong and %d weak beams'
+                               % (len(self.pool), inp['IMinStrongBeams'],
+                                  inp['IMinWeakBeams']))
+
+    @classmethod
+    def read(cls, directory, inp=None):
+        '''From the felix.inp (unless given) and felix.cif of a directory'''
+        if inp is None:
+            inp = inpfile.InpFile.read(os.path.join(directory, 'felix.inp'))
+        cif = felixcif.read_cif(os.path.join(directory, 'felix.cif'),
+                                inp['RDebyeWallerConstant'])
+        return cls(inp, cif)
+
+    def tilts(self, pixels=None):
+        '''(mask, k) of the pixels, 2*IPixelCount square by default'''
+        if pixels is None:
+            pixels = self.inp['IPixelCount']
+        return blochpreview.pixel_tilts(self.inp, self.big_k, pixels)
+
+    def shell(self, k, s):
+        '''(pixel, beam, Sg) of the g-vectors that may have |Sg| <= s.
+
+        For each of (n, 3) k, the pool g-vectors with |2k.g + g^2| <=
+        2Ks, which includes all those with |Sg| <= s, and the loud
+        ones; pixel numbers rows of k and beam the pool.
+        '''
+        big_k = self.big_k
+        reach = 2*big_k*s*(1 + 1e-9)
+        found = self.tree.query_ball_point(-k, math.sqrt(big_k**2 + reach))
+        found = [np.asarray(f, dtype=int) for f in found]
+        pixel = np.repeat(np.arange(len(k)), [len(f) for f in found])
+        beam = (np.concatenate(found) if found
+                else np.zeros(0, dtype=int))
+        k_dot_g = np.einsum('ij,ij->i', k[pixel], self.g[beam])
+        inside = ((np.abs(2*k_dot_g + self.g_magnitude[beam]**2) <= reach) &
+                  ~self.is_loud[beam])
+        pixel = np.concatenate([pixel[inside],
+                                np.repeat(np.arange(len(k)), len(self.loud))])
+        beam = np.concatenate([beam[inside], np.tile(self.loud, len(k))])
+        k_dot_g = np.einsum('ij,ij->i', k[pixel], self.g[beam])
+        return pixel, beam, blochpreview.deviation(
+            k_dot_g, self.g_magnitude[beam], big_k)
+
+    def select(self, pixel, beam, sg, count):
+        '''(strong, weak, reach) of the beams of a shell.
+
+        strong and weak are True for the pairs of (pixel, beam) that are
+        strong and weak beams of the pixel; reach is the |Sg| each pixel
+        needs the shell to hold, inf if it has too few beams.  Beams
+        outside the shell are quiet, so with |Sg| > s their perturbation
+        strength is below quiet/s.
+        '''
+        inp = self.inp
+        size = np.abs(sg)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            strength = np.abs(self.ug[beam])/size
+        # the 000 beam is always strong
+        strength[beam == 0] = 1000.0
+        perturbing = strength >= STRONG_PERTURBATION
+
+        # the Sg limit goes up in steps until there are IMinStrongBeams
+        needed = inp['IMinStrongBeams'] - np.bincount(pixel[perturbing],
+                                                      minlength=count)
+        last = kth_smallest(pixel, np.where(perturbing, np.inf, size),
+                            np.clip(needed, 1, None), count)
+        limit = np.where(needed > 0, (np.floor(last/SG_STEP) + 1)*SG_STEP,
+                         SG_STEP)
+        strong = perturbing | (size < limit[pixel])
+        reach = np.maximum(np.where(np.isnan(limit), np.inf, limit),
+                           self.quiet/STRONG_PERTURBATION)
+
+        # then the weak beam perturbation strength goes down in steps
+        wanted = inp['IMinWeakBeams']
+        weak = np.zeros(len(beam), dtype=bool)
+        if wanted > 0:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ranked = kth_smallest(
+                    pixel, np.where(strong | (strength == 0), np.inf,
+                                    -strength), wanted, count)
+                first = WEAK_FACTOR*STRONG_PERTURBATION
+                steps = np.maximum(np.ceil(
+                    np.log(-ranked/first)/math.log(WEAK_FACTOR) - 1e-9), 0)
+                threshold = first*WEAK_FACTOR**steps
+                reach = np.maximum(reach, np.where(
+                    np.isnan(threshold), np.inf, self.quiet/threshold))
+            weak = ~strong & (strength >= threshold[pixel])
+        return strong, weak, reach
+
+    def beams(self, k, chunk=512):
+        '''(strong, weak) number of beams of each of (n, 3) k.
+
+        chunk is the most pixels whose shells are searched at once.  Each
+        chunk starts with the shell the last one needed, since
+        neighbouring pixels need much the same.
+        '''
+        strong = np.zeros(len(k), dtype=int)
+        weak = np.zeros(len(k), dtype=int)
+        widest = max(SG_STEP, self.quiet/STRONG_PERTURBATION)
+        for start in range(0, len(k), chunk):
+            todo = np.arange(start, min(start + chunk, len(k)))
+            s = widest
+            widest = max(SG_STEP, self.quiet/STRONG_PERTURBATION)
+            while len(todo):
+                pixel, beam, sg = self.shell(k[todo], s)
+                is_strong, is_weak, reach = self.select(pixel, beam, sg,
+                                                        len(todo))
+                # a shell with the whole pool in it is wide enough
+                whole = (np.bincount(pixel, minlength=len(todo)) ==
+                         len(self.pool))
+                if np.any(whole & np.isinf(reach)):
+                    raise PreviewError('a pool of %d reflections has too few '
+                                       'beams for some pixels'
+                                       % len(self.pool))
+                done = (reach <= s) | whole
+                widest = max(widest, np.max(np.append(
+                    reach[done & np.isfinite(reach)], 0)))
+                strong[todo[done]] = np.bincount(
+                    pixel[is_strong], minlength=len(todo))[done]
+                weak[todo[done]] = np.bincount(
+                    pixel[is_weak], minlength=len(todo))[done]
+                todo = todo[~done]
+                if len(todo):
+                    # wide enough for all of them, or at least twice as wide
+                    s = max(2*s, np.max(np.where(np.isfinite(reach[~done]),
+                                                 reach[~done], 2*s)))
+        if np.any(strong + self.inp['IMinWeakBeams'] > len(self.pool)):
+            raise PreviewError('a pool of %d reflections has too few for the '
+                               'strong and %d weak beams of some pixels'
+                               % (len(self.pool), self.inp['IMinWeakBeams']))
+        return strong, weak
+
+    def beam_counts(self, pixels=None):
+        '''(strong, weak) beams of each pixel, 0 outside the mask'''
+        mask, k = self.tilts(pixels)
+        strong = np.zeros(mask.shape, dtype=int)
+        weak = np.zeros(mask.shape, dtype=int)
+        strong[mask], weak[mask] = self.beams(k)
+        return strong, weak
+
+
+def summary(preview, strong, weak):
+    '''Lines describing the beam count maps of a BeamPreview'''
+    used = strong > 0
+    cost = strong[used].astype(float)**3
+    lines = ['%d reflections in the pool, %d pixels%s' % (
+        len(preview.pool), used.sum(),
+        '' if cKDTree is not None else ' (no scipy, brute-force search)')]
+    for name, counts in (('strong', strong[used]), ('weak', weak[used])):
+        lines.append('%-6s beams %4d to %4d, mean %.1f' % (
+            name, counts.min(), counts.max(), counts.mean()))
+    lines.append('n^3 per pixel %.3g to %.3g, total %.3g; the 10%% most '
+                 'expensive pixels are %.0f%% of it' % (
+                     cost.min(), cost.max(), cost.sum(),
+                     100*np.sort(cost)[-max(1, len(cost)//10):].sum()
+                     / cost.sum()))
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Strong and weak beams per pixel of a felix sample')
+    parser.add_argument('directory', help='directory with felix.inp and '
+                        'felix.cif')
+    for option, name, kind in OPTIONS:
+        parser.add_argument('--' + option, type=kind, default=None,
+                            help='%s instead of that of felix.inp' % name)
+    parser.add_argument('-o', '--output', default=None,
+                        help='PNG of the strong beam and n^3 maps')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        inp = inpfile.InpFile.read(os.path.join(args.directory, 'felix.inp'))
+        for option, name, kind in OPTIONS:
+            if getattr(args, option) is not None:
+                inp[name] = getattr(args, option)
+        preview = BeamPreview.read(args.directory, inp)
+        strong, weak = preview.beam_counts()
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    for line in summary(preview, strong, weak):
+        print(line)
+    print('in %.2f s' % (time.time() - start))
+    if args.output:
+        import binexport
+        maps = np.array([[strong.astype(float)], [strong.astype(float)**3]])
+        binexport.write_png(args.output, blochpreview.montage(maps))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+'''
+Batch export of felix .bin output to PNG or GIF
+
+Every .bin image below a directory (a single output directory or a whole
+sample_outputs tree) is written next to its source with the same name and
+a .png or .gif extension.  Files are shared out over a process pool, and
+any image whose output is already newer than its .bin is skipped, so
+exporting a run again only converts what has changed.
+
+Intensities are scaled to 0..255 either per image (each image uses its
+own full range) or per stack (one range over every image exported, so
+images can be compared by eye).  A per-stack export rescales everything
+it converts, but skipped files keep the range they were written with;
+use force to rewrite them after new output has been added.
+
+PNG is written directly with zlib.  GIF needs Pillow.
+
+    python binexport.py ../samples/GaAs_long/sample_outputs -j 8
+    python binexport.py outdir --scale stack --format gif --force
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+import felixbin
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMATS = ('png', 'gif')
+SCALES = ('image', 'stack')
+
+
+def find_bins(path):
+    '''Every felix .bin image below path, sorted'''
+    found = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        found.extend(os.path.join(root, f) for f in sorted(files)
+                     if felixbin.parse_hkl(f) is not None)
+    return found
+
+
+def output_name(binfile, fmt):
+    return os.path.splitext(binfile)[0] + '.' + fmt
+
+
+def is_stale(binfile, outfile):
+    '''True if outfile is missing or older than binfile'''
+    try:
+        return os.path.getmtime(outfile) < os.path.getmtime(binfile)
+    except OSError:
+        return True
+
+
+def write_png(filename, grey):
+    '''Write a (y, x) uint8 array as an 8-bit greyscale PNG'''
+    grey = np.ascontiguousarray(grey, dtype=np.uint8)
+    height, width = grey.shape
+    # every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = grey
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                           8, 0, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def write_gif(filename, grey):
+    '''Write a (y, x) uint8 array as a greyscale GIF (needs Pillow)'''
+    if Image is None:
+        raise RuntimeError('GIF export needs Pillow (pip install pillow)')
+    Image.fromarray(np.ascontiguousarray(grey, dtype=np.uint8),
+                    mode='L').save(filename)
+
+
+WRITERS = {'png': write_png, 'gif': write_gif}
+
+
+def image_range(binfile):
+    '''(min, max) of one .bin image, ignoring NaN'''
+    image = felixbin.open_bin(binfile)
+    return float(np.nanmin(image)), float(np.nanmax(image))
+
+
+def export_one(job):
+    '''Convert one .bin; job is (binfile, outfile, fmt, vmin, vmax).
+
+    Returns (binfile, error message or None) so that one bad file does
+    not stop the rest of the batch.
+    '''
+    binfile, outfile, fmt, vmin, vmax = job
+    try:
+        grey = felixbin.to_uint8(felixbin.open_bin(binfile), vmin, vmax)
+        WRITERS[fmt](outfile, grey)
+    except (ValueError, IOError, OSError, RuntimeError) as e:
+        return binfile, str(e)
+    return binfile, None
+
+
+def export(path, fmt='png', scale='image', processes=None, force=False,
+           progress=None):
+    '''Export every .bin below path.
+
+    processes is the pool size (default: all cores, 1 runs in-process),
+    progress an optional callable(done, total) called after each image.
+    Returns a dict with lists 'written', 'skipped' and 'failed'
+    (the last as (binfile, message) pairs).
+    '''
+    if fmt not in FORMATS:
+        raise ValueError('format must be one of %s' % (FORMATS,))
+    if scale not in SCALES:
+        raise ValueError('scale must be one of %s' % (SCALES,))
+    if fmt == 'gif' and Image is None:
+        raise RuntimeError('GIF export needs Pillow (pip install pillow)')
+
+    binfiles = find_bins(path)
+    todo = [f for f in binfiles
+            if force or is_stale(f, output_name(f, fmt))]
+    result = {'written': [], 'skipped': sorted(set(binfiles) - set(todo)),
+              'failed': []}
+    if not todo:
+        return result
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(todo)))
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    # large chunks keep the per-task overhead down on big runs
+    chunksize = max(1, len(todo)//(4*processes))
+    try:
+        vmin = vmax = None
+        if scale == 'stack':
+            # the range has to cover every image, converted or not
+            if pool is not None:
+                ranges = pool.map(image_range, binfiles, chunksize)
+            else:
+                ranges = [image_range(f) for f in binfiles]
+            vmin = min(r[0] for r in ranges)
+            vmax = max(r[1] for r in ranges)
+        jobs = [(f, output_name(f, fmt), fmt, vmin, vmax) for f in todo]
+        if pool is not None:
+            done = pool.imap_unordered(export_one, jobs, chunksize)
+        else:
+            done = map(export_one, jobs)
+        for n, (binfile, error) in enumerate(done):
+            if error is None:
+                result['written'].append(binfile)
+            else:
+                result['failed'].append((binfile, error))
+            if progress is not None:
+                progress(n + 1, len(jobs))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    result['written'].sort()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert felix .bin output to PNG or GIF')
+    parser.add_argument('path', help='output directory or sample_outputs')
+    parser.add_argument('-f', '--format', choices=FORMATS, default='png')
+    parser.add_argument('-s', '--scale', choices=SCALES, default='image',
+                        help='intensity range per image or over all images')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--force', action='store_true',
+                        help='rewrite images that are already up to date')
+    args = parser.parse_args(argv)
+
+    try:
+        result = export(args.path, args.format, args.scale, args.processes,
+                        args.force)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+    for binfile, error in result['failed']:
+        print('failed: %s: %s' % (binfile, error), file=sys.stderr)
+    print('%d written, %d up to date, %d failed'
+          % (len(result['written']), len(result['skipped']),
+             len(result['failed'])))
+    return 1 if result['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
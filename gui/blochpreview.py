@@ -0,0 +1,444 @@
+'''
+Quick-look LACBED patterns, without running felixrefine
+
+BlochPreview goes through the same steps as a felix simulation of
+felix.inp, felix.cif and felix.hkl, written for whole arrays at once:
+
+    - the reflection pool of HKLCount/HKLMake, sorted by |g| (HKLSort)
+    - the Ug matrix of UgMatrix, Kirkland scattering factors with
+      occupancy and isotropic Debye-Waller factors
+    - per pixel, the deviation parameters and strong beams of
+      BlochCoefficientCalculation and StrongAndWeakBeamsDetermination
+    - the structure matrix of each pixel, diagonalised and propagated
+      to each thickness as in CreateWaveFunctions
+
+Rather than one eigenproblem per pixel, the structure matrices of all
+pixels with the same number of strong beams are stacked and solved in
+batched numpy.linalg.eig calls.  A coarse grid covering the same
+convergence angle (pixels=16 is 32x32 instead of 2*IPixelCount square)
+then takes seconds on one core, which is quick enough to try out
+IPixelCount, beam counts and thicknesses before a real run.
+
+It is a preview, not felix: scattering factors are always Kirkland's,
+Bird & King absorption (IAbsorbFLAG 2) is taken as proportional
+absorption of RAbsorptionPer, weak beams (IMinWeakBeams) are left out,
+higher order Laue zones are not treated specially, and no blur is
+applied.
+
+    preview = BlochPreview.read('samples/GaAs_short')
+    images = preview.simulate(pixels=16)    # (hkl, thickness, 32, 32)
+    preview.hkls                            # reflection of each image
+
+    python blochpreview.py samples/GaAs_short --pixels 16 -o preview.png
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+import felixcif
+import inpfile
+from kirkland import kirkland
+
+# physical constants as smodules.f90 has them
+SPEED_OF_LIGHT = 2.99762458e8
+ELECTRON_MASS = 9.10938291e-31
+PLANCK_CONSTANT = 6.62606957e-34
+ELECTRON_CHARGE = 1.602176565e-19
+ANGSTROM = 1e10
+# felixrefine's RHOLZAcceptanceAngle and first IHKLMAXValue
+HOLZ_ANGLE = math.radians(2.0)
+FIRST_HKL_MAX = 5
+# StrongAndWeakBeamsDetermination: Sg limit step, perturbation strength
+SG_STEP = 0.005
+STRONG_PERTURBATION = 0.0025/SG_STEP
+# pixels either side of the centre of a preview
+PREVIEW_PIXELS = 16
+
+
+class PreviewError(ValueError):
+    pass
+
+
+def electron(kilovolts):
+    '''(K in 1/Angstrom including 2pi, relativistic correction)'''
+    energy = ELECTRON_CHARGE*kilovolts*1000
+    rest = ELECTRON_MASS*SPEED_OF_LIGHT**2
+    velocity = SPEED_OF_LIGHT*math.sqrt(1 - (rest/(energy + rest))**2)
+    wavelength = (PLANCK_CONSTANT/(math.sqrt(2*ELECTRON_MASS*energy) *
+                                   math.sqrt(1 + energy/(2*rest)))*ANGSTROM)
+    return (2*math.pi/wavelength,
+            1/math.sqrt(1 - (velocity/SPEED_OF_LIGHT)**2))
+
+
+def microscope_frame(cif, zone, x_direction):
+    '''Rows a*, b*, c* (1/Angstrom, with 2pi) in the microscope frame.
+
+    As ReciprocalLattice: x along the reciprocal vector x_direction, z
+    along the real-space beam direction zone.
+    '''
+    real = cif.orthogonal()
+    recip = 2*math.pi*np.linalg.inv(real).T
+    recip[np.abs(recip) < felixcif.TINY] = 0.0
+    x = np.dot(x_direction, recip)
+    z = np.dot(zone, real)
+    x /= np.linalg.norm(x)
+    z /= np.linalg.norm(z)
+    to_microscope = np.array([x, np.cross(z, x), z])
+    return recip.dot(to_microscope.T)
+
+
+def allowed(hkl, lattice):
+    '''Reflections of (n, 3) hkl not absent for a lattice letter'''
+    h, k, l = hkl.T
+    if lattice == 'F':
+        return (h % 2 == k % 2) & (k % 2 == l % 2)
+    if lattice == 'I':
+        return (h + k + l) % 2 == 0
+    if lattice == 'A':
+        return (k + l) % 2 == 0
+    if lattice == 'B':
+        return (h + l) % 2 == 0
+    if lattice == 'C':
+        return (h + k) % 2 == 0
+    if lattice == 'R':
+        return (h - k + l) % 3 == 0
+    if lattice == 'V':
+        return (-h + k + l) % 3 == 0
+    return np.ones(len(hkl), dtype=bool)
+
+
+def candidate_hkls(recip, lattice, zone, hkl_max, holz=False):
+    '''The reflections HKLCount counts for IHKLMAXValue hkl_max'''
+    lengths = np.linalg.norm(recip, axis=1)
+    longest = lengths.max()
+    # hkl_max along the longest reciprocal vector, more along shorter ones
+    limits = [hkl_max if m == longest
+              else hkl_max*int(math.floor(longest/m + 0.5)) for m in lengths]
+    grid = np.mgrid[-limits[0]:limits[0] + 1, -limits[1]:limits[1] + 1,
+                    -limits[2]:limits[2] + 1].reshape(3, -1).T
+    grid = grid[allowed(grid, lattice)]
+    along = grid.dot(zone)
+    if not holz:
+        return grid[along == 0]
+    norms = np.linalg.norm(grid, axis=1)*np.linalg.norm(zone)
+    norms[norms == 0] = 1
+    return grid[np.abs(along)/norms <= math.sin(HOLZ_ANGLE)]
+
+
+def reflection_pool(recip, lattice, zone, min_pool, holz=False):
+    '''(n, 3) hkl of the pool, at least min_pool, in order of |g|'''
+    hkl_max = FIRST_HKL_MAX
+    hkl = candidate_hkls(recip, lattice, zone, hkl_max, holz)
+    while len(hkl) < min_pool:
+        hkl_max += 1
+        if hkl_max > 100:
+            raise PreviewError('no pool of %d reflections for zone %s'
+                               % (min_pool, list(zone)))
+        hkl = candidate_hkls(recip, lattice, zone, hkl_max, holz)
+    return hkl[np.argsort(np.linalg.norm(hkl.dot(recip), axis=1),
+                          kind='mergesort')]
+
+
+def cell_atoms(cif, inp):
+    '''felixcif unique_atoms, with UgMatrix's Debye-Waller default.
+
+    UgMatrix uses the felix.inp value for unrealistic cif ones.
+    '''
+    atoms = cif.unique_atoms()
+    b_iso = atoms['b_iso']
+    atoms['b_iso'] = np.where((b_iso > 10) | (b_iso < 0),
+                              inp['RDebyeWallerConstant'], b_iso)
+    return atoms
+
+
+def structure_factors(hkl, recip, atoms, prefactor):
+    '''Ug of each of (n, 3) hkl without absorption, as UgMatrix'''
+    g = np.linalg.norm(hkl.dot(recip), axis=1)
+    b_iso = atoms['b_iso'][:, None]
+    f = (kirkland(atoms['numbers'][:, None], g[None, :]) *
+         atoms['occupancy'][:, None] *
+         np.exp(-b_iso*g[None, :]**2/(16*math.pi**2)))
+    # g.r = 2pi (h x + k y + l z) for fractional atom positions
+    phase = np.exp(-2j*math.pi*hkl.dot(atoms['positions'].T))
+    return prefactor*np.einsum('au,ua->u', f, phase)
+
+
+def ug_matrix(hkl, recip, atoms, prefactor):
+    '''Ug(i, j) of g = hkl[i] - hkl[j] without absorption, as UgMatrix.
+
+    Each different g is only calculated once; the diagonal is zero.
+    '''
+    n = len(hkl)
+    differences = (hkl[:, None, :] - hkl[None, :, :]).reshape(-1, 3)
+    unique, inverse = np.unique(differences, axis=0, return_inverse=True)
+    ug = structure_factors(unique, recip, atoms, prefactor)
+    matrix = ug[np.ravel(inverse)].reshape(n, n)
+    np.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def accepted_pool(inp, cif, recip, big_k):
+    '''The reflection pool of felix.inp, within RAcceptanceAngle if set'''
+    pool = reflection_pool(recip, cif.lattice,
+                           np.array(inp['IIncidentBeamDirection']),
+                           inp['IMinReflectionPool'], inp['IHolzFLAG'] == 1)
+    if inp['RAcceptanceAngle'] != 0:
+        magnitude = np.linalg.norm(pool.dot(recip), axis=1)
+        pool = pool[magnitude <= big_k*math.tan(
+            math.radians(inp['RAcceptanceAngle']))]
+    return pool
+
+
+def pixel_tilts(inp, big_k, pixels=PREVIEW_PIXELS):
+    '''(mask, k) of a 2*pixels square covering the convergence angle.
+
+    mask is the (2*pixels, 2*pixels) IMaskFLAG mask; k the (n, 3)
+    incident wave vectors of its pixels, x along image columns.
+    '''
+    size = 2*pixels
+    centre = pixels + 0.5
+    rows, columns = np.mgrid[1:size + 1, 1:size + 1]
+    if inp['IMaskFLAG'] == 0:
+        mask = np.hypot(rows - centre, columns - centre) <= centre
+    else:
+        mask = np.ones((size, size), dtype=bool)
+    step = 2*math.pi*inp['ROuterConvergenceAngle']/pixels
+    kx = (columns[mask] - centre)*step
+    ky = (rows[mask] - centre)*step
+    kz = np.sqrt(big_k**2 - kx**2 - ky**2)
+    return mask, np.column_stack([kx, ky, kz])
+
+
+def deviation(k_dot_g, magnitude, big_k):
+    '''Deviation parameters Sg (1/Angstrom) from k.g and |g|.
+
+    As BlochCoefficientCalculation; the arrays broadcast together and
+    Sg is zero where |g| is.
+    '''
+    magnitude = np.broadcast_to(magnitude, np.broadcast(k_dot_g,
+                                                        magnitude).shape)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # k' is the incident beam, k0 the one at the Bragg condition
+        along = k_dot_g/magnitude
+        k_prime = np.sqrt(big_k**2 - along**2)
+        k0_dot_k = (-magnitude/2*along +
+                    np.sqrt(big_k**2 - magnitude**2/4)*k_prime)
+        sign = np.where(2*k_dot_g + magnitude**2 >= 0, -1.0, 1.0)
+        sg = sign*magnitude*np.sqrt(
+            np.maximum(2*(big_k**2 - k0_dot_k), 0))/big_k
+    return np.where(magnitude == 0, 0.0, sg)
+
+
+def thicknesses(inp):
+    '''Thicknesses (Angstrom) of a felix.inp, as IThicknessCount'''
+    first, last = inp['RInitialThickness'], inp['RFinalThickness']
+    step = inp['RDeltaThickness']
+    count = int(math.floor((last - first)/step + 0.5)) + 1 if step else 1
+    return first + step*np.arange(max(count, 1))
+
+
+class BlochPreview(object):
+    '''Reflection pool, Ug matrix and geometry of a felix simulation.
+
+    hkls are the reflections of felix.hkl found in the pool, in the
+    order of the images simulate() returns; missing are those that are
+    not in it.
+    '''
+
+    def __init__(self, inp, cif, hkls):
+        self.inp = inp
+        self.big_k, correction = electron(inp['RAcceleratingVoltage'])
+        self.recip = microscope_frame(cif,
+                                      np.array(inp['IIncidentBeamDirection']),
+                                      inp['IXDirection'])
+        pool = accepted_pool(inp, cif, self.recip, self.big_k)
+        self.pool = pool
+        self.g = pool.dot(self.recip)
+        self.g_magnitude = np.linalg.norm(self.g, axis=1)
+        self.ug = ug_matrix(pool, self.recip, cell_atoms(cif, inp),
+                            correction/(math.pi*cif.volume))
+        if inp['IAbsorbFLAG'] in (1, 2):
+            self.ug = self.ug*(1 + 1j*inp['RAbsorptionPer']/100)
+
+        index = dict((tuple(h), i) for i, h in enumerate(pool.tolist()))
+        self.hkls, self.missing, outputs = [], [], []
+        for hkl in hkls:
+            hkl = tuple(hkl)
+            if hkl in self.hkls:
+                continue
+            if hkl in index:
+                self.hkls.append(hkl)
+                outputs.append(index[hkl])
+            else:
+                self.missing.append(hkl)
+        if not outputs:
+            raise PreviewError('none of the reflections of felix.hkl are in '
+                               'the pool of %d' % len(pool))
+        self.outputs = np.array(outputs)
+        if inp['IMinStrongBeams'] + inp['IMinWeakBeams'] > len(pool):
+            raise PreviewError('a pool of %d reflections has too few for %d '
+                               'strong and %d weak beams'
+                               % (len(pool), inp['IMinStrongBeams'],
+                                  inp['IMinWeakBeams']))
+
+    @classmethod
+    def read(cls, directory, inp=None):
+        '''From the felix.inp (unless given), felix.cif and felix.hkl'''
+        import expimages
+        if inp is None:
+            inp = inpfile.InpFile.read(os.path.join(directory, 'felix.inp'))
+        cif = felixcif.read_cif(os.path.join(directory, 'felix.cif'),
+                                inp['RDebyeWallerConstant'])
+        path = os.path.join(directory, 'felix.hkl')
+        if not os.path.isfile(path):
+            raise PreviewError('no felix.hkl in %s' % directory)
+        return cls(inp, cif, expimages.read_hkl(path))
+
+    def tilts(self, pixels=PREVIEW_PIXELS):
+        '''(mask, k) of a 2*pixels square covering the convergence angle.
+
+        mask is the (2*pixels, 2*pixels) IMaskFLAG mask; k the (n, 3)
+        incident wave vectors of its pixels, x along image columns.
+        '''
+        return pixel_tilts(self.inp, self.big_k, pixels)
+
+    def deviations(self, k):
+        '''(pixels, pool) deviation parameters Sg (1/Angstrom)'''
+        return deviation(k.dot(self.g.T), self.g_magnitude, self.big_k)
+
+    def strong_beams(self, sg):
+        '''(pixels, pool) True for the strong beams of each pixel.
+
+        StrongAndWeakBeamsDetermination raises the Sg limit in steps of
+        0.005 until there are IMinStrongBeams; that limit is worked out
+        directly here from the sorted |Sg| of each pixel.
+        '''
+        size = np.abs(sg)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            strength = np.abs(self.ug[:, 0])/size
+        strength[:, 0] = 1000.0
+        strong = strength >= STRONG_PERTURBATION
+        needed = self.inp['IMinStrongBeams'] - strong.sum(axis=1)
+        others = np.sort(np.where(strong, np.inf, size), axis=1)
+        last = others[np.arange(len(sg)), np.clip(needed - 1, 0, None)]
+        steps = np.where(needed > 0, np.floor(last/SG_STEP) + 1, 1)
+        return strong | (size < (steps*SG_STEP)[:, None])
+
+    def beam_counts(self, pixels=PREVIEW_PIXELS):
+        '''(2*pixels, 2*pixels) strong beams of each pixel, 0 outside'''
+        mask, k = self.tilts(pixels)
+        counts = np.zeros(mask.shape, dtype=int)
+        counts[mask] = self.strong_beams(self.deviations(k)).sum(axis=1)
+        return counts
+
+    def simulate(self, pixels=PREVIEW_PIXELS, thickness=None, chunk=256):
+        '''(hkl, thickness, 2*pixels, 2*pixels) intensities.
+
+        thickness (Angstrom) defaults to those of felix.inp; chunk is
+        the most eigenproblems stacked into one numpy.linalg.eig call.
+        '''
+        if thickness is None:
+            thickness = thicknesses(self.inp)
+        thickness = np.atleast_1d(np.asarray(thickness, dtype=float))
+        mask, k = self.tilts(pixels)
+        sg = self.deviations(k)
+        strong = self.strong_beams(sg)
+        counts = strong.sum(axis=1)
+        intensity = np.zeros((len(self.outputs), len(thickness), len(k)))
+        # off-diagonal Ug/2K, Sg on the diagonal: Spence's structure matrix
+        scale = (2*math.pi)**2/(2*self.big_k)
+
+        for n in np.unique(counts):
+            same = np.flatnonzero(counts == n)
+            for start in range(0, len(same), chunk):
+                px = same[start:start + chunk]
+                # beams in pool order, so the 000 beam comes first
+                beams = np.nonzero(strong[px])[1].reshape(len(px), n)
+                matrix = scale*self.ug[beams[:, :, None], beams[:, None, :]]
+                diagonal = np.arange(n)
+                matrix[:, diagonal, diagonal] = sg[px[:, None], beams]
+                values, vectors = np.linalg.eig(matrix)
+                # unit amplitude in 000 at the top surface
+                top = np.zeros((len(px), n, 1), dtype=complex)
+                top[:, 0, 0] = 1
+                alpha = np.linalg.solve(vectors, top)[:, :, 0]
+                # where each output reflection is among the beams, if it is
+                found = beams[:, None, :] == self.outputs[None, :, None]
+                present = found.any(axis=2)
+                rows = vectors[np.arange(len(px))[:, None],
+                               found.argmax(axis=2)]
+                for i, t in enumerate(thickness):
+                    psi = np.einsum('poj,pj->po', rows,
+                                    np.exp(1j*t*values)*alpha)
+                    intensity[:, i, px] = np.where(present,
+                                                   np.abs(psi)**2, 0).T
+
+        images = np.zeros((len(self.outputs), len(thickness)) + mask.shape)
+        images[:, :, mask] = intensity
+        return images
+
+
+def montage(images, gap=1):
+    '''Images (hkl, thickness, y, x) side by side, one row per thickness.
+
+    Each image is scaled to 0..255 by its own range.
+    '''
+    count, rows, height, width = images.shape
+    grey = np.zeros((rows*(height + gap) - gap, count*(width + gap) - gap),
+                    dtype=np.uint8)
+    for i in range(count):
+        for j in range(rows):
+            image = images[i, j]
+            low, high = image.min(), image.max()
+            scaled = (image - low)/(high - low) if high > low else 0*image
+            grey[j*(height + gap):j*(height + gap) + height,
+                 i*(width + gap):i*(width + gap) + width] = np.round(
+                     255*scaled)
+    return grey
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Quick-look LACBED patterns of a felix sample')
+    parser.add_argument('directory', help='directory with felix.inp, '
+                        'felix.cif and felix.hkl')
+    parser.add_argument('--pixels', type=int, default=PREVIEW_PIXELS,
+                        help='pixels either side of the centre, like '
+                        'IPixelCount (default: %d)' % PREVIEW_PIXELS)
+    parser.add_argument('--thickness', type=float, nargs='+', default=None,
+                        help='thicknesses in Angstrom (default: those of '
+                        'felix.inp)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='PNG of the patterns, a row per thickness')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    try:
+        preview = BlochPreview.read(args.directory)
+        images = preview.simulate(args.pixels, args.thickness)
+        counts = preview.beam_counts(args.pixels)
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    used = counts[counts > 0]
+    print('%d reflections in the pool, %d to %d strong beams (mean %.1f)'
+          % (len(preview.pool), used.min(), used.max(), used.mean()))
+    for hkl in preview.missing:
+        print('%s is not in the pool' % list(hkl))
+    print('%d patterns of %dx%d pixels at %d thicknesses in %.2f s'
+          % (len(preview.hkls), images.shape[3], images.shape[2],
+             images.shape[1], time.time() - start))
+    if args.output:
+        import binexport
+        binexport.write_png(args.output, montage(images))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
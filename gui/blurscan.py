@@ -0,0 +1,190 @@
+'''
+Re-fit RBlurRadius from the unblurred simulations felixrefine saves
+
+With IUnblurredFLAG = 1 in felix.inp, felixrefine writes the simulated
+images of every pattern and thickness as they were before BlurG, to
+<output directory>_unblurred.fxu next to the usual output (see
+WriteUnblurredStack in src/felix/write_output_mod.f90).  Blurring is a
+pure post-process, so any number of radii can be tried on that stack
+and scored against the experimental images here, in seconds, instead
+of re-running felix once per radius.
+
+BlurG convolves each image with a normalised Gaussian of half-width
+NINT(3*radius) along each axis in turn, repeating edge pixels, and then
+stretches the result back to the minimum and maximum of the input.
+blur() gives the same images through FFTs: the stack is padded with its
+edge pixels and transformed once, and each radius then costs only a
+multiplication and an inverse transform.
+
+    cd samples/GaAs_short
+    python blurscan.py . GaAs_I0012_085nm_080x080_unblurred.fxu \\
+        --radii 0 0.5 1 1.5 2 2.5 3
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import struct
+import sys
+
+import numpy as np
+
+import figureofmerit
+import inpfile
+
+MAGIC = b'FXUB'
+VERSION = 1
+# 'FXUB', version, size, patterns, thicknesses, iteration; three reals
+HEADER = struct.Struct('<4s5i3d')
+DTYPE = np.dtype('<f4')
+TINY = 1.0e-9
+
+
+class UnblurredStack(object):
+    '''A .fxu file: images are a read-only (pattern, thickness, y, x) view'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                raise ValueError('%s is too short for a .fxu file' % path)
+            (magic, version, self.size, patterns, thicknesses,
+             self.iteration, self.initial_thickness, self.delta_thickness,
+             self.blur_radius) = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('%s is not a version %d .fxu file'
+                                 % (path, VERSION))
+            hkls = np.fromfile(f, dtype='<i4', count=3*patterns)
+        self.hkls = [tuple(int(i) for i in h) for h in hkls.reshape(-1, 3)]
+        offset = HEADER.size + hkls.nbytes
+        expected = offset + patterns*thicknesses*self.size**2*DTYPE.itemsize
+        if os.path.getsize(path) != expected:
+            raise ValueError('%s is %d bytes, expected %d' % (
+                path, os.path.getsize(path), expected))
+        # Fortran order (x, y, pattern, thickness), where a .bin row is
+        # one x: transposing the C view gives felix's rows as rows
+        data = np.memmap(path, dtype=DTYPE, mode='r', offset=offset,
+                         shape=(thicknesses, patterns, self.size, self.size))
+        self.images = data.transpose(1, 0, 3, 2)
+
+    @property
+    def thicknesses(self):
+        '''Thickness of each image column in Angstroms'''
+        return [self.initial_thickness + i*self.delta_thickness
+                for i in range(self.images.shape[1])]
+
+
+def kernel_radius(radius):
+    '''NINT(3*radius), the half-width of BlurG's kernel'''
+    return int(np.floor(3*radius + 0.5))
+
+
+def gaussian_kernel(radius):
+    '''BlurG's normalised 1D kernel'''
+    half = kernel_radius(radius)
+    x = np.arange(-half, half + 1, dtype=float)
+    kernel = np.exp(-x**2/(2*radius**2))
+    return kernel/kernel.sum()
+
+
+def _kernel_fft(radius, length, real):
+    # kernel centred on element 0 of a circular array of this length
+    kernel = gaussian_kernel(radius)
+    half = len(kernel)//2
+    wrapped = np.zeros(length)
+    wrapped[:half + 1] = kernel[half:]
+    if half:
+        wrapped[-half:] = kernel[:half]
+    return np.fft.rfft(wrapped) if real else np.fft.fft(wrapped)
+
+
+def stretch(blurred, images):
+    '''Scale blurred back to the min and max of images, as BlurG does'''
+    lo = images.min(axis=(-2, -1), keepdims=True)
+    hi = images.max(axis=(-2, -1), keepdims=True)
+    blurred = blurred - blurred.min(axis=(-2, -1), keepdims=True)
+    return blurred*(hi - lo)/blurred.max(axis=(-2, -1), keepdims=True) + lo
+
+
+def blur(images, radii):
+    '''BlurG of an array of images for each radius, lazily.
+
+    Yields (radius, blurred images) in the order of radii; a radius no
+    larger than felix's TINY gives the images unchanged, as in Simulate.
+    '''
+    images = np.asarray(images, dtype=float)
+    pad = max([kernel_radius(r) for r in radii if r > TINY] or [0])
+    ny, nx = images.shape[-2:]
+    padded = np.pad(images, [(0, 0)]*(images.ndim - 2) + [(pad, pad)]*2,
+                    mode='edge')
+    shape = padded.shape[-2:]
+    spectrum = np.fft.rfft2(padded) if pad else None
+    for radius in radii:
+        if radius <= TINY:
+            yield radius, images
+            continue
+        kernel = (_kernel_fft(radius, shape[0], False)[:, np.newaxis] *
+                  _kernel_fft(radius, shape[1], True)[np.newaxis, :])
+        blurred = np.fft.irfft2(spectrum*kernel, s=shape)
+        yield radius, stretch(blurred[..., pad:pad + ny, pad:pad + nx],
+                              images)
+
+
+def scan(stack, exp, radii, correlation=figureofmerit.NORMALISED,
+         processing=figureofmerit.NONE, mask=None):
+    '''Score of each blur radius, as a list of (radius, Score)'''
+    return [(radius, figureofmerit.score(blurred, exp, correlation,
+                                         processing, mask))
+            for radius, blurred in blur(stack, radii)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Find the blur radius that best fits experiment')
+    parser.add_argument('sample', help='directory with felix.inp and the '
+                        'experimental images')
+    parser.add_argument('stack', help='a _unblurred.fxu file from felix')
+    parser.add_argument('--radii', type=float, nargs='+',
+                        default=[0.5*i for i in range(9)],
+                        help='blur radii in pixels (default 0 to 4 by 0.5)')
+    parser.add_argument('-c', '--correlation', type=int, default=None,
+                        choices=sorted(figureofmerit.CORRELATIONS),
+                        help='ICorrelationFLAG (default: from felix.inp)')
+    parser.add_argument('-p', '--processing', type=int, default=None,
+                        choices=sorted(figureofmerit.PROCESSING),
+                        help='IImageProcessingFLAG (default: from felix.inp)')
+    args = parser.parse_args(argv)
+
+    try:
+        stack = UnblurredStack(args.stack)
+        inp = inpfile.InpFile.read(os.path.join(args.sample, 'felix.inp'))
+        exp = figureofmerit.experimental_stack(args.sample, stack.hkls)
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    correlation = args.correlation
+    if correlation is None:
+        correlation = inp['ICorrelationFLAG']
+    processing = args.processing
+    if processing is None:
+        processing = inp['IImageProcessingFLAG']
+    thicknesses = stack.thicknesses
+    print('%d patterns, %d thicknesses, %s, processing %s; felix used '
+          'RBlurRadius %g' % (len(stack.hkls), len(thicknesses),
+                              figureofmerit.CORRELATIONS[correlation],
+                              figureofmerit.PROCESSING.get(processing,
+                                                           'none'),
+                              stack.blur_radius))
+    results = scan(stack.images, exp, args.radii, correlation, processing)
+    for radius, result in results:
+        print('radius %6.2f  FoM %9.4f%%  thickness %7.1f A'
+              % (radius, 100*result.fom, thicknesses[result.thickness]))
+    radius, best = min(results, key=lambda r: r[1].fom)
+    print('best: RBlurRadius %g at %.1f A, FoM %.4f%%'
+          % (radius, thicknesses[best.thickness], 100*best.fom))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+'''
+Reader for Gatan DigitalMicrograph 3 (.dm3) images
+
+A .dm3 file is a tree of tag groups and tagged data, described at
+https://imagej.nih.gov/ij/plugins/DM3Format.gj.html.  The tree is walked
+once, without reading any array data: each array tag records only where
+its data starts in the file, its element type and its length.  The
+image is then a read-only numpy.memmap view at that offset, so reading
+the pixels is left to whoever uses them.
+
+ReadDM3TagsAndImage (src/felix/read_dm3_mod.f90) takes the second 'Data'
+tag in the file, which is the image after the thumbnail; image() does
+the same by taking the last entry of ImageList, and checks its declared
+dimensions against the length of the data.
+
+    dm3 = DM3File('samples/GaAs_short/DM3/GaAs_+0+0+0.dm3')
+    dm3.image().shape      # (80, 80), rows as felix reads them
+    dm3.tags['ImageList'][1]['ImageData']['Calibrations']
+'''
+
+from __future__ import division
+
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC_VERSION = 3
+DELIMITER = b'%%%%'
+TAG_GROUP, TAG_DATA = 20, 21
+
+# DM3 encoded types
+STRUCT, STRING, ARRAY = 15, 18, 20
+# encoded type -> element format (the byte order comes from the header)
+SIMPLE = {2: 'h', 3: 'i', 4: 'H', 5: 'I', 6: 'f', 7: 'd', 8: '?',
+          9: 'b', 10: 'B', 11: 'q', 12: 'Q'}
+# ImageData DataType -> numpy element type, for the image array itself
+IMAGE_TYPES = {1: 'i2', 2: 'f4', 3: 'c8', 6: 'u1', 7: 'i4', 9: 'i1',
+               10: 'u2', 11: 'u4', 12: 'f8', 13: 'c16', 14: 'u1',
+               23: 'u4'}
+
+
+class DM3Error(ValueError):
+    '''A file that is not a readable DM3 image'''
+
+
+class ArrayData(object):
+    '''Where an array tag's data lies in the file, without the data'''
+
+    def __init__(self, offset, dtype, length):
+        self.offset = offset
+        self.dtype = dtype
+        self.length = length
+
+    @property
+    def nbytes(self):
+        return self.length*self.dtype.itemsize
+
+    def __repr__(self):
+        return '<array of %d %s at byte %d>' % (self.length, self.dtype,
+                                                self.offset)
+
+
+class DM3File(object):
+    '''The tag tree of one .dm3 file.
+
+    tags is a dict of name -> value for each group; unnamed entries (as
+    in ImageList) are numbered instead, so the tree reads like
+    tags['ImageList'][1]['ImageData']['Dimensions'][0].  Simple values
+    and strings are read; arrays are left as ArrayData.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if len(f.read(16)) < 16:
+                raise DM3Error('%s is too short to be a DM3 file' % path)
+            # the tags are parsed in place, the file is never copied
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse()
+        finally:
+            self.data.close()
+            del self.data
+
+    def _parse(self):
+        path = self.path
+        version, size, order = struct.unpack('>3I', self.data[:12])
+        if version != MAGIC_VERSION:
+            raise DM3Error('%s is not a DM3 file (version %d)'
+                           % (path, version))
+        # tag headers are always big-endian, the data itself as declared
+        self.order = '<' if order == 1 else '>'
+        self.pos = 12
+        try:
+            self.tags = self._group()
+        except (struct.error, IndexError, KeyError) as e:
+            raise DM3Error('%s: damaged tag tree near byte %d (%s)'
+                           % (path, self.pos, e))
+
+    def _unpack(self, fmt):
+        fmt = struct.Struct(fmt)
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def _group(self):
+        sorted_, open_, count = self._unpack('>BBI')
+        group = {}
+        for i in range(count):
+            kind, length = self._unpack('>BH')
+            label = self.data[self.pos:self.pos + length].decode('latin-1')
+            self.pos += length
+            if kind == TAG_GROUP:
+                value = self._group()
+            elif kind == TAG_DATA:
+                value = self._tag()
+            else:
+                raise DM3Error('%s: unknown tag kind %d at byte %d'
+                               % (self.path, kind, self.pos))
+            group[label or i] = value
+        return group
+
+    def _tag(self):
+        if self.data[self.pos:self.pos + 4] != DELIMITER:
+            raise DM3Error("%s: missing '%%%%%%%%' at byte %d"
+                           % (self.path, self.pos))
+        self.pos += 4
+        count, = self._unpack('>I')
+        info = self._unpack('>%dI' % count)
+        return self._value(info)
+
+    def _value(self, info):
+        kind = info[0]
+        if kind in SIMPLE:
+            return self._unpack(self.order + SIMPLE[kind])[0]
+        if kind == STRING:
+            text = self.data[self.pos:self.pos + 2*info[1]]
+            self.pos += 2*info[1]
+            return text.decode('utf-16-le' if self.order == '<'
+                               else 'utf-16-be', 'replace')
+        if kind == STRUCT:
+            fields = [info[4 + 2*i] for i in range(info[2])]
+            return tuple(self._value((t,)) for t in fields)
+        if kind == ARRAY:
+            if info[1] == STRUCT:
+                # array of structs: [20, 15, 0, n, (0, type)*n, length]
+                fields = [info[5 + 2*i] for i in range(info[3])]
+                dtype = np.dtype([('f%d' % i, self.order + SIMPLE[t])
+                                  for i, t in enumerate(fields)])
+                length = info[4 + 2*info[3]]
+            else:
+                dtype = np.dtype(self.order + SIMPLE[info[1]])
+                length = info[2]
+            array = ArrayData(self.pos, dtype, length)
+            self.pos += array.nbytes
+            return array
+        raise DM3Error('%s: unknown data type %d at byte %d'
+                       % (self.path, kind, self.pos))
+
+    def image_tags(self):
+        '''ImageData group of the main image (the last in ImageList)'''
+        images = self.tags.get('ImageList', {})
+        for key in sorted(images, reverse=True):
+            entry = images[key]
+            if isinstance(entry, dict) and 'ImageData' in entry:
+                return entry['ImageData']
+        raise DM3Error('%s has no image' % self.path)
+
+    def image(self):
+        '''The image as a read-only (rows, columns) numpy.memmap'''
+        tags = self.image_tags()
+        data = tags['Data']
+        dims = [tags['Dimensions'][i] for i in sorted(tags['Dimensions'])]
+        # a single frame may still be saved as x * y * 1
+        while len(dims) > 2 and dims[-1] == 1:
+            dims.pop()
+        if len(dims) != 2:
+            raise DM3Error('%s: image has %d dimensions, expected 2'
+                           % (self.path, len(dims)))
+        dtype = data.dtype
+        if tags.get('DataType') in IMAGE_TYPES:
+            dtype = np.dtype(self.order + IMAGE_TYPES[tags['DataType']])
+        if data.nbytes != dims[0]*dims[1]*dtype.itemsize:
+            raise DM3Error('%s: %d bytes of image data for %dx%d %s pixels'
+                           % (self.path, data.nbytes, dims[0], dims[1],
+                              dtype))
+        # Dimensions are (x, y) with x fastest, i.e. C order (y, x)
+        return np.memmap(self.path, dtype=dtype, mode='r',
+                         offset=data.offset, shape=(dims[1], dims[0]))
+
+
+def read_dm3(path):
+    '''The main image of a .dm3 file as a read-only numpy.memmap'''
+    return DM3File(path).image()
@@ -0,0 +1,199 @@
+'''
+Experimental images of a sample directory, found and checked as felix would
+
+ReadExperimentalImages (src/felix/read_files_mod.f90) looks for
+<formula>_+0+0+0.img in LR_<2N>x<2N>/, then .dm3 in DM3/, then .img and
+.dm3 directly in the sample directory, where N is IPixelCount and the
+formula is the one ReadCif takes from felix.cif.  Whichever is found
+first decides where every other image is read from: one per reflection
+of felix.hkl, e.g. GaAs_-2-2+10.dm3.
+
+A .img is 2N rows of 2N little-endian reals of 8 bytes; a .dm3 holds a
+2N x 2N image after its thumbnail (see dm3.py).  Images are opened as
+read-only numpy.memmap views, so checking a sample reads the file
+headers and sizes but not the pixels, and a missing reflection or a
+wrong image size shows up before felix is started rather than after
+MPI start-up on the cluster.
+
+    problems = check('samples/GaAs_short')      # [] if felix can read it
+    images = load('samples/GaAs_short')         # {(h, k, l): memmap}
+
+    python expimages.py samples/GaAs_short
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import re
+import sys
+
+import numpy as np
+
+import dm3
+import inpfile
+from felixbin import hkl_string
+
+IMG_DTYPE = np.dtype('<f8')
+# ReadCif tries these in turn and keeps only letters and digits
+FORMULA_TAGS = ('_chemical_formula_structural', '_chemical_formula_iupac',
+                '_chemical_formula_sum')
+HKL_RE = re.compile(r'\[\s*([-+]?\d+)\s*,\s*([-+]?\d+)\s*,\s*([-+]?\d+)\s*\]')
+
+
+class SampleError(ValueError):
+    '''A sample directory felix could not read its images from'''
+
+    def __init__(self, problems):
+        ValueError.__init__(self, '\n'.join(problems))
+        self.problems = problems
+
+
+def cif_formula(path):
+    '''Chemical formula of a .cif as used in image names, e.g. SrTiO3'''
+    found = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split(None, 1)
+            if parts and parts[0] in FORMULA_TAGS and len(parts) > 1:
+                found.setdefault(parts[0], parts[1])
+    for tag in FORMULA_TAGS:
+        if tag in found:
+            return ''.join(c for c in found[tag] if c.isalnum())
+    raise ValueError('%s has no chemical formula' % path)
+
+
+def read_hkl(path):
+    '''Reflections listed in a felix.hkl, as (h, k, l) tuples'''
+    hkls = []
+    with open(path) as f:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            match = HKL_RE.search(line)
+            if match is None:
+                raise ValueError('%s line %d: expected [h,k,l], found %r'
+                                 % (path, number + 1, line.strip()))
+            hkls.append(tuple(int(i) for i in match.groups()))
+    return hkls
+
+
+def locations(pixel_count):
+    '''(directory, extension) in the order felix searches them'''
+    size = 2*pixel_count
+    return [('LR_%dx%d' % (size, size), '.img'), ('DM3', '.dm3'),
+            ('', '.img'), ('', '.dm3')]
+
+
+def locate(sample, formula, pixel_count):
+    '''(directory, extension) felix would read images from, or None'''
+    for directory, extension in locations(pixel_count):
+        name = '%s_+0+0+0%s' % (formula, extension)
+        if os.path.isfile(os.path.join(sample, directory, name)):
+            return directory, extension
+    return None
+
+
+def image_path(sample, directory, formula, hkl, extension):
+    return os.path.join(sample, directory,
+                        '%s_%s%s' % (formula, hkl_string(hkl), extension))
+
+
+def open_img(path, size):
+    '''A size x size .img as a read-only numpy.memmap'''
+    nbytes = os.path.getsize(path)
+    if nbytes != size*size*IMG_DTYPE.itemsize:
+        raise ValueError('%s is %d bytes, a %dx%d .img is %d'
+                         % (path, nbytes, size, size,
+                            size*size*IMG_DTYPE.itemsize))
+    return np.memmap(path, dtype=IMG_DTYPE, mode='r', shape=(size, size))
+
+
+def open_image(path, size):
+    '''An experimental .img or .dm3 image, checked to be size x size'''
+    if path.lower().endswith('.dm3'):
+        image = dm3.read_dm3(path)
+        if image.shape != (size, size):
+            raise ValueError('%s is %dx%d, felix expects %dx%d'
+                             % ((path,) + image.shape + (size, size)))
+        return image
+    return open_img(path, size)
+
+
+def _scan(sample):
+    '''Everything felix would read images with, and what is wrong'''
+    problems, images = [], {}
+    try:
+        inp = inpfile.InpFile.read(os.path.join(sample, 'felix.inp'))
+    except (IOError, OSError, ValueError) as e:
+        return [str(e)], images
+    if inp['IRefineModeFLAG'] == inpfile.SIMULATE:
+        # a simulation never reads experimental images
+        return problems, images
+    pixel_count = inp['IPixelCount']
+    try:
+        formula = cif_formula(os.path.join(sample, 'felix.cif'))
+        hkls = read_hkl(os.path.join(sample, 'felix.hkl'))
+    except (IOError, OSError, ValueError) as e:
+        return [str(e)], images
+    if not hkls:
+        return ['felix.hkl lists no reflections'], images
+    found = locate(sample, formula, pixel_count)
+    if found is None:
+        return ['no %s_+0+0+0 image in %s' % (formula, ', '.join(
+            os.path.join(d, '') + '*' + e
+            for d, e in locations(pixel_count)))], images
+    directory, extension = found
+    size = 2*pixel_count
+    for hkl in hkls:
+        path = image_path(sample, directory, formula, hkl, extension)
+        if not os.path.isfile(path):
+            problems.append('missing %s, listed in felix.hkl'
+                            % os.path.relpath(path, sample))
+            continue
+        try:
+            images[hkl] = open_image(path, size)
+        except (IOError, OSError, ValueError) as e:
+            problems.append(str(e))
+    return problems, images
+
+
+def check(sample):
+    '''Problems felix would have reading sample's images ([] if none)'''
+    return _scan(sample)[0]
+
+
+def load(sample):
+    '''Experimental images of sample keyed by (h, k, l), as memmaps.
+
+    Raises SampleError listing every problem if felix could not read
+    them; a simulation gives an empty dict.
+    '''
+    problems, images = _scan(sample)
+    if problems:
+        raise SampleError(problems)
+    return images
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Check the experimental images of felix samples')
+    parser.add_argument('samples', nargs='+', metavar='sample',
+                        help='directory holding felix.inp')
+    args = parser.parse_args(argv)
+    status = 0
+    for sample in args.samples:
+        problems = check(sample)
+        if problems:
+            status = 1
+            print('%s: %d problem%s' % (sample, len(problems),
+                                        's'[:len(problems) > 1]))
+            for problem in problems:
+                print('  ' + problem)
+        else:
+            print('%s: ok' % sample)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,14 +5,18 @@ GUI features:
 -includes pretty felix crystal images & introductory information
 -easy-to-use interface with buttons, tabs and os dialogs (wx python)
 -information buttons beside every widget explaining its use
--import & export variable options to .inp file
+-import & export variable options to .inp file, checked against the
+ line by line layout felix reads
 -new variables can easily be added, removed to GUI (via class instance)
 -type numerical variable values
 -select choice variables from lists (inclduing combinations)
--runs felix simulation with mpirun
+-runs felix simulation with mpirun as a supervised job (output, cancel,
+ rerun, exit code, wall time and peak memory shown in the output tab)
 -defaults felixrefine but can manually find a different simulation to run
 -specify cores for mpirun to use
--convert specific .bin files to .gif (currently size 539x539)
+-live plot of iteration_log.txt while a refinement runs
+-convert .bin output folders to .png in parallel, skipping done ones
+-view .bin output directly in the image viewer, with cached thumbnails
 
 
 The various input variables are imported as a list of object instances, 
@@ -32,21 +36,54 @@ output tab - run felix, convert & view images
 from __future__ import division
 
 import time
+import os
+
+class PhaseTimer(): #per-phase timings for speed tests
+    
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.phases = []
 
-def printtime(): #a basic timeit function for speed tests
-    global t
-    print(time.time() - t)
-    t = time.time()
+    def mark(self, name): #time since the last mark is charged to name
+        now = time.time()
+        self.phases.append((name, now - self.last))
+        self.last = now
 
-t = time.time()
+    def report(self):
+        if os.environ.get('FELIX_GUI_TIMING', '1') != '0':
+            print(', '.join('%s %.3f s' % p for p in self.phases) 
+                + ' (total %.3f s)' % (self.last - self.start))
+
+startup = PhaseTimer()
 
 from inputvariables import iv
 from inputvariables import seperator
+startup.mark('input variables')
 
 import wx
 import wx.lib.scrolledpanel
-import shutil
-import os
+import collections
+
+import thumbcache
+import jobrunner
+import inpfile
+#felixbin, binexport, iterationlog and numpy are imported where they are
+#used, as numpy alone takes longer to import than the window takes to show
+startup.mark('imports')
+
+### IMAGE ASSETS
+images = {} #every image asset is decoded once, then shared
+bitmaps = {} #and each size of it is made once
+
+def bitmap(filename, size=None):
+    if (filename, size) not in bitmaps:
+        if filename not in images:
+            images[filename] = wx.Image(filename, wx.BITMAP_TYPE_ANY)
+        image = images[filename]
+        if size is not None:
+            image = image.Scale(*size)
+        bitmaps[filename, size] = wx.BitmapFromImage(image)
+    return bitmaps[filename, size]
 
 ### OVERALL MAIN FRAME SETUP
 class MainFrame(wx.Frame):
@@ -55,14 +92,11 @@ class MainFrame(wx.Frame):
         
         wx.Frame.__init__(self, None, title="Felix")
         
-
         ### TITLE PANEL
         tpanel = wx.Panel(self)
 
-        timage = wx.Image("crystal.png", wx.BITMAP_TYPE_PNG)
-        timage.Rescale(660/6,300/6) #660*300
-        timage = wx.BitmapFromImage(timage)
-        timage = wx.StaticBitmap(tpanel, -1, timage)        
+        timage = wx.StaticBitmap(tpanel, -1, 
+            bitmap("crystal.png", (660/6,300/6))) #660*300
 
         ttext = wx.StaticText(tpanel, wx.ID_ANY, 
             'FELIX\n'
@@ -83,11 +117,55 @@ class MainFrame(wx.Frame):
         tpanel.SetSizer(tpanelSizer)
         tpanelSizer.Fit(tpanel)
 
+        startup.mark('title panel')
+
         ### MAIN NOTEBOOK PANEL INITIALISE
-        notebook = wx.Notebook(self, wx.ID_ANY)
+        #each tab is an empty panel until it is first selected, so only
+        #the about tab is built before the window shows
+        self.notebook = wx.Notebook(self, wx.ID_ANY)
+        self.tabs = []
+        for name, build in [("about", self.buildAboutTab),
+                ("input", self.buildInputTab),
+                ("output", self.buildOutputTab)]:
+            tab = wx.Panel(self.notebook)
+            tab.build = build
+            self.notebook.AddPage(tab, name)
+            self.tabs.append(tab)
+        self.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.onTabChanged)
+        self.buildTab(0)
+
+        self.job = None
+        self.jobLines = [] #filled by the job threads, emptied by the timer
+        self.jobTimer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onJobTimer, self.jobTimer)
+         
+        ### OVERALL FRAME SIZERS
+        frameSizer = wx.BoxSizer(wx.VERTICAL)
+        frameSizer.Add(tpanel, 0, wx.LEFT)            
+        frameSizer.Add(self.notebook, 1, wx.CENTER | wx.EXPAND | wx.ALL, 5)
+        
+        self.SetSizer(frameSizer)
+        self.SetMinSize((1000,300))
+        #sized for the input tab, which is not built yet to fit to
+        self.SetSize((1130,640))
+        startup.mark('main frame')
+
+    ### TAB CONSTRUCTION
+    def onTabChanged(self, event):
+        self.buildTab(event.GetSelection())
+        event.Skip()
 
-        ## TAB - ABOUT
-        taba = wx.Panel(notebook) #tab About (panel)
+    def buildTab(self, i):
+        tab = self.tabs[i]
+        if tab.build is not None:
+            build, tab.build = tab.build, None
+            timer = PhaseTimer()
+            build(tab)
+            tab.Layout()
+            timer.mark(self.notebook.GetPageText(i) + ' tab')
+            timer.report()
+
+    def buildAboutTab(self, taba):
         atext = wx.StaticText(taba, label= (
             "\n"          
             "(C) 2013-2017, all rights reserved\n\n"
@@ -100,13 +178,10 @@ class MainFrame(wx.Frame):
             "info dialogs explaining their uses in more detail"
             "\n\n"))
 
-        aimage = wx.Image("crystal.png", wx.BITMAP_TYPE_PNG)
-        aimage = wx.BitmapFromImage(aimage)
-        aimage = wx.StaticBitmap(taba, -1, aimage, size = (660,300))
-        aimage2 = wx.Image("crystal2.jpg", wx.BITMAP_TYPE_JPEG)
-        aimage2.Rescale(400,400)
-        aimage2 = wx.BitmapFromImage(aimage2)
-        aimage2 = wx.StaticBitmap(taba, -1, aimage2, size = (250,250))
+        aimage = wx.StaticBitmap(taba, -1, bitmap("crystal.png"), 
+            size = (660,300))
+        aimage2 = wx.StaticBitmap(taba, -1, 
+            bitmap("crystal2.jpg", (400,400)), size = (250,250))
 
         rowSizer = wx.BoxSizer(wx.HORIZONTAL)
         rowSizer.Add(aimage2, 0, wx.RIGHT | wx.CENTRE, 10)
@@ -116,11 +191,9 @@ class MainFrame(wx.Frame):
         tabaSizer.Add(rowSizer, 0, wx.CENTRE | wx.TOP, 5)
         tabaSizer.Add(aimage, 0, wx.CENTRE | wx.ALL,5)               
         taba.SetSizer(tabaSizer)
-        tabaSizer.Fit(taba)         
+        tabaSizer.Fit(taba)
 
-        ## TAB - INPUT INITIALISE
-        tabi = wx.Panel(notebook)
-        
+    def buildInputTab(self, tabi):
         #TAB - INPUT SUBPANEL 1
         ipanel = wx.lib.scrolledpanel.ScrolledPanel(tabi, size=(1100,400))
         ipanel.SetupScrolling()
@@ -129,7 +202,6 @@ class MainFrame(wx.Frame):
         perrow = 2
         rowSizer = wx.BoxSizer(wx.HORIZONTAL) #this reuses rowSizer
         onrow = 0
-        rmlist = []
         for i in range(len(iv)):
             if isinstance(iv[i], seperator): #if seperator, end group
                 for j in range(perrow - onrow):
@@ -143,7 +215,6 @@ class MainFrame(wx.Frame):
                 ipanelSizer.Add(title, 0, wx.LEFT, 20)
                 ipanelSizer.Add(wx.StaticLine(ipanel), 0,
                     wx.ALL | wx.EXPAND, 2)
-                rmlist.append(i)
                 rowSizer = wx.BoxSizer(wx.HORIZONTAL)
                 onrow = 0
             else: #else is a variable, add variable and widget to group
@@ -155,9 +226,7 @@ class MainFrame(wx.Frame):
                 onrow += 1
                 rowSizer.Add(wx.StaticText(ipanel, wx.ID_ANY, iv[i].name),
                     8, wx.ALL, 5)
-                iimage = wx.Image("info.png", wx.BITMAP_TYPE_PNG)
-                iimage = wx.BitmapFromImage(iimage)
-                iimage = wx.StaticBitmap(ipanel, -1, iimage)
+                iimage = wx.StaticBitmap(ipanel, -1, bitmap("info.png"))
                 iimage.Bind(wx.EVT_LEFT_DOWN, lambda evt,
                     text=iv[i].infoText: self.onInfo(evt,text))  
                 rowSizer.Add(iimage, 1, wx.CENTRE)                
@@ -167,11 +236,6 @@ class MainFrame(wx.Frame):
                 if onrow < perrow:                
                     rowSizer.AddStretchSpacer(4)    
                
-        j = 0 #remove seperators from iv (input variables) 
-        for i in rmlist:
-            iv.pop(i-j)
-            j += 1
-
         ipanel.SetSizer(ipanelSizer)
         ipanelSizer.Fit(ipanel)
        
@@ -210,8 +274,7 @@ class MainFrame(wx.Frame):
         tabi.SetSizer(tabiSizer)
         tabiSizer.Fit(tabi)
 
-        ##TAB - OUTPUT
-        tabo = wx.Panel(notebook)
+    def buildOutputTab(self, tabo):
         otext = wx.StaticText(tabo, label= (
             "From here, you can run the Felix simulation on a\n"
             "directory with the appropiate images and a\n"
@@ -241,15 +304,62 @@ class MainFrame(wx.Frame):
             text=('Run Felix simulation on chosen directory assuming '
             + 'felix.inp file exists'): self.onInfo(evt,text))
 
+        self.rerunButton = wx.Button(tabo, label = 'rerun')
+        self.rerunButton.Bind(wx.EVT_BUTTON, self.onRerun)
+        self.rerunButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text='Run the last job again in the same directory': 
+            self.onInfo(evt,text))
+        self.rerunButton.Disable()
+
+        self.cancelButton = wx.Button(tabo, label = 'cancel')
+        self.cancelButton.Bind(wx.EVT_BUTTON, self.onCancel)
+        self.cancelButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text='Stop the running job (all mpirun ranks)': 
+            self.onInfo(evt,text))
+        self.cancelButton.Disable()
+
+        self.jobStatus = wx.StaticText(tabo, wx.ID_ANY, 'no job run yet')
+        self.jobOutput = wx.TextCtrl(tabo, wx.ID_ANY, size = (-1,120),
+            style = wx.TE_MULTILINE | wx.TE_READONLY)
+
         viewerButton = wx.Button(tabo, label = 'viewer')
         viewerButton.Bind(wx.EVT_BUTTON, self.onViewer)
         viewerButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
             text='View images in a folder': self.onInfo(evt,text))
 
-        convertButton = wx.Button(tabo, label = 'convert(size70)')
+        convertButton = wx.Button(tabo, label = 'convert')
         convertButton.Bind(wx.EVT_BUTTON, self.onConvert)
         convertButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
-            text='Convert a .bin into a .gif': self.onInfo(evt,text))        
+            text='Convert the .bin images below a folder into .png':
+            self.onInfo(evt,text))        
+
+        monitorButton = wx.Button(tabo, label = 'monitor')
+        monitorButton.Bind(wx.EVT_BUTTON, self.onMonitor)
+        monitorButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text=('Plot iteration_log.txt of a refinement as it runs '
+            + '(starts automatically on run)'): self.onInfo(evt,text))
+
+        timingButton = wx.Button(tabo, label = 'timing')
+        timingButton.Bind(wx.EVT_BUTTON, self.onTiming)
+        timingButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text=('Show where the time of a run went, from the timings '
+            + 'felix writes with ITimingFLAG = 1'): self.onInfo(evt,text))
+
+        previewButton = wx.Button(tabo, label = 'preview')
+        previewButton.Bind(wx.EVT_BUTTON, self.onPreview)
+        previewButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text=('Quick-look patterns of the input tab values, for the '
+            + 'felix.cif and felix.hkl of a folder, without running felix')
+            : self.onInfo(evt,text))
+
+        beamsButton = wx.Button(tabo, label = 'beams')
+        beamsButton.Bind(wx.EVT_BUTTON, self.onBeams)
+        beamsButton.Bind(wx.EVT_RIGHT_DOWN, lambda evt, 
+            text=('Strong and weak beams felix will use for each pixel, and '
+            + 'the cost of each, for the felix.cif of a folder')
+            : self.onInfo(evt,text))
+
+        self.monitor = MonitorPanel(tabo)
 
         buttonoSizer = wx.BoxSizer(wx.HORIZONTAL)
         buttonoSizer.Add(findButton, 0, wx.LEFT)
@@ -257,38 +367,33 @@ class MainFrame(wx.Frame):
         buttonoSizer.Add(wx.StaticText(tabo, wx.ID_ANY, 'cores ='), 0,
             wx.CENTRE | wx.LEFT, 10)
         buttonoSizer.Add(self.coresInput, 0, wx.LEFT, 2)
+        runSizer = wx.BoxSizer(wx.HORIZONTAL)
+        runSizer.Add(runButton, 0, wx.LEFT, 10)
+        runSizer.Add(self.rerunButton, 0, wx.LEFT, 10)
+        runSizer.Add(self.cancelButton, 0, wx.LEFT, 10)
+        runSizer.Add(self.jobStatus, 0, wx.CENTRE | wx.LEFT, 10)
         buttonoSizer2 = wx.BoxSizer(wx.HORIZONTAL)
         buttonoSizer2.Add(viewerButton, 0, wx.LEFT, 10)
         buttonoSizer2.Add(convertButton, 0, wx.LEFT, 10)
+        buttonoSizer2.Add(monitorButton, 0, wx.LEFT, 10)
+        buttonoSizer2.Add(timingButton, 0, wx.LEFT, 10)
+        buttonoSizer2.Add(previewButton, 0, wx.LEFT, 10)
+        buttonoSizer2.Add(beamsButton, 0, wx.LEFT, 10)
         
         taboSizer = wx.BoxSizer(wx.VERTICAL)
         taboSizer.Add(otext, 0, wx.CENTRE | wx.ALL, 20)
         taboSizer.Add(wx.StaticLine(tabo), 0, wx.ALL | wx.EXPAND, 2)
         taboSizer.Add(buttonoSizer, 0, wx.CENTRE)
         taboSizer.Add(wx.StaticLine(tabo), 0, wx.ALL | wx.EXPAND, 2)
-        taboSizer.Add(runButton, 0, wx.CENTRE)
+        taboSizer.Add(runSizer, 0, wx.CENTRE)
+        taboSizer.Add(self.jobOutput, 0, wx.ALL | wx.EXPAND, 5)
         taboSizer.Add(wx.StaticLine(tabo), 0, wx.ALL | wx.EXPAND, 2)
         taboSizer.Add(buttonoSizer2, 0, wx.CENTRE)
         taboSizer.Add(wx.StaticLine(tabo), 0, wx.ALL | wx.EXPAND, 2)
+        taboSizer.Add(self.monitor, 1, wx.ALL | wx.EXPAND, 5)
 
         tabo.SetSizer(taboSizer)
-        taboSizer.Fit(tabo)    
-
-        ### MAIN NOTEBOOK FINALISE
-        notebook.AddPage(taba, "about")
-        notebook.AddPage(tabi, "input")
-        notebook.AddPage(tabo, "output")
-        
-        printtime() 
-         
-        ### OVERALL FRAME SIZERS
-        frameSizer = wx.BoxSizer(wx.VERTICAL)
-        frameSizer.Add(tpanel, 0, wx.LEFT)            
-        frameSizer.Add(notebook, 1, wx.CENTER | wx.EXPAND | wx.ALL, 5)
-        
-        self.SetSizer(frameSizer)
-        self.SetMinSize((1000,300))
-        frameSizer.Fit(self)
+        taboSizer.Fit(tabo)
 
     ### BUTTON FUNCTIONS (inside frame class)
     def onInfo(self, event, text):
@@ -303,35 +408,24 @@ class MainFrame(wx.Frame):
                 if(keycode != 46 or '.' not in self.coresInput.GetValue()):
                     event.Skip()
    
+    def widgetINP(self):
+        #felix.inp from the current widget values, None if one is invalid
+        try:
+            return inpfile.InpFile.from_values(dict((v.name, v.get())
+                for v in iv if not isinstance(v, seperator)))
+        except ValueError as e:
+            print(e)
+            return None
+
     def onCreateINP(self, event):
         dlg = wx.DirDialog(self)
         
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
-            print "felix.inp was created in this path: %s" % path
-                       
-            inpFilename = path + "/felix.inp"
-            txtFilename = path + "/felix.txt"
-        
-            inpfile = open(inpFilename, "wb")
-            
-            inpfile.write(
-                          "# Input file for felixsim/draw/refine "
-                                "version:VERSION: Build:BUILD:\n"
-                          "# ------------------------------------\n"
-                          "\n"
-                          "# ------------------------------------\n"
-                          "# felixsim input\n"
-                          "\n"
-                          )
-            
-            for i in range(len(iv)):
-                inpfile.write(iv[i].writeInputLine() + "\n")
-            
-            inpfile.close()
-
-            #debug - copy inp as a text file for easy debug viewing       
-            shutil.copyfile(inpFilename, txtFilename)
+            inp = self.widgetINP()
+            if inp is not None:
+                inp.write(path + "/felix.inp")
+                print "felix.inp was created in this path: %s" % path
             
         dlg.Destroy()
         
@@ -342,18 +436,18 @@ class MainFrame(wx.Frame):
             path = dlg.GetPath()
             print "Loading: %s" %path
             
-            iList = list(range(len(iv)))
-            for line in list(open(path, "rb")):
-                if (line.split() and line.split()[0] not in ['','#']):
-                    for i in range(len(iv)):
-                        if iv[i].name == line.split()[0]:
-                            value = line.split("=")[1].replace(',',' ').split()
-                            if iv[i].read(value) == True:
-                                print iv[i].name + " recognised"
-                                #iv[i].read()
-                                iList.remove(i)
-            for i in iList:
-                print iv[i].name + " not recognised"
+            try:
+                inp = inpfile.InpFile.read(path)
+            except (ValueError, IOError) as e:
+                print e
+            else:
+                for v in iv:
+                    if isinstance(v, seperator):
+                        continue
+                    if v.read(inp[v.name]):
+                        print v.name + " recognised"
+                    else:
+                        print v.name + " not recognised: " + str(inp[v.name])
                
         dlg.Destroy()
        
@@ -367,18 +461,132 @@ class MainFrame(wx.Frame):
         dlg.Destroy()   
 
     def onRun(self, event):
+        if self.job is not None and self.job.running:
+            print('a felix job is already running, cancel it first')
+            return
         dlg = wx.DirDialog(self)
         
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
-            #sets current terminal and hence spawn directory
-            #os.chdir(path)
-            os.system('gnome-terminal --working-directory=\'' + path
-                + '\' -e \'mpirun -n ' + self.coresInput.GetValue() + ' '
-                + self.findText.GetValue()+'\'')
+            self.job = jobrunner.Job(path, self.coresInput.GetValue(),
+                self.findText.GetValue(), on_output=self.onJobOutput,
+                on_exit=lambda job: wx.CallAfter(self.onJobExit, job))
+            self.startJob()
+            
+        dlg.Destroy()
+
+    def onRerun(self, event):
+        if self.job is not None and not self.job.running:
+            self.job.cores = int(self.coresInput.GetValue())
+            self.job.felix = self.findText.GetValue()
+            self.startJob()
+
+    def onCancel(self, event):
+        if self.job is not None:
+            self.job.cancel()
+            self.jobStatus.SetLabel('cancelling...')
+
+    def startJob(self):
+        self.jobOutput.Clear()
+        import expimages
+        problems = expimages.check(self.job.directory)
+        if problems:
+            #felix would stop at ReadExperimentalImages, so don't start it
+            self.jobOutput.AppendText('\n'.join(problems) + '\n')
+            self.jobStatus.SetLabel('not started: experimental images')
+            return
+        self.jobOutput.AppendText(' '.join(self.job.command) + '\n')
+        self.job.start()
+        if self.job.running:
+            self.jobStatus.SetLabel('running in ' + self.job.directory)
+            self.cancelButton.Enable()
+            self.rerunButton.Disable()
+            self.jobTimer.Start(250)
+            self.monitor.watch(self.job.directory + '/iteration_log.txt')
+
+    def onJobOutput(self, stream, line):
+        #job thread; list.append is atomic, the timer does the wx side
+        self.jobLines.append(line)
+
+    def onJobTimer(self, event):
+        lines, self.jobLines = self.jobLines, []
+        if lines:
+            self.jobOutput.AppendText('\n'.join(lines) + '\n')
+
+    def onJobExit(self, job):
+        self.jobTimer.Stop()
+        self.onJobTimer(None)
+        self.jobStatus.SetLabel(job.describe())
+        print('felix ' + job.describe())
+        self.cancelButton.Disable()
+        self.rerunButton.Enable()
+
+    def onMonitor(self, event):
+        dlg = wx.DirDialog(self)
+        
+        if dlg.ShowModal() == wx.ID_OK:
+            self.monitor.watch(dlg.GetPath() + '/iteration_log.txt')
+            
+        dlg.Destroy()
+
+    def onTiming(self, event):
+        dlg = wx.DirDialog(self)
+        
+        if dlg.ShowModal() == wx.ID_OK:
+            import timingreport
+            try:
+                summary = timingreport.TimingSummary.read(dlg.GetPath())
+            except (IOError, OSError, ValueError) as e:
+                print('no timings: ' + str(e))
+            else:
+                timingFrame = TimingFrame(dlg.GetPath(), summary)
+                timingFrame.Show()
             
         dlg.Destroy()
     
+    def onPreview(self, event):
+        inp = self.widgetINP()
+        if inp is None:
+            return
+        dlg = wx.DirDialog(self)
+        
+        if dlg.ShowModal() == wx.ID_OK:
+            import blochpreview
+            busy = wx.BusyCursor()
+            try:
+                preview = blochpreview.BlochPreview.read(dlg.GetPath(), inp)
+                images = preview.simulate()
+            except (IOError, OSError, ValueError) as e:
+                print('no preview: ' + str(e))
+            else:
+                for hkl in preview.missing:
+                    print('not in the reflection pool: %s' % list(hkl))
+                previewFrame = PreviewFrame(dlg.GetPath(), preview, images)
+                previewFrame.Show()
+            finally:
+                del busy
+            
+        dlg.Destroy()
+
+    def onBeams(self, event):
+        inp = self.widgetINP()
+        if inp is None:
+            return
+        dlg = wx.DirDialog(self)
+        
+        if dlg.ShowModal() == wx.ID_OK:
+            import felixcif
+            try:
+                cif = felixcif.read_cif(dlg.GetPath() + '/felix.cif',
+                    inp['RDebyeWallerConstant'])
+            except (IOError, OSError, ValueError) as e:
+                print('no beams: ' + str(e))
+            else:
+                beamsFrame = BeamsFrame(dlg.GetPath(), inp, cif)
+                beamsFrame.Show()
+            
+        dlg.Destroy()
+
     def onViewer(self, event):
         dlg = wx.DirDialog(self)
         
@@ -389,69 +597,468 @@ class MainFrame(wx.Frame):
         dlg.Destroy()
 
     def onPrint(self, event):
-        print '-'*50
-        for i in range(len(iv)):
-            print iv[i].writeInputLine()
-        print '-'*50
+        inp = self.widgetINP()
+        if inp is not None:
+            print '-'*50
+            print inp.text().rstrip()
+            print '-'*50
 
     def onConvert(self, event):
-#        dlg = wx.FileDialog(self, message="select .bin to convert")
-#        
-#        if dlg.ShowModal() == wx.ID_OK:
-#            f = dlg.GetPath()
-#            print('converting following to .gif:' + f)
-#            
-#            os.system('convert -size 70x70 -depth 64 -define'
-#                + ' quantum:format=floating-point'
-#                + ' -define quantum:scale=65535.0 -endian lsb GRAY:'
-#                + f + ' ' + f.split('.')[0] + '.gif')
-
         dlg = wx.DirDialog(self)
                 
         if dlg.ShowModal() == wx.ID_OK:
             path = dlg.GetPath()
-            gen = (f for f in os.listdir(path) if f.split('.')[1] == 'bin')
-            for f in gen:
-                f = path + '/' + f
-                try:
-                    print('converting following to .gif:' + f)
-            
-                    os.system('convert -size 70x70 -depth 64 -define'
-                        + ' quantum:format=floating-point'
-                        + ' -define quantum:scale=65535.0 -endian lsb GRAY:'
-                        + f + ' ' + f.split('.')[0] + '.gif')
-                except:
-                    print('exception')
-            print('finished converting images in directory')                   
+            import binexport
+            print('converting .bin images to .png in:' + path)
+            #process pool over every .bin below path, up to date ones skipped
+            result = binexport.export(path)
+            for f, error in result['failed']:
+                print('failed: ' + f + ': ' + error)
+            print('finished converting images in directory: '
+                + '%d written, %d up to date' 
+                % (len(result['written']), len(result['skipped'])))
      
         dlg.Destroy() 
 
+def binImage(array):
+    #greyscale wx.Image straight from a .bin memmap, no temporary files
+    import felixbin
+    y,x = array.shape
+    return wx.ImageFromBuffer(x, y, felixbin.to_rgb(array)).Copy()
+
+### REFINEMENT MONITOR
+class MonitorPanel(wx.Panel):
+    #plots iteration_log.txt of a running refinement; the log is only read
+    #from where the last poll stopped and only redrawn when it has grown
+
+    def __init__(self, parent, interval=2000):
+
+        wx.Panel.__init__(self, parent, size=(-1,250))
+        self.SetBackgroundColour(wx.WHITE)
+        self.log = None
+        self.interval = interval
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onTimer, self.timer)
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.Bind(wx.EVT_SIZE, lambda evt: self.Refresh())
+
+    def watch(self, path):
+        import iterationlog
+        self.log = iterationlog.IterationLog(path)
+        self.log.poll()
+        self.Refresh()
+        self.timer.Start(self.interval)
+
+    def onTimer(self, event):
+        if self.log.poll():
+            self.Refresh()
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self)
+        w,h = self.GetClientSize()
+        if self.log is None:
+            dc.DrawText('no refinement being monitored', 10, 10)
+            return
+        if len(self.log) == 0:
+            dc.DrawText('waiting for ' + self.log.path, 10, 10)
+            return
+        it = self.log.iterations
+        fom = self.log.fom
+        dc.DrawText('figure of merit %.6f at iteration %d' 
+            % (fom[-1], it[-1]), 10, 5)
+        dc.DrawText('refined variables (each scaled to its own range)', 
+            w//2 + 10, 5)
+        self.plot(dc, it, [fom], (10, 25, w//2 - 20, h - 35))
+        self.plot(dc, it, self.log.variables.T, 
+            (w//2 + 10, 25, w//2 - 20, h - 35))
+
+    def plot(self, dc, x, ys, box):
+        import numpy
+        left,top,width,height = box
+        dc.SetPen(wx.BLACK_PEN)
+        dc.SetBrush(wx.TRANSPARENT_BRUSH)
+        dc.DrawRectangle(left, top, width, height)
+        if len(x) < 2 or width < 10 or height < 10:
+            return
+        colours = ['BLUE', 'RED', 'FOREST GREEN', 'ORANGE', 'PURPLE',
+            'BROWN', 'CADET BLUE', 'MAGENTA']
+        xs = left + (x - x[0])*(width - 1)/max(x[-1] - x[0], 1)
+        for i,y in enumerate(ys):
+            lo,hi = numpy.nanmin(y), numpy.nanmax(y)
+            if not hi > lo:
+                hi = lo + 1 #flat line through the middle
+                lo = lo - 1
+            yy = top + height - 1 - (y - lo)*(height - 1)/(hi - lo)
+            dc.SetPen(wx.Pen(colours[i % len(colours)], 1))
+            points = [(int(a),int(b)) for a,b in zip(xs,yy) if b == b]
+            if len(points) > 1:
+                dc.DrawLines(points)
+
+### PHASE TIMINGS
+class TimingFrame(wx.Frame):
+    #where the time of a run went: one bar of every phase's share of all
+    #rank-seconds, then a bar per rank split into phases, so ranks that
+    #spend long in Gather and Broadcast (waiting) stand out
+
+    #by timingreport.PHASES, waiting greyed out; others after those
+    colours = ['SEA GREEN', 'BLUE', 'RED', 'FOREST GREEN', 'LIGHT GREY',
+        'ORANGE', 'PURPLE', 'BROWN', 'GREY', 'CADET BLUE', 'MAGENTA']
+
+    def __init__(self, path, summary):
+        wx.Frame.__init__(self, None, title='felix timings: ' + path,
+            size=(800, 200 + 14*len(summary.ranks)))
+        self.summary = summary
+        self.panel = wx.Panel(self)
+        self.panel.SetBackgroundColour(wx.WHITE)
+        self.panel.Bind(wx.EVT_PAINT, self.onPaint)
+        self.panel.Bind(wx.EVT_SIZE, lambda evt: self.panel.Refresh())
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self.panel)
+        w,h = self.panel.GetClientSize()
+        summary = self.summary
+        phases = summary.phases
+        total = summary.total()
+        if not total:
+            dc.DrawText('no time recorded', 10, 10)
+            return
+        dc.DrawText('%d ranks, %d iterations, %.1f rank-seconds; '
+            'computing %.0f%% of the time, slowest rank %.2f x the mean'
+            % (len(summary.ranks), len(summary.iterations), total,
+            100*sum(b[0] for b in summary.busy().values())
+            /(max(summary.by_rank().values())*len(summary.ranks)),
+            summary.imbalance()), 10, 5)
+        #legend
+        x = 10
+        for phase in phases:
+            dc.SetBrush(wx.Brush(self.colour(phase)))
+            dc.DrawRectangle(x, 26, 10, 10)
+            dc.DrawText(phase, x + 14, 23)
+            x += 20 + dc.GetTextExtent(phase)[0]
+        #flame: each phase's share of everything
+        width = w - 70
+        x = 60
+        dc.DrawText('all', 10, 48)
+        for phase in phases:
+            dx = int(round(summary.total(phase=phase)/total*width))
+            self.segment(dc, phase, x, 46, dx, 18, phase)
+            x += dx
+        #one bar per rank, to the scale of the busiest
+        by_phase = [summary.by_rank(phase) for phase in phases]
+        longest = max(summary.by_rank().values())
+        rowh = max(4, min(14, (h - 80)//max(1, len(summary.ranks))))
+        for row,rank in enumerate(summary.ranks):
+            y = 72 + row*rowh
+            if rowh >= 10:
+                dc.DrawText('%d' % rank, 10, y - 2)
+            x = 60
+            for phase,totals in zip(phases, by_phase):
+                dx = int(round(totals[rank]/longest*width))
+                self.segment(dc, phase, x, y, dx, rowh - 1)
+                x += dx
+
+    def colour(self, phase):
+        import timingreport
+        if phase in timingreport.PHASES:
+            i = timingreport.PHASES.index(phase)
+        else:
+            i = len(timingreport.PHASES) + self.summary.phases.index(phase)
+        return self.colours[i % len(self.colours)]
+
+    def segment(self, dc, phase, x, y, width, height, label=None):
+        if width < 1:
+            return
+        dc.SetPen(wx.TRANSPARENT_PEN)
+        dc.SetBrush(wx.Brush(self.colour(phase)))
+        dc.DrawRectangle(x, y, width, height)
+        if label and dc.GetTextExtent(label)[0] + 4 < width:
+            dc.SetTextForeground(wx.WHITE)
+            dc.DrawText(label, x + 2, y + 2)
+            dc.SetTextForeground(wx.BLACK)
+
+### QUICK-LOOK PATTERNS
+class PreviewFrame(wx.Frame):
+    #blochpreview patterns of every reflection of felix.hkl at one
+    #thickness, chosen with the slider; each scaled to its own range
+
+    def __init__(self, path, preview, images, zoom=4):
+        wx.Frame.__init__(self, None, title='felix preview: ' + path,
+            size=(900, 600))
+        self.preview = preview
+        self.images = images
+        import blochpreview
+        self.thicknesses = blochpreview.thicknesses(preview.inp)
+        self.zoom = zoom
+        self.panel = wx.ScrolledWindow(self)
+        self.panel.SetBackgroundColour(wx.WHITE)
+        self.panel.SetScrollRate(10, 10)
+        self.panel.Bind(wx.EVT_PAINT, self.onPaint)
+        self.panel.Bind(wx.EVT_SIZE, lambda evt: self.layout())
+        self.slider = wx.Slider(self, value=0, minValue=0,
+            maxValue=max(1, images.shape[1] - 1))
+        self.slider.Enable(images.shape[1] > 1)
+        self.slider.Bind(wx.EVT_SLIDER, lambda evt: self.panel.Refresh())
+        self.label = wx.StaticText(self, wx.ID_ANY, '')
+        sliderSizer = wx.BoxSizer(wx.HORIZONTAL)
+        sliderSizer.Add(self.slider, 1, wx.EXPAND)
+        sliderSizer.Add(self.label, 0, wx.CENTRE | wx.LEFT, 10)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.panel, 1, wx.EXPAND)
+        sizer.Add(sliderSizer, 0, wx.ALL | wx.EXPAND, 5)
+        self.SetSizer(sizer)
+
+    def cell(self):
+        #size of one pattern with its label
+        return self.zoom*self.images.shape[3] + 10, \
+            self.zoom*self.images.shape[2] + 24
+
+    def columns(self):
+        return max(1, self.panel.GetClientSize()[0]//self.cell()[0])
+
+    def layout(self):
+        w,h = self.cell()
+        rows = -(-self.images.shape[0]//self.columns())
+        self.panel.SetVirtualSize((self.columns()*w, rows*h))
+        self.panel.Refresh()
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self.panel)
+        self.panel.DoPrepareDC(dc)
+        t = self.slider.GetValue()
+        self.label.SetLabel('%.0f A' % self.thicknesses[t])
+        w,h = self.cell()
+        columns = self.columns()
+        for i,hkl in enumerate(self.preview.hkls):
+            x = (i % columns)*w + 5
+            y = (i//columns)*h + 5
+            image = binImage(self.images[i, t]).Scale(
+                self.zoom*self.images.shape[3], self.zoom*self.images.shape[2])
+            dc.DrawBitmap(wx.BitmapFromImage(image), x, y)
+            dc.DrawText('%d %d %d' % hkl, x, y + h - 22)
+
+### BEAMS PER PIXEL
+class BeamsFrame(wx.Frame):
+    #beampreview maps of the strong beams of each pixel and their n^3 cost,
+    #recalculated when the pool and beam numbers are changed
+
+    FIELDS = ('IMinReflectionPool', 'IMinStrongBeams', 'IMinWeakBeams',
+        'RAcceptanceAngle', 'IPixelCount')
+
+    def __init__(self, path, inp, cif, size=400):
+        wx.Frame.__init__(self, None, title='felix beams: ' + path,
+            size=(900, 500))
+        self.inp = inp
+        self.cif = cif
+        self.size = size
+        self.preview = None
+        self.maps = None
+        self.inputs = {}
+        fieldSizer = wx.BoxSizer(wx.HORIZONTAL)
+        for name in self.FIELDS:
+            self.inputs[name] = wx.TextCtrl(self, wx.ID_ANY,
+                value=str(inp[name]), size=(70,-1),
+                style=wx.TE_PROCESS_ENTER)
+            self.inputs[name].Bind(wx.EVT_TEXT_ENTER,
+                lambda evt: self.update())
+            fieldSizer.Add(wx.StaticText(self, wx.ID_ANY, name + ' ='), 0,
+                wx.CENTRE | wx.LEFT, 10)
+            fieldSizer.Add(self.inputs[name], 0, wx.LEFT, 2)
+        updateButton = wx.Button(self, label = 'update')
+        updateButton.Bind(wx.EVT_BUTTON, lambda evt: self.update())
+        fieldSizer.Add(updateButton, 0, wx.LEFT, 10)
+        self.panel = wx.Panel(self)
+        self.panel.SetBackgroundColour(wx.WHITE)
+        self.panel.Bind(wx.EVT_PAINT, self.onPaint)
+        self.panel.Bind(wx.EVT_MOTION, self.onMotion)
+        self.summary = wx.StaticText(self, wx.ID_ANY, '')
+        self.label = wx.StaticText(self, wx.ID_ANY, '')
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(fieldSizer, 0, wx.ALL, 5)
+        sizer.Add(self.panel, 1, wx.EXPAND)
+        sizer.Add(self.summary, 0, wx.ALL, 5)
+        sizer.Add(self.label, 0, wx.ALL, 5)
+        self.SetSizer(sizer)
+        self.update()
+
+    def update(self):
+        import beampreview
+        try:
+            for name in self.FIELDS:
+                self.inp[name] = self.inputs[name].GetValue()
+        except ValueError as e:
+            self.summary.SetLabel(str(e))
+            return
+        busy = wx.BusyCursor()
+        try:
+            self.preview = beampreview.BeamPreview(self.inp, self.cif)
+            strong, weak = self.preview.beam_counts()
+        except (IOError, OSError, ValueError) as e:
+            self.maps = None
+            self.summary.SetLabel(str(e))
+        else:
+            self.maps = strong, weak, strong.astype(float)**3
+            self.summary.SetLabel('\n'.join(
+                beampreview.summary(self.preview, strong, weak)))
+        finally:
+            del busy
+        self.Layout()
+        self.panel.Refresh()
+
+    def zoom(self):
+        #whole screen pixels per map pixel, maps about self.size across
+        return max(1, self.size//self.maps[0].shape[0])
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self.panel)
+        if self.maps is None:
+            return
+        strong, weak, cost = self.maps
+        size = self.zoom()*strong.shape[0]
+        for i,(name,image) in enumerate((('strong beams', strong),
+                ('n^3', cost))):
+            x = 10 + i*(size + 20)
+            dc.DrawBitmap(wx.BitmapFromImage(binImage(image.astype(float))
+                .Scale(size, size)), x, 10)
+            dc.DrawText(name, x, size + 14)
+
+    def onMotion(self, event):
+        if self.maps is None:
+            return
+        strong, weak, cost = self.maps
+        zoom = self.zoom()
+        size = zoom*strong.shape[0]
+        x,y = event.GetPosition()
+        x = (x - 10) % (size + 20)
+        column, row = x//zoom, (y - 10)//zoom
+        if 0 <= column < strong.shape[1] and 0 <= row < strong.shape[0] \
+                and x < size and strong[row, column]:
+            self.label.SetLabel('pixel %d %d: %d strong, %d weak beams, '
+                'n^3 = %.3g' % (column + 1, row + 1, strong[row, column],
+                weak[row, column], cost[row, column]))
+        else:
+            self.label.SetLabel('')
+
 ### VISUALISER FRAME
+VIEWEREXT = ('.jpg', '.png', '.gif', '.bin')
+THUMBSIZE = 300
+thumbs = None #on-disk cache shared by all viewers, made on first use
+
+def decodeThumb(path, size):
+    #runs on the loader thread, so only wx.Image (no bitmaps) in here
+    if os.path.splitext(path)[1].lower() == '.bin':
+        import felixbin
+        image = binImage(felixbin.open_bin(path))
+    else:
+        image = wx.Image(path, wx.BITMAP_TYPE_ANY)
+    if not image.IsOk():
+        raise ValueError('cannot read ' + path)
+    x,y = image.GetSize()
+    c = size/max(x,y)
+    image.Rescale(max(1,int(c*x)),max(1,int(c*y)))
+    x,y = image.GetSize()
+    return x, y, bytes(image.GetData())
+
 class aviewerFrame(wx.Frame):
 
     def __init__(self, path):
 
-        wx.Frame.__init__(self, None, title="Visulise")
-        panel = wx.lib.scrolledpanel.ScrolledPanel(self, size=(500,500))
-        panel.SetupScrolling(scroll_x=False)
+        wx.Frame.__init__(self, None, title="Visulise", size=(500,500))
+        global thumbs
+        if thumbs is None:
+            thumbs = thumbcache.ThumbCache()
 
-        sizer = wx.BoxSizer(wx.VERTICAL)
-        
-        for f in os.listdir(path):
-            if os.path.splitext(f)[1].lower() in ('.jpg', '.png', '.gif'):
-                image = wx.Image(path + '/' + f, wx.BITMAP_TYPE_ANY)
-                x,y = image.GetSize()
-                c = 300/max(x,y)
-                image.Rescale(c*x,c*y) 
-                image = wx.BitmapFromImage(image)
-                image = wx.StaticBitmap(panel, -1, image)
-                sizer.Add(image, 0, wx.CENTRE | wx.ALL, 5)
-                
-        panel.SetSizer(sizer)
+        paths = [path + '/' + f for f in sorted(os.listdir(path))
+            if os.path.splitext(f)[1].lower() in VIEWEREXT]
+        self.grid = ThumbGrid(self, paths)
+        self.Bind(wx.EVT_CLOSE, self.onClose)
+
+    def onClose(self, event):
+        self.grid.loader.stop()
+        event.Skip()
+
+class ThumbGrid(wx.ScrolledWindow):
+    #only the tiles in view are decoded, on a background thread; decoded
+    #bitmaps are kept for the most recently drawn tiles only
+    
+    def __init__(self, parent, paths, keep=200):
+
+        wx.ScrolledWindow.__init__(self, parent)
+        self.SetBackgroundColour(wx.WHITE)
+        self.paths = paths
+        self.tile = THUMBSIZE + 10
+        self.keep = keep
+        self.bitmaps = collections.OrderedDict()
+        self.failed = set()
+        self.loader = thumbcache.ThumbLoader(thumbs, THUMBSIZE, decodeThumb,
+            lambda p, t: wx.CallAfter(self.onThumb, p, t))
+
+        self.SetScrollRate(20, 20)
+        self.Bind(wx.EVT_PAINT, self.onPaint)
+        self.Bind(wx.EVT_SIZE, self.onSize)
+        self.layout()
+
+    def layout(self):
+        w = self.GetClientSize()[0]
+        self.cols = max(1, w//self.tile)
+        rows = (len(self.paths) + self.cols - 1)//self.cols
+        self.SetVirtualSize((self.cols*self.tile, rows*self.tile))
+
+    def onSize(self, event):
+        self.layout()
+        self.Refresh()
+        event.Skip()
+
+    def visible(self):
+        x,y = self.CalcUnscrolledPosition(0, 0)
+        w,h = self.GetClientSize()
+        first = y//self.tile*self.cols
+        last = ((y + h)//self.tile + 1)*self.cols
+        return range(max(0,first), min(len(self.paths),last))
+
+    def onPaint(self, event):
+        dc = wx.PaintDC(self)
+        self.DoPrepareDC(dc)
+        missing = []
+        for i in self.visible():
+            p = self.paths[i]
+            x = (i % self.cols)*self.tile + 5
+            y = (i//self.cols)*self.tile + 5
+            if p in self.bitmaps:
+                self.bitmaps[p] = self.bitmaps.pop(p) #most recently used
+                bitmap = self.bitmaps[p]
+                bx,by = bitmap.GetSize()
+                dc.DrawBitmap(bitmap, x + (THUMBSIZE - bx)//2, 
+                    y + (THUMBSIZE - by)//2)
+            else:
+                dc.DrawRectangle(x, y, THUMBSIZE, THUMBSIZE)
+                dc.DrawText(os.path.basename(p), x + 5, y + 5)
+                if p not in self.failed:
+                    missing.append(p)
+        if missing:
+            self.loader.request(missing)
+
+    def onThumb(self, path, thumb):
+        if not self:
+            return #frame closed while the thumb was decoding
+        if thumb is None:
+            self.failed.add(path)
+            return
+        x,y,data = thumb
+        self.bitmaps[path] = wx.BitmapFromBuffer(x, y, data)
+        while len(self.bitmaps) > self.keep:
+            self.bitmaps.popitem(last=False)
+        self.Refresh()
+
+def startupDone():
+    startup.mark('event loop')
+    startup.report()
 
 if __name__ == '__main__':    
     app = wx.App(False)
+    startup.mark('wx app')
     frame = MainFrame().Show()
+    #runs once the main loop is up, i.e. when the window can be used
+    wx.CallAfter(startupDone)
     app.MainLoop()
 
 
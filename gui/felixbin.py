@@ -0,0 +1,276 @@
+'''
+Reader for the .bin image output of felixrefine
+
+felixrefine writes one directory per saved iteration, e.g.
+GaAs_I0004_085nm_070x070/, holding one raw image per reflection, e.g.
+GaAs_085nm_070x070_+0+0+2.bin.  Each image is 2*IPixelCount square,
+written row by row (one direct-access record per row) as little-endian
+reals whose width depends on IByteSize and the compiler.
+
+Images are opened as read-only numpy.memmap views, so nothing is read
+from disk until pixels are actually used.  The pixel count comes from the
+directory name and the element size from the file length, so no image
+size has to be supplied by hand.
+
+    stack = BinStack('samples/GaAs_long/sample_outputs')
+    stack.shape            # (14, 69, 70, 70) iteration, reflection, y, x
+    stack[3, 0]            # memmap of the first reflection, 4th iteration
+    stack.image(3, (0, 0, 2))
+'''
+
+from __future__ import division
+
+import os
+import re
+
+import numpy as np
+
+# trailing _NNNxNNN of an output directory, e.g. SrTiO3_I0002_063nm_128x128
+SIZE_RE = re.compile(r'_(\d+)x(\d+)$')
+ITER_RE = re.compile(r'_I(\d+)_')
+THICK_RE = re.compile(r'_(\d+)(nm|A)_')
+# trailing +h+k+l of an image file, e.g. GaAs_085nm_070x070_-2-2+10.bin
+HKL_RE = re.compile(r'([+-]\d+)([+-]\d+)([+-]\d+)\.bin$')
+
+# bytes per pixel -> little-endian real type
+DTYPES = {8: np.dtype('<f8'), 4: np.dtype('<f4')}
+
+
+def parse_dirname(name):
+    '''Split an output directory name into its parts.
+
+    Returns a dict with formula, iteration (None for simulations),
+    thickness, unit ('nm' or 'A') and size (pixels along one side), or
+    None if the name is not a felix output directory.
+    '''
+    name = os.path.basename(os.path.normpath(name))
+    size = SIZE_RE.search(name)
+    if size is None or size.group(1) != size.group(2):
+        return None
+    info = {'formula': name.split('_')[0], 'size': int(size.group(1)),
+            'iteration': None, 'thickness': None, 'unit': None}
+    iteration = ITER_RE.search(name)
+    if iteration is not None:
+        info['iteration'] = int(iteration.group(1))
+    thickness = THICK_RE.search(name)
+    if thickness is not None:
+        info['thickness'] = int(thickness.group(1))
+        info['unit'] = thickness.group(2)
+    return info
+
+
+def parse_hkl(filename):
+    '''(h, k, l) of a .bin file name, or None if it has no hkl suffix'''
+    match = HKL_RE.search(filename)
+    if match is None:
+        return None
+    return tuple(int(i) for i in match.groups())
+
+
+def hkl_string(hkl):
+    '''(0, -2, 10) -> '+0-2+10', as used in felix file names'''
+    return ''.join('%+d' % i for i in hkl)
+
+
+def bin_dtype(path, size):
+    '''Element type of a size x size .bin file, from its length'''
+    nbytes = os.path.getsize(path)
+    if size <= 0 or nbytes % (size*size) != 0:
+        raise ValueError('%s: %d bytes is not a %dx%d image'
+                         % (path, nbytes, size, size))
+    try:
+        return DTYPES[nbytes//(size*size)]
+    except KeyError:
+        raise ValueError('%s: unsupported %d-byte pixels'
+                         % (path, nbytes//(size*size)))
+
+
+def open_bin(path, size=None):
+    '''Open one .bin image as a read-only (y, x) numpy.memmap.
+
+    If size is not given it is taken from the enclosing directory name,
+    falling back to a square image of 8-byte reals.
+    '''
+    if size is None:
+        info = parse_dirname(os.path.dirname(os.path.abspath(path)))
+        if info is not None:
+            size = info['size']
+        else:
+            size = int(round((os.path.getsize(path)/8)**0.5))
+    dtype = bin_dtype(path, size)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(size, size))
+
+
+class BinDirectory(object):
+    '''The .bin images of one output directory, keyed by (h, k, l)'''
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.info = parse_dirname(self.path)
+        if self.info is None:
+            raise ValueError('%s is not a felix output directory (no _NxN)'
+                             % path)
+        self.size = self.info['size']
+        self.iteration = self.info['iteration']
+        self.files = {}
+        for f in sorted(os.listdir(self.path)):
+            hkl = parse_hkl(f)
+            if hkl is not None:
+                self.files[hkl] = os.path.join(self.path, f)
+        self.hkls = sorted(self.files, key=_hkl_order)
+        self._images = {}
+
+    def __len__(self):
+        return len(self.hkls)
+
+    @property
+    def shape(self):
+        return (len(self.hkls), self.size, self.size)
+
+    def image(self, hkl):
+        '''memmap of reflection hkl, opened on first use'''
+        hkl = tuple(hkl)
+        if hkl not in self._images:
+            self._images[hkl] = open_bin(self.files[hkl], self.size)
+        return self._images[hkl]
+
+    def __getitem__(self, index):
+        return self.image(self.hkls[index])
+
+    def __iter__(self):
+        for hkl in self.hkls:
+            yield hkl, self.image(hkl)
+
+
+class BinStack(object):
+    '''All output directories below a run, as one lazy 4D array.
+
+    path is either a single output directory or a directory containing
+    them (e.g. sample_outputs).  Indexing follows
+    (iteration, reflection, y, x); a missing reflection in one iteration
+    reads as NaN.
+    '''
+
+    def __init__(self, path):
+        path = os.path.abspath(path)
+        if parse_dirname(path) is not None and _has_bins(path):
+            dirs = [BinDirectory(path)]
+        else:
+            dirs = [BinDirectory(os.path.join(path, d))
+                    for d in sorted(os.listdir(path))
+                    if parse_dirname(d) is not None
+                    and os.path.isdir(os.path.join(path, d))
+                    and _has_bins(os.path.join(path, d))]
+        if not dirs:
+            raise ValueError('no felix .bin output found in %s' % path)
+        sizes = set(d.size for d in dirs)
+        if len(sizes) != 1:
+            raise ValueError('%s mixes image sizes %s' % (path, sorted(sizes)))
+        # saved iterations in order; simulations (no iteration) keep their
+        # directory order after any refinement output
+        dirs.sort(key=lambda d: (d.iteration is None, d.iteration))
+        self.path = path
+        self.dirs = dirs
+        self.size = sizes.pop()
+        self.iterations = [d.iteration for d in dirs]
+        hkls = set()
+        for d in dirs:
+            hkls.update(d.hkls)
+        self.hkls = sorted(hkls, key=_hkl_order)
+        self._hklindex = dict((hkl, i) for i, hkl in enumerate(self.hkls))
+
+    @property
+    def shape(self):
+        return (len(self.dirs), len(self.hkls), self.size, self.size)
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def reflection_index(self, hkl):
+        return self._hklindex[tuple(hkl)]
+
+    def image(self, i, hkl):
+        '''(y, x) image of reflection hkl in the i-th saved iteration'''
+        d = self.dirs[i]
+        hkl = tuple(hkl)
+        if hkl in d.files:
+            return d.image(hkl)
+        if hkl not in self._hklindex:
+            raise KeyError('no reflection %s in %s' % (hkl_string(hkl),
+                                                       self.path))
+        return np.full((self.size, self.size), np.nan)
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        if len(index) < 2:
+            index = index + (slice(None),)
+        i, r, pixels = index[0], index[1], index[2:]
+        if isinstance(i, slice) or isinstance(r, slice):
+            # anything spanning more than one image is assembled on demand
+            block = self.asarray(i, r)
+            block = block[(slice(None) if isinstance(i, slice) else 0,
+                           slice(None) if isinstance(r, slice) else 0)]
+            return block[(Ellipsis,) + pixels] if pixels else block
+        image = self.image(i, self.hkls[r])
+        return image[pixels] if pixels else image
+
+    def asarray(self, iterations=slice(None), reflections=slice(None)):
+        '''Copy a block of the stack into memory.
+
+        iterations and reflections are slices or integers; the result is
+        always 4D (iteration, reflection, y, x).
+        '''
+        ilist = _as_range(iterations, len(self.dirs))
+        rlist = _as_range(reflections, len(self.hkls))
+        dtype = np.result_type(*[self.image(i, self.hkls[r]).dtype
+                                 for i in ilist[:1] for r in rlist[:1]] or
+                               [np.float64])
+        out = np.empty((len(ilist), len(rlist), self.size, self.size),
+                       dtype=dtype)
+        for a, i in enumerate(ilist):
+            for b, r in enumerate(rlist):
+                out[a, b] = self.image(i, self.hkls[r])
+        return out
+
+    def __array__(self, dtype=None):
+        out = self.asarray()
+        return out if dtype is None else out.astype(dtype)
+
+
+def to_uint8(image, vmin=None, vmax=None):
+    '''Linearly rescale an image to 0..255 for display'''
+    image = np.asarray(image, dtype=np.float64)
+    if vmin is None:
+        vmin = np.nanmin(image)
+    if vmax is None:
+        vmax = np.nanmax(image)
+    scale = 255.0/(vmax - vmin) if vmax > vmin else 0.0
+    out = np.nan_to_num((image - vmin)*scale)
+    return np.clip(out, 0, 255).astype(np.uint8)
+
+
+def to_rgb(image, vmin=None, vmax=None):
+    '''Greyscale image as a contiguous (y, x, 3) uint8 array, as wx wants'''
+    grey = to_uint8(image, vmin, vmax)
+    return np.ascontiguousarray(np.repeat(grey[:, :, np.newaxis], 3, axis=2))
+
+
+def _has_bins(path):
+    return any(parse_hkl(f) is not None for f in os.listdir(path))
+
+
+def _hkl_order(hkl):
+    # increasing h^2+k^2+l^2, close to the |g| order felix uses
+    return (sum(i*i for i in hkl), tuple(-i for i in hkl))
+
+
+def _as_range(index, n):
+    if isinstance(index, slice):
+        return list(range(n))[index]
+    index = int(index)
+    if index < 0:
+        index += n
+    if not 0 <= index < n:
+        raise IndexError('index %d out of range' % index)
+    return [index]
@@ -0,0 +1,420 @@
+'''
+The parts of felix.cif that felix uses
+
+ReadCif (src/felix/read_cif_mod.f90) takes the unit cell, the space
+group, the symmetry operators and the _atom_site_ loop from felix.cif
+through the ciftbx library; UniqueAtomPositions
+(src/felix/crystallography_mod.f90) then applies every operator to
+every site and drops the duplicates.  read_cif() does the same for
+Python tools, following felix's rules for what it reads:
+
+    - element symbols come from _atom_site_type_symbol (or the label),
+      e.g. Sr2+ is Sr and O2- is O, and D is taken as H
+    - B_iso is _atom_site_B_iso_or_equiv, else 8 pi^2 U_iso, else the
+      default (RDebyeWallerConstant in felix.inp)
+    - an occupancy of 0 or none means 1
+    - the cell volume is _cell_volume if the cif has one
+    - the lattice letter (F, I, A, B, C, R, V or P) is the first letter
+      of the space group name, which sets the reflection conditions
+
+The _atom_site_aniso_ loop (U or B) is read too, although felix itself
+does not use it yet.  Symmetry is applied to all sites at once, and two
+atoms are the same if they have the same label and positions within
+TINY, as in UniqueAtomPositions, found by rounding the positions to
+whole numbers of TINY rather than comparing every pair.
+
+read_cif keeps the Cif of the last CACHE_SIZE files it read, keyed by
+the sha256 of their contents, and hands out copies, so tools that
+load the same felix.cif (or a few variants of it) over and over only
+parse each one once.
+
+    cif = read_cif('samples/GaAs_short/felix.cif')
+    cif.lattice, cif.volume          # 'F', 180.55
+    atoms = cif.unique_atoms()       # 8 atoms of the unit cell
+'''
+
+from __future__ import division
+
+import collections
+import copy
+import hashlib
+import io
+import math
+import re
+import threading
+
+import numpy as np
+
+# SElementSymbolMatrix of smodules.f90, atomic number Z is index + 1
+ELEMENTS = (
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
+    'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+    'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr', 'Y', 'Zr',
+    'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
+    'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd',
+    'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb',
+    'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg',
+    'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn', 'Fr', 'Ra', 'Ac', 'Th',
+    'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm',
+    'Md', 'No', 'Lr', 'D', 'Ja', 'Jb', 'Jc', 'Jd', 'Je', 'Jf')
+LATTICES = 'FIABCRVP'
+# felix's TINY, below which a position, B or occupancy counts as zero
+TINY = 1e-9
+# one CIF value: quoted (the quote ends before a blank), or up to a blank
+TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+# one term of a symmetry operator component, e.g. -y, +1/2 or 0.25
+TERM = re.compile(r'([+-]?)\s*(\d+(?:\.\d*)?(?:/\d+)?|\.\d+|[xyz])')
+SYMOP_TAGS = ('_symmetry_equiv_pos_as_xyz',
+              '_space_group_symop_operation_xyz')
+GROUP_TAGS = ('_symmetry_space_group_name_h-m',
+              '_space_group_name_h-m_alt', '_symmetry_space_group_name_hall',
+              '_space_group_name_hall')
+# (row, column) of each _atom_site_aniso_U_ij
+ANISO = ('11', '22', '33', '12', '13', '23')
+# Cifs read_cif keeps
+CACHE_SIZE = 1024
+
+
+class CifError(ValueError):
+    pass
+
+
+# parse_symop's operators, the same few hundred in every cif
+_symops = {}
+
+
+def tokens(text):
+    '''The (value, is a tag) tokens of CIF text, without comments.
+
+    Text fields (between lines starting with ;) are one value.
+    '''
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith(';'):
+            field = [line[1:]]
+            i += 1
+            while i < len(lines) and not lines[i].startswith(';'):
+                field.append(lines[i])
+                i += 1
+            i += 1
+            yield '\n'.join(field).strip(), False
+            continue
+        for match in TOKEN.finditer(line):
+            quoted, double, bare = match.groups()
+            if bare is not None and bare.startswith('#'):
+                break
+            if bare is None:
+                yield quoted if quoted is not None else double, False
+            else:
+                yield bare, bare.startswith('_')
+        i += 1
+
+
+def parse(text):
+    '''{tag: [values]} of CIF text, tags in lower case.
+
+    A tag outside a loop_ has a list of one value.  Only the first data
+    block is read, as felix does.
+    '''
+    items = {}
+    stream = list(tokens(text))
+    i = 0
+    blocks = 0
+    while i < len(stream):
+        value, is_tag = stream[i]
+        lower = value.lower()
+        if not is_tag and lower.startswith('data_'):
+            blocks += 1
+            if blocks > 1:
+                break
+            i += 1
+        elif not is_tag and lower == 'loop_':
+            i += 1
+            tags = []
+            while i < len(stream) and stream[i][1]:
+                tags.append(stream[i][0].lower())
+                i += 1
+            values = []
+            while (i < len(stream) and not stream[i][1] and
+                   not stream[i][0].lower().startswith(('loop_', 'data_'))):
+                values.append(stream[i][0])
+                i += 1
+            if tags and len(values) % len(tags):
+                raise CifError('loop of %s has %d values, not a multiple '
+                               'of %d' % (tags[0], len(values), len(tags)))
+            for n, tag in enumerate(tags):
+                items[tag] = values[n::len(tags)]
+        elif is_tag:
+            if i + 1 < len(stream) and not stream[i + 1][1]:
+                items[lower] = [stream[i + 1][0]]
+                i += 2
+            else:
+                items[lower] = []
+                i += 1
+        else:
+            i += 1
+    return items
+
+
+def number(text):
+    '''A CIF number without its standard uncertainty, None for ? or .'''
+    if text is None or text in ('?', '.'):
+        return None
+    try:
+        return float(re.sub(r'\(\d+\)$', '', text))
+    except ValueError:
+        raise CifError('%r is not a number' % text)
+
+
+def element(symbol):
+    '''Element of a type symbol or label, as ReadCif finds it'''
+    name = symbol[:2]
+    if len(name) < 2 or name[1] in '1234567890+-()':
+        name = name[:1]
+    name = name[:1].upper() + name[1:].lower()
+    if name not in ELEMENTS:
+        raise CifError('no element for atom %r' % symbol)
+    return name
+
+
+def atomic_number(name):
+    z = ELEMENTS.index(name) + 1
+    # deuterium is hydrogen
+    return 1 if name == 'D' else z
+
+
+def parse_symop(text):
+    '''(3x3 rotation, translation) of an operator such as -y+1/2,x,z'''
+    if text not in _symops:
+        _symops[text] = _parse_symop(text)
+    rotation, translation = _symops[text]
+    return rotation.copy(), translation.copy()
+
+
+def _parse_symop(text):
+    parts = text.replace(' ', '').lower().split(',')
+    if len(parts) != 3:
+        raise CifError('symmetry operator %r does not have 3 parts' % text)
+    rotation = np.zeros((3, 3))
+    translation = np.zeros(3)
+    for row, part in enumerate(parts):
+        position = 0
+        for match in TERM.finditer(part):
+            if match.start() != position:
+                raise CifError('cannot read symmetry operator %r' % text)
+            position = match.end()
+            sign = -1.0 if match.group(1) == '-' else 1.0
+            term = match.group(2)
+            if term in 'xyz':
+                rotation[row, 'xyz'.index(term)] += sign
+            else:
+                num, _, den = term.partition('/')
+                translation[row] += sign*float(num)/float(den or 1)
+        if position != len(part) or not part:
+            raise CifError('cannot read symmetry operator %r' % text)
+    return rotation, translation
+
+
+class Cif(object):
+    '''Unit cell, symmetry and atom sites of a felix.cif.
+
+    lengths (Angstrom) and angles (radians) of the cell, volume,
+    space_group (the name), lattice (letter used for reflection
+    conditions), rotations (n, 3, 3) and translations (n, 3) of the
+    symmetry operators, and per basis atom: labels, elements, numbers
+    (Z), positions (fractional, (n, 3)), b_iso, occupancy, u_aniso
+    ((n, 3, 3) U_ij in Angstrom^2, zero for sites without them) and
+    anisotropic (True for sites with them).
+    '''
+
+    def __init__(self, items, default_b=0.0):
+        def single(tag, required=True):
+            values = items.get(tag)
+            value = number(values[0]) if values else None
+            if value is None and required:
+                raise CifError('no %s' % tag)
+            return value
+
+        self.lengths = np.array([single('_cell_length_' + x) for x in 'abc'])
+        self.angles = np.radians([single('_cell_angle_' + x)
+                                  for x in ('alpha', 'beta', 'gamma')])
+        volume = single('_cell_volume', required=False)
+        self.volume = volume if volume else self.cell_volume()
+
+        for tag in GROUP_TAGS:
+            name = (items.get(tag) or [''])[0].strip().lstrip('-')
+            if name[:1].isalpha():
+                break
+        else:
+            raise CifError('no space group name')
+        self.space_group = name
+        self.lattice = self._lattice(name[0].upper())
+
+        for tag in SYMOP_TAGS:
+            if items.get(tag):
+                ops = [parse_symop(text) for text in items[tag]]
+                break
+        else:
+            ops = [(np.eye(3), np.zeros(3))]
+        self.rotations = np.array([op[0] for op in ops])
+        self.translations = np.array([op[1] for op in ops])
+
+        labels = items.get('_atom_site_label')
+        if not labels:
+            raise CifError('no _atom_site_label loop')
+        count = len(labels)
+
+        def column(tag):
+            values = items.get(tag) or []
+            return [number(v) for v in values] + [None]*(count - len(values))
+
+        symbols = items.get('_atom_site_type_symbol') or labels
+        self.labels = list(labels)
+        self.elements = [element(s) for s in symbols]
+        self.numbers = np.array([atomic_number(e) for e in self.elements])
+        xyz = [column('_atom_site_fract_' + x) for x in 'xyz']
+        if any(v is None for c in xyz for v in c):
+            raise CifError('an atom site has no fractional coordinates')
+        self.positions = np.array(xyz).T
+        b_iso = []
+        for b, u in zip(column('_atom_site_b_iso_or_equiv'),
+                        column('_atom_site_u_iso_or_equiv')):
+            if b is not None and abs(b) > TINY:
+                b_iso.append(b)
+            elif u is not None and abs(u) > TINY:
+                b_iso.append(8*math.pi**2*u)
+            else:
+                b_iso.append(default_b)
+        self.b_iso = np.array(b_iso)
+        self.occupancy = np.array([o if o is not None and o > TINY else 1.0
+                                   for o in column('_atom_site_occupancy')])
+        self._read_aniso(items)
+        self._unique = None
+
+    def _read_aniso(self, items):
+        self.u_aniso = np.zeros((len(self.labels), 3, 3))
+        self.anisotropic = np.zeros(len(self.labels), dtype=bool)
+        labels = items.get('_atom_site_aniso_label') or []
+        for kind, scale in (('u', 1.0), ('b', 1/(8*math.pi**2))):
+            tags = ['_atom_site_aniso_%s_%s' % (kind, ij) for ij in ANISO]
+            if not any(items.get(tag) for tag in tags):
+                continue
+            for n, label in enumerate(labels):
+                if label not in self.labels:
+                    raise CifError('aniso atom %r is not an atom site' % label)
+                site = self.labels.index(label)
+                for ij, tag in zip(ANISO, tags):
+                    values = items.get(tag) or []
+                    u = number(values[n]) if n < len(values) else None
+                    i, j = int(ij[0]) - 1, int(ij[1]) - 1
+                    self.u_aniso[site, i, j] = self.u_aniso[site, j, i] = \
+                        scale*(u or 0.0)
+                self.anisotropic[site] = True
+
+    def cell_volume(self):
+        ca, cb, cg = np.cos(self.angles)
+        return float(np.prod(self.lengths) *
+                     math.sqrt(1 - ca*ca - cb*cb - cg*cg + 2*ca*cb*cg))
+
+    def orthogonal(self):
+        '''Rows a, b and c in ReciprocalLattice's orthogonal frame'''
+        a, b, c = self.lengths
+        ca, cb, cg = np.cos(self.angles)
+        sg = math.sin(self.angles[2])
+        return np.array([
+            [a, 0.0, 0.0],
+            [b*cg, b*sg, 0.0],
+            [c*cb, c*(ca - cb*cg)/sg,
+             c*math.sqrt(1 - ca*ca - cb*cb - cg*cg + 2*ca*cb*cg)/sg]])
+
+    def _lattice(self, letter):
+        # ReciprocalLattice: R is obverse (V) in hexagonal axes and
+        # primitive in rhombohedral ones
+        if letter == 'R':
+            a, b, c = [v/v.dot(v) for v in self.orthogonal()]
+            letter = 'V' if abs(a.dot(b)*b.dot(c)*c.dot(a)) < TINY else 'P'
+        if letter not in LATTICES:
+            raise CifError('space group %r: felix has no reflection '
+                           'conditions for lattice %s'
+                           % (self.space_group, letter))
+        return letter
+
+    def unique_atoms(self):
+        '''Every atom of the unit cell, as UniqueAtomPositions finds them.
+
+        Returns a dict of labels, elements, numbers, positions, b_iso,
+        occupancy, u_aniso (turned by the symmetry operator that made
+        the atom) and sites (the basis atom it came from), one entry per
+        atom, in the order felix has them.
+        '''
+        if self._unique is None:
+            self._unique = self._expand()
+        operator, site, positions = self._unique
+        return {'labels': [self.labels[i] for i in site],
+                'elements': [self.elements[i] for i in site],
+                'numbers': self.numbers[site],
+                'positions': positions.copy(),
+                'b_iso': self.b_iso[site],
+                'occupancy': self.occupancy[site],
+                'u_aniso': self._turned_u(operator, site),
+                'sites': site.copy()}
+
+    def _expand(self):
+        # (operator, site, position) of the atoms, all sites under the
+        # first operator, then the second, ...
+        positions = (np.einsum('oij,sj->osi', self.rotations, self.positions)
+                     + self.translations[:, None, :]).reshape(-1, 3)
+        positions = np.mod(positions, 1.0)
+        positions[np.abs(positions) < TINY] = 0.0
+        count = len(self.positions)
+        operator = np.repeat(np.arange(len(self.rotations)), count)
+        site = np.tile(np.arange(count), len(self.rotations))
+        # the same label at the same position is the same atom
+        label = np.unique(self.labels, return_inverse=True)[1]
+        keys = np.column_stack([np.ravel(label)[site],
+                                np.round(positions/TINY).astype(np.int64)])
+        first = np.sort(np.unique(keys, axis=0, return_index=True)[1])
+        return operator[first], site[first], positions[first]
+
+    def _turned_u(self, operator, site):
+        # U_ij are along a*, b*, c*: beta = N U N with N their lengths
+        # turns as R beta R^T under an operator of rotation R
+        if not self.anisotropic.any():
+            return np.zeros((len(site), 3, 3))
+        n = np.linalg.norm(np.linalg.inv(self.orthogonal()), axis=0)
+        r = self.rotations[operator]*n[None, None, :]/n[None, :, None]
+        return np.einsum('aij,ajk,alk->ail', r, self.u_aniso[site], r)
+
+
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def read_cif(path, default_b=0.0):
+    '''Cif of a file; default_b is B_iso for sites without one.
+
+    A copy of a cached Cif if a file with the same contents was read
+    with the same default_b.
+    '''
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    key = (hashlib.sha256(data).hexdigest(), default_b)
+    with _cache_lock:
+        cif = _cache.pop(key, None)
+    if cif is None:
+        cif = Cif(parse(data.decode('latin-1')), default_b)
+        # the atoms, so that copies share the work of expanding them
+        cif.unique_atoms()
+    with _cache_lock:
+        _cache[key] = cif
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return copy.deepcopy(cif)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,291 @@
+'''
+Batch figure of merit for simulated against experimental LACBED images
+
+FigureOfMeritAndThickness (src/felix/refinementcontrol_mod.f90) scores a
+simulation on rank 0, one image at a time: for every thickness and every
+pattern it applies IImageProcessingFLAG to both images and calls
+PhaseCorrelate, ResidualSumofSquares, Normalised2DCrossCorrelation or
+MaskedCorrelation (src/felix/utilities_mod.f90).  The same arithmetic is
+done here on whole arrays, so a finished run can be scored again under
+another ICorrelationFLAG, image processing or mask without simulating
+it again.
+
+Simulated images are a (pattern, thickness, y, x) array and experimental
+images a (pattern, y, x) array, pattern i of one matching pattern i of
+the other.  correlations() gives the (pattern, thickness) table of
+per-image figures of merit (0 is a perfect match, as in felix) and
+score() reduces it as felix does: the mean over patterns at each
+thickness, with the best thickness the one with the lowest mean.
+
+    sim, hkls, thicknesses = simulated_stack('runs/GaAs_sim')
+    exp = experimental_stack('samples/GaAs_short', hkls)
+    result = score(sim, exp, correlation=PHASE, processing=SQRT)
+    result.fom, thicknesses[result.thickness]
+
+    python figureofmerit.py samples/GaAs_short runs/GaAs_sim -c 0 2 -p 0 1
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import os
+import sys
+
+import numpy as np
+
+import felixbin
+
+# ICorrelationFLAG
+PHASE, RESIDUAL, NORMALISED, MASKED = 0, 1, 2, 3
+CORRELATIONS = {PHASE: 'phase correlation',
+                RESIDUAL: 'residual sum of squares',
+                NORMALISED: 'normalised cross correlation',
+                MASKED: 'masked cross correlation'}
+# IImageProcessingFLAG
+NONE, SQRT, LOG = 0, 1, 2
+PROCESSING = {NONE: 'none', SQRT: 'square root', LOG: 'log'}
+TINY = 1.0e-9
+# ResidualSumofSquares scales the raw experimental image by this
+RESIDUAL_SCALE = 2.0**16
+# complex128 bytes of FFT work per chunk of phase correlations
+FFT_CHUNK_BYTES = 64*1024*1024
+
+
+class Score(collections.namedtuple(
+        'Score', 'fom thickness per_thickness per_image image_thickness')):
+    '''Figure of merit of a simulation, as felix works it out.
+
+    fom is the lowest mean over patterns, at thickness index thickness;
+    per_thickness holds every mean and per_image the (pattern, thickness)
+    table.  image_thickness is the best thickness index of each pattern,
+    whose spread is the thickness range felix reports.
+    '''
+    __slots__ = ()
+
+
+def process(images, processing):
+    '''IImageProcessingFLAG applied to an array of images.
+
+    Like felix, any value other than SQRT or LOG means no processing.
+    '''
+    images = np.asarray(images, dtype=float)
+    if processing == SQRT:
+        return np.sqrt(images)
+    if processing == LOG:
+        # anything not above TINY is set to TINY, not to log(TINY)
+        positive = images > TINY
+        return np.where(positive, np.log(np.where(positive, images, 1.0)),
+                        TINY)
+    return images
+
+
+def phase_correlation(sim, exp):
+    '''PhaseCorrelate of each pair of images in two broadcast arrays'''
+    sim, exp = np.broadcast_arrays(sim, exp)
+    shape = sim.shape[-2:]
+    flat_sim = sim.reshape((-1,) + shape)
+    flat_exp = exp.reshape((-1,) + shape)
+    result = np.empty(len(flat_sim))
+    chunk = max(1, FFT_CHUNK_BYTES//(16*shape[0]*shape[1]))
+    for start in range(0, len(flat_sim), chunk):
+        part = slice(start, start + chunk)
+        cross = np.fft.rfft2(flat_sim[part])*np.conj(np.fft.rfft2(
+            flat_exp[part]))
+        size = np.abs(cross)
+        nonzero = size != 0
+        cross = np.where(nonzero, cross/np.where(nonzero, size, 1.0), 0)
+        # irfft2 divides by the pixel count, as felix does after FFTW
+        result[part] = np.fft.irfft2(cross, s=shape).max(axis=(-2, -1))
+    return result.reshape(sim.shape[:-2])
+
+
+def residual_sum_of_squares(sim, exp):
+    '''ResidualSumofSquares, with exp the unprocessed experiment'''
+    return ((exp/RESIDUAL_SCALE - sim)**2).sum(axis=(-2, -1))
+
+
+def normalised_correlation(sim, exp):
+    '''Normalised2DCrossCorrelation of each pair of images'''
+    sim = sim - sim.mean(axis=(-2, -1), keepdims=True)
+    exp = exp - exp.mean(axis=(-2, -1), keepdims=True)
+    npix = sim.shape[-1]*sim.shape[-2]
+    return (sim*exp).sum(axis=(-2, -1))/(
+        np.sqrt((sim**2).mean(axis=(-2, -1))) *
+        np.sqrt((exp**2).mean(axis=(-2, -1)))*npix)
+
+
+def masked_correlation(sim, exp, mask):
+    '''MaskedCorrelation of each pair of images, masks of 1 and 0.
+
+    As in felix the means are over the masked pixels only, but every
+    pixel, masked out or not, then takes part in the correlation.
+    '''
+    count = mask.sum(axis=(-2, -1), keepdims=True)
+    count = np.where(count > 0, count, mask.shape[-1]*mask.shape[-2])
+    sim = sim*mask
+    exp = exp*mask
+    sim = sim - sim.sum(axis=(-2, -1), keepdims=True)/count
+    exp = exp - exp.sum(axis=(-2, -1), keepdims=True)/count
+    count = count[..., 0, 0]
+    return (sim*exp).sum(axis=(-2, -1))/(
+        np.sqrt((sim**2).sum(axis=(-2, -1))/count) *
+        np.sqrt((exp**2).sum(axis=(-2, -1))/count)*count)
+
+
+def correlations(sim, exp, correlation=NORMALISED, processing=NONE,
+                 mask=None):
+    '''(pattern, thickness) figures of merit of every simulated image.
+
+    sim is (pattern, thickness, y, x), exp (pattern, y, x) and mask, for
+    MASKED, (pattern, y, x).  A MASKED score without a mask is a
+    normalised cross correlation, as felix scores the first simulations
+    of a refinement before it has made its masks.
+    '''
+    sim = np.asarray(sim, dtype=float)
+    raw = np.asarray(exp, dtype=float)
+    if sim.ndim != 4 or raw.shape != sim.shape[:1] + sim.shape[2:]:
+        raise ValueError('simulated %s and experimental %s images do not '
+                         'match' % (sim.shape, raw.shape))
+    sim = process(sim, processing)
+    exp = process(raw, processing)[:, np.newaxis]
+    if correlation == PHASE:
+        fom = 1 - phase_correlation(sim, exp)
+    elif correlation == RESIDUAL:
+        fom = residual_sum_of_squares(sim, raw[:, np.newaxis])
+    elif correlation == NORMALISED or (correlation == MASKED and
+                                       mask is None):
+        fom = 1 - normalised_correlation(sim, exp)
+    elif correlation == MASKED:
+        mask = np.asarray(mask, dtype=float)
+        if mask.shape != raw.shape:
+            raise ValueError('masks %s do not match the images %s'
+                             % (mask.shape, raw.shape))
+        fom = 1 - masked_correlation(sim, exp, mask[:, np.newaxis])
+    else:
+        raise ValueError('unknown ICorrelationFLAG %r' % (correlation,))
+    bad = np.argwhere(np.isnan(fom))
+    if len(bad):
+        raise ValueError('NaN image correlation for pattern %d, thickness '
+                         '%d' % tuple(bad[0] + 1))
+    return fom
+
+
+def reduce(fom):
+    '''Score of a (pattern, thickness) table of figures of merit'''
+    per_thickness = fom.mean(axis=0)
+    # argmin takes the first of equal values, as felix's strict '<'
+    best = int(np.argmin(per_thickness))
+    return Score(float(per_thickness[best]), best, per_thickness, fom,
+                 np.argmin(fom, axis=1))
+
+
+def score(sim, exp, correlation=NORMALISED, processing=NONE, mask=None):
+    '''Score of a simulation, see correlations() for the arguments'''
+    return reduce(correlations(sim, exp, correlation, processing, mask))
+
+
+def difference_mask(base, varied, fraction=0.1):
+    '''Masks felix makes for MASKED refinement, (pattern, y, x) of 1, 0.
+
+    base and varied are (pattern, y, x) simulations before and after
+    the parameters are changed; pixels that change by more than fraction
+    of the largest change in their pattern are kept.
+    '''
+    change = np.abs(np.asarray(varied, float) - np.asarray(base, float))
+    limit = fraction*change.max(axis=(-2, -1), keepdims=True)
+    return (change > limit).astype(float)
+
+
+def thickness_angstrom(info):
+    '''Thickness of a parsed output directory name in Angstroms'''
+    if info['unit'] == 'nm':
+        return 10*info['thickness']
+    return info['thickness']
+
+
+def simulated_stack(path, hkls=None):
+    '''Every output directory below path as one simulated stack.
+
+    Returns ((pattern, thickness, y, x) array, hkls, thicknesses in
+    Angstroms), with the directories in order of thickness: the Sim_
+    directories of one simulation, or a single refinement iteration as
+    one thickness.  hkls picks and orders the patterns.
+    '''
+    stack = felixbin.BinStack(path)
+    dirs = sorted(stack.dirs, key=lambda d: thickness_angstrom(d.info))
+    thicknesses = [thickness_angstrom(d.info) for d in dirs]
+    if len(set(thicknesses)) != len(thicknesses):
+        raise ValueError('%s holds more than one image per thickness, '
+                         'give a single iteration directory' % path)
+    if hkls is None:
+        hkls = stack.hkls
+    sim = np.empty((len(hkls), len(dirs), stack.size, stack.size))
+    for j, d in enumerate(dirs):
+        for i, hkl in enumerate(hkls):
+            sim[i, j] = d.image(hkl)
+    return sim, list(hkls), thicknesses
+
+
+def experimental_stack(sample, hkls):
+    '''Experimental images of sample for hkls, as (pattern, y, x)'''
+    import expimages
+    images = expimages.load(sample)
+    missing = [h for h in hkls if h not in images]
+    if missing:
+        raise ValueError('no experimental image for %s'
+                         % ', '.join(felixbin.hkl_string(h)
+                                     for h in missing))
+    return np.array([images[h] for h in hkls], dtype=float)
+
+
+def read_masks(directory, hkls, size):
+    '''The .mask files felix writes in debug mode, as (pattern, y, x)'''
+    masks = np.empty((len(hkls), size, size))
+    for i, hkl in enumerate(hkls):
+        path = os.path.join(directory, '%d%d%d.mask' % tuple(hkl))
+        masks[i] = np.fromfile(path, dtype='<f8').reshape(size, size)
+    return masks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Score felix simulations against experimental images')
+    parser.add_argument('sample', help='directory with felix.inp, felix.hkl, '
+                        'felix.cif and the experimental images')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='simulation output or one iteration directory '
+                        '(default: the sample directory)')
+    parser.add_argument('-c', '--correlation', type=int, nargs='+',
+                        default=[NORMALISED], choices=sorted(CORRELATIONS),
+                        help='ICorrelationFLAG values to score with')
+    parser.add_argument('-p', '--processing', type=int, nargs='+',
+                        default=[NONE], choices=sorted(PROCESSING),
+                        help='IImageProcessingFLAG values to score with')
+    parser.add_argument('--masks', default=None,
+                        help='directory of .mask files for ICorrelationFLAG 3')
+    args = parser.parse_args(argv)
+
+    try:
+        sim, hkls, thicknesses = simulated_stack(args.output or args.sample)
+        exp = experimental_stack(args.sample, hkls)
+        mask = None
+        if args.masks:
+            mask = read_masks(args.masks, hkls, sim.shape[-1])
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    print('%d patterns, %d thicknesses %d-%d A' % (
+        len(hkls), len(thicknesses), thicknesses[0], thicknesses[-1]))
+    for correlation in args.correlation:
+        for processing in args.processing:
+            result = score(sim, exp, correlation, processing, mask)
+            spread = result.image_thickness
+            print('%-30s %-12s FoM %9.4f%%  thickness %5d A  range %5d A'
+                  % (CORRELATIONS[correlation], PROCESSING[processing],
+                     100*result.fom, thicknesses[result.thickness],
+                     thicknesses[spread.max()] - thicknesses[spread.min()]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+'''
+Reading and writing felix.inp
+
+ReadInpFile (src/felix/read_files_mod.f90) reads felix.inp strictly by
+position: six header lines, then every value from a fixed line, skipping
+the first 27 characters, with pairs of comment lines between sections.
+The names in the file are never looked at.  SCHEMA below lists the lines
+in the same order, so a file can be checked against what felix will
+actually read (a value under the wrong name, or one that runs past the
+Fortran field, is an error here rather than a silent misread there).
+
+Values are typed by kind:
+
+    int      I15.1 field             1
+    real     F18.9 field             7.8
+    vector   [u,v,w]                 [-1, 1, 0]
+    refine   refinement letters      'BC' (or 'S' to simulate)
+    sites    atomic sites            (1, 2)
+
+InpFile keeps the original text, and setting a value only rewrites that
+one line, so reading and writing an unchanged file gives the same bytes.
+
+Fields added to felix after a file was written are optional: they come
+last, felix uses their default when the file ends before them, and they
+are only appended to a file when they are set.
+
+    inp = InpFile.read('samples/GaAs_long/felix.inp')
+    inp['RAbsorptionPer'] = 5.0
+    inp['IIncidentBeamDirection']      # [-1, 1, 0]
+    inp.write('felix.inp')
+'''
+
+from __future__ import division
+
+import collections
+import re
+
+# the value starts after 27X; I15.1 / F18.9 read this many characters
+VALUE_COLUMN = 27
+FIELD_WIDTH = {'int': 15, 'real': 18}
+# name padding used when a line has to be written from scratch
+NAME_WIDTH = 26
+REFINE_LETTERS = 'ABCDEFGHI'
+SIMULATE = 'S'
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+class Field(object):
+    '''One value line of felix.inp'''
+
+    def __init__(self, name, kind, default, aliases=(), label=None,
+                 optional=False):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.aliases = tuple(aliases)
+        # the text written before '=', if not just the name
+        self.label = label or name
+        # may be missing from the end of the file
+        self.optional = optional
+
+
+# None marks a comment line, with the text it gets in a new file
+SCHEMA = [
+    (None, '# Input file for Felix version :VERSION: Build :BUILD:'),
+    (None, '# ------------------------------------'),
+    (None, ''),
+    (None, '# ------------------------------------'),
+    (None, ''),
+    (None, '# control flags'),
+    Field('IWriteFLAG', 'int', 1),
+    Field('IImageFLAG', 'int', 1),
+    Field('IScatterFactorMethodFLAG', 'int', 0),
+    Field('IBlochMethodFLAG', 'int', 0),
+    Field('IMaskFLAG', 'int', 0),
+    Field('IHolzFLAG', 'int', 0),
+    Field('IAbsorbFLAG', 'int', 1),
+    Field('IAnisoDebyeWallerFlag', 'int', 0,
+          aliases=['IAnisoDebyeWallerFactorFlag']),
+    Field('IByteSize', 'int', 8),
+    (None, ''),
+    (None, '# radius of the beam in pixels'),
+    Field('IPixelCount', 'int', 64),
+    (None, ''),
+    (None, '# beam selection criteria'),
+    Field('IMinReflectionPool', 'int', 600),
+    Field('IMinStrongBeams', 'int', 200),
+    Field('IMinWeakBeams', 'int', 0),
+    (None, ''),
+    (None, '# crystal settings'),
+    Field('RDebyeWallerConstant', 'real', 0.0),
+    Field('RAbsorptionPer', 'real', 5.0,
+          aliases=['RAbsorptionPercentage']),
+    (None, ''),
+    (None, '# microscope settings'),
+    Field('ROuterConvergenceAngle', 'real', 3.0,
+          aliases=['RConvergenceAngle']),
+    Field('IIncidentBeamDirection', 'vector', [0, 0, 1]),
+    Field('IXDirection', 'vector', [1, 0, 0]),
+    Field('INormalDirection', 'vector', [0, 0, 1]),
+    Field('RAcceleratingVoltage', 'real', 200.0,
+          label='RAcceleratingVoltage (kV)'),
+    Field('RAcceptanceAngle', 'real', 0.0),
+    (None, ''),
+    (None, '# Image Output Options'),
+    Field('RInitialThickness', 'real', 1000.0),
+    Field('RFinalThickness', 'real', 1000.0),
+    Field('RDeltaThickness', 'real', 10.0),
+    Field('IReflectOut', 'real', 1, aliases=['RPrecision']),
+    (None, ''),
+    (None, '#Refinement Specific Flags'),
+    Field('IRefineModeFLAG', 'refine', SIMULATE),
+    Field('IWeightingFLAG', 'int', 0),
+    Field('IRefineMethodFLAG', 'int', 1, aliases=['IMethodFLAG']),
+    Field('ICorrelationFLAG', 'int', 2),
+    Field('IImageProcessingFLAG', 'int', 0),
+    Field('RBlurRadius', 'real', 0.0),
+    Field('INoofUgs', 'int', 1),
+    Field('IAtomicSites', 'sites', (1,)),
+    Field('IPrint', 'int', 0),
+    Field('RSimplexLengthScale', 'real', 5.0),
+    Field('RExitCriteria', 'real', 0.0001),
+    Field('IUnblurredFLAG', 'int', 0, optional=True),
+    Field('IResultFileFLAG', 'int', 0, optional=True),
+    Field('ICheckpointFLAG', 'int', 0, optional=True),
+    Field('IPixelScheduleFLAG', 'int', 0, optional=True),
+    Field('ITimingFLAG', 'int', 0, optional=True),
+    Field('IEigenCacheMB', 'int', 0, optional=True),
+    Field('IVertexGroups', 'int', 0, optional=True),
+]
+
+FIELDS = [f for f in SCHEMA if isinstance(f, Field)]
+# every name or alias -> (Field, line number in the file)
+LOOKUP = {}
+for _line, _f in enumerate(SCHEMA):
+    if isinstance(_f, Field):
+        for _name in (_f.name,) + _f.aliases:
+            LOOKUP[_name] = (_f, _line)
+del _line, _f, _name
+# lines a file must have; the optional fields after them may be missing
+REQUIRED = max(i for i, f in enumerate(SCHEMA)
+               if not (isinstance(f, Field) and f.optional)) + 1
+
+NUMBER_RE = r'[-+]?(\d+\.?\d*|\.\d+)([eEdD][-+]?\d+)?'
+VECTOR_RE = re.compile(r'^\[\s*(%s)\s*,\s*(%s)\s*,\s*(%s)\s*\]$'
+                       % (NUMBER_RE, NUMBER_RE, NUMBER_RE))
+SITES_RE = re.compile(r'^\(\s*\d+\s*(,\s*\d+\s*)*\)$')
+
+
+class InpError(ValueError):
+    '''A felix.inp that felix would misread, with the 1-based line'''
+
+    def __init__(self, message, line=None):
+        if line is not None:
+            message = 'felix.inp line %d: %s' % (line, message)
+        ValueError.__init__(self, message)
+        self.line = line
+
+
+def field(name):
+    '''The Field called name (or one of its aliases)'''
+    try:
+        return LOOKUP[name][0]
+    except KeyError:
+        raise KeyError('%s is not a felix.inp variable' % name)
+
+
+def _number(text):
+    text = text.replace('d', 'e').replace('D', 'e')
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_value(kind, text):
+    '''Typed value of the text after '=' '''
+    text = text.strip()
+    try:
+        if kind == 'int':
+            return int(text)
+        if kind == 'real':
+            return _number(text)
+        if kind == 'vector':
+            match = VECTOR_RE.match(text)
+            if match is None:
+                raise ValueError
+            return [_number(match.group(i)) for i in (1, 4, 7)]
+        if kind == 'refine':
+            letters = text.replace(' ', '').upper()
+            if not letters or \
+                    not set(letters) <= set(REFINE_LETTERS + SIMULATE):
+                raise ValueError
+            return letters
+        if kind == 'sites':
+            if SITES_RE.match(text) is None:
+                raise ValueError
+            return tuple(int(i) for i in text.strip('()').split(','))
+    except ValueError:
+        raise ValueError('%r is not a valid %s value' % (text, kind))
+    raise ValueError('unknown kind %r' % kind)
+
+
+def format_value(kind, value):
+    '''Text felix reads back as value'''
+    if kind == 'int':
+        if int(value) != value:
+            raise ValueError('%r is not an integer' % (value,))
+        return str(int(value))
+    if kind == 'real':
+        if isinstance(value, int) and not isinstance(value, bool):
+            return str(value)
+        return repr(float(value))
+    if kind == 'vector':
+        value = list(value)
+        if len(value) != 3:
+            raise ValueError('%r is not a 3-vector' % (value,))
+        return '[' + ','.join(
+            str(v) if int(v) != v else str(int(v)) for v in value) + ']'
+    if kind == 'refine':
+        if isinstance(value, (list, tuple)):
+            value = ''.join(value)
+        return parse_value(kind, value)
+    if kind == 'sites':
+        if isinstance(value, int):
+            value = (value,)
+        return '(' + ','.join(str(int(i)) for i in value) + ')'
+    raise ValueError('unknown kind %r' % kind)
+
+
+def format_line(f, value, key=None):
+    '''A complete line (no newline) for field f'''
+    if key is None:
+        key = f.label.ljust(NAME_WIDTH)
+    line = key + '= ' + format_value(f.kind, value)
+    _check_width(f, line)
+    return line
+
+
+def _check_width(f, line, number=None):
+    key, value = line.split('=', 1)
+    if len(key) + 1 > VALUE_COLUMN and f.kind in FIELD_WIDTH:
+        raise InpError("'=' of %s is past column %d, felix would read the "
+                       "name as the value" % (f.name, VALUE_COLUMN), number)
+    width = FIELD_WIDTH.get(f.kind)
+    if width is not None and \
+            len(line.rstrip()) > VALUE_COLUMN + width:
+        raise InpError('%s value %r runs past column %d, where felix stops '
+                       'reading' % (f.name, value.strip(),
+                                    VALUE_COLUMN + width), number)
+
+
+class InpFile(object):
+    '''The lines of a felix.inp, with typed access to its values'''
+
+    def __init__(self, lines=None):
+        if lines is None:
+            lines = [format_line(f, f.default) + '\n'
+                     if isinstance(f, Field) else f[1] + '\n'
+                     for f in SCHEMA]
+        self.lines = list(lines)
+        self.values = collections.OrderedDict()
+        if len(self.lines) < REQUIRED:
+            raise InpError('file ends after %d lines, felix reads %d'
+                           % (len(self.lines), REQUIRED),
+                           len(self.lines) + 1)
+        for number, f in enumerate(SCHEMA):
+            if not isinstance(f, Field):
+                continue
+            if number >= len(self.lines) or (
+                    f.optional and not self.lines[number].strip()):
+                # felix reads a blank line as zero, but it is the default
+                self.values[f.name] = f.default
+            else:
+                self.values[f.name] = self._parse(f, number)
+
+    def _parse(self, f, number):
+        line = self.lines[number].rstrip('\r\n')
+        if '=' not in line:
+            raise InpError('expected %s, found %r' % (f.name, line),
+                           number + 1)
+        key, text = line.split('=', 1)
+        name = key.split()[0] if key.split() else ''
+        if name not in (f.name,) + f.aliases:
+            raise InpError('expected %s, found %s; felix reads by position'
+                           % (f.name, name or 'no name'), number + 1)
+        _check_width(f, line, number + 1)
+        try:
+            return parse_value(f.kind, text)
+        except ValueError as e:
+            raise InpError('%s: %s' % (f.name, e), number + 1)
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text.splitlines(True))
+
+    @classmethod
+    def read(cls, path):
+        with open(path, 'rb') as f:
+            return cls.parse(f.read().decode('ascii'))
+
+    @classmethod
+    def from_values(cls, values):
+        '''A new felix.inp with defaults for anything not in values'''
+        inp = cls()
+        inp.update(values)
+        return inp
+
+    def copy(self):
+        new = InpFile.__new__(InpFile)
+        new.lines = list(self.lines)
+        new.values = collections.OrderedDict(
+            (k, list(v) if isinstance(v, list) else v)
+            for k, v in self.values.items())
+        return new
+
+    def __contains__(self, name):
+        return name in LOOKUP
+
+    def __getitem__(self, name):
+        return self.values[field(name).name]
+
+    def __setitem__(self, name, value):
+        f, number = LOOKUP.get(name, (None, None))
+        if f is None:
+            field(name)
+        if isinstance(value, string_types) and f.kind != 'refine':
+            value = parse_value(f.kind, value)
+        if number >= len(self.lines):
+            self._extend(number)
+        old = self.lines[number]
+        ending = old[len(old.rstrip('\r\n')):] or '\n'
+        # keep the name and its padding exactly as they were
+        line = format_line(f, value,
+                           old.split('=', 1)[0] if '=' in old else None)
+        self.lines[number] = line + ending
+        self.values[f.name] = parse_value(f.kind, line.split('=', 1)[1])
+
+    def _extend(self, number):
+        # write out the optional lines up to number, in the file's style
+        last = self.lines[-1]
+        ending = last[len(last.rstrip('\r\n')):]
+        if not ending:
+            ending = '\r\n' if self.lines[0].endswith('\r\n') else '\n'
+            self.lines[-1] = last + ending
+        for f in SCHEMA[len(self.lines):number + 1]:
+            self.lines.append(format_line(f, self.values[f.name]) + ending)
+
+    def update(self, values):
+        for name, value in dict(values).items():
+            self[name] = value
+
+    def items(self):
+        return self.values.items()
+
+    def text(self):
+        return ''.join(self.lines)
+
+    def write(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.text().encode('ascii'))
@@ -1,42 +1,74 @@
-import itertools
 import wx
 
+import inpfile
+
 ### INPUT VARIABLES & WIDGET CLASSES
-def combof(pool, maxn): #optional combination function for choice variables
-    combolist = []
-    indexlist = []    
-    for r in range(1, maxn + 1):
-        n = len(pool)
-        #if r > n:
-        indices = range(0, r)
-        tempstr = pool[0]
-        temparray = [0]
-        for i in indices[1:]:
-            tempstr += ', ' + pool[i]
-            temparray.append(i)
-
-        combolist.append(tempstr)
-        indexlist.append(temparray)
-
-        while True:
-            for i in reversed(range(r)):
-                if indices[i] != i + n - r:
-                    break
-            else:
-                break
-            indices[i] += 1
-            for j in range(i+1, r):
-                indices[j] = indices[j-1] + 1
-            tempstr = pool[indices[0]]
-            temparray = [indices[0]]
-            for i in indices[1:]:
-                tempstr += ', ' + pool[i]
-                temparray.append(i)
-            
-            combolist.append(tempstr)
-            indexlist.append(temparray)
+class combo_table(): #all combinations of a choice pool, made on demand
+    #combinations of 1 up to maxn choices, in the order of size then
+    #lexicographic by index, are ranked and unranked arithmetically
+    #(combinatorial number system) so nothing is expanded up front
+
+    def __init__(self, pool, maxn):
+        self.pool = list(pool)
+        n = len(self.pool)
+        self.maxn = min(maxn, n)
+        #pascal's triangle, binom[i][j] = i choose j
+        self.binom = [[1]]
+        for i in range(1, n + 1):
+            row = self.binom[-1]
+            self.binom.append([1] + [row[j-1] + row[j] 
+                for j in range(1, i)] + [1])
+        #rank of the first combination of each size
+        self.offsets = [0]
+        for r in range(1, self.maxn + 1):
+            self.offsets.append(self.offsets[-1] + self.choose(n, r))
+
+    def choose(self, n, r):
+        if r < 0 or n < 0 or r > n:
+            return 0
+        return self.binom[n][r]
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def indices(self, rank): #rank -> sorted list of pool indices
+        if rank < 0:
+            rank += len(self)
+        if not 0 <= rank < len(self):
+            raise IndexError('combination %d out of range' % rank)
+        n = len(self.pool)
+        r = 1
+        while rank >= self.offsets[r]:
+            r += 1
+        k = rank - self.offsets[r-1]
+        indices = []
+        x = 0
+        for i in range(r):
+            while k >= self.choose(n - 1 - x, r - 1 - i):
+                k -= self.choose(n - 1 - x, r - 1 - i)
+                x += 1
+            indices.append(x)
+            x += 1
+        return indices
+
+    def rank(self, indices): #sorted list of pool indices -> rank
+        n = len(self.pool)
+        r = len(indices)
+        if not 1 <= r <= self.maxn or list(indices) != sorted(set(indices)) \
+                or indices[0] < 0 or indices[-1] >= n:
+            raise ValueError('%s is not a combination of this pool' 
+                % (indices,))
+        k = self.choose(n, r) - 1
+        for i, c in enumerate(indices):
+            k -= self.choose(n - 1 - c, r - i)
+        return self.offsets[r-1] + k
 
-    return combolist, indexlist
+    def __getitem__(self, rank): #label shown in the widget
+        return ', '.join(self.pool[i] for i in self.indices(rank))
+
+    def __iter__(self):
+        for rank in range(len(self)):
+            yield self[rank]
 
 class input_var(): #input variable
     
@@ -53,57 +85,65 @@ class input_var(): #input variable
 class combo_var(input_var): #combo variable - select option from list
 
     def __init__(self, name, choices, defaultRef=0, maxchoice = -1,
-                    infoText=''):
+                    infoText='', values=None):
         if maxchoice == -1:
             maxchoice = 1
 
         #all(isinstance(elem, str) for elem in choices)
         input_var.__init__(self, name, infoText)
-        self.choices, self.refList = combof(choices, maxchoice)
+        self.choices = combo_table(choices, maxchoice)
         self.defaultRef = defaultRef
+        #value felix reads for each single choice, its index by default
+        self.values = values if values is not None else range(len(choices))
+        self.valueIndex = dict((v, i) for i, v in enumerate(self.values))
         
     def inputWidget(self, panel): 
             
         self.widget = wx.Choice(panel, wx.ID_ANY, size=(100, -1),
-                                     choices=self.choices, name=self.name)
-        self.widget.SetStringSelection(self.choices[self.defaultRef])
+                                     choices=list(self.choices), 
+                                     name=self.name)
+        self.widget.SetSelection(self.defaultRef)
         #self.widget.Bind(wx.EVT_RIGHT_DOWN, self.onInfo)
               
         return self.widget
+
+    def get(self):
+        ref = self.choices.indices(self.widget.GetSelection())
+        if self.choices.maxn == 1:
+            return self.values[ref[0]]
+        return [self.values[i] for i in ref]
         
     def writeInputLine(self):
-        choiceRef = str(self.refList[self.widget.GetSelection()]).strip('[]')
-        i = 30 - len(self.name)
-        j = 15 - len(choiceRef)
-        
-        return self.name + ' '*i + '= ' + choiceRef
+        return inpfile.format_line(inpfile.field(self.name), self.get())
 
-    def read(self, choiceRef):
+    def read(self, value):
+        if isinstance(value, inpfile.string_types):
+            value = list(value) #refinement letters
+        elif not isinstance(value, (list, tuple)):
+            value = [value]
         try: 
-            choiceRef = [int(i) for i in choiceRef]
-        except:
+            choiceRef = sorted(self.valueIndex[i] for i in value)
+            self.widget.SetSelection(self.choices.rank(choiceRef))
+        except (KeyError, ValueError):
             return False
         else:
-            if choiceRef in self.refList:
-                self.widget.SetSelection(self.refList.index(choiceRef))
-                return True
-               
-            else:
-                return False
+            return True
 
 
-class value_var(input_var):
+class value_var(input_var): #typed in number
     
     def __init__(self, name, infoText=''):
         input_var.__init__(self, name, infoText)        
-
+        self.kind = inpfile.field(name).kind
                         
     def inputWidget(self, panel):
-        self.widget = wx.TextCtrl(panel, wx.ID_ANY)
+        self.widget = wx.TextCtrl(panel, wx.ID_ANY,
+            value=inpfile.format_value(self.kind, 
+                inpfile.field(self.name).default))
 
         def checkChar(event):
             keycode = event.GetKeyCode()
-            if keycode in list(range(48,58))+[46]+[8]+[37]+[39]:
+            if keycode in list(range(48,58))+[45,46]+[8]+[37]+[39]:
                 if(keycode != 46 or '.' not in self.widget.GetValue()):
                     event.Skip()
                     self.chosen = self.widget.GetValue()
@@ -113,25 +153,31 @@ class value_var(input_var):
 
         return self.widget
         #return wx.TextCtrl(panel, wx.ID_ANY)
+
+    def get(self):
+        #text as typed, inpfile checks it is valid for felix
+        return inpfile.parse_value(self.kind, self.widget.GetValue())
                     
     def writeInputLine(self):
-        i = 30 - len(self.name)
-        if self.widget.GetValue() == '':
-            value = 0
-        else:
-            value = self.widget.GetValue()
-        return self.name + ' '*i + '= ' + str(value)
+        return inpfile.format_line(inpfile.field(self.name), self.get())
         
     def read(self, value):
         try:
-            value = str(value[0])
-            #print(value)
-            self.widget.SetValue(value)
+            self.widget.SetValue(inpfile.format_value(self.kind, value))
             return True
         except ValueError:
             return False
 
 
+class text_var(value_var): #typed in vector, list or letters
+
+    def inputWidget(self, panel):
+        self.widget = wx.TextCtrl(panel, wx.ID_ANY,
+            value=inpfile.format_value(self.kind, 
+                inpfile.field(self.name).default))
+        return self.widget
+
+
 class seperator():
 
     def __init__(self, name):
@@ -139,58 +185,82 @@ class seperator():
 
 
         
-###INPUT VARIABLES      
+###INPUT VARIABLES
+#same names and order as felix.inp (see inpfile.SCHEMA), every one of
+#which must be here for onCreateINP to write a file felix can read
 iv =[
-    seperator('Flag Variables'),
-    combo_var('IWriteFLAG', ['0','5','11'],
-                    infoText = 'For detailed terminal info...'),    
-    combo_var('IImageFLAG', ['Diffractions','Reflections',
-                    'Amplitude+Phase'], 2, maxchoice = 3),
-    combo_var('IOutputFLAG', ['Nothing','Ug Matrix','Eigenspectra',
-                    'Wavefunctions'], 0),
-
-    seperator('Beam Variables'),
-    combo_var('IBinorTextFLAG', ['Binary','Text'], 1),
-    combo_var('IScatteringFactorMethod', ['Kirklands','Peng',
-                    'Doyle+Turner'], 0),
-    combo_var('IZolzFLAG', ['No','Yes'], 0),
-    combo_var('ICentralBeamFlag', ['Not included','included'], 0),
+    seperator('Control Flags'),
+    value_var('IWriteFLAG', 
+                    infoText = 'Amount of terminal output, 0 is least'),
+    value_var('IImageFLAG'),
+    combo_var('IScatterFactorMethodFLAG', ['Kirkland','Peng',
+                    'Doyle+Turner','Lobato'], 0),
+    value_var('IBlochMethodFLAG'),
     combo_var('IMaskFLAG', ['Circular','Square'], 0),
-    combo_var('IAbsorbFLAG', ['No','Proprtional','Einstein Perturbative',
-                    'Einstein Exact'], 0),
+    combo_var('IHolzFLAG', ['No','Yes'], 0),
+    combo_var('IAbsorbFLAG', ['No','Proportional','Bird & King'], 1),
+    combo_var('IAnisoDebyeWallerFlag', ['No','Yes'], 0),
+    value_var('IByteSize',
+                    infoText = 'Bytes per pixel of the experimental images'),
+    value_var('IPixelCount', infoText = 'Radius of the beam in pixels'),
+
+    seperator('Beam Selection & Crystal'),
     value_var('IMinReflectionPool'),
-    combo_var('IAnisotropicDebyeWallerFLAG', ['No','Yes'], 0),
-    combo_var('IPseudoCubicFLAG', ['Orthorhombic','PseudoCubic'], 0),
-    combo_var('IXDirectionFLAG', ['Ignore','Use'], 0),
-    value_var('IPixelCount'),
     value_var('IMinStrongBeams'),
     value_var('IMinWeakBeams'),
-    value_var('RBSBmax'),
-
-    seperator('Directional Vectors'),
-    value_var('RBSPmax'),
-    value_var('RDebyeWallerConstant'),
-    value_var('RAbsorptionPer'),
-    value_var('RConvergenceAngle'),
-    value_var('IIncidentBeamDirectionX',
-                    infoText = 'IIncidentBeamDirectionX coordinate'),
-    value_var('IIncidentBeamDirectionY'),
-    value_var('IIncidentBeamDirectionZ'),
-    value_var('IXDirectionX'),
-
-    seperator('Miscellaneous Variables'),
-    value_var('IXDirectionY'),
-    value_var('IXDirectionZ'),
-    value_var('INormalDirectionX'),
-    value_var('INormalDirectionY'),
-    value_var('INormalDirectionZ'),
-    value_var('RAccelerationVoltage'),
-    value_var('RInitialThickness'),
-    value_var('RFinalThickness'),
-    value_var('RDeltaThickness'),
+    value_var('RDebyeWallerConstant',
+                    infoText = 'Default Debye-Waller factor if not in .cif'),
+    value_var('RAbsorptionPer',
+                    infoText = 'Percentage for proportional absorption'),
+
+    seperator('Microscope Settings'),
+    value_var('ROuterConvergenceAngle'),
+    text_var('IIncidentBeamDirection', infoText = 'e.g. [0,0,1]'),
+    text_var('IXDirection', infoText = 'e.g. [1,0,0]'),
+    text_var('INormalDirection', infoText = 'e.g. [0,0,1]'),
+    value_var('RAcceleratingVoltage', infoText = 'in kV'),
+    value_var('RAcceptanceAngle'),
+
+    seperator('Image Output Options'),
+    value_var('RInitialThickness', infoText = 'in Angstroms'),
+    value_var('RFinalThickness', infoText = 'in Angstroms'),
+    value_var('RDeltaThickness', infoText = 'in Angstroms'),
     value_var('IReflectOut'),
-    value_var('IImageOutputFLAG'),
-    value_var('IRefineModeFLAG'),
+
+    seperator('Refinement'),
+    combo_var('IRefineModeFLAG', list('SABCDEFGHI'), 0, maxchoice = 9,
+                    values = list('SABCDEFGHI'),
+                    infoText = 'S to simulate only, or what to refine: '
+                    'A Ugs (on their own), B coordinates, C occupancies, '
+                    'D isotropic DW, E anisotropic DW, F lattice lengths, '
+                    'G lattice angles, H convergence angle, I kV'),
+    value_var('IWeightingFLAG'),
+    combo_var('IRefineMethodFLAG', ['Simplex','Downhill gradient',
+                    'Max gradient','Pairwise gradient'], 0,
+                    values = [1,2,3,4]),
+    combo_var('ICorrelationFLAG', ['Phase','Sum of squares',
+                    'Normalised CC','Masked CC'], 2),
+    value_var('IImageProcessingFLAG', 
+                    infoText = '0 none, 1 square root, 2 log'),
+    value_var('RBlurRadius'),
+    value_var('INoofUgs'),
+    text_var('IAtomicSites', infoText = 'Atoms to refine, e.g. (1,2)'),
+    value_var('IPrint'),
+    value_var('RSimplexLengthScale'),
+    value_var('RExitCriteria'),
+    value_var('IUnblurredFLAG',
+        infoText = '1 also saves simulations before blurring, see blurscan.py'),
+    value_var('IResultFileFLAG',
+        infoText = '1 saves images in one results file, 2 also as .bin, see resultfile.py'),
+    value_var('ICheckpointFLAG',
+        infoText = '1 saves refinement state each iteration, 2 also resumes from it'),
+    value_var('IPixelScheduleFLAG',
+        infoText = 'pixels per core: 0 in blocks, 1 interleaved, 2 balanced by measured cost'),
+    value_var('ITimingFLAG',
+        infoText = '1 writes phase timings of every core, see timingreport.py'),
+    value_var('IEigenCacheMB',
+        infoText = 'MB per core for reusing eigensystems while the Ug matrix is unchanged'),
+    value_var('IVertexGroups',
+        infoText = 'groups of cores simulating simplex points side by side, 0 for none'),
     seperator('')
     ]
-
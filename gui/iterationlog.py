@@ -0,0 +1,117 @@
+'''
+Incremental reader for the iteration_log.txt written by felixrefine
+
+WriteOutVariables appends one line per iteration,
+
+    Iter  RFigureofMerit  variable_1 ... variable_n
+
+in (I5.1,1X,F13.9,1X,n(F13.9,1X)) format.  IterationLog remembers how
+far into the file it has read, so each poll() only parses lines added
+since the last one, and keeps the rows in a numpy buffer that grows by
+doubling.  A half-written last line is left for the next poll, and a
+file that shrinks (a new run in the same directory) is read again from
+the start.
+
+    log = IterationLog('sample_outputs/iteration_log.txt')
+    log.poll()             # number of new rows
+    log.iterations, log.fom, log.variables
+'''
+
+from __future__ import division
+
+import os
+
+import numpy as np
+
+
+def parse_line(line):
+    '''Values of one log line as floats; overflowed (****) fields are NaN'''
+    values = []
+    for field in line.split():
+        try:
+            values.append(float(field))
+        except ValueError:
+            values.append(np.nan)
+    return values
+
+
+class IterationLog(object):
+
+    def __init__(self, path, capacity=64):
+        self.path = path
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        self.offset = 0
+        self.partial = b''
+        self.rows = 0
+        self.data = None
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def table(self):
+        '''(rows, columns) view of everything read so far'''
+        if self.data is None:
+            return np.zeros((0, 2))
+        return self.data[:self.rows]
+
+    @property
+    def iterations(self):
+        return self.table[:, 0]
+
+    @property
+    def fom(self):
+        return self.table[:, 1]
+
+    @property
+    def variables(self):
+        return self.table[:, 2:]
+
+    def poll(self):
+        '''Read whatever has been appended since the last call.
+
+        Returns the number of new rows (0 if the file does not exist yet
+        or has not changed).
+        '''
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            chunk = f.read(size - self.offset)
+        self.offset += len(chunk)
+        lines = (self.partial + chunk).split(b'\n')
+        # anything after the last newline is still being written
+        self.partial = lines.pop()
+        rows = [parse_line(line.decode('ascii', 'replace'))
+                for line in lines if line.strip()]
+        return self._append(rows)
+
+    def _append(self, rows):
+        if not rows:
+            return 0
+        ncol = max(len(r) for r in rows)
+        if self.data is None:
+            self.data = np.full((max(self.capacity, len(rows)), ncol), np.nan)
+        elif ncol > self.data.shape[1]:
+            wider = np.full((self.data.shape[0], ncol), np.nan)
+            wider[:, :self.data.shape[1]] = self.data
+            self.data = wider
+        needed = self.rows + len(rows)
+        if needed > self.data.shape[0]:
+            grown = np.full((max(needed, 2*self.data.shape[0]),
+                             self.data.shape[1]), np.nan)
+            grown[:self.rows] = self.data[:self.rows]
+            self.data = grown
+        for i, r in enumerate(rows):
+            self.data[self.rows + i, :len(r)] = r
+        self.rows = needed
+        return len(rows)
@@ -0,0 +1,294 @@
+'''
+Supervised mpirun jobs for felix, for the GUI and for batch use
+
+A Job starts `mpirun -n N felixrefine` (or any other felix executable) in
+a working directory as a child process, without a shell or a terminal.
+Two reader threads pass its stdout and stderr on line by line and a
+third waits for it to finish, recording the exit code, the wall time
+and the peak resident memory of the run (from the rusage of the mpirun
+process, which includes the ranks it waited for).  cancel() stops the
+whole process group, politely first.
+
+The GUI is wxPython under Python 2, so this uses threads rather than
+asyncio; callbacks are made on the worker threads and GUI code should
+pass them on with wx.CallAfter.
+
+Given a cache (resultcache.ResultCache), a job whose inputs match an
+earlier finished run restores that run's output instead of starting
+felix, and a job that finishes is stored for next time.
+
+Headless, e.g. on a compute node:
+
+    python jobrunner.py -n 16 -C ~/runs/GaAs --felix ~/felix/src/felixrefine
+    python jobrunner.py -n 16 -C ~/runs/GaAs --cache ~/.cache/felix/results
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# what a job can be in; a job that was never started is 'ready'
+READY, RUNNING, FINISHED, FAILED, CANCELLED = (
+    'ready', 'running', 'finished', 'failed', 'cancelled')
+
+
+def default_felix():
+    '''felixrefine next to this gui directory, as the GUI assumes'''
+    here = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(os.path.dirname(here), 'src', 'felixrefine')
+
+
+def max_rss_bytes(rusage):
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss
+    return rusage.ru_maxrss*1024
+
+
+class Job(object):
+    '''One felix run.
+
+    on_output(stream, line) gets each line of 'stdout' or 'stderr' and
+    on_exit(job) is called once the job has finished, failed or been
+    cancelled.  A job can be started again once it is no longer running.
+    A job restored from cache has cached set and no process.
+    '''
+
+    def __init__(self, directory, cores=1, felix=None, mpirun='mpirun',
+                 on_output=None, on_exit=None, cache=None):
+        self.directory = directory
+        self.cores = int(cores)
+        self.felix = felix or default_felix()
+        self.mpirun = mpirun
+        self.on_output = on_output
+        self.on_exit = on_exit
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.process = None
+        self.state = READY
+        self._reset()
+
+    def _reset(self):
+        self.returncode = None
+        self.start_time = None
+        self.end_time = None
+        self.max_rss = None
+        self.cancelled = False
+        self.error = None
+        self.cached = False
+
+    @property
+    def command(self):
+        if self.mpirun:
+            return [self.mpirun, '-n', str(self.cores), self.felix]
+        return [self.felix]
+
+    @property
+    def running(self):
+        return self.state == RUNNING
+
+    @property
+    def wall_time(self):
+        if self.start_time is None:
+            return None
+        return (self.end_time or time.time()) - self.start_time
+
+    def start(self):
+        with self.lock:
+            if self.state == RUNNING:
+                raise RuntimeError('job in %s is already running'
+                                   % self.directory)
+            self._reset()
+            self.start_time = time.time()
+            if self.cache is not None:
+                # the record of an identical finished run, copied back
+                self.cached = self.cache.begin(self)
+            if self.cached:
+                self.end_time = time.time()
+                self.returncode = 0
+                self.process = None
+                self.state = FINISHED
+            else:
+                self._spawn()
+        if self.cached:
+            self._output('stdout', 'restored from cache, as run in %s'
+                         % self.cached.get('directory'))
+            if self.on_exit is not None:
+                self.on_exit(self)
+            return
+        if self.process is None:
+            self._output('stderr', self.error)
+            if self.on_exit is not None:
+                self.on_exit(self)
+            return
+        self.readers = [
+            self._thread(self._read, 'stdout', self.process.stdout),
+            self._thread(self._read, 'stderr', self.process.stderr)]
+        self.waiter = self._thread(self._wait)
+
+    def _spawn(self):
+        devnull = open(os.devnull)
+        try:
+            # own process group, so cancel() reaches every rank
+            self.process = subprocess.Popen(
+                self.command, cwd=self.directory,
+                stdin=devnull, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, preexec_fn=os.setsid,
+                close_fds=True)
+        except OSError as e:
+            self.end_time = time.time()
+            self.error = '%s: %s' % (self.command[0], e)
+            self.state = FAILED
+            self.process = None
+        else:
+            self.state = RUNNING
+        finally:
+            devnull.close()
+
+    def _thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _output(self, stream, line):
+        if self.on_output is not None:
+            self.on_output(stream, line)
+
+    def _read(self, stream, pipe):
+        for line in iter(pipe.readline, b''):
+            self._output(stream, line.decode('utf-8', 'replace').rstrip('\n'))
+        pipe.close()
+
+    def _wait(self):
+        # wait4 rather than Popen.wait, for the child's own rusage
+        pid, status, rusage = os.wait4(self.process.pid, 0)
+        for reader in self.readers:
+            reader.join()
+        with self.lock:
+            self.end_time = time.time()
+            self.max_rss = max_rss_bytes(rusage)
+            if os.WIFSIGNALED(status):
+                self.returncode = -os.WTERMSIG(status)
+            else:
+                self.returncode = os.WEXITSTATUS(status)
+            self.process.returncode = self.returncode
+            if self.cancelled:
+                self.state = CANCELLED
+            elif self.returncode == 0:
+                self.state = FINISHED
+            else:
+                self.state = FAILED
+        if self.cache is not None:
+            self.cache.finish(self)
+        if self.on_exit is not None:
+            self.on_exit(self)
+
+    def cancel(self, grace=5.0):
+        '''SIGTERM the job's process group, then SIGKILL after grace s'''
+        with self.lock:
+            if self.state != RUNNING:
+                return
+            self.cancelled = True
+            pgid = self.process.pid
+        self._signal(pgid, signal.SIGTERM)
+        killer = threading.Timer(grace, self._kill, (pgid,))
+        killer.daemon = True
+        killer.start()
+
+    def _kill(self, pgid):
+        if self.state == RUNNING:
+            self._signal(pgid, signal.SIGKILL)
+
+    def _signal(self, pgid, sig):
+        try:
+            os.killpg(pgid, sig)
+        except OSError:
+            pass # already gone
+
+    def join(self, timeout=None):
+        '''Wait for a started job to end; True if it has'''
+        if self.state == RUNNING:
+            self.waiter.join(timeout)
+        return self.state != RUNNING
+
+    def summary(self):
+        '''The record of this run, as kept in a job log'''
+        return {'directory': os.path.abspath(self.directory),
+                'command': self.command, 'state': self.state,
+                'returncode': self.returncode,
+                'start': self.start_time, 'wall_time': self.wall_time,
+                'max_rss': self.max_rss, 'error': self.error,
+                'cached': bool(self.cached)}
+
+    def describe(self):
+        if self.state == READY:
+            return 'not started'
+        text = '%s after %.1f s' % (self.state, self.wall_time or 0.0)
+        if self.cached:
+            return text + ', restored from cache'
+        if self.returncode is not None:
+            text += ', exit code %d' % self.returncode
+        if self.max_rss is not None:
+            text += ', peak memory %.1f MB' % (self.max_rss/1024**2)
+        return text
+
+
+def append_log(filename, job):
+    '''Add one JSON line describing a finished job to filename'''
+    with open(filename, 'a') as f:
+        f.write(json.dumps(job.summary(), sort_keys=True) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run felix under mpirun and report how it went')
+    parser.add_argument('-n', '--cores', type=int, default=1)
+    parser.add_argument('-C', '--directory', default='.',
+                        help='directory holding felix.inp (default: .)')
+    parser.add_argument('--felix', default=None,
+                        help='felix executable (default: ../src/felixrefine)')
+    parser.add_argument('--mpirun', default='mpirun',
+                        help="MPI launcher, or '' to run felix directly")
+    parser.add_argument('--log', default=None,
+                        help='append a JSON summary of the run to this file')
+    parser.add_argument('--cache', default=None, metavar='DIRECTORY',
+                        help='reuse the output of identical finished runs '
+                        'kept here (see resultcache.py)')
+    parser.add_argument('--cache-mb', type=float, default=2048,
+                        help='size limit of the cache (default 2048 MB)')
+    args = parser.parse_args(argv)
+
+    def output(stream, line):
+        print(line, file=sys.stdout if stream == 'stdout' else sys.stderr)
+        sys.stdout.flush()
+
+    cache = None
+    if args.cache:
+        import resultcache
+        cache = resultcache.ResultCache(args.cache,
+                                        int(args.cache_mb*1024**2))
+    job = Job(args.directory, args.cores, args.felix, args.mpirun,
+              on_output=output, cache=cache)
+    job.start()
+    try:
+        while not job.join(0.5):
+            pass
+    except KeyboardInterrupt:
+        job.cancel()
+        job.join()
+    print('felix ' + job.describe(), file=sys.stderr)
+    if args.log:
+        append_log(args.log, job)
+    return 0 if job.state == FINISHED else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
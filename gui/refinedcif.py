@@ -0,0 +1,267 @@
+'''
+Rebuild a refined felix.cif from the iteration_log.txt of a refinement
+
+felixrefine only writes a structure.cif into the output directories of
+the iterations it saves, so a refinement that is stopped (at a batch
+walltime, say) may have logged far better fits than any cif on disk.
+WriteOutVariables (src/felix/write_output_mod.f90) logs each iteration
+as the values of every atom for each refined type, in this order:
+
+    B   x, y and z of each atom of the _atom_site_ loop
+    C   occupancy of each atom
+    D   isotropic Debye-Waller factor (B_iso) of each atom
+    F   a, b and c
+    H   convergence angle, a felix.inp value rather than a cif one
+
+with one empty column first when IAbsorbFLAG is 2.  refined_cif() puts
+the values of one row into the original felix.cif, keeping everything
+else in it as it was.  Structure factor refinement (A) has nothing to
+put in a cif, and felix does not refine E, G or I.
+
+    cif, (iteration, fom), inp_values = refined_cif(
+        'samples/SrTiO3_long',
+        'samples/SrTiO3_long/sample_outputs/iteration_log.txt', row=BEST)
+
+    python refinedcif.py samples/SrTiO3_long -o refined.cif --row best \\
+        --log samples/SrTiO3_long/sample_outputs/iteration_log.txt
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import io
+import math
+import os
+import re
+import sys
+
+import numpy as np
+
+import inpfile
+import iterationlog
+
+LAST, BEST = 'last', 'best'
+# one CIF value: quoted, or anything up to the next blank
+TOKEN = re.compile(r"'[^']*'|\"[^\"]*\"|\S+")
+# cif B and U isotropic displacement, as felix converts them
+B_PER_U = 8*math.pi**2
+# refine modes with nothing to put in a cif
+NOT_IN_CIF = {
+    'A': 'structure factor (A) refinement has no values in a cif',
+    'E': 'felix does not refine anisotropic Debye-Waller factors (E)',
+    'G': 'felix does not refine unit cell angles (G)',
+    'I': 'felix does not refine the accelerating voltage (I)',
+}
+
+
+class RefinedCifError(ValueError):
+    pass
+
+
+def columns(mode, natoms, absorb_flag, count):
+    '''What each of the count log variables is, as (name, atom) pairs.
+
+    WriteOutVariables logs every atom, not only IAtomicSites: B gives
+    x, y and z of each atom, C each occupancy and D each B_iso, then F
+    gives a, b and c and H the convergence angle.  name is x, y, z,
+    occupancy, B_iso, a, b, c, convergence or None for a column that
+    holds nothing (felix leaves the first one empty when IAbsorbFLAG is
+    2); atom is the 0-based row of the _atom_site_ loop.
+    '''
+    for letter in mode:
+        if letter in NOT_IN_CIF:
+            raise RefinedCifError(NOT_IN_CIF[letter])
+    layout = [(None, None)] if absorb_flag == 2 else []
+    atoms = range(natoms)
+    if 'B' in mode:
+        layout += [(axis, i) for i in atoms for axis in 'xyz']
+    if 'C' in mode:
+        layout += [('occupancy', i) for i in atoms]
+    if 'D' in mode:
+        layout += [('B_iso', i) for i in atoms]
+    if 'F' in mode:
+        layout += [(axis, None) for axis in 'abc']
+    if 'H' in mode:
+        layout += [('convergence', None)]
+    if len(layout) != count:
+        raise RefinedCifError(
+            'the log has %d variables, not the %d felix writes for refine '
+            'mode %s with %d atoms and IAbsorbFLAG %d'
+            % (count, len(layout), mode, natoms, absorb_flag))
+    return layout
+
+
+def pick_row(log, row=LAST):
+    '''(iteration, figure of merit, variables) of one log row.
+
+    row is LAST, BEST (the lowest figure of merit) or an iteration
+    number, whose last row is taken if felix logged it more than once.
+    '''
+    if not len(log):
+        raise RefinedCifError('%s has no iterations' % log.path)
+    if row == LAST:
+        i = len(log) - 1
+    elif row == BEST:
+        fom = np.where(np.isnan(log.fom), np.inf, log.fom)
+        i = int(np.argmin(fom))
+    else:
+        found = np.nonzero(log.iterations == int(row))[0]
+        if not len(found):
+            raise RefinedCifError('%s has no iteration %s'
+                                  % (log.path, row))
+        i = int(found[-1])
+    variables = log.variables[i]
+    if np.isnan(variables).any():
+        raise RefinedCifError('iteration %d has overflowed (****) values'
+                              % log.iterations[i])
+    return int(log.iterations[i]), float(log.fom[i]), variables
+
+
+def format_number(value):
+    return '%.6g' % value
+
+
+def _replace_value(line, tag, value):
+    # the value after a single-value tag such as _cell_length_a
+    match = re.match(r'(\s*%s\s+)(\S+)' % re.escape(tag), line)
+    if match is None:
+        return None
+    return line[:match.start(2)] + value + line[match.end(2):]
+
+
+def _atom_site_loop(lines):
+    '''(tags, row line numbers) of the _atom_site_ loop of a cif'''
+    for start, line in enumerate(lines):
+        if line.strip() != 'loop_':
+            continue
+        tags = []
+        i = start + 1
+        while i < len(lines) and lines[i].strip().startswith('_'):
+            tags.append(lines[i].split()[0])
+            i += 1
+        if not tags or not tags[0].startswith('_atom_site_'):
+            continue
+        rows = []
+        while i < len(lines):
+            text = lines[i].strip()
+            if text.startswith(('_', 'loop_', 'data_')):
+                break
+            if text and not text.startswith('#'):
+                rows.append(i)
+            i += 1
+        return tags, rows
+    raise RefinedCifError('no _atom_site_ loop in the cif')
+
+
+def _set_atom(lines, tags, rows, atom, tag, value):
+    if tag not in tags:
+        raise RefinedCifError('the cif has no %s' % tag)
+    line = lines[rows[atom]]
+    tokens = list(TOKEN.finditer(line))
+    if len(tokens) != len(tags):
+        raise RefinedCifError('atom site %d does not have a value for '
+                              'each tag: %r' % (atom + 1, line))
+    token = tokens[tags.index(tag)]
+    lines[rows[atom]] = line[:token.start()] + value + line[token.end():]
+
+
+def apply_values(lines, tags, rows, layout, values):
+    '''Put the values of layout into the lines of a cif, in place.
+
+    Returns the values that belong in felix.inp, by felix.inp name.
+    '''
+    other = {}
+    for (name, atom), value in zip(layout, values):
+        if name is None:
+            continue
+        if name == 'convergence':
+            other['ROuterConvergenceAngle'] = value
+        elif name in 'abc':
+            tag = '_cell_length_' + name
+            for i, line in enumerate(lines):
+                replaced = _replace_value(line, tag, format_number(value))
+                if replaced is not None:
+                    lines[i] = replaced
+                    break
+            else:
+                raise RefinedCifError('the cif has no %s' % tag)
+        elif name in 'xyz':
+            _set_atom(lines, tags, rows, atom, '_atom_site_fract_' + name,
+                      format_number(value))
+        elif name == 'occupancy':
+            _set_atom(lines, tags, rows, atom, '_atom_site_occupancy',
+                      format_number(value))
+        elif '_atom_site_B_iso_or_equiv' in tags:
+            _set_atom(lines, tags, rows, atom, '_atom_site_B_iso_or_equiv',
+                      format_number(value))
+        else:
+            _set_atom(lines, tags, rows, atom, '_atom_site_U_iso_or_equiv',
+                      format_number(value/B_PER_U))
+    return other
+
+
+def refined_cif(directory, log_path=None, row=LAST):
+    '''Text of felix.cif in directory with one log row's values put in.
+
+    Returns (cif text, (iteration, figure of merit), values that belong
+    in felix.inp rather than the cif, by felix.inp name).
+    '''
+    inp = inpfile.InpFile.read(os.path.join(directory, 'felix.inp'))
+    log = iterationlog.IterationLog(
+        log_path or os.path.join(directory, 'iteration_log.txt'))
+    log.poll()
+    iteration, fom, variables = pick_row(log, row)
+    # newline='' keeps the line endings of the cif as they are
+    with io.open(os.path.join(directory, 'felix.cif'), newline='') as f:
+        lines = f.read().splitlines(True)
+    tags, rows = _atom_site_loop(lines)
+    layout = columns(inp['IRefineModeFLAG'], len(rows), inp['IAbsorbFLAG'],
+                     len(variables))
+    other = apply_values(lines, tags, rows, layout, variables)
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    header = ('# refined values of iteration %d, figure of merit %.6f, '
+              'from %s%s' % (iteration, fom, log.path, newline))
+    return header + ''.join(lines), (iteration, fom), other
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Put refined values from iteration_log.txt into '
+        'felix.cif')
+    parser.add_argument('directory', help='directory with the felix.inp and '
+                        'felix.cif of the refinement')
+    parser.add_argument('--log', default=None,
+                        help='iteration_log.txt (default: in directory)')
+    parser.add_argument('--row', default=LAST,
+                        help='last, best or an iteration number '
+                        '(default: last)')
+    parser.add_argument('-o', '--output', default=None,
+                        help='cif to write (default: standard output)')
+    parser.add_argument('--inp', default=None,
+                        help='also write felix.inp with refined values that '
+                        'belong there, such as the convergence angle')
+    args = parser.parse_args(argv)
+
+    try:
+        text, (iteration, fom), other = refined_cif(
+            args.directory, args.log, args.row)
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.output:
+        with io.open(args.output, 'w', newline='') as f:
+            f.write(text)
+        print('%s: iteration %d, figure of merit %.4f%%'
+              % (args.output, iteration, 100*fom))
+    else:
+        sys.stdout.write(text)
+    for name, value in sorted(other.items()):
+        print('%s = %s' % (name, format_number(value)), file=sys.stderr)
+    if args.inp:
+        inp = inpfile.InpFile.read(os.path.join(args.directory, 'felix.inp'))
+        inp.update(other)
+        inp.write(args.inp)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+'''
+Content-addressed cache of finished felix runs
+
+Running felix on exactly the same input again gives the same output, so
+a run is keyed by what it reads: the values of felix.inp as the parser
+in inpfile.py sees them (so spacing, comments and number formatting
+make no difference), felix.cif, the reflections of felix.hkl, the
+pixels of every experimental image felix would read (see expimages.py)
+and the felix executable itself.  A finished run stores whatever it
+wrote into its directory under ~/.cache/felix/results/<key>/, and a
+later run with the same key copies that back instead of starting
+mpirun.
+
+The cache is bounded in bytes and evicts least recently used runs (a
+hit refreshes the run's entry.json), and counts its hits and misses in
+stats.json.  Jobs use it through jobrunner.Job(..., cache=ResultCache())
+or `sweep.py run --cache`.  The number of MPI ranks is not part of the
+key, since it only changes how felix shares out the work.
+
+    run_key('samples/GaAs_short')       # sha256 hex digest
+    cache = ResultCache(maxbytes=4*1024**3)
+    print(cache.report())
+
+    python resultcache.py report
+    python resultcache.py key samples/GaAs_short
+    python resultcache.py evict --max-mb 1024
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import expimages
+import inpfile
+import jobrunner
+
+# changes whenever what goes into a key does
+KEY_VERSION = 1
+ENTRY = 'entry.json'
+STATS = 'stats.json'
+FILES = 'files'
+# read from a run directory, so never part of its output
+INPUTS = ('felix.inp', 'felix.cif', 'felix.hkl')
+# written next to felix's output by jobrunner and sweep
+IGNORED = ('sweep_status.json',)
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'felix', 'results')
+
+
+def find_executable(name):
+    '''Path of an executable as the shell would find it, or None'''
+    if os.path.dirname(name):
+        return name if os.path.isfile(name) else None
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def _hash_file(digest, path, block=1024*1024):
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(block), b''):
+            digest.update(data)
+
+
+def run_key(directory, felix=None):
+    '''sha256 hex digest of everything a felix run in directory reads.
+
+    Raises IOError or ValueError (expimages.SampleError) if felix could
+    not run there, as there would then be nothing to cache.
+    '''
+    digest = hashlib.sha256()
+
+    def part(name, text):
+        digest.update(('%s %d\n' % (name, len(text))).encode('ascii'))
+        digest.update(text)
+
+    part('version', str(KEY_VERSION).encode('ascii'))
+    inp = inpfile.InpFile.read(os.path.join(directory, 'felix.inp'))
+    part('felix.inp', json.dumps(list(inp.values.items())).encode('utf-8'))
+    with open(os.path.join(directory, 'felix.cif'), 'rb') as f:
+        cif = f.read()
+    part('felix.cif', b'\n'.join(line.rstrip() for line in cif.splitlines()))
+    hkls = expimages.read_hkl(os.path.join(directory, 'felix.hkl'))
+    part('felix.hkl', json.dumps(hkls).encode('ascii'))
+    images = expimages.load(directory)
+    for hkl in sorted(images):
+        image = images[hkl]
+        part('image %d %d %d %s %s' % (hkl + (image.dtype.str, image.shape)),
+             image.tobytes())
+    executable = felix and find_executable(felix)
+    if executable is not None:
+        felix_digest = hashlib.sha256()
+        _hash_file(felix_digest, executable)
+        part('felix', felix_digest.hexdigest().encode('ascii'))
+    return digest.hexdigest()
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _copy(src, dst):
+    # copies, not links: felix appends to iteration_log.txt in place
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def snapshot(directory):
+    '''name -> (mtime, size) of everything at the top of directory'''
+    found = {}
+    for name in os.listdir(directory):
+        st = os.stat(os.path.join(directory, name))
+        found[name] = (st.st_mtime, st.st_size)
+    return found
+
+
+def outputs(directory, before):
+    '''Names in directory added or changed since snapshot before'''
+    after = snapshot(directory)
+    return sorted(name for name in after if name not in INPUTS + IGNORED
+                  and after[name] != before.get(name))
+
+
+class ResultCache(object):
+    '''Size-bounded LRU store of felix run outputs, keyed by run_key()'''
+
+    def __init__(self, directory=None, maxbytes=2*1024**3):
+        self.directory = directory or default_directory()
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def entry(self, key):
+        '''The stored record of run key, or None if it is not cached'''
+        try:
+            with open(os.path.join(self.path(key), ENTRY)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def entries(self):
+        '''(key, record, last use) of every cached run, oldest use first'''
+        found = []
+        for key in os.listdir(self.directory):
+            entry = self.entry(key)
+            try:
+                used = os.path.getmtime(os.path.join(self.path(key), ENTRY))
+            except OSError:
+                continue
+            if entry is not None:
+                found.append((key, entry, used))
+        return sorted(found, key=lambda e: e[2])
+
+    def _count(self, **counts):
+        with self.lock:
+            stats = self.stats()
+            for name, value in counts.items():
+                stats[name] = stats.get(name, 0) + value
+            self._write_json(os.path.join(self.directory, STATS), stats)
+
+    def _write_json(self, filename, value):
+        # write then rename, so a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                   suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f, indent=1, sort_keys=True)
+        if os.name == 'nt' and os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp, filename)
+
+    def stats(self):
+        '''Counts of hits, misses, stores and evictions so far'''
+        try:
+            with open(os.path.join(self.directory, STATS)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def restore(self, key, directory):
+        '''Copy cached run key into directory; its record, or None'''
+        entry = self.entry(key)
+        if entry is None:
+            self._count(misses=1)
+            return None
+        files = os.path.join(self.path(key), FILES)
+        for name in entry['outputs']:
+            _remove(os.path.join(directory, name))
+            _copy(os.path.join(files, name), os.path.join(directory, name))
+        os.utime(os.path.join(self.path(key), ENTRY), None)
+        self._count(hits=1, saved_seconds=entry.get('wall_time') or 0.0)
+        return entry
+
+    def store(self, key, directory, names, summary=None):
+        '''Keep names (outputs of run key) from directory in the cache'''
+        if self.entry(key) is not None:
+            return
+        tmp = tempfile.mkdtemp(dir=self.directory, suffix='.tmp')
+        try:
+            os.makedirs(os.path.join(tmp, FILES))
+            for name in names:
+                _copy(os.path.join(directory, name),
+                      os.path.join(tmp, FILES, name))
+            entry = dict(summary or {})
+            entry.update({'key': key, 'outputs': list(names),
+                          'stored': time.time(),
+                          'bytes': _size(tmp)})
+            self._write_json(os.path.join(tmp, ENTRY), entry)
+            os.rename(tmp, self.path(key))
+        except (IOError, OSError):
+            # e.g. the same run stored at once by another job
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self._count(stores=1)
+        self.evict()
+
+    def nbytes(self):
+        return sum(e['bytes'] for k, e, t in self.entries())
+
+    def evict(self, maxbytes=None):
+        '''Remove least recently used runs until within maxbytes'''
+        if maxbytes is None:
+            maxbytes = self.maxbytes
+        with self.lock:
+            entries = self.entries()
+            total = sum(e['bytes'] for k, e, t in entries)
+            removed = 0
+            for key, entry, used in entries:
+                if total <= maxbytes:
+                    break
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= entry['bytes']
+                removed += 1
+        if removed:
+            self._count(evictions=removed)
+        return removed
+
+    def clear(self):
+        return self.evict(0)
+
+    def begin(self, job):
+        '''Restore job's run if cached (returning its record), or
+        prepare to store it once it has finished'''
+        try:
+            job.cache_key = run_key(job.directory, job.felix)
+        except (IOError, OSError, ValueError):
+            # felix will fail on its own; nothing to cache
+            job.cache_key = None
+            return None
+        entry = self.restore(job.cache_key, job.directory)
+        if entry is None:
+            job.cache_before = snapshot(job.directory)
+        return entry
+
+    def finish(self, job):
+        '''Store a job begin() did not find, if it finished'''
+        if (job.cached or job.cache_key is None
+                or job.state != jobrunner.FINISHED):
+            return
+        self.store(job.cache_key, job.directory,
+                   outputs(job.directory, job.cache_before),
+                   {'directory': os.path.abspath(job.directory),
+                    'wall_time': job.wall_time, 'cores': job.cores})
+
+    def summary(self):
+        '''One line of hit and miss counts'''
+        stats = self.stats()
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        return ('cache: %d hits, %d misses (%.0f%% hit rate), %.0f s of '
+                'felix saved; %d stored, %d evicted' % (
+                    hits, misses, 100*hits/max(1, hits + misses),
+                    stats.get('saved_seconds', 0.0), stats.get('stores', 0),
+                    stats.get('evictions', 0)))
+
+    def report(self):
+        '''summary() and what the cache holds, as text'''
+        entries = self.entries()
+        nbytes = sum(e['bytes'] for k, e, t in entries)
+        lines = ['%s: %d runs, %.1f of %.1f MB' % (
+            self.directory, len(entries), nbytes/1024**2,
+            self.maxbytes/1024**2), self.summary()]
+        for key, entry, used in reversed(entries):
+            lines.append('  %s  %8.1f MB  %7.1f s  used %s  %s' % (
+                key[:12], entry['bytes']/1024**2,
+                entry.get('wall_time') or 0.0,
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(used)),
+                entry.get('directory', '')))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Inspect the cache of finished felix runs')
+    parser.add_argument('--cache', default=None,
+                        help='cache directory (default: %s)'
+                        % default_directory())
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('report', help='hit and miss counts and cached runs')
+    p = sub.add_parser('key', help='cache key of a sample directory')
+    p.add_argument('directory')
+    p.add_argument('--felix', default=None,
+                   help='felix executable, which is part of the key')
+    p = sub.add_parser('evict', help='remove least recently used runs')
+    p.add_argument('--max-mb', type=float, required=True)
+    sub.add_parser('clear', help='remove every cached run')
+    args = parser.parse_args(argv)
+
+    cache = ResultCache(args.cache)
+    if args.command == 'key':
+        try:
+            print(run_key(args.directory, args.felix))
+        except (IOError, OSError, ValueError) as e:
+            parser.error(str(e))
+    elif args.command == 'evict':
+        print('%d runs removed' % cache.evict(int(args.max_mb*1024**2)))
+    elif args.command == 'clear':
+        print('%d runs removed' % cache.clear())
+    else:
+        print(cache.report())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
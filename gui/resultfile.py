@@ -0,0 +1,418 @@
+'''
+One-file results of a felix run: every saved image and iteration_log row
+
+With IResultFileFLAG = 1 in felix.inp, felixrefine appends the images
+of each saved iteration to <formula>_results.fxr instead of writing a
+directory of one .bin file per reflection (2 writes both; the iteration
+directories still hold structure.cif and StructureFactors.txt).  Each
+line it adds to iteration_log.txt goes into the same file.  See
+OpenResultFile and WriteResultBlock in src/felix/write_output_mod.f90.
+
+The file is little-endian: a 40-byte header ('FXRC', version, formula)
+and then self-describing blocks, each a 48-byte header
+
+    'FXB1', kind, iteration, size, thickness (A), chunk count, codec,
+    bytes per value, 0, payload bytes
+
+followed by the (h, k, l) and byte length of every chunk and then the
+chunks.  An image block holds one thickness of one iteration, a chunk
+per reflection, each image in the row order of its .bin file; a log
+block holds one chunk, the row of iteration_log.txt.  felix writes raw
+chunks (codec 0); compress() rewrites them with zlib (codec 1).
+
+ResultFile reads only the block headers, so the index of a file of any
+size costs a few reads, and image() then reads (or decompresses) just
+the one chunk asked for.  A block felix is still writing is left for
+the next poll().
+
+    results = ResultFile('sample_outputs/GaAs_results.fxr')
+    results.iterations, results.hkls, results.thicknesses(4)
+    results.image(4, (0, 0, 2))        # (y, x) array
+    results.log                        # the iteration_log.txt table
+
+    python resultfile.py convert samples/GaAs_long/sample_outputs
+    python resultfile.py compress GaAs_results.fxr
+    python resultfile.py info GaAs_results.fxr
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+import felixbin
+import iterationlog
+
+MAGIC = b'FXRC'
+BLOCK_MAGIC = b'FXB1'
+VERSION = 1
+# 'FXRC', version, formula
+HEADER = struct.Struct('<4si32s')
+# 'FXB1', kind, iteration, size, thickness, count, codec, itemsize,
+# reserved, payload bytes
+BLOCK_HEADER = struct.Struct('<4s3id4iq')
+# block kinds
+IMAGES, LOG_ROW = 1, 2
+# chunk codecs
+RAW, ZLIB = 0, 1
+CODECS = {RAW: 'raw', ZLIB: 'zlib'}
+# bytes per value -> little-endian real type
+DTYPES = {8: np.dtype('<f8'), 4: np.dtype('<f4')}
+# thicknesses closer than this (in A) are the same thickness
+THICKNESS_TOLERANCE = 0.5
+
+
+class ResultFileError(ValueError):
+    '''A file that is not a readable felix results file'''
+
+
+class Block(object):
+    '''Where one block's chunks lie in the file, without the data'''
+
+    def __init__(self, kind, iteration, size, thickness, codec, itemsize,
+                 hkls, offsets, lengths):
+        self.kind = kind
+        self.iteration = iteration
+        self.size = size
+        self.thickness = thickness
+        self.codec = codec
+        self.itemsize = itemsize
+        self.hkls = hkls
+        self.offsets = offsets
+        self.lengths = lengths
+        self.index = dict((hkl, i) for i, hkl in enumerate(hkls))
+
+    def __repr__(self):
+        return '<%s block, iteration %d, %d chunks>' % (
+            {IMAGES: 'image', LOG_ROW: 'log'}.get(self.kind, self.kind),
+            self.iteration, len(self.hkls))
+
+
+class ResultFile(object):
+    '''The index of a .fxr file, read lazily chunk by chunk'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ResultFileError('%s is too short for a results file'
+                                  % path)
+        magic, version, formula = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ResultFileError('%s is not a version %d results file'
+                                  % (path, VERSION))
+        self.formula = formula.decode('ascii', 'replace').strip(' \0')
+        self.offset = HEADER.size
+        self.blocks = []
+        # (iteration, thickness) -> image block, the last written wins
+        self._images = {}
+        self._hkls = {}
+        self.poll()
+
+    def poll(self):
+        '''Index any blocks added since the last call; returns how many'''
+        added = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while True:
+                block = self._read_block(f)
+                if block is None:
+                    break
+                self.offset = f.tell()
+                self.blocks.append(block)
+                added += 1
+                if block.kind == IMAGES:
+                    key = (block.iteration, self._thickness(
+                        block.iteration, block.thickness))
+                    self._images[key] = block
+                    for hkl in block.hkls:
+                        self._hkls.setdefault(hkl, len(self._hkls))
+        return added
+
+    def _read_block(self, f):
+        # the next whole block, or None at the end of what is written
+        start = f.tell()
+        header = f.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            return None
+        (magic, kind, iteration, size, thickness, count, codec, itemsize,
+         reserved, payload) = BLOCK_HEADER.unpack(header)
+        if magic != BLOCK_MAGIC:
+            raise ResultFileError('%s: no block at byte %d' % (self.path,
+                                                              start))
+        if codec not in CODECS or itemsize not in DTYPES:
+            raise ResultFileError('%s: block at byte %d has codec %d and '
+                                  '%d-byte values' % (self.path, start,
+                                                      codec, itemsize))
+        hkls = np.fromfile(f, dtype='<i4', count=3*count)
+        lengths = np.fromfile(f, dtype='<i8', count=count)
+        if len(hkls) < 3*count or len(lengths) < count:
+            f.seek(start)
+            return None
+        if lengths.sum() != payload:
+            raise ResultFileError('%s: block at byte %d has chunks of %d '
+                                  'bytes in a %d-byte payload'
+                                  % (self.path, start, lengths.sum(),
+                                     payload))
+        data = f.tell()
+        f.seek(0, os.SEEK_END)
+        if f.tell() < data + payload:
+            # still being written
+            f.seek(start)
+            return None
+        f.seek(data + payload)
+        offsets = data + np.cumsum(lengths) - lengths
+        return Block(kind, iteration, size, thickness, codec, itemsize,
+                     [tuple(int(i) for i in h) for h in hkls.reshape(-1, 3)],
+                     [int(i) for i in offsets], [int(i) for i in lengths])
+
+    def _thickness(self, iteration, thickness):
+        # an image block's thickness, matched to one already indexed
+        for i, t in self._images:
+            if i == iteration and abs(t - thickness) < THICKNESS_TOLERANCE:
+                return t
+        return thickness
+
+    @property
+    def iterations(self):
+        '''Iterations with saved images, in order'''
+        return sorted(set(i for i, t in self._images))
+
+    @property
+    def hkls(self):
+        '''Every reflection with an image, in the order first written'''
+        return sorted(self._hkls, key=self._hkls.get)
+
+    def thicknesses(self, iteration):
+        '''Thicknesses in A with images saved for iteration'''
+        return sorted(t for i, t in self._images if i == iteration)
+
+    def block(self, iteration, thickness=None):
+        '''The image block of an iteration (and thickness, if several)'''
+        thicknesses = self.thicknesses(iteration)
+        if not thicknesses:
+            raise KeyError('no images of iteration %d in %s'
+                           % (iteration, self.path))
+        if thickness is None:
+            if len(thicknesses) > 1:
+                raise KeyError('iteration %d has %d thicknesses in %s, '
+                               'give one' % (iteration, len(thicknesses),
+                                             self.path))
+            thickness = thicknesses[0]
+        best = min(thicknesses, key=lambda t: abs(t - thickness))
+        if abs(best - thickness) >= THICKNESS_TOLERANCE:
+            raise KeyError('no images at %g A in iteration %d of %s'
+                           % (thickness, iteration, self.path))
+        return self._images[(iteration, best)]
+
+    def chunk(self, block, i):
+        '''Values of chunk i of block as a 1D array, read on its own'''
+        dtype = DTYPES[block.itemsize]
+        if block.codec == RAW:
+            return np.memmap(self.path, dtype=dtype, mode='r',
+                             offset=block.offsets[i],
+                             shape=(block.lengths[i]//dtype.itemsize,))
+        with open(self.path, 'rb') as f:
+            f.seek(block.offsets[i])
+            data = zlib.decompress(f.read(block.lengths[i]))
+        return np.frombuffer(data, dtype=dtype)
+
+    def image(self, iteration, hkl, thickness=None):
+        '''(y, x) image of reflection hkl in iteration, as in its .bin'''
+        block = self.block(iteration, thickness)
+        hkl = tuple(hkl)
+        if hkl not in block.index:
+            raise KeyError('no reflection %s in iteration %d of %s'
+                           % (felixbin.hkl_string(hkl), iteration,
+                              self.path))
+        return self.chunk(block, block.index[hkl]).reshape(block.size,
+                                                           block.size)
+
+    def stack(self, iteration, hkls=None):
+        '''(pattern, thickness, y, x) images of an iteration.
+
+        Returns (images, hkls, thicknesses in A), as
+        figureofmerit.simulated_stack does for .bin directories.
+        '''
+        thicknesses = self.thicknesses(iteration)
+        blocks = [self.block(iteration, t) for t in thicknesses]
+        if hkls is None:
+            hkls = blocks[0].hkls
+        size = blocks[0].size
+        images = np.empty((len(hkls), len(blocks), size, size))
+        for j, block in enumerate(blocks):
+            for i, hkl in enumerate(hkls):
+                images[i, j] = self.image(iteration, hkl, block.thickness)
+        return images, list(hkls), thicknesses
+
+    @property
+    def log(self):
+        '''(rows, columns) table of the iteration_log.txt rows'''
+        rows = [self.chunk(b, 0) for b in self.blocks if b.kind == LOG_ROW]
+        if not rows:
+            return np.zeros((0, 2))
+        width = max(len(r) for r in rows)
+        table = np.full((len(rows), width), np.nan)
+        for i, row in enumerate(rows):
+            table[i, :len(row)] = row
+        return table
+
+
+class Writer(object):
+    '''Writes a results file as felix does, with compressed chunks'''
+
+    def __init__(self, path, formula, codec=ZLIB, level=6):
+        if codec not in CODECS:
+            raise ValueError('unknown codec %r' % (codec,))
+        self.codec = codec
+        self.level = level
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION,
+                                    formula.encode('ascii').ljust(32)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def write_block(self, kind, iteration, size, thickness, hkls, chunks):
+        '''Append one block of 1D real chunks, one per hkl'''
+        chunks = [np.ascontiguousarray(c) for c in chunks]
+        itemsize = chunks[0].dtype.itemsize if chunks else 8
+        dtype = DTYPES[itemsize]
+        data = [c.astype(dtype).tobytes() for c in chunks]
+        if self.codec == ZLIB:
+            data = [zlib.compress(d, self.level) for d in data]
+        self.file.write(BLOCK_HEADER.pack(
+            BLOCK_MAGIC, kind, iteration, size, thickness, len(data),
+            self.codec, itemsize, 0, sum(len(d) for d in data)))
+        self.file.write(np.array(hkls, dtype='<i4').reshape(-1, 3).tobytes())
+        self.file.write(np.array([len(d) for d in data],
+                                 dtype='<i8').tobytes())
+        for d in data:
+            self.file.write(d)
+
+    def write_images(self, iteration, thickness, hkls, images):
+        '''Append the (y, x) images of one iteration and thickness'''
+        images = [np.asarray(i) for i in images]
+        self.write_block(IMAGES, iteration, images[0].shape[0], thickness,
+                         hkls, [i.ravel() for i in images])
+
+    def write_log_row(self, iteration, values):
+        '''Append one row of iteration_log.txt'''
+        values = np.asarray(values, dtype=float)
+        self.write_block(LOG_ROW, iteration, len(values), 0.0, [(0, 0, 0)],
+                         [values])
+
+
+def convert(tree, path, codec=ZLIB):
+    '''Write the .bin directories and iteration_log.txt of tree to path.
+
+    Thicknesses come from the directory names, so they are only as
+    exact as the nm (or A) the names give.
+    '''
+    stack = felixbin.BinStack(tree)
+    log = iterationlog.IterationLog(os.path.join(stack.path,
+                                                 'iteration_log.txt'))
+    log.poll()
+    with Writer(path, stack.dirs[0].info['formula'], codec) as out:
+        for d in stack.dirs:
+            thickness = d.info['thickness']
+            if d.info['unit'] == 'nm':
+                thickness *= 10
+            out.write_images(d.iteration or 0, thickness, d.hkls,
+                             [d.image(hkl) for hkl in d.hkls])
+        for row in log.table:
+            out.write_log_row(int(row[0]), row)
+    return len(stack.dirs), len(log)
+
+
+def compress(path, out, codec=ZLIB, level=6):
+    '''Copy a results file to out with every chunk in codec'''
+    results = ResultFile(path)
+    with Writer(out, results.formula, codec, level) as writer:
+        for block in results.blocks:
+            writer.write_block(block.kind, block.iteration, block.size,
+                               block.thickness, block.hkls,
+                               [results.chunk(block, i)
+                                for i in range(len(block.hkls))])
+    return len(results.blocks)
+
+
+def info(path):
+    '''Summary of a results file, one line per saved iteration'''
+    results = ResultFile(path)
+    lines = ['%s: %s, %d reflections, %d iterations, %d log rows' % (
+        path, results.formula, len(results.hkls), len(results.iterations),
+        len(results.log))]
+    for iteration in results.iterations:
+        thicknesses = results.thicknesses(iteration)
+        block = results.block(iteration, thicknesses[0])
+        lines.append('  iteration %4d: %d images of %dx%d at %s A (%s)' % (
+            iteration, len(block.hkls), block.size, block.size,
+            ', '.join('%g' % t for t in thicknesses), CODECS[block.codec]))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Convert, compress and list felix results files')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser(
+        'convert', help='put a tree of .bin directories into one file')
+    command.add_argument('tree', help='e.g. sample_outputs')
+    command.add_argument('-o', '--output', default=None,
+                         help='default: <formula>_results.fxr in the tree')
+    command.add_argument('--raw', action='store_true',
+                         help='do not compress the images')
+    command = commands.add_parser(
+        'compress', help='rewrite the raw chunks felix writes with zlib')
+    command.add_argument('file')
+    command.add_argument('-o', '--output', default=None,
+                         help='default: replace the file')
+    command.add_argument('--level', type=int, default=6,
+                         help='zlib compression level (default 6)')
+    command = commands.add_parser('info', help='list what a file holds')
+    command.add_argument('file')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'convert':
+            output = args.output
+            if output is None:
+                formula = felixbin.BinStack(args.tree).dirs[0].info['formula']
+                output = os.path.join(args.tree, formula + '_results.fxr')
+            dirs, rows = convert(args.tree, output,
+                                 RAW if args.raw else ZLIB)
+            print('%s: %d directories, %d log rows' % (output, dirs, rows))
+        elif args.command == 'compress':
+            output = args.output or args.file + '.tmp'
+            blocks = compress(args.file, output, level=args.level)
+            if args.output is None:
+                if os.name == 'nt':
+                    # rename does not replace files on Windows
+                    os.remove(args.file)
+                os.rename(output, args.file)
+                output = args.file
+            print('%s: %d blocks' % (output, blocks))
+        elif args.command == 'info':
+            print(info(args.file))
+        else:
+            parser.error('give a command: convert, compress or info')
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,423 @@
+'''
+Timing and numerical regression benchmark over the bundled samples
+
+`run` copies each sample (without its sample_outputs) to a scratch
+directory, turns on ITimingFLAG and runs felixrefine there once for
+every number of MPI ranks asked for.  Each run adds one JSON line to a
+history file with the build of felix, the wall time, the peak memory
+and the slowest rank's seconds in each timing phase (see
+timingreport.py).  Where the sample has sample_outputs, every .bin the
+run wrote is compared with the image of the same name there: the
+largest difference, the fraction of pixels outside
+atol + rtol*|reference| and the normalised cross-correlation of each
+image, done a whole output directory at a time.
+
+`report` compares, for each sample and number of ranks, the latest build
+in the history with the build before it and flags runs that got slower
+or used more memory by more than a fraction, and changes in the
+correlation or the pixels out of tolerance.  It exits with 1 if
+anything was flagged, so it can gate a build.
+
+    python samplebenchmark.py run ../samples/* --ranks 1 2 4
+    python samplebenchmark.py report
+    python samplebenchmark.py compare run ../samples/GaAs_long/sample_outputs
+
+The sample_outputs came from an older felix, so agreement with them is
+not exact; what matters is that it does not change between builds.
+The build is the start of the sha256 of the felix executable unless
+--build names it.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import felixbin
+import figureofmerit
+import inpfile
+import jobrunner
+import timingreport
+
+HISTORY = 'benchmark_history.jsonl'
+REFERENCE = 'sample_outputs'
+# a pixel is out of tolerance if
+# |produced - reference| > ATOL + RTOL*|reference|
+RTOL = 1e-3
+ATOL = 1e-6
+
+
+def build_id(felix):
+    '''First 12 hex digits of the sha256 of the felix executable'''
+    digest = hashlib.sha256()
+    with open(felix, 'rb') as f:
+        for data in iter(lambda: f.read(1024*1024), b''):
+            digest.update(data)
+    return digest.hexdigest()[:12]
+
+
+def prepare(sample, directory):
+    '''Copy of sample in directory, with phase timings turned on'''
+    shutil.copytree(sample, directory,
+                    ignore=shutil.ignore_patterns(REFERENCE))
+    path = os.path.join(directory, 'felix.inp')
+    inp = inpfile.InpFile.read(path)
+    inp['ITimingFLAG'] = 1
+    inp.write(path)
+
+
+def output_directories(path):
+    '''{name: path} of the felix output directories in path'''
+    found = {}
+    for name in sorted(os.listdir(path)):
+        full = os.path.join(path, name)
+        if (os.path.isdir(full) and felixbin.parse_dirname(name) is not None
+                and any(n.endswith('.bin') for n in os.listdir(full))):
+            found[name] = full
+    return found
+
+
+def compare_directory(produced, reference, rtol=RTOL, atol=ATOL):
+    '''Per-image comparison of two output directories.
+
+    Returns ({hkl: (max |difference|, fraction of pixels out of
+    tolerance, ncc)}, hkls only in reference, hkls only in produced).
+    '''
+    produced = felixbin.BinDirectory(produced)
+    reference = felixbin.BinDirectory(reference)
+    common = [hkl for hkl in reference.hkls if hkl in produced.files]
+    missing = [hkl for hkl in reference.hkls if hkl not in produced.files]
+    extra = [hkl for hkl in produced.hkls if hkl not in reference.files]
+    if not common:
+        return {}, missing, extra
+    if produced.size != reference.size:
+        raise ValueError('%s is %dx%d but %s is %dx%d'
+                         % (produced.path, produced.size, produced.size,
+                            reference.path, reference.size, reference.size))
+    sim = np.array([produced.image(hkl) for hkl in common], dtype=float)
+    ref = np.array([reference.image(hkl) for hkl in common], dtype=float)
+    difference = np.abs(sim - ref)
+    outside = (difference > atol + rtol*np.abs(ref)).mean(axis=(1, 2))
+    largest = difference.max(axis=(1, 2))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ncc = figureofmerit.normalised_correlation(sim, ref)
+    # a flat image has no correlation; call it perfect only if identical
+    ncc = np.where(np.isfinite(ncc), ncc, np.where(largest == 0, 1.0, 0.0))
+    return (dict(zip(common, zip(largest.tolist(), outside.tolist(),
+                                 ncc.tolist()))),
+            missing, extra)
+
+
+def compare(produced, reference, rtol=RTOL, atol=ATOL):
+    '''Summary of every .bin in produced against reference, as a dict'''
+    wanted = output_directories(reference)
+    made = output_directories(produced)
+    images, missing, extra = 0, 0, 0
+    largest, outside, ncc = [], [], []
+    worst = None
+    for name in sorted(set(wanted) | set(made)):
+        if name not in made:
+            missing += len(felixbin.BinDirectory(wanted[name]))
+            continue
+        if name not in wanted:
+            extra += len(felixbin.BinDirectory(made[name]))
+            continue
+        result, gone, added = compare_directory(made[name], wanted[name],
+                                                rtol, atol)
+        missing += len(gone)
+        extra += len(added)
+        images += len(result)
+        for hkl, (d, f, c) in result.items():
+            largest.append(d)
+            outside.append(f)
+            ncc.append(c)
+            if worst is None or c < worst[0]:
+                worst = (c, '%s/%s' % (name, felixbin.hkl_string(hkl)))
+    summary = {'images': images, 'missing': missing, 'extra': extra,
+               'rtol': rtol, 'atol': atol}
+    if images:
+        summary.update({
+            'max_difference': max(largest),
+            'outside': float(np.mean(outside)),
+            'images_outside': int(np.count_nonzero(outside)),
+            'ncc_min': min(ncc), 'ncc_mean': float(np.mean(ncc)),
+            'worst': worst[1]})
+    return summary
+
+
+def phase_times(directory):
+    '''{phase: seconds of the slowest rank} from felix's timing files'''
+    summary = timingreport.TimingSummary.read(directory)
+    return dict((phase, max(summary.by_rank(phase).values()))
+                for phase in summary.phases)
+
+
+def run(directory, cores=1, felix=None, mpirun='mpirun'):
+    '''The finished jobrunner.Job of one felix run in directory'''
+    lines = []
+    job = jobrunner.Job(directory, cores, felix, mpirun,
+                        on_output=lambda stream, line: lines.append(line))
+    job.start()
+    while not job.join(0.5):
+        pass
+    if job.state != jobrunner.FINISHED:
+        raise ValueError('felix %s in %s: %s'
+                         % (job.describe(), directory,
+                            job.error or (lines[-1] if lines else '')))
+    return job
+
+
+def measure(sample, cores=1, felix=None, mpirun='mpirun', build=None,
+            rtol=RTOL, atol=ATOL, keep=False):
+    '''One history record for sample run on cores ranks'''
+    felix = felix or jobrunner.default_felix()
+    name = os.path.basename(os.path.normpath(sample))
+    scratch = tempfile.mkdtemp(prefix='felix_bench_%s_%d_' % (name, cores))
+    directory = os.path.join(scratch, name)
+    try:
+        prepare(sample, directory)
+        job = run(directory, cores, felix, mpirun)
+        record = {'sample': name, 'ranks': cores,
+                  'build': build or build_id(felix),
+                  'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  'wall_time': job.wall_time, 'max_rss': job.max_rss,
+                  'phases': phase_times(directory)}
+        reference = os.path.join(sample, REFERENCE)
+        if os.path.isdir(reference):
+            record['accuracy'] = compare(directory, reference, rtol, atol)
+        if keep:
+            record['directory'] = directory
+        return record
+    finally:
+        if not keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+def append(filename, record):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+def read_history(filename):
+    '''The records of a history file, oldest first'''
+    records = []
+    with open(filename) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                raise ValueError('%s line %d is not JSON' % (filename, n))
+    return records
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return float(np.median(values)) if values else None
+
+
+def build_summary(records):
+    '''Medians over repeated runs of one build, sample and rank count'''
+    phases = set()
+    for r in records:
+        phases.update(r.get('phases', {}))
+    summary = {'runs': len(records),
+               'wall_time': _median([r['wall_time'] for r in records]),
+               'max_rss': _median([r.get('max_rss') for r in records]),
+               'phases': dict((p, _median([r['phases'].get(p)
+                                           for r in records]))
+                              for p in phases)}
+    accuracy = [r['accuracy'] for r in records
+                if r.get('accuracy', {}).get('images')]
+    if accuracy:
+        # the worst of the runs, as these should all be the same
+        summary['ncc_min'] = min(a['ncc_min'] for a in accuracy)
+        summary['outside'] = max(a['outside'] for a in accuracy)
+        summary['missing'] = max(a['missing'] for a in accuracy)
+    return summary
+
+
+def _grew(old, new, fraction):
+    return old is not None and new is not None and old > 0 and \
+        new > old*(1 + fraction)
+
+
+def changes(old, new, slower=0.1, ncc=1e-4, outside=1e-3, min_seconds=0.5):
+    '''What got worse from build summary old to new, as short phrases'''
+    flags = []
+    if (_grew(old['wall_time'], new['wall_time'], slower)
+            and new['wall_time'] - old['wall_time'] >= min_seconds):
+        flags.append('wall time +%.0f%%'
+                     % (100*(new['wall_time']/old['wall_time'] - 1)))
+    for phase in sorted(new['phases'], key=_phase_order):
+        before, after = old['phases'].get(phase), new['phases'][phase]
+        if (_grew(before, after, slower)
+                and after - before >= min_seconds):
+            flags.append('%s +%.0f%%' % (phase, 100*(after/before - 1)))
+    if _grew(old['max_rss'], new['max_rss'], slower):
+        flags.append('memory +%.0f%%'
+                     % (100*(new['max_rss']/old['max_rss'] - 1)))
+    if 'ncc_min' in old and 'ncc_min' in new:
+        if abs(new['ncc_min'] - old['ncc_min']) > ncc:
+            flags.append('ncc %.5f -> %.5f' % (old['ncc_min'], new['ncc_min']))
+        if abs(new['outside'] - old['outside']) > outside:
+            flags.append('outside %.2f%% -> %.2f%%'
+                         % (100*old['outside'], 100*new['outside']))
+        if new['missing'] > old['missing']:
+            flags.append('%d images missing' % new['missing'])
+    elif 'ncc_min' in old:
+        flags.append('no images to compare')
+    return flags
+
+
+def _phase_order(phase):
+    if phase in timingreport.PHASES:
+        return (timingreport.PHASES.index(phase), phase)
+    return (len(timingreport.PHASES), phase)
+
+
+def trend(records, **limits):
+    '''[(sample, ranks, previous build, latest build, old, new, flags)]
+
+    for each sample and rank count, comparing the median of the latest
+    build's runs with those of the build before it (old is None if there
+    is only one build).  limits are passed to changes().
+    '''
+    builds = []
+    groups = {}
+    for r in records:
+        if r['build'] not in builds:
+            builds.append(r['build'])
+        key = (r['sample'], r['ranks'])
+        groups.setdefault(key, {}).setdefault(r['build'], []).append(r)
+    rows = []
+    for key in sorted(groups):
+        ran = sorted(groups[key], key=builds.index)
+        new = build_summary(groups[key][ran[-1]])
+        if len(ran) == 1:
+            rows.append(key + (None, ran[-1], None, new, []))
+            continue
+        old = build_summary(groups[key][ran[-2]])
+        rows.append(key + (ran[-2], ran[-1], old, new,
+                           changes(old, new, **limits)))
+    return rows
+
+
+def _seconds(value):
+    return '%9.1f' % value if value is not None else '%9s' % '-'
+
+
+def report(rows):
+    lines = ['%-14s %5s %12s %9s %9s %8s %9s %8s  %s' % (
+        'sample', 'ranks', 'build', 'before s', 'after s', 'MB',
+        'ncc min', 'outside', 'flags')]
+    for sample, ranks, _, build, old, new, flags in rows:
+        lines.append('%-14s %5d %12s %s %s %8s %9s %8s  %s' % (
+            sample, ranks, build,
+            _seconds(old['wall_time'] if old else None),
+            _seconds(new['wall_time']),
+            '%.0f' % (new['max_rss']/1024**2) if new['max_rss'] else '-',
+            '%.5f' % new['ncc_min'] if 'ncc_min' in new else '-',
+            '%.2f%%' % (100*new['outside']) if 'outside' in new else '-',
+            ', '.join(flags) or ('first build' if old is None else 'ok')))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Timing and accuracy regression runs of the samples')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('run', help='run samples and add to the history')
+    p.add_argument('samples', nargs='+',
+                   help='sample directories with felix.inp')
+    p.add_argument('--ranks', type=int, nargs='+', default=[1],
+                   help='MPI rank counts to run each sample with')
+    p.add_argument('--repeat', type=int, default=1,
+                   help='runs of each sample and rank count')
+    p.add_argument('--felix', default=None,
+                   help='felix executable (default: ../src/felixrefine)')
+    p.add_argument('--mpirun', default='mpirun',
+                   help="MPI launcher, or '' to run felix directly")
+    p.add_argument('--build', default=None,
+                   help='name of this build (default: the start of the '
+                   'sha256 of felix)')
+    p.add_argument('--history', default=HISTORY)
+    p.add_argument('--rtol', type=float, default=RTOL)
+    p.add_argument('--atol', type=float, default=ATOL)
+    p.add_argument('--keep', action='store_true',
+                   help='keep the directories felix ran in')
+
+    p = sub.add_parser('report', help='compare the last two builds')
+    p.add_argument('--history', default=HISTORY)
+    p.add_argument('--slower', type=float, default=0.1,
+                   help='flag time or memory growing by more than this '
+                   'fraction (default 0.1)')
+    p.add_argument('--ncc', type=float, default=1e-4,
+                   help='flag the lowest correlation changing by more than '
+                   'this (default 1e-4)')
+    p.add_argument('--outside', type=float, default=1e-3,
+                   help='flag the fraction of pixels out of tolerance '
+                   'changing by more than this (default 1e-3)')
+
+    p = sub.add_parser('compare', help='compare two output directories')
+    p.add_argument('produced', help='where felix ran')
+    p.add_argument('reference', help='e.g. a sample_outputs directory')
+    p.add_argument('--rtol', type=float, default=RTOL)
+    p.add_argument('--atol', type=float, default=ATOL)
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        failed = 0
+        for sample in args.samples:
+            for ranks in args.ranks:
+                for _ in range(args.repeat):
+                    try:
+                        record = measure(sample, ranks, args.felix,
+                                         args.mpirun, args.build, args.rtol,
+                                         args.atol, args.keep)
+                    except (IOError, OSError, ValueError) as e:
+                        print(e, file=sys.stderr)
+                        failed += 1
+                        continue
+                    append(args.history, record)
+                    accuracy = record.get('accuracy', {})
+                    print('%s on %d: %.1f s%s' % (
+                        record['sample'], ranks, record['wall_time'],
+                        ', ncc >= %.5f' % accuracy['ncc_min']
+                        if accuracy.get('images') else ''))
+        return 1 if failed else 0
+    elif args.command == 'report':
+        try:
+            records = read_history(args.history)
+        except (IOError, OSError, ValueError) as e:
+            parser.error(str(e))
+        rows = trend(records, slower=args.slower, ncc=args.ncc,
+                     outside=args.outside)
+        print(report(rows))
+        return 1 if any(row[-1] for row in rows) else 0
+    elif args.command == 'compare':
+        try:
+            summary = compare(args.produced, args.reference, args.rtol,
+                              args.atol)
+        except (IOError, OSError, ValueError) as e:
+            parser.error(str(e))
+        print(json.dumps(summary, indent=1, sort_keys=True))
+        return 1 if summary['missing'] else 0
+    else:
+        parser.print_help()
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+'''
+felix's structure factor setup time against the size of the reflection pool
+
+Runs felixrefine on a sample once per IMinReflectionPool, simulation only
+and with a few pixels so the run is mostly setup, and reports the
+UgSetup phase of its timings (StructureFactorInitialisation: the Ug
+matrix and the grouping of equivalent Ugs) and the Absorption phase,
+next to the INhkl and the number of unique Ugs felix found.  The
+slowest rank is taken, since every rank does the setup.
+
+    python setupbenchmark.py ../samples/GaAs_long --pools 200 400 800 1200
+
+shows a table of pool, INhkl, unique Ugs, UgSetup and Absorption
+seconds and UgSetup microseconds per INhkl^2, and the power of INhkl
+that UgSetup grows with between the smallest and largest pool.
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+import inpfile
+import jobrunner
+import timingreport
+
+# felix's message after grouping the Ug matrix, see ug_matrix_mod.f90
+UNIQUE = re.compile(r'(\d+) unique structure factors of\s+(\d+) reflections')
+
+
+def prepare(sample, directory, pool, pixels=4):
+    '''felix.inp, felix.cif and felix.hkl of sample in directory'''
+    inp = inpfile.InpFile.read(os.path.join(sample, 'felix.inp'))
+    inp['IMinReflectionPool'] = pool
+    inp['IRefineModeFLAG'] = 'S'
+    inp['IPixelCount'] = pixels
+    inp['RFinalThickness'] = inp['RInitialThickness']
+    inp['ITimingFLAG'] = 1
+    inp.write(os.path.join(directory, 'felix.inp'))
+    for name in ('felix.cif', 'felix.hkl'):
+        shutil.copy(os.path.join(sample, name), directory)
+
+
+def run(directory, cores=1, felix=None, mpirun='mpirun'):
+    '''(job, stdout lines) of one felix run in directory'''
+    lines = []
+    job = jobrunner.Job(directory, cores, felix, mpirun,
+                        on_output=lambda stream, line: lines.append(line))
+    job.start()
+    while not job.join(0.5):
+        pass
+    return job, lines
+
+
+def measure(sample, pool, cores=1, felix=None, mpirun='mpirun', pixels=4,
+            keep=False):
+    '''{'pool', 'nhkl', 'unique', 'setup', 'absorption', 'directory'}'''
+    directory = tempfile.mkdtemp(prefix='felix_setup_%d_' % pool)
+    try:
+        prepare(sample, directory, pool, pixels)
+        job, lines = run(directory, cores, felix, mpirun)
+        if job.state != jobrunner.FINISHED:
+            raise ValueError('felix %s for a pool of %d: %s'
+                             % (job.describe(), pool,
+                                job.error or (lines[-1] if lines else '')))
+        found = [UNIQUE.search(line) for line in lines]
+        found = [m for m in found if m]
+        if not found:
+            raise ValueError('no "unique structure factors" in the output '
+                             'of felix for a pool of %d' % pool)
+        summary = timingreport.TimingSummary.read(directory)
+        return {'pool': pool,
+                'unique': int(found[-1].group(1)),
+                'nhkl': int(found[-1].group(2)),
+                'setup': max(summary.by_rank('UgSetup').values()),
+                'absorption': max(summary.by_rank('Absorption').values()),
+                'directory': directory if keep else None}
+    finally:
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def growth(results, key='setup'):
+    '''Exponent x of time ~ INhkl^x, from the smallest and largest pool'''
+    first, last = results[0], results[-1]
+    if (last['nhkl'] <= first['nhkl'] or first[key] <= 0
+            or last[key] <= 0):
+        return None
+    return (math.log(last[key]/first[key]) /
+            math.log(last['nhkl']/first['nhkl']))
+
+
+def report(results):
+    lines = ['%5s %6s %7s %10s %13s %11s' % (
+        'pool', 'INhkl', 'unique', 'UgSetup s', 'Absorption s', 'us/INhkl^2')]
+    for r in results:
+        lines.append('%5d %6d %7d %10.3f %13.3f %11.2f' % (
+            r['pool'], r['nhkl'], r['unique'], r['setup'], r['absorption'],
+            1e6*r['setup']/r['nhkl']**2))
+    exponent = growth(results)
+    if exponent is not None:
+        lines.append('UgSetup grows as INhkl^%.1f' % exponent)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Time felix's structure factor setup against INhkl")
+    parser.add_argument('sample', help='directory with felix.inp, felix.cif '
+                        'and felix.hkl')
+    parser.add_argument('--pools', type=int, nargs='+',
+                        default=[100, 200, 400, 800],
+                        help='IMinReflectionPool values (default: 100 200 '
+                        '400 800)')
+    parser.add_argument('-n', '--cores', type=int, default=1)
+    parser.add_argument('--felix', default=None,
+                        help='felix executable (default: ../src/felixrefine)')
+    parser.add_argument('--mpirun', default='mpirun',
+                        help="MPI launcher, or '' to run felix directly")
+    parser.add_argument('--pixels', type=int, default=4,
+                        help='IPixelCount of the runs (default: 4)')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the directories felix ran in')
+    args = parser.parse_args(argv)
+
+    results = []
+    for pool in sorted(args.pools):
+        try:
+            result = measure(args.sample, pool, args.cores, args.felix,
+                             args.mpirun, args.pixels, args.keep)
+        except (IOError, OSError, ValueError) as e:
+            parser.error(str(e))
+        results.append(result)
+        print('pool %d: INhkl %d, UgSetup %.3f s%s' % (
+            pool, result['nhkl'], result['setup'],
+            ', in ' + result['directory'] if args.keep else ''),
+            file=sys.stderr)
+    print(report(results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
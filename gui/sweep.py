@@ -0,0 +1,337 @@
+'''
+Parameter sweeps over felix.inp, run on a fixed budget of cores
+
+A sweep starts from a template sample directory (felix.inp, felix.hkl,
+felix.cif and the experimental images in LR_NxN/, DM3/ or alongside) and
+a set of points, each a dict of felix.inp variables to change:
+
+    grid({'RAbsorptionPer': [5, 7.8, 10], 'RBlurRadius': [1.5, 2.2]})
+    zipped({'RInitialThickness': [800, 900], 'RFinalThickness': [800, 900]})
+
+create() writes one working directory per point, p0000, p0001, ..., with
+its own edited felix.inp and everything else hard-linked from the
+template (copied only where the sweep is on another file system), plus
+sweep.json describing the sweep.  run() then starts felix in each
+directory under mpirun, keeping as many jobs going as fit in the core
+budget, e.g. 4 jobs of 8 ranks on a 32-core node.
+
+Each directory gets a sweep_status.json once its job ends, so running a
+sweep again only restarts points that have not finished; an interrupted
+point is started again from scratch.
+
+    python sweep.py create ../samples/GaAs_long runs/abs \\
+        --vary RAbsorptionPer=5,7.8,10 --vary RBlurRadius=1.5,2.2
+    python sweep.py run runs/abs --cores 32 --ranks 8
+    python sweep.py run runs/abs --cores 32 --cache ~/.cache/felix/results
+    python sweep.py status runs/abs
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import threading
+
+import inpfile
+import jobrunner
+
+MANIFEST = 'sweep.json'
+STATUS = 'sweep_status.json'
+# files felix writes as it runs, removed before a point is restarted
+RUN_OUTPUTS = ('iteration_log.txt',)
+
+
+def grid(values):
+    '''Every combination of values, a dict of name -> list'''
+    names = sorted(values)
+    return [dict(zip(names, combo))
+            for combo in itertools.product(*[values[n] for n in names])]
+
+
+def zipped(values):
+    '''Points taking the i-th value of every list together'''
+    names = sorted(values)
+    lengths = set(len(values[n]) for n in names)
+    if len(lengths) > 1:
+        raise ValueError('zipped values need equal lengths, got %s'
+                         % dict((n, len(values[n])) for n in names))
+    return [dict(zip(names, combo))
+            for combo in zip(*[values[n] for n in names])]
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def input_files(template):
+    '''Files of a sample directory felix reads, other than felix.inp'''
+    found = []
+    for f in sorted(os.listdir(template)):
+        path = os.path.join(template, f)
+        if f in ('felix.hkl', 'felix.cif') or \
+                os.path.splitext(f)[1].lower() in ('.img', '.dm3'):
+            found.append(f)
+        elif os.path.isdir(path) and (f == 'DM3' or f.startswith('LR_')):
+            found.extend(os.path.join(f, g) for g in sorted(os.listdir(path)))
+    return found
+
+
+def point_name(index):
+    return 'p%04d' % index
+
+
+def create(template, directory, points, cores=None):
+    '''Write the working directories of a sweep.
+
+    cores, if given, is the number of mpirun ranks each point uses; a
+    point can also set its own with a 'cores' entry.  Directories that
+    already exist are left alone, so extending a sweep keeps its results.
+    '''
+    template = os.path.abspath(template)
+    base = inpfile.InpFile.read(os.path.join(template, 'felix.inp'))
+    files = input_files(template)
+    # edit every felix.inp first, so a bad value fails before any writing
+    entries, inps = [], []
+    for i, point in enumerate(points):
+        point = dict(point)
+        ranks = point.pop('cores', cores)
+        inp = base.copy()
+        inp.update(point)
+        inps.append(inp)
+        entries.append({'name': point_name(i), 'values': point,
+                        'cores': ranks})
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for entry, inp in zip(entries, inps):
+        path = os.path.join(directory, entry['name'])
+        if os.path.isdir(path):
+            continue
+        os.makedirs(path)
+        for f in files:
+            if not os.path.isdir(os.path.join(path, os.path.dirname(f))):
+                os.makedirs(os.path.join(path, os.path.dirname(f)))
+            link_or_copy(os.path.join(template, f), os.path.join(path, f))
+        inp.write(os.path.join(path, 'felix.inp'))
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump({'template': template, 'points': entries}, f, indent=1,
+                  sort_keys=True)
+    return entries
+
+
+def load(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def point_status(directory, name):
+    '''Saved job summary of a point, or None if it never finished'''
+    try:
+        with open(os.path.join(directory, name, STATUS)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def pending(directory):
+    '''Manifest entries whose job has not finished successfully'''
+    return [p for p in load(directory)['points']
+            if (point_status(directory, p['name']) or {}).get('state')
+            != jobrunner.FINISHED]
+
+
+class Scheduler(object):
+    '''Runs points of a sweep as jobs within a core budget.
+
+    Jobs are started largest first whenever enough cores are free
+    (first-fit decreasing), which keeps a node full when points ask for
+    different numbers of ranks.
+    '''
+
+    def __init__(self, directory, cores, ranks=1, felix=None,
+                 mpirun='mpirun', report=print, cache=None):
+        self.directory = directory
+        self.cache = cache
+        self.cores = cores
+        self.ranks = ranks
+        self.felix = felix
+        self.mpirun = mpirun
+        self.report = report
+        self.cond = threading.Condition()
+        self.running = []
+        self.stopping = False
+
+    def ranks_for(self, point):
+        return min(point.get('cores') or self.ranks, self.cores)
+
+    def run(self, points=None):
+        '''Run points (default: all unfinished); returns their summaries'''
+        if points is None:
+            points = pending(self.directory)
+        queue = sorted(points, key=self.ranks_for, reverse=True)
+        results = {}
+        with self.cond:
+            while (queue and not self.stopping) or self.running:
+                free = self.cores - sum(j.cores for j in self.running)
+                started = False
+                for point in list(queue):
+                    if self.stopping or self.ranks_for(point) > free:
+                        continue
+                    queue.remove(point)
+                    job = self._start(point, results)
+                    if job is not None:
+                        free -= job.cores
+                        started = True
+                if not started:
+                    self.cond.wait(1.0)
+        return results
+
+    def _start(self, point, results):
+        path = os.path.join(self.directory, point['name'])
+        for f in RUN_OUTPUTS + (STATUS,):
+            if os.path.exists(os.path.join(path, f)):
+                os.remove(os.path.join(path, f))
+        job = jobrunner.Job(path, self.ranks_for(point), self.felix,
+                            self.mpirun, on_exit=self._finished,
+                            cache=self.cache)
+        job.point = point
+        job.results = results
+        self.running.append(job)
+        self.report('%s started on %d cores: %s' % (
+            point['name'], job.cores, point['values']))
+        job.start()
+        return job
+
+    def _finished(self, job):
+        summary = job.summary()
+        summary['values'] = job.point['values']
+        if job.state != jobrunner.CANCELLED:
+            # a cancelled point is left without status, to run next time
+            with open(os.path.join(job.directory, STATUS), 'w') as f:
+                json.dump(summary, f, indent=1, sort_keys=True)
+        self.report('%s %s' % (job.point['name'], job.describe()))
+        with self.cond:
+            job.results[job.point['name']] = summary
+            if job in self.running:
+                self.running.remove(job)
+            self.cond.notify()
+
+    def stop(self):
+        '''Cancel everything running and start nothing more'''
+        with self.cond:
+            self.stopping = True
+            jobs = list(self.running)
+            self.cond.notify()
+        for job in jobs:
+            job.cancel()
+
+
+def parse_vary(text):
+    '''NAME=v1,v2,... -> (name, [v1, ...]); vectors [u,v,w], sites (i,j)'''
+    if '=' not in text:
+        raise argparse.ArgumentTypeError('expected NAME=value,value,...')
+    name, values = text.split('=', 1)
+    parsed, depth, item = [], 0, ''
+    for c in values:
+        depth += {'[': 1, '(': 1, ']': -1, ')': -1}.get(c, 0)
+        if c == ',' and depth == 0:
+            parsed.append(item)
+            item = ''
+        else:
+            item += c
+    parsed.append(item)
+    return name.strip(), [v.strip() for v in parsed if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='felix.inp parameter sweeps')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('create', help='write the working directories')
+    p.add_argument('template', help='sample directory with felix.inp')
+    p.add_argument('directory', help='where to put the sweep')
+    p.add_argument('--vary', action='append', type=parse_vary, default=[],
+                   metavar='NAME=V1,V2', help='values of one variable')
+    p.add_argument('--zip', action='store_true',
+                   help='pair the values up instead of taking every '
+                   'combination')
+    p.add_argument('--points', help='JSON list of {name: value} points')
+    p.add_argument('--ranks', type=int, default=None,
+                   help='mpirun ranks per point')
+
+    p = sub.add_parser('run', help='run unfinished points')
+    p.add_argument('directory')
+    p.add_argument('--cores', type=int, required=True,
+                   help='cores to use in total')
+    p.add_argument('--ranks', type=int, default=1,
+                   help='mpirun ranks per job unless the point says')
+    p.add_argument('--felix', default=None)
+    p.add_argument('--mpirun', default='mpirun')
+    p.add_argument('--cache', default=None, metavar='DIRECTORY',
+                   help='reuse the output of identical finished runs kept '
+                   'here (see resultcache.py)')
+    p.add_argument('--cache-mb', type=float, default=2048,
+                   help='size limit of the cache (default 2048 MB)')
+
+    p = sub.add_parser('status', help='show the state of every point')
+    p.add_argument('directory')
+
+    args = parser.parse_args(argv)
+    if args.command == 'create':
+        if args.points:
+            with open(args.points) as f:
+                points = json.load(f)
+        elif args.vary:
+            values = dict(args.vary)
+            try:
+                points = zipped(values) if args.zip else grid(values)
+            except ValueError as e:
+                parser.error(str(e))
+        else:
+            parser.error('give --vary or --points')
+        try:
+            entries = create(args.template, args.directory, points,
+                             args.ranks)
+        except (KeyError, ValueError) as e:
+            parser.error(e.args[0])
+        print('%d points in %s' % (len(entries), args.directory))
+    elif args.command == 'run':
+        cache = None
+        if args.cache:
+            import resultcache
+            cache = resultcache.ResultCache(args.cache,
+                                            int(args.cache_mb*1024**2))
+        scheduler = Scheduler(args.directory, args.cores, args.ranks,
+                              args.felix, args.mpirun, cache=cache)
+        todo = pending(args.directory)
+        print('%d of %d points to run' % (
+            len(todo), len(load(args.directory)['points'])))
+        try:
+            results = scheduler.run(todo)
+        except KeyboardInterrupt:
+            scheduler.stop()
+            scheduler.run([])
+            return 1
+        failed = [n for n, r in results.items()
+                  if r['state'] != jobrunner.FINISHED]
+        if cache is not None:
+            print(cache.summary())
+        return 1 if failed else 0
+    elif args.command == 'status':
+        for point in load(args.directory)['points']:
+            status = point_status(args.directory, point['name'])
+            state = status['state'] if status else 'pending'
+            print('%s %-9s %s' % (point['name'], state, point['values']))
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,181 @@
+'''
+On-disk thumbnail cache and background loader for the image viewer
+
+Thumbnails are stored as small raw RGB files under ~/.cache/felix/thumbs,
+keyed by the source path, its mtime and size and the thumbnail size, so
+a changed image is simply a cache miss.  The cache is bounded in bytes
+and evicts least recently used entries (a hit refreshes the entry's
+mtime).
+
+Nothing here depends on wx: the caller supplies a decode(path, size)
+function returning (width, height, rgb bytes) and gets the same back.
+ThumbLoader runs the decoding on a worker thread, always serving the
+most recently requested (i.e. visible) images first.
+'''
+
+from __future__ import division
+
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+
+MAGIC = b'FTH1'
+HEADER = struct.Struct('<4sHH')
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'felix', 'thumbs')
+
+
+class ThumbCache(object):
+    '''Size-bounded LRU store of (width, height, rgb) thumbnails'''
+
+    def __init__(self, directory=None, maxbytes=64*1024*1024):
+        self.directory = directory or default_directory()
+        self.maxbytes = maxbytes
+        self.lock = threading.Lock()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        # name -> [last use, bytes]; rebuilt from the directory each start
+        self.entries = {}
+        for f in os.listdir(self.directory):
+            if f.endswith('.thumb'):
+                st = os.stat(os.path.join(self.directory, f))
+                self.entries[f] = [st.st_mtime, st.st_size]
+        self.nbytes = sum(e[1] for e in self.entries.values())
+
+    def key(self, path, size):
+        st = os.stat(path)
+        ident = '%s\0%r\0%d\0%d' % (os.path.abspath(path), st.st_mtime,
+                                    st.st_size, size)
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest() + '.thumb'
+
+    def get(self, path, size, decode):
+        '''Thumbnail of path no larger than size, decoding on a miss'''
+        name = self.key(path, size)
+        thumb = self._read(name)
+        if thumb is None:
+            thumb = decode(path, size)
+            self._write(name, thumb)
+        return thumb
+
+    def _read(self, name):
+        filename = os.path.join(self.directory, name)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, width, height = HEADER.unpack(data[:HEADER.size])
+        rgb = data[HEADER.size:]
+        if magic != MAGIC or len(rgb) != 3*width*height:
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        with self.lock:
+            if name in self.entries:
+                self.entries[name][0] = os.path.getmtime(filename)
+        return width, height, rgb
+
+    def _write(self, name, thumb):
+        width, height, rgb = thumb
+        data = HEADER.pack(MAGIC, width, height) + bytes(rgb)
+        # write then rename, so a reader never sees half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmp, os.path.join(self.directory, name))
+        except (IOError, OSError):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self.lock:
+            old = self.entries.get(name)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[name] = [os.path.getmtime(
+                os.path.join(self.directory, name)), len(data)]
+            self.nbytes += len(data)
+            self._evict()
+
+    def _evict(self):
+        if self.nbytes <= self.maxbytes:
+            return
+        for name in sorted(self.entries, key=lambda n: self.entries[n][0]):
+            if self.nbytes <= self.maxbytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            self.nbytes -= self.entries.pop(name)[1]
+
+    def clear(self):
+        with self.lock:
+            for name in list(self.entries):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            self.entries = {}
+            self.nbytes = 0
+
+
+class ThumbLoader(object):
+    '''Worker thread filling thumbnail requests from a ThumbCache.
+
+    request() replaces whatever is still pending, so scrolling quickly
+    past a folder only decodes what ends up on screen.  done(path, thumb)
+    is called on the worker thread (thumb is None if decoding failed);
+    GUI code should hand it over with wx.CallAfter.
+    '''
+
+    def __init__(self, cache, size, decode, done):
+        self.cache = cache
+        self.size = size
+        self.decode = decode
+        self.done = done
+        self.pending = []
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, paths):
+        with self.cond:
+            self.pending = list(paths)
+            self.cond.notify()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.pending = []
+            self.cond.notify()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.stopped:
+                    self.cond.wait()
+                if self.stopped:
+                    return
+                path = self.pending.pop(0)
+            try:
+                thumb = self.cache.get(path, self.size, self.decode)
+            except Exception:
+                # an unreadable file just shows as an empty tile
+                thumb = None
+            with self.cond:
+                if self.stopped:
+                    return
+            self.done(path, thumb)
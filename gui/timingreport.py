@@ -0,0 +1,198 @@
+'''
+Where the time of a felix run goes, from its phase timings
+
+With ITimingFLAG = 1 in felix.inp every rank writes
+felix_timing.<rank>.jsonl into the directory felix runs in, one JSON
+object per phase and iteration (see src/felix/timing_mod.f90):
+
+    {"rank": 3, "iter": 12, "phase": "Bloch", "calls": 1024,
+     "seconds": 4.1234567E+000}
+
+TimingSummary adds these up over ranks and iterations.  Gather and
+Broadcast are collective, so time in them is mostly a rank waiting for
+the slowest one; report() shows each phase's share of all rank-seconds
+(flame-style, widest first) and how evenly the ranks were loaded.
+
+    summary = TimingSummary.read('samples/GaAs_short')
+    print(summary.report())
+
+    python timingreport.py samples/GaAs_short --iterations
+'''
+
+from __future__ import division, print_function
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+# in the order felix goes through them; any others come after
+PHASES = ('UgSetup', 'UgMatrix', 'Absorption', 'Bloch', 'Gather', 'BlurG',
+          'FigureOfMerit', 'Output', 'Broadcast')
+# collective calls, where a rank mostly waits for the others
+WAITING = ('Gather', 'Broadcast')
+PATTERN = 'felix_timing.*.jsonl'
+
+
+def timing_files(directory):
+    return sorted(glob.glob(os.path.join(directory, PATTERN)))
+
+
+def read_records(path):
+    '''The records of one felix_timing.<rank>.jsonl.
+
+    A line cut short (a rank killed while writing) is skipped.
+    '''
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and 'phase' in record:
+                records.append(record)
+    return records
+
+
+def bar(fraction, width, fill='#'):
+    return fill*int(round(max(0.0, min(1.0, fraction))*width))
+
+
+class TimingSummary(object):
+    '''Seconds and calls by (rank, iteration, phase)'''
+
+    def __init__(self, records=()):
+        self.seconds = {}
+        self.calls = {}
+        for record in records:
+            self.add(record)
+
+    @classmethod
+    def read(cls, directory):
+        files = timing_files(directory)
+        if not files:
+            raise ValueError('no %s in %s; run felix with ITimingFLAG = 1'
+                             % (PATTERN, directory))
+        summary = cls()
+        for path in files:
+            for record in read_records(path):
+                summary.add(record)
+        return summary
+
+    def add(self, record):
+        key = (int(record['rank']), int(record['iter']), record['phase'])
+        self.seconds[key] = self.seconds.get(key, 0.0) + record['seconds']
+        self.calls[key] = self.calls.get(key, 0) + record.get('calls', 1)
+
+    @property
+    def ranks(self):
+        return sorted(set(k[0] for k in self.seconds))
+
+    @property
+    def iterations(self):
+        return sorted(set(k[1] for k in self.seconds))
+
+    @property
+    def phases(self):
+        found = set(k[2] for k in self.seconds)
+        return ([p for p in PHASES if p in found]
+                + sorted(found.difference(PHASES)))
+
+    def total(self, rank=None, iteration=None, phase=None):
+        '''Seconds summed over whatever is not given'''
+        return sum(s for (r, i, p), s in self.seconds.items()
+                   if (rank is None or r == rank)
+                   and (iteration is None or i == iteration)
+                   and (phase is None or p == phase))
+
+    def by_rank(self, phase=None):
+        '''{rank: seconds}, of one phase or all of them'''
+        totals = dict((r, 0.0) for r in self.ranks)
+        for (r, i, p), s in self.seconds.items():
+            if phase is None or p == phase:
+                totals[r] += s
+        return totals
+
+    def busy(self):
+        '''{rank: (seconds computing, seconds in WAITING phases)}'''
+        totals = self.by_rank()
+        waiting = dict((r, 0.0) for r in totals)
+        for (r, i, p), s in self.seconds.items():
+            if p in WAITING:
+                waiting[r] += s
+        return dict((r, (totals[r] - waiting[r], waiting[r]))
+                    for r in totals)
+
+    def imbalance(self, phase=None):
+        '''Slowest rank over the mean, 1 when the load is even'''
+        totals = list(self.by_rank(phase).values())
+        if not totals or not sum(totals):
+            return 1.0
+        return max(totals)/(sum(totals)/len(totals))
+
+    def report(self, width=40, iterations=False):
+        '''Phase shares, load per rank and optionally per iteration'''
+        ranks = self.ranks
+        everything = self.total()
+        lines = ['%d ranks, %d iterations, %.2f rank-seconds'
+                 % (len(ranks), len(self.iterations), everything), '',
+                 '%-14s %11s %6s %8s' % ('phase', 'seconds', 'share',
+                                         'max/mean')]
+        shares = [(self.total(phase=p), p) for p in self.phases]
+        for seconds, phase in sorted(shares, reverse=True):
+            share = seconds/everything if everything else 0.0
+            lines.append('%-14s %11.3f %5.1f%% %8.2f  %s' % (
+                phase, seconds, 100*share, self.imbalance(phase),
+                bar(share, width)))
+
+        busy = self.busy()
+        longest = max([sum(b) for b in busy.values()] or [0.0])
+        lines += ['', '%-6s %11s %11s  busy (#) and waiting (.)'
+                  % ('rank', 'busy', 'waiting')]
+        for rank in ranks:
+            working, waiting = busy[rank]
+            scale = width/longest if longest else 0.0
+            n = int(round(working*scale))
+            m = int(round((working + waiting)*scale)) - n
+            lines.append('%-6d %11.3f %11.3f  %s' % (
+                rank, working, waiting, '#'*n + '.'*m))
+        total_busy = sum(b[0] for b in busy.values())
+        if longest:
+            lines.append('ranks computing %.1f%% of the time'
+                         % (100*total_busy/(longest*len(ranks))))
+
+        if iterations:
+            phases = self.phases
+            lines += ['', 'slowest rank per iteration (seconds)',
+                      '%6s ' % 'iter' + ' '.join('%13s' % p[:13]
+                                                 for p in phases)]
+            for iteration in self.iterations:
+                lines.append('%6d ' % iteration + ' '.join(
+                    '%13.4f' % max(self.seconds.get((r, iteration, p), 0.0)
+                                   for r in ranks) for p in phases))
+        return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Sum up the felix_timing.<rank>.jsonl of a felix run')
+    parser.add_argument('directory', help='directory felix ran in')
+    parser.add_argument('--iterations', action='store_true',
+                        help='also show the slowest rank of every phase in '
+                        'each iteration')
+    parser.add_argument('--width', type=int, default=40,
+                        help='width of the bars (default: 40)')
+    args = parser.parse_args(argv)
+
+    try:
+        summary = TimingSummary.read(args.directory)
+    except (IOError, OSError, ValueError) as e:
+        parser.error(str(e))
+    print(summary.report(args.width, args.iterations))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
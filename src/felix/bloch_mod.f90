@@ -56,6 +56,7 @@ MODULE bloch_mod
     USE message_mod
     
     USE test_koch_mod
+    USE eigen_cache_mod
   
     ! globals - output
     USE RPara, ONLY : RIndividualReflections ! RIndividualReflections( LACBED_ID, thickness_ID, local_pixel_ID )
@@ -99,6 +100,7 @@ MODULE bloch_mod
     COMPLEX(CKIND),ALLOCATABLE :: CDiagonalSgMatrix(:,:), COffDiagonalSgMatrix(:,:)
     COMPLEX(CKIND) :: CScatteringElement
     INTEGER(IKIND) :: ScatterMatrixRow
+    LOGICAL :: LCached
      
     IErr=0
     ! we are inside the mask
@@ -114,50 +116,57 @@ MODULE bloch_mod
     RKn = DOT_PRODUCT(RTiltedK,RNormDirM)
     Rk0 = ZERO
     RkPrime=ZERO
-    !IF(my_rank.EQ.0) PRINT*,RTiltedK
-    ! Compute the deviation parameter for reflection pool
-    ! NB RDevPara is in units of (1/A)
-    ! in the microscope ref frame(NB exp(i*s.r), physics convention)
-    DO knd=1,INhkl
-      ! Version without small angle approximation
-      ! Sg=(g/k)*[2(k^2-k0.k')]^0.5
-      ! k0 is defined by the Bragg condition
-      Rk0(1) = -RgPoolMag(knd)/2
-      Rk0(3) = SQRT(RBigK**2-Rk0(1)**2)
-      ! k' is from RTiltedK
-      RkPrime(1)=DOT_PRODUCT(RTiltedK,RgPool(knd,:))/RgPoolMag(knd)!Gives NaN for 000
-      RkPrime(3) = SQRT(RBigK**2-RkPrime(1)**2)
-      RDevPara(knd)=-SIGN(ONE,(2*DOT_PRODUCT(RgPool(knd,:),RTiltedK)+RgPoolMag(knd)**2))*&
-                    RgPoolMag(knd)*SQRT(2*(RBigK**2-DOT_PRODUCT(Rk0,RkPrime)))/RBigK
-      IF (RgPoolMag(knd).EQ.ZERO) RDevPara(knd)=ZERO!Avoid NaN for 000
-      !IF(my_rank.EQ.0) PRINT*, knd,RgPool(knd,1),RgPool(knd,2)
-      !IF(my_rank.EQ.0) PRINT*, "new",RDevPara(knd),&
-      !      SIGN(ONE,(2*DOT_PRODUCT(RgPool(knd,:),RTiltedK)-RgPoolMag(knd)**2))
-      ! Old version, Sg parallel to z: Sg=-[k'z+gz-sqrt( (k'z+gz)^2-2k'.g-g^2)]
-      !RDevPara(knd)= -RTiltedK(3)-RgPool(knd,3)+&
-      !  SQRT( (RTiltedK(3)+RgPool(knd,3))**2 - &
-      !  2*DOT_PRODUCT(RgPool(knd,:),RTiltedK) - RgPoolMag(knd)**2 )
-      !IF(my_rank.EQ.0) PRINT*, "old", RDevPara(knd)
-      ! Debugging output
-      IF(knd.EQ.2.AND.IYPixelIndex.EQ.10.AND.IXPixelIndex.EQ.10) THEN
-        CALL message(LM,"RBigK ",RBigK)!LM,dbg7
-        CALL message(LM,"Rhkl(knd) ",Rhkl(knd:knd,:))
-        CALL message(LM,"RgPool(knd) ",RgPool(knd:knd,:))
-        CALL message(LM,"RTiltedK ",RTiltedK)
-        CALL message(LM,"RDevPara ",RDevPara(knd))
-      END IF
-    END DO
+    ! the same Ug matrix and geometry give the same beams and eigensystem,
+    ! kept from an earlier simulation by eigen_cache_mod
+    nBeams = 0
+    IF (IBlochMethodFLAG.NE.1) nBeams = EigenCacheLookup(IYPixelIndex,IXPixelIndex)
+    LCached = nBeams.GT.0
+    IF (.NOT.LCached) THEN
+      !IF(my_rank.EQ.0) PRINT*,RTiltedK
+      ! Compute the deviation parameter for reflection pool
+      ! NB RDevPara is in units of (1/A)
+      ! in the microscope ref frame(NB exp(i*s.r), physics convention)
+      DO knd=1,INhkl
+        ! Version without small angle approximation
+        ! Sg=(g/k)*[2(k^2-k0.k')]^0.5
+        ! k0 is defined by the Bragg condition
+        Rk0(1) = -RgPoolMag(knd)/2
+        Rk0(3) = SQRT(RBigK**2-Rk0(1)**2)
+        ! k' is from RTiltedK
+        RkPrime(1)=DOT_PRODUCT(RTiltedK,RgPool(knd,:))/RgPoolMag(knd)!Gives NaN for 000
+        RkPrime(3) = SQRT(RBigK**2-RkPrime(1)**2)
+        RDevPara(knd)=-SIGN(ONE,(2*DOT_PRODUCT(RgPool(knd,:),RTiltedK)+RgPoolMag(knd)**2))*&
+                      RgPoolMag(knd)*SQRT(2*(RBigK**2-DOT_PRODUCT(Rk0,RkPrime)))/RBigK
+        IF (RgPoolMag(knd).EQ.ZERO) RDevPara(knd)=ZERO!Avoid NaN for 000
+        !IF(my_rank.EQ.0) PRINT*, knd,RgPool(knd,1),RgPool(knd,2)
+        !IF(my_rank.EQ.0) PRINT*, "new",RDevPara(knd),&
+        !      SIGN(ONE,(2*DOT_PRODUCT(RgPool(knd,:),RTiltedK)-RgPoolMag(knd)**2))
+        ! Old version, Sg parallel to z: Sg=-[k'z+gz-sqrt( (k'z+gz)^2-2k'.g-g^2)]
+        !RDevPara(knd)= -RTiltedK(3)-RgPool(knd,3)+&
+        !  SQRT( (RTiltedK(3)+RgPool(knd,3))**2 - &
+        !  2*DOT_PRODUCT(RgPool(knd,:),RTiltedK) - RgPoolMag(knd)**2 )
+        !IF(my_rank.EQ.0) PRINT*, "old", RDevPara(knd)
+        ! Debugging output
+        IF(knd.EQ.2.AND.IYPixelIndex.EQ.10.AND.IXPixelIndex.EQ.10) THEN
+          CALL message(LM,"RBigK ",RBigK)!LM,dbg7
+          CALL message(LM,"Rhkl(knd) ",Rhkl(knd:knd,:))
+          CALL message(LM,"RgPool(knd) ",RgPool(knd:knd,:))
+          CALL message(LM,"RTiltedK ",RTiltedK)
+          CALL message(LM,"RDevPara ",RDevPara(knd))
+        END IF
+      END DO
 
-    ! select only those beams where the Ewald sphere is close to the
-    ! reciprocal lattice, i.e. within RBSMaxDeviationPara
-    CALL StrongAndWeakBeamsDetermination(INhkl,IMinWeakBeams,&
-                    IMinStrongBeams,RDevPara,CUgMat,&
-                    IStrongBeamList,IWeakBeamList,nBeams,nWeakBeams,IErr)
-    IF(l_alert(IErr,"BlochCoefficientCalculation",&
-          "StrongAndWeakBeamsDetermination()")) RETURN
-    CALL message(LXL,dbg7,"strong beams",nBeams)
-    CALL message(LXL,dbg7,"weak beams",nWeakBeams)
-    CALL message(LXL,dbg7,"INhkl",INhkl)
+      ! select only those beams where the Ewald sphere is close to the
+      ! reciprocal lattice, i.e. within RBSMaxDeviationPara
+      CALL StrongAndWeakBeamsDetermination(INhkl,IMinWeakBeams,&
+                      IMinStrongBeams,RDevPara,CUgMat,&
+                      IStrongBeamList,IWeakBeamList,nBeams,nWeakBeams,IErr)
+      IF(l_alert(IErr,"BlochCoefficientCalculation",&
+            "StrongAndWeakBeamsDetermination()")) RETURN
+      CALL message(LXL,dbg7,"strong beams",nBeams)
+      CALL message(LXL,dbg7,"weak beams",nWeakBeams)
+      CALL message(LXL,dbg7,"INhkl",INhkl)
+    END IF
 
     !--------------------------------------------------------------------
     ! ALLOCATE memory for eigen problem
@@ -185,102 +194,114 @@ MODULE bloch_mod
       IF(l_alert(IErr,"BlochCoefficientCalculation","allocate COffDiagonalSgMatrix")) RETURN
     END IF
 
-    ! compute the effective Ug matrix by selecting only those beams
-    ! for which IStrongBeamList has an entry
-    CBeamProjectionMatrix= CZERO
-    DO knd=1,nBeams
-      CBeamProjectionMatrix(knd,IStrongBeamList(knd))=CONE
-    ENDDO
+    IF (.NOT.LCached) THEN
+      ! compute the effective Ug matrix by selecting only those beams
+      ! for which IStrongBeamList has an entry
+      CBeamProjectionMatrix= CZERO
+      DO knd=1,nBeams
+        CBeamProjectionMatrix(knd,IStrongBeamList(knd))=CONE
+      ENDDO
 
 
-    CUgSgMatrix = CZERO
-    CBeamTranspose=TRANSPOSE(CBeamProjectionMatrix)
-    ! reduce the matrix to just include strong beams using some nifty matrix multiplication
-    ! CUgMatPartial = CUgMat * CBeamTranspose
-    CALL ZGEMM('N','N',INhkl,nBeams,INhkl,CONE,CUgMat, &
-              INhkl,CBeamTranspose,INhkl,CZERO,CUgMatPartial,INhkl)
-    ! CUgSgMatrix = CBeamProjectionMatrix * CUgMatPartial
-    CALL ZGEMM('N','N',nBeams,nBeams,INhkl,CONE,CBeamProjectionMatrix, &
-              nBeams,CUgMatPartial,INhkl,CZERO,CUgSgMatrix,nBeams)
+      CUgSgMatrix = CZERO
+      CBeamTranspose=TRANSPOSE(CBeamProjectionMatrix)
+      ! reduce the matrix to just include strong beams using some nifty matrix multiplication
+      ! CUgMatPartial = CUgMat * CBeamTranspose
+      CALL ZGEMM('N','N',INhkl,nBeams,INhkl,CONE,CUgMat, &
+                INhkl,CBeamTranspose,INhkl,CZERO,CUgMatPartial,INhkl)
+      ! CUgSgMatrix = CBeamProjectionMatrix * CUgMatPartial
+      CALL ZGEMM('N','N',nBeams,nBeams,INhkl,CONE,CBeamProjectionMatrix, &
+                nBeams,CUgMatPartial,INhkl,CZERO,CUgSgMatrix,nBeams)
 
-    !--------------------------------------------------------------------
-    ! higher order Laue zones and weak beams
-    !--------------------------------------------------------------------
+      !--------------------------------------------------------------------
+      ! higher order Laue zones and weak beams
+      !--------------------------------------------------------------------
 
-    IF (IHolzFLAG.EQ.1) THEN!We are considering higher order Laue Zones !?? suspect this is non-functional
-      DO ind=1,nBeams
-        CUgSgMatrix(ind,ind) = CUgSgMatrix(ind,ind) + TWO*RBigK*RDevPara(IStrongBeamList(ind))
-      ENDDO
-      DO knd =1,nBeams ! Columns
-        DO ind = 1,nBeams ! Rows
-          CUgSgMatrix(knd,ind) = CUgSgMatrix(knd,ind) / &
-                (SQRT(1+RgDotNorm(IStrongBeamList(knd))/RKn)*&
-                SQRT(1+RgDotNorm(IStrongBeamList(ind))/RKn))
+      IF (IHolzFLAG.EQ.1) THEN!We are considering higher order Laue Zones !?? suspect this is non-functional
+        DO ind=1,nBeams
+          CUgSgMatrix(ind,ind) = CUgSgMatrix(ind,ind) + TWO*RBigK*RDevPara(IStrongBeamList(ind))
+        ENDDO
+        DO knd =1,nBeams ! Columns
+          DO ind = 1,nBeams ! Rows
+            CUgSgMatrix(knd,ind) = CUgSgMatrix(knd,ind) / &
+                  (SQRT(1+RgDotNorm(IStrongBeamList(knd))/RKn)*&
+                  SQRT(1+RgDotNorm(IStrongBeamList(ind))/RKn))
+          END DO
         END DO
-      END DO
-      CUgSgMatrix = (TWOPI**2)*CUgSgMatrix/(TWO*RBigK)
-    ELSE!ZOLZ only
-      ! replace the diagonal parts with strong beam deviation parameters
-      DO ind=1,nBeams
-        CUgSgMatrix(ind,ind) = TWO*RBigK*RDevPara(IStrongBeamList(ind))/(TWOPI*TWOPI)
-      ENDDO
-      ! add the weak beams perturbatively for the 1st column (sumC) and
-      ! the diagonal elements (sumD)
-      DO knd=2,nBeams
-        sumC=CZERO
-        sumD=CZERO
-        DO ind=1,nWeakBeams
-          ! Zuo&Weickenmeier Ultramicroscopy 57 (1995) 375-383 eq.4
-          sumC=sumC + &
-          CUgMat(IStrongBeamList(knd),IWeakBeamList(ind))*&
-          CUgMat(IWeakBeamList(ind),1)/(TWO*RBigK*RDevPara(IWeakBeamList(ind)))
-          ! Zuo&Weickenmeier Ultramicroscopy 57 (1995) 375-383 eq.5
-          sumD = sumD + &
-          CUgMat(IStrongBeamList(knd),IWeakBeamList(ind))*&
-          CUgMat(IWeakBeamList(ind),IStrongBeamList(knd))/&
-          (TWO*RBigK*RDevPara(IWeakBeamList(ind)))
+        CUgSgMatrix = (TWOPI**2)*CUgSgMatrix/(TWO*RBigK)
+      ELSE!ZOLZ only
+        ! replace the diagonal parts with strong beam deviation parameters
+        DO ind=1,nBeams
+          CUgSgMatrix(ind,ind) = TWO*RBigK*RDevPara(IStrongBeamList(ind))/(TWOPI*TWOPI)
         ENDDO
-        ! Replace the Ug's
-        WHERE (CUgSgMatrix.EQ.CUgSgMatrix(knd,1))
-          CUgSgMatrix = CUgSgMatrix(knd,1) - sumC
-        END WHERE
-        ! Replace the Sg's
-        CUgSgMatrix(knd,knd)= CUgSgMatrix(knd,knd) - TWO*RBigK*sumD/(TWOPI*TWOPI)
-      ENDDO
-      !The 4pi^2 is a result of using h, not hbar, in the conversion from VG(ij) to Ug(ij).  Needs to be taken out of the weak beam calculation too 
-      !Divide by 2K so off-diagonal elementa are Ug/2K, diagonal elements are Sg, Spence's (1990) 'Structure matrix'
-      CUgSgMatrix = TWOPI*TWOPI*CUgSgMatrix/(TWO*RBigK)
-    END IF
+        ! add the weak beams perturbatively for the 1st column (sumC) and
+        ! the diagonal elements (sumD)
+        DO knd=2,nBeams
+          sumC=CZERO
+          sumD=CZERO
+          DO ind=1,nWeakBeams
+            ! Zuo&Weickenmeier Ultramicroscopy 57 (1995) 375-383 eq.4
+            sumC=sumC + &
+            CUgMat(IStrongBeamList(knd),IWeakBeamList(ind))*&
+            CUgMat(IWeakBeamList(ind),1)/(TWO*RBigK*RDevPara(IWeakBeamList(ind)))
+            ! Zuo&Weickenmeier Ultramicroscopy 57 (1995) 375-383 eq.5
+            sumD = sumD + &
+            CUgMat(IStrongBeamList(knd),IWeakBeamList(ind))*&
+            CUgMat(IWeakBeamList(ind),IStrongBeamList(knd))/&
+            (TWO*RBigK*RDevPara(IWeakBeamList(ind)))
+          ENDDO
+          ! Replace the Ug's
+          WHERE (CUgSgMatrix.EQ.CUgSgMatrix(knd,1))
+            CUgSgMatrix = CUgSgMatrix(knd,1) - sumC
+          END WHERE
+          ! Replace the Sg's
+          CUgSgMatrix(knd,knd)= CUgSgMatrix(knd,knd) - TWO*RBigK*sumD/(TWOPI*TWOPI)
+        ENDDO
+        !The 4pi^2 is a result of using h, not hbar, in the conversion from VG(ij) to Ug(ij).  Needs to be taken out of the weak beam calculation too 
+        !Divide by 2K so off-diagonal elementa are Ug/2K, diagonal elements are Sg, Spence's (1990) 'Structure matrix'
+        CUgSgMatrix = TWOPI*TWOPI*CUgSgMatrix/(TWO*RBigK)
+      END IF
     
-    !--------------------------------------------------------------------
-    ! diagonalize the UgMatEffective
-    !--------------------------------------------------------------------
+      !--------------------------------------------------------------------
+      ! diagonalize the UgMatEffective
+      !--------------------------------------------------------------------
 
-    ! If koch method - Split CUgSgMatrix into diagonal and off diagonal to speed convergence
-    IF(IBlochMethodFLAG.EQ.1) THEN
-      COffDiagonalSgMatrix = CUgSgMatrix
-      CDiagonalSgMatrix = CZERO
-      DO ind = 1,SIZE(CUgSgMatrix,2)
-        CDiagonalSgMatrix(ind,ind) = CUgSgMatrix(ind,ind)      
-        COffDiagonalSgMatrix(ind,ind) = CZERO
-      END DO
-    END IF
+      ! If koch method - Split CUgSgMatrix into diagonal and off diagonal to speed convergence
+      IF(IBlochMethodFLAG.EQ.1) THEN
+        COffDiagonalSgMatrix = CUgSgMatrix
+        CDiagonalSgMatrix = CZERO
+        DO ind = 1,SIZE(CUgSgMatrix,2)
+          CDiagonalSgMatrix(ind,ind) = CUgSgMatrix(ind,ind)      
+          COffDiagonalSgMatrix(ind,ind) = CZERO
+        END DO
+      END IF
 
-    CALL EigenSpectrum(nBeams,CUgSgMatrix,CEigenValues(:),CEigenVectors(:,:),IErr)
-    IF(l_alert(IErr,"BlochCoefficientCalculation","EigenSpectrum()")) RETURN
-    ! NB destroys CUgSgMatrix
+      CALL EigenSpectrum(nBeams,CUgSgMatrix,CEigenValues(:),CEigenVectors(:,:),IErr)
+      IF(l_alert(IErr,"BlochCoefficientCalculation","EigenSpectrum()")) RETURN
+      ! NB destroys CUgSgMatrix
 
-    IF (IHolzFLAG.EQ.1) THEN ! higher order laue zone included so adjust Eigen values/vectors
-      CEigenValues = CEigenValues * RKn/RBigK
-      DO knd = 1,nBeams
-        CEigenVectors(knd,:) = CEigenVectors(knd,:) / &
-              SQRT(1+RgDotNorm(IStrongBeamList(knd))/RKn)
-      END DO
-    END IF
+      IF (IHolzFLAG.EQ.1) THEN ! higher order laue zone included so adjust Eigen values/vectors
+        CEigenValues = CEigenValues * RKn/RBigK
+        DO knd = 1,nBeams
+          CEigenVectors(knd,:) = CEigenVectors(knd,:) / &
+                SQRT(1+RgDotNorm(IStrongBeamList(knd))/RKn)
+        END DO
+      END IF
 
-    ! Invert the EigenVector matrix
-    CDummyEigenVectors = CEigenVectors
-    CALL INVERT(nBeams,CDummyEigenVectors(:,:),CInvertedEigenVectors,IErr)
+      ! Invert the EigenVector matrix
+      CDummyEigenVectors = CEigenVectors
+      CALL INVERT(nBeams,CDummyEigenVectors(:,:),CInvertedEigenVectors,IErr)
+      IF (IBlochMethodFLAG.NE.1) THEN
+        CALL EigenCacheStore(IYPixelIndex,IXPixelIndex,nBeams,IStrongBeamList,&
+              CEigenValues,CEigenVectors,CInvertedEigenVectors(:,1),IErr)
+        IF(l_alert(IErr,"BlochCoefficientCalculation","EigenCacheStore()")) RETURN
+      END IF
+    ELSE
+      ! only the first column of the inverse is used, see CreateWaveFunctions
+      CInvertedEigenVectors = CZERO
+      CALL EigenCacheFetch(IYPixelIndex,IXPixelIndex,IStrongBeamList,CEigenValues,&
+            CEigenVectors,CInvertedEigenVectors(:,1))
+    END IF
 
     !--------------------------------------------------------------------
     ! fill RIndividualReflections( LACBED_ID , thickness_ID, local_pixel_ID ) 
@@ -413,7 +434,7 @@ MODULE bloch_mod
     INTEGER(IKIND),INTENT(OUT) :: IErr 
     REAL(RKIND) :: RWaveIntensity(nBeams)
     COMPLEX(CKIND) :: CPsi0(nBeams),CAlphaWeightingCoefficients(nBeams),&
-          CWaveFunctions(nBeams),CEigenValueDependentTerms(nBeams,nBeams)
+          CWaveFunctions(nBeams)
     INTEGER(IKIND) :: ind,jnd,knd,hnd,ifullind,iuniind,gnd,ichnk
     
     IErr=0
@@ -424,16 +445,12 @@ MODULE bloch_mod
     ! put in the thickness
     ! From EQ 6.32 in Kirkland Advance Computing in EM
     CAlphaWeightingCoefficients = MATMUL(CInvertedEigenVectors(1:nBeams,1:nBeams),CPsi0) 
-    CEigenValueDependentTerms= CZERO
-    DO hnd=1,nBeams     ! This is a diagonal matrix
-      CEigenValueDependentTerms(hnd,hnd) = &
-            EXP(CIMAGONE*CMPLX(RThickness,ZERO,CKIND)*CEigenValues(hnd)) 
-    ENDDO
     ! The diffracted intensity for each beam
     ! EQ 6.35 in Kirkland Advance Computing in EM
-    ! C-1*C*alpha 
-    CWaveFunctions(:) = MATMUL( &
-          MATMUL(CEigenVectors(1:nBeams,1:nBeams),CEigenValueDependentTerms), & 
+    ! C-1*C*alpha, the eigenvalue dependent terms being a diagonal matrix
+    ! are applied to alpha as a vector, n**2 rather than n**3 operations
+    CWaveFunctions(:) = MATMUL( CEigenVectors(1:nBeams,1:nBeams), &
+          EXP(CIMAGONE*CMPLX(RThickness,ZERO,CKIND)*CEigenValues(1:nBeams)) * &
           CAlphaWeightingCoefficients(:) )
 
     !?? possible small time saving here by only calculating the (tens of) output
@@ -0,0 +1,247 @@
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+! Felix
+!
+! Richard Beanland, Keith Evans & Rudolf A Roemer
+!
+! (C) 2013-19, all rights reserved
+!
+! Version: :VERSION:
+! Date:    :DATE:
+! Time:    :TIME:
+! Status:  :RLSTATUS:
+! Build:   :BUILD:
+! Author:  :AUTHOR:
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+!  Felix is free software: you can redistribute it and/or modify
+!  it under the terms of the GNU General Public License as published by
+!  the Free Software Foundation, either version 3 of the License, or
+!  (at your option) any later version.
+!
+!  Felix is distributed in the hope that it will be useful,
+!  but WITHOUT ANY WARRANTY; without even the implied warranty of
+!  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+!  GNU General Public License for more details.
+!
+!  You should have received a copy of the GNU General Public License
+!  along with Felix.  If not, see <http://www.gnu.org/licenses/>.
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+!>
+!! Module-description:
+!!
+!! Checkpoints of a refinement, ICheckpointFLAG in felix.inp.  With ICheckpointFLAG=1
+!! rank 0 writes felix_checkpoint.bin at every iteration: the simplex vertices and their
+!! figures of merit, or the vectors and scalars that carry a gradient refinement from
+!! one cycle to the next.  With ICheckpointFLAG=2 felixrefine also reads it back at the
+!! start and carries on from there, e.g. after a batch job is killed at its walltime.
+!!
+MODULE checkpoint_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND
+
+  IMPLICIT NONE
+  PRIVATE
+  PUBLIC :: WriteCheckpoint, ReadCheckpoint, ClearCheckpoint
+  PUBLIC :: LCheckpointLoaded, ICheckpointIter, ICheckpointThickness, &
+        RCheckpointState, RCheckpointValues
+
+  ! the state of a refinement ReadCheckpoint found, on every rank
+  LOGICAL, SAVE :: LCheckpointLoaded = .FALSE.
+  INTEGER(IKIND), SAVE :: ICheckpointIter, ICheckpointThickness
+  REAL(RKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: RCheckpointState
+  REAL(RKIND), DIMENSION(:), ALLOCATABLE, SAVE :: RCheckpointValues
+
+  INTEGER(4), PARAMETER :: ICheckpointVersion = 1
+  CHARACTER(*), PARAMETER :: SCheckpointFile = 'felix_checkpoint.bin'
+
+  CONTAINS
+
+  !>
+  !! Procedure-description: Writes the state of a refinement to felix_checkpoint.bin,
+  !! on rank 0 and only if ICheckpointFLAG is set.  The file is little-endian,
+  !!   'FXCK', version, IRefineMethodFLAG, INoOfVariables, iteration, thickness index,
+  !!   the two dimensions of RState, the size of RValues and of the mask (4-byte integers)
+  !!   IIndependentVariableType (4-byte integers)
+  !!   RState, RValues and, for ICorrelationFLAG=3, RImageMask (8-byte reals)
+  !! It is written to a temporary file and then moved into place, so a job killed part
+  !! way through leaves the previous checkpoint intact.
+  !!
+  SUBROUTINE WriteCheckpoint(Iter,IThicknessIndex,RState,RValues,IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : ICheckpointFLAG, IRefineMethodFLAG, INoOfVariables, &
+          IIndependentVariableType, ICorrelationFLAG
+    USE RPARA, ONLY : RImageMask
+    USE IChannels, ONLY : IChOutWIImage
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: Iter,IThicknessIndex
+    REAL(RKIND), DIMENSION(:,:), INTENT(IN) :: RState
+    REAL(RKIND), DIMENSION(:), INTENT(IN) :: RValues
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(4) :: IMaskSize
+
+    IErr=0
+    IF (ICheckpointFLAG.EQ.0.OR.my_rank.NE.0) RETURN
+    IMaskSize=0
+    IF (ICorrelationFLAG.EQ.3.AND.ALLOCATED(RImageMask)) IMaskSize=INT(SIZE(RImageMask),4)
+
+    CALL message ( LL, dbg6, "Writing checkpoint at iteration ",Iter )
+    OPEN(UNIT=IChOutWIImage,STATUS='REPLACE',FILE=SCheckpointFile//'.tmp',&
+          FORM='UNFORMATTED',ACCESS='STREAM',CONVERT='LITTLE_ENDIAN',IOSTAT=IErr)
+    IF(l_alert(IErr,"WriteCheckpoint","OPEN() "//SCheckpointFile//'.tmp')) RETURN
+    WRITE(IChOutWIImage,IOSTAT=IErr) 'FXCK', ICheckpointVersion, INT(IRefineMethodFLAG,4), &
+          INT(INoOfVariables,4), INT(Iter,4), INT(IThicknessIndex,4), &
+          INT(SIZE(RState,1),4), INT(SIZE(RState,2),4), INT(SIZE(RValues),4), IMaskSize, &
+          INT(IIndependentVariableType(1:INoOfVariables),4), REAL(RState,8), REAL(RValues,8)
+    IF(l_alert(IErr,"WriteCheckpoint","WRITE() "//SCheckpointFile//'.tmp')) RETURN
+    IF (IMaskSize.GT.0) THEN
+      WRITE(IChOutWIImage,IOSTAT=IErr) REAL(RImageMask,8)
+      IF(l_alert(IErr,"WriteCheckpoint","WRITE() mask")) RETURN
+    END IF
+    CLOSE(IChOutWIImage,IOSTAT=IErr)
+    IF(l_alert(IErr,"WriteCheckpoint","CLOSE() "//SCheckpointFile//'.tmp')) RETURN
+    CALL system('mv -f '//SCheckpointFile//'.tmp '//SCheckpointFile)
+
+  END SUBROUTINE WriteCheckpoint
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Reads felix_checkpoint.bin, if there is one, on rank 0 and
+  !! sends it to every rank.  A checkpoint of another refinement method or of other
+  !! refinement variables is ignored and the refinement starts afresh.  Sets
+  !! LCheckpointLoaded, ICheckpointIter, ICheckpointThickness, RCheckpointState and
+  !! RCheckpointValues, which the refinement copies into its own variables, and for
+  !! ICorrelationFLAG=3 restores RImageMask on rank 0.
+  !!
+  SUBROUTINE ReadCheckpoint(IErr)
+
+    USE message_mod
+    USE MPI
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : IRefineMethodFLAG, INoOfVariables, IIndependentVariableType, &
+          ICorrelationFLAG
+    USE IChannels, ONLY : IChOutWIImage
+
+    ! global outputs
+    USE RPARA, ONLY : RImageMask
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    CHARACTER(4) :: SMagic
+    INTEGER(4) :: IHeader(9),IMaskSize
+    INTEGER(4), DIMENSION(:), ALLOCATABLE :: ITypes
+    ! found (0 or 1), iteration, thickness index, state dimensions, number of values
+    INTEGER(IKIND) :: IFound(6)
+    LOGICAL :: LExists
+    REAL(8), DIMENSION(:), ALLOCATABLE :: RMask
+
+    IErr=0
+    IFound=0
+    IF (my_rank.EQ.0) THEN
+      INQUIRE(FILE=SCheckpointFile,EXIST=LExists)
+      IF (LExists) THEN
+        OPEN(UNIT=IChOutWIImage,STATUS='OLD',FILE=SCheckpointFile,FORM='UNFORMATTED',&
+              ACCESS='STREAM',CONVERT='LITTLE_ENDIAN',IOSTAT=IErr)
+        IF(l_alert(IErr,"ReadCheckpoint","OPEN() "//SCheckpointFile)) RETURN
+        ! IHeader: version, method, variables, iteration, thickness, state dimensions,
+        ! number of values, mask size
+        READ(IChOutWIImage,IOSTAT=IErr) SMagic,IHeader
+        IF (IErr.EQ.0.AND.(SMagic.NE.'FXCK'.OR.IHeader(1).NE.ICheckpointVersion)) IErr=1
+        IF(l_alert(IErr,"ReadCheckpoint","not a felix checkpoint: "//SCheckpointFile)) RETURN
+        ALLOCATE(ITypes(MAX(IHeader(3),1)),STAT=IErr)
+        IF(l_alert(IErr,"ReadCheckpoint","allocate ITypes")) RETURN
+        READ(IChOutWIImage,IOSTAT=IErr) ITypes(1:IHeader(3))
+        IF(l_alert(IErr,"ReadCheckpoint","READ() "//SCheckpointFile)) RETURN
+        IMaskSize=0
+        IF (ICorrelationFLAG.EQ.3.AND.ALLOCATED(RImageMask)) IMaskSize=INT(SIZE(RImageMask),4)
+        IF (IHeader(2).NE.IRefineMethodFLAG.OR.IHeader(3).NE.INoOfVariables) THEN
+          CALL message(LS,"Checkpoint is of another refinement, ignoring "//SCheckpointFile)
+        ELSE IF (ANY(ITypes(1:IHeader(3)).NE.IIndependentVariableType(1:INoOfVariables)) &
+              .OR.IHeader(9).NE.IMaskSize) THEN
+          CALL message(LS,"Checkpoint refines other variables, ignoring "//SCheckpointFile)
+        ELSE
+          IFound=(/ 1_IKIND, INT(IHeader(4:8),IKIND) /)
+        END IF
+        IF (IFound(1).EQ.0) CLOSE(IChOutWIImage,IOSTAT=IErr)
+        DEALLOCATE(ITypes)
+      END IF
+    END IF
+    !===================================== ! whether to resume, and from where
+    CALL MPI_BCAST(IFound,6,MPI_INTEGER,0,MPI_COMM_WORLD,IErr)
+    !=====================================
+    IF (IFound(1).EQ.0) RETURN
+    ICheckpointIter=IFound(2)
+    ICheckpointThickness=IFound(3)
+    ALLOCATE(RCheckpointState(IFound(4),IFound(5)),RCheckpointValues(IFound(6)),STAT=IErr)
+    IF(l_alert(IErr,"ReadCheckpoint","allocate RCheckpointState")) RETURN
+    IF (my_rank.EQ.0) THEN
+      READ(IChOutWIImage,IOSTAT=IErr) RCheckpointState,RCheckpointValues
+      IF(l_alert(IErr,"ReadCheckpoint","READ() state from "//SCheckpointFile)) RETURN
+      IF (IMaskSize.GT.0) THEN
+        ALLOCATE(RMask(IMaskSize),STAT=IErr)
+        IF(l_alert(IErr,"ReadCheckpoint","allocate RMask")) RETURN
+        READ(IChOutWIImage,IOSTAT=IErr) RMask
+        IF(l_alert(IErr,"ReadCheckpoint","READ() mask from "//SCheckpointFile)) RETURN
+        RImageMask=RESHAPE(RMask,SHAPE(RImageMask))
+        DEALLOCATE(RMask)
+      END IF
+      CLOSE(IChOutWIImage,IOSTAT=IErr)
+      IF(l_alert(IErr,"ReadCheckpoint","CLOSE() "//SCheckpointFile)) RETURN
+    END IF
+    !=====================================
+    CALL MPI_BCAST(RCheckpointState,SIZE(RCheckpointState),MPI_DOUBLE_PRECISION,0,&
+          MPI_COMM_WORLD,IErr)
+    CALL MPI_BCAST(RCheckpointValues,SIZE(RCheckpointValues),MPI_DOUBLE_PRECISION,0,&
+          MPI_COMM_WORLD,IErr)
+    !=====================================
+    LCheckpointLoaded=.TRUE.
+    CALL message(LS,"Resuming refinement from "//SCheckpointFile//", iteration ",&
+          ICheckpointIter)
+
+  END SUBROUTINE ReadCheckpoint
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Deletes felix_checkpoint.bin once a refinement has finished,
+  !! so the next run with ICheckpointFLAG=2 starts afresh
+  !!
+  SUBROUTINE ClearCheckpoint(IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : ICheckpointFLAG
+    USE IChannels, ONLY : IChOutWIImage
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    LOGICAL :: LExists
+
+    IErr=0
+    IF (ICheckpointFLAG.EQ.0.OR.my_rank.NE.0) RETURN
+    INQUIRE(FILE=SCheckpointFile,EXIST=LExists)
+    IF (.NOT.LExists) RETURN
+    OPEN(UNIT=IChOutWIImage,STATUS='OLD',FILE=SCheckpointFile,IOSTAT=IErr)
+    IF(l_alert(IErr,"ClearCheckpoint","OPEN() "//SCheckpointFile)) RETURN
+    CLOSE(IChOutWIImage,STATUS='DELETE',IOSTAT=IErr)
+    IF(l_alert(IErr,"ClearCheckpoint","CLOSE() "//SCheckpointFile)) RETURN
+
+  END SUBROUTINE ClearCheckpoint
+
+END MODULE checkpoint_mod
@@ -262,7 +262,7 @@ MODULE crystallography_mod
 
     ! global outputs
     USE RPARA, ONLY : RAtomCoordinate,ROccupancy,RIsoDW,RAtomPosition
-    USE IPARA, ONLY : IAtomicNumber,IAnisoDW
+    USE IPARA, ONLY : IAtomicNumber,IAnisoDW,IAtomSite
     USE SPARA, ONLY : SAtomLabel, SAtomName
 
     ! global inputs
@@ -276,7 +276,7 @@ MODULE crystallography_mod
     IMPLICIT NONE
     
     INTEGER(IKIND) :: IErr,ind,jnd,knd
-    INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IAllAtomicNumber, RAllAnisoDW
+    INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IAllAtomicNumber, RAllAnisoDW, IAllSite
     REAL(RKIND),ALLOCATABLE :: RAllAtomPosition(:,:), RAllOccupancy(:), RAllIsoDW(:)
     LOGICAL :: Lunique
     CHARACTER(2), DIMENSION(:), ALLOCATABLE :: SAllAtomName
@@ -285,7 +285,7 @@ MODULE crystallography_mod
     ind=SIZE(RSymVec,1)*SIZE(RBasisAtomPosition,1)
     ! All atom positions generated by symmetry, including duplicates: local variables
     ALLOCATE( RAllAtomPosition(ind,ITHREE),SAllAtomName(ind),SAllAtomLabel(ind),&
-        RAllOccupancy(ind),RAllIsoDW(ind),IAllAtomicNumber(ind),RAllAnisoDW(ind),STAT=IErr )
+        RAllOccupancy(ind),RAllIsoDW(ind),IAllAtomicNumber(ind),RAllAnisoDW(ind),IAllSite(ind),STAT=IErr )
     IF(l_alert(IErr,"UniqueAtomPositions","allocations")) RETURN
    
     !--------------------------------------------------------------------  
@@ -302,6 +302,7 @@ MODULE crystallography_mod
         RAllIsoDW(knd) = RBasisIsoDW(jnd)
         IAllAtomicNumber(knd) = IBasisAtomicNumber(jnd)
         RAllAnisoDW(knd) = IBasisAnisoDW(jnd)
+        IAllSite(knd) = jnd
         knd=knd+1
       END DO
 !WRITE(SPrintString,'(F3.0,1X,F3.0,1X,F3.0,2X,F3.0,1X,F3.0,1X,F3.0,2X,F3.0,1X,F3.0,1X,F3.0)') RSymMat(ind,1,:),RSymMat(ind,2,:),RSymMat(ind,3,:)
@@ -322,6 +323,7 @@ MODULE crystallography_mod
     ROccupancy(1) = RAllOccupancy(1)
     IAtomicNumber(1) = IAllAtomicNumber(1)
     IAnisoDW(1) = RAllAnisoDW(1)
+    IAtomSite(1) = IAllSite(1)
     jnd=2
     ! work through all possible atom coords and check for duplicates
     DO ind=2,IMaxPossibleNAtomsUnitCell
@@ -342,6 +344,7 @@ MODULE crystallography_mod
         ROccupancy(jnd) = RAllOccupancy(ind)
         IAtomicNumber(jnd) = IAllAtomicNumber(ind)!
         IAnisoDW(jnd) = RAllAnisoDW(ind)
+        IAtomSite(jnd) = IAllSite(ind)
         jnd=jnd+1
       END IF
     END DO
@@ -358,7 +361,7 @@ MODULE crystallography_mod
     ! Finished with these variables now
     DEALLOCATE( &
          RAllAtomPosition, SAllAtomName, RAllOccupancy, RAllIsoDW, &
-         IAllAtomicNumber, RAllAnisoDW, STAT=IErr)
+         IAllAtomicNumber, RAllAnisoDW, IAllSite, STAT=IErr)
     IF(l_alert(IErr,"UniqueAtomPositions","deallocations")) RETURN
       
     !--------------------------------------------------------------------
@@ -0,0 +1,303 @@
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+! Felix
+!
+! Richard Beanland, Keith Evans & Rudolf A Roemer
+!
+! (C) 2013-19, all rights reserved
+!
+! Version: :VERSION:
+! Date:    :DATE:
+! Time:    :TIME:
+! Status:  :RLSTATUS:
+! Build:   :BUILD:
+! Author:  :AUTHOR:
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+!  Felix is free software: you can redistribute it and/or modify
+!  it under the terms of the GNU General Public License as published by
+!  the Free Software Foundation, either version 3 of the License, or
+!  (at your option) any later version.
+!
+!  Felix is distributed in the hope that it will be useful,
+!  but WITHOUT ANY WARRANTY; without even the implied warranty of
+!  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+!  GNU General Public License for more details.
+!
+!  You should have received a copy of the GNU General Public License
+!  along with Felix.  If not, see <http://www.gnu.org/licenses/>.
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+!>
+!! Module-description:
+!!
+!! Keeps the Bloch wave eigensystem of each pixel between simulations, IEigenCacheMB
+!! in felix.inp (MB per core, 0 for none).  The strong and weak beams of a pixel and
+!! its eigenproblem depend only on CUgMat and the geometry of the tilt (RBigK, RDeltaK,
+!! RNormDirM, RgPool and the beam limits), so while none of those change a pixel only
+!! needs its thickness-dependent amplitudes recalculated.  EigenCacheValidate compares
+!! them with those of the last simulation and empties the cache when any differ.
+!! When the cache is full a new eigensystem replaces the smallest one held if it is
+!! larger, since diagonalisation goes as the cube of the number of beams and memory
+!! only as the square.
+!!
+MODULE eigen_cache_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND, CKIND
+
+  IMPLICIT NONE
+  PRIVATE
+  PUBLIC :: EigenCacheValidate, EigenCacheLookup, EigenCacheFetch, EigenCacheStore, &
+        EigenCacheReport
+
+  TYPE EigenSystem
+    INTEGER(IKIND) :: nBeams = 0
+    INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IStrongBeamList
+    COMPLEX(CKIND), DIMENSION(:), ALLOCATABLE :: CEigenValues, CAlpha
+    COMPLEX(CKIND), DIMENSION(:,:), ALLOCATABLE :: CEigenVectors
+  END TYPE EigenSystem
+
+  LOGICAL, SAVE :: LCacheOn = .FALSE.
+  ! one per pixel of the (2*IPixelCount)**2 image, see PixelKey
+  TYPE(EigenSystem), DIMENSION(:), ALLOCATABLE, SAVE :: EigenCache
+  ! what the cached eigensystems were calculated from
+  COMPLEX(CKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: CUgMatCached
+  REAL(RKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: RgPoolCached
+  REAL(RKIND), SAVE :: RGeometryCached(5)
+  INTEGER(IKIND), SAVE :: IBeamLimitsCached(3)
+  INTEGER(8), SAVE :: IBytesCached = 0, IBytesBudget = 0
+  ! pixels found, calculated and not kept for lack of room this simulation
+  INTEGER(IKIND), SAVE :: IHits = 0, IMisses = 0, INotKept = 0
+
+  CONTAINS
+
+  !>
+  !! Procedure-description: Called by every core before a simulation.  Empties the
+  !! cache if CUgMat or the geometry differ from when it was filled.
+  !!
+  SUBROUTINE EigenCacheValidate(IErr)
+
+    USE message_mod
+
+    ! global inputs
+    USE IPARA, ONLY : IEigenCacheMB, IPixelCount, INhkl, IMinStrongBeams, &
+          IMinWeakBeams, IHolzFLAG
+    USE RPARA, ONLY : RDeltaK, RNormDirM, RgPool
+    USE CPARA, ONLY : CUgMat
+    USE BlochPara, ONLY : RBigK
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    REAL(RKIND) :: RGeometry(5)
+    INTEGER(IKIND) :: IBeamLimits(3)
+
+    IErr=0
+    IHits = 0
+    IMisses = 0
+    INotKept = 0
+    IF (IEigenCacheMB.LE.0) RETURN
+    IF (.NOT.LCacheOn) THEN
+      ALLOCATE(EigenCache((2*IPixelCount)**2),CUgMatCached(INhkl,INhkl),&
+            RgPoolCached(INhkl,3),STAT=IErr)
+      IF(l_alert(IErr,"EigenCacheValidate","allocate EigenCache")) RETURN
+      IBytesBudget = INT(IEigenCacheMB,8)*1024_8*1024_8
+      LCacheOn = .TRUE.
+    ELSE
+      RGeometry = (/ RBigK, RDeltaK, RNormDirM /)
+      IBeamLimits = (/ IMinStrongBeams, IMinWeakBeams, IHolzFLAG /)
+      IF (ALL(CUgMat.EQ.CUgMatCached).AND.ALL(RgPool.EQ.RgPoolCached).AND.&
+            ALL(RGeometry.EQ.RGeometryCached).AND.ALL(IBeamLimits.EQ.IBeamLimitsCached)) &
+            RETURN
+      CALL message(LL,"Ug matrix or geometry changed, emptying the eigensystem cache")
+      CALL EigenCacheClear
+    END IF
+    CUgMatCached = CUgMat
+    RgPoolCached = RgPool
+    RGeometryCached = (/ RBigK, RDeltaK, RNormDirM /)
+    IBeamLimitsCached = (/ IMinStrongBeams, IMinWeakBeams, IHolzFLAG /)
+
+  END SUBROUTINE EigenCacheValidate
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Number of strong beams of the pixel's cached eigensystem,
+  !! or 0 if it has none
+  !!
+  INTEGER(IKIND) FUNCTION EigenCacheLookup(IYPixelIndex,IXPixelIndex)
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IYPixelIndex,IXPixelIndex
+
+    EigenCacheLookup = 0
+    IF (.NOT.LCacheOn) RETURN
+    EigenCacheLookup = EigenCache(PixelKey(IYPixelIndex,IXPixelIndex))%nBeams
+    IF (EigenCacheLookup.GT.0) IHits = IHits+1
+
+  END FUNCTION EigenCacheLookup
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Copies out the cached eigensystem of a pixel; CAlpha is the
+  !! first column of the inverted eigenvector matrix, all that the top surface boundary
+  !! condition needs
+  !!
+  SUBROUTINE EigenCacheFetch(IYPixelIndex,IXPixelIndex,IStrongBeamList,CEigenValues,&
+        CEigenVectors,CAlpha)
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IYPixelIndex,IXPixelIndex
+    INTEGER(IKIND), DIMENSION(:), INTENT(OUT) :: IStrongBeamList
+    COMPLEX(CKIND), DIMENSION(:), INTENT(OUT) :: CEigenValues,CAlpha
+    COMPLEX(CKIND), DIMENSION(:,:), INTENT(OUT) :: CEigenVectors
+    INTEGER(IKIND) :: IKey,n
+
+    IKey = PixelKey(IYPixelIndex,IXPixelIndex)
+    n = EigenCache(IKey)%nBeams
+    IStrongBeamList = 0
+    IStrongBeamList(1:n) = EigenCache(IKey)%IStrongBeamList
+    CEigenValues = EigenCache(IKey)%CEigenValues
+    CEigenVectors = EigenCache(IKey)%CEigenVectors
+    CAlpha = EigenCache(IKey)%CAlpha
+
+  END SUBROUTINE EigenCacheFetch
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Keeps the eigensystem of a pixel, if there is room or it is
+  !! larger than the smallest one held
+  !!
+  SUBROUTINE EigenCacheStore(IYPixelIndex,IXPixelIndex,nBeams,IStrongBeamList,&
+        CEigenValues,CEigenVectors,CAlpha,IErr)
+
+    USE message_mod
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IYPixelIndex,IXPixelIndex,nBeams
+    INTEGER(IKIND), DIMENSION(:), INTENT(IN) :: IStrongBeamList
+    COMPLEX(CKIND), DIMENSION(:), INTENT(IN) :: CEigenValues,CAlpha
+    COMPLEX(CKIND), DIMENSION(:,:), INTENT(IN) :: CEigenVectors
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: IKey,ISmallest
+    INTEGER(8) :: IBytes
+
+    IErr=0
+    IF (.NOT.LCacheOn) RETURN
+    IMisses = IMisses+1
+    IKey = PixelKey(IYPixelIndex,IXPixelIndex)
+    IBytes = SystemBytes(nBeams)
+    DO WHILE (IBytesCached+IBytes.GT.IBytesBudget)
+      ISmallest = MINLOC(EigenCache%nBeams,1,MASK=EigenCache%nBeams.GT.0)
+      IF (ISmallest.EQ.0) THEN
+        INotKept = INotKept+1 ! larger than the whole budget
+        RETURN
+      END IF
+      IF (EigenCache(ISmallest)%nBeams.GE.nBeams) THEN
+        INotKept = INotKept+1
+        RETURN
+      END IF
+      CALL EigenCacheEvict(ISmallest)
+    END DO
+
+    ALLOCATE(EigenCache(IKey)%IStrongBeamList(nBeams),EigenCache(IKey)%CEigenValues(nBeams),&
+          EigenCache(IKey)%CAlpha(nBeams),EigenCache(IKey)%CEigenVectors(nBeams,nBeams),&
+          STAT=IErr)
+    IF(l_alert(IErr,"EigenCacheStore","allocate")) RETURN
+    EigenCache(IKey)%nBeams = nBeams
+    EigenCache(IKey)%IStrongBeamList = IStrongBeamList(1:nBeams)
+    EigenCache(IKey)%CEigenValues = CEigenValues(1:nBeams)
+    EigenCache(IKey)%CAlpha = CAlpha(1:nBeams)
+    EigenCache(IKey)%CEigenVectors = CEigenVectors(1:nBeams,1:nBeams)
+    IBytesCached = IBytesCached+IBytes
+
+  END SUBROUTINE EigenCacheStore
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: How many pixels of the last simulation reused their
+  !! eigensystem, on this core
+  !!
+  SUBROUTINE EigenCacheReport
+
+    USE message_mod
+    USE MyMPI
+
+    USE SPARA, ONLY : SPrintString
+
+    IMPLICIT NONE
+
+    IF (.NOT.LCacheOn) RETURN
+    WRITE(SPrintString,FMT='(A,I6,A,I6,A,I6,A,F9.1,A)') "Eigensystem cache: ",IHits,&
+          " pixels reused, ",IMisses," calculated, ",INotKept," not kept, ",&
+          REAL(IBytesCached,RKIND)/1024.0_RKIND**2," MB held"
+    CALL message(LM,SPrintString)
+
+  END SUBROUTINE EigenCacheReport
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  INTEGER(IKIND) FUNCTION PixelKey(IYPixelIndex,IXPixelIndex)
+
+    USE IPARA, ONLY : IPixelCount
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IYPixelIndex,IXPixelIndex
+
+    PixelKey = (IXPixelIndex-1)*2*IPixelCount+IYPixelIndex
+
+  END FUNCTION PixelKey
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  INTEGER(8) FUNCTION SystemBytes(nBeams)
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: nBeams
+
+    ! eigenvectors, eigenvalues and alpha (complex), strong beam list
+    SystemBytes = INT(nBeams,8)*(INT(nBeams,8)+2_8)*INT(2*CKIND,8)+INT(nBeams,8)*INT(IKIND,8)
+
+  END FUNCTION SystemBytes
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  SUBROUTINE EigenCacheEvict(IKey)
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IKey
+
+    IF (EigenCache(IKey)%nBeams.EQ.0) RETURN
+    IBytesCached = IBytesCached-SystemBytes(EigenCache(IKey)%nBeams)
+    DEALLOCATE(EigenCache(IKey)%IStrongBeamList,EigenCache(IKey)%CEigenValues,&
+          EigenCache(IKey)%CAlpha,EigenCache(IKey)%CEigenVectors)
+    EigenCache(IKey)%nBeams = 0
+
+  END SUBROUTINE EigenCacheEvict
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  SUBROUTINE EigenCacheClear
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND) :: ind
+
+    DO ind = 1,SIZE(EigenCache)
+      CALL EigenCacheEvict(ind)
+    END DO
+
+  END SUBROUTINE EigenCacheClear
+
+END MODULE eigen_cache_mod
@@ -50,6 +50,10 @@ PROGRAM Felixrefine
   USE refinementcontrol_mod       ! CONTAINS Simulate and SimulateAndFit
   USE write_output_mod
   USE simplex_mod
+  USE checkpoint_mod
+  USE pixel_schedule_mod
+  USE timing_mod
+  USE vertex_group_mod
 
   USE IConst; USE RConst; USE SConst
   USE IPara;  USE RPara;  USE CPara; USE SPara;
@@ -76,7 +80,7 @@ PROGRAM Felixrefine
   INTEGER(IKIND),DIMENSION(10) :: INoOfVariablesForRefinementType
 
   ! allocatable arrays
-  INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IOriginGVecIdentifier
+  INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IOriginGVecIdentifier,IVertexThickness
   REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RSimplexFoM,RIndependentVariable,&
         RCurrentVar,RVar0,RLastVar,RPvec,RFitVec,RLastVec
   REAL(RKIND),DIMENSION(:,:),ALLOCATABLE :: RSimplexVariable,RgDummyVecMat,&
@@ -103,6 +107,10 @@ PROGRAM Felixrefine
   IF(l_alert(INT(REAL(IErr4)),"felixrefine","MPI_Comm_rank")) CALL abort
   CALL MPI_Comm_size(MPI_COMM_WORLD,p,IErr4) ! get size of the current communicator
   IF(l_alert(INT(REAL(IErr4)),"felixrefine","MPI_Comm_size")) CALL abort
+  ! all cores simulate together unless SetVertexGroups splits them
+  group_comm = MPI_COMM_WORLD
+  group_rank = my_rank
+  group_p = p
 
   ! startup terminal output
   CALL message(LS,"-----------------------------------------------------------------")
@@ -124,6 +132,12 @@ PROGRAM Felixrefine
   IF(l_alert(IErr,"felixrefine","ReadInpFile")) CALL abort
   CALL SetMessageMode( IWriteFLAG, IErr )
   IF(l_alert(IErr,"felixrefine","set_message_mod_mode")) CALL abort
+  ! phase timings of every rank, if ITimingFLAG is set
+  CALL TimingInit(IErr)
+  IF(l_alert(IErr,"felixrefine","TimingInit")) CALL abort
+  ! groups of cores that simulate simplex points side by side, if IVertexGroups is set
+  CALL SetVertexGroups(IErr)
+  IF(l_alert(IErr,"felixrefine","SetVertexGroups")) CALL abort
   CALL message(LL,'IBlochMethodFLAG =',IBlochMethodFLAG)
 
   CALL read_cif(IErr) ! felix.cif ! some allocations are here
@@ -199,6 +213,8 @@ PROGRAM Felixrefine
   IF(l_alert(IErr,"felixrefine","allocate ROccupancy")) CALL abort
   ALLOCATE(IAtomicNumber(IMaxPossibleNAtomsUnitCell),STAT=IErr)
   IF(l_alert(IErr,"felixrefine","allocate IAtomicNumber")) CALL abort
+  ALLOCATE(IAtomSite(IMaxPossibleNAtomsUnitCell),STAT=IErr) ! basis atom of each atom
+  IF(l_alert(IErr,"felixrefine","allocate IAtomSite")) CALL abort
   ! Anisotropic Debye-Waller factor
   ALLOCATE(IAnisoDW(IMaxPossibleNAtomsUnitCell),STAT=IErr)
   IF(l_alert(IErr,"felixrefine","allocate IAnisoDW")) CALL abort
@@ -412,7 +428,9 @@ PROGRAM Felixrefine
   !--------------------------------------------------------------------
   ! structure factor initialization
   ! Calculate Ug matrix for each entry in CUgMatNoAbs(1:INhkl,1:INhkl)
+  CALL TimerStart(ITimeUgSetup)
   CALL StructureFactorInitialisation(IErr)
+  CALL TimerStop(ITimeUgSetup)
   IF(l_alert(IErr,"felixrefine","StructureFactorInitialisation")) CALL abort
   ! NB IEquivalentUgKey and CUniqueUg allocated in here
   ! CUniqueUg vector produced here to later fill RIndependentVariable
@@ -422,7 +440,9 @@ PROGRAM Felixrefine
   !--------------------------------------------------------------------
   CALL SYSTEM_CLOCK( IStartTime2 )
   CALL message(LS,dbg3,"Starting absorption calculation... ")
+  CALL TimerStart(ITimeAbsorption)
   CALL Absorption (IErr)
+  CALL TimerStop(ITimeAbsorption)
 !  CALL message( LM, "Initial Ug matrix, with absorption (nm^-2)" )
 !  DO ind = 1,6
 !      WRITE(SPrintString,FMT='(3(I2,1X),A2,1X,6(F7.4,1X,F7.4,2X))') NINT(Rhkl(ind,:)),": ",100*CUgMat(ind,1:6)
@@ -599,6 +619,11 @@ PROGRAM Felixrefine
   ALLOCATE(RImageSimi(2*IPixelCount,2*IPixelCount,INoOfLacbedPatterns,IThicknessCount),&
         STAT=IErr)
   IF(l_alert(IErr,"felixrefine","allocate RImageSimi")) CALL abort
+  IF (my_rank.EQ.0.AND.IUnblurredFLAG.EQ.1) THEN ! unblurred copy for blur re-fitting
+    ALLOCATE(RImageSimiUnblurred(2*IPixelCount,2*IPixelCount,INoOfLacbedPatterns,&
+          IThicknessCount),STAT=IErr)
+    IF(l_alert(IErr,"felixrefine","allocate RImageSimiUnblurred")) CALL abort
+  END IF
 
   IF (ICorrelationFLAG.EQ.3) THEN ! allocate images for masked correlation
     ! Baseline Images to calculate mask
@@ -616,27 +641,29 @@ PROGRAM Felixrefine
   END IF
 
   RSimulatedPatterns = ZERO
-  ! The pixels to be calculated by this core  
-  ILocalPixelCountMin= (IPixelTotal*(my_rank)/p)+1
-  ILocalPixelCountMax= (IPixelTotal*(my_rank+1)/p) 
-  ALLOCATE(RIndividualReflections(INoOfLacbedPatterns,IThicknessCount,&
-         (ILocalPixelCountMax-ILocalPixelCountMin)+1),STAT=IErr)
-  IF(l_alert(IErr,"felixrefine","allocate RIndividualReflections")) CALL abort
-
   ! position of pixels calculated by this core, IDisplacements & ICount are global variables
-  ALLOCATE(IDisplacements(p),ICount(p),STAT=IErr)
+  ALLOCATE(IDisplacements(group_p),ICount(group_p),STAT=IErr)
   IF(l_alert(IErr,"felixrefine","allocate IDisplacements")) CALL abort
-  DO ind = 1,p
-    IDisplacements(ind) = (IPixelTotal*(ind-1)/p)*INoOfLacbedPatterns*IThicknessCount
-    ICount(ind) = (((IPixelTotal*(ind)/p) - (IPixelTotal*(ind-1)/p)))* &
-          INoOfLacbedPatterns*IThicknessCount    
-  END DO
+  ! The pixels to be calculated by each core, as IPixelScheduleFLAG says,
+  ! which also allocates RIndividualReflections
+  CALL SetPixelSchedule(IErr)
+  IF(l_alert(IErr,"felixrefine","SetPixelSchedule")) CALL abort
+
+  !--------------------------------------------------------------------
+  ! resume an interrupted refinement, see checkpoint_mod
+  !--------------------------------------------------------------------
+  IF (ISimFLAG.EQ.0.AND.ICheckpointFLAG.EQ.2) THEN
+    CALL ReadCheckpoint(IErr)
+    IF(l_alert(IErr,"felixrefine","ReadCheckpoint")) CALL abort
+  END IF
 
   !--------------------------------------------------------------------
   ! baseline simulation
   !--------------------------------------------------------------------
   RFigureofMerit=666.666 ! Initial large value, diabolically
   Iter = 0
+  ! the first simulation also sets up the Ug calculation, so it is needed
+  ! even when resuming; its fit and output are those of the checkpoint
   ! baseline simulation with timer
   CALL Simulate(IErr)
   IF(l_alert(IErr,"felixrefine","Simulate")) CALL abort
@@ -648,30 +675,38 @@ PROGRAM Felixrefine
       WRITE(SPrintString,FMT='(A24,I3,A12)') &
         "Writing simulations for ", IThicknessCount," thicknesses"
       CALL message(LS,SPrintString)
+      CALL TimerStart(ITimeOutput)
       DO ind = 1,IThicknessCount
         CALL WriteIterationOutput(Iter,ind,IErr)
         IF(l_alert(IErr,"felixrefine","WriteIterationOutput")) CALL abort 
       END DO  
+      CALL TimerStop(ITimeOutput)
     END IF 
    ELSE ! Refinement Mode
-    IF(my_rank.EQ.0) THEN!outputs come from core 0 only
+    IF(my_rank.EQ.0.AND..NOT.LCheckpointLoaded) THEN!outputs come from core 0 only
       ! Figure of merit is passed back as a global variable
+      CALL TimerStart(ITimeFigureOfMerit)
       CALL FigureOfMeritAndThickness(Iter,IThicknessIndex,IErr)
+      CALL TimerStop(ITimeFigureOfMerit)
       IF(l_alert(IErr,"felixrefine",&
             "FigureOfMeritAndThickness")) CALL abort 
-      ! Keep baseline simulation for masked correlation
-      IF (ICorrelationFLAG.EQ.3) THEN
-        RImageBase=RImageSimi  
-        RImageAvi=RImageSimi 
-      END IF
       CALL message ( LS, "Writing output; baseline simulation" )
+      CALL TimerStart(ITimeOutput)
       CALL WriteIterationOutput(Iter,IThicknessIndex,IErr)
+      CALL TimerStop(ITimeOutput)
       IF(l_alert(IErr,"felixrefine","WriteIterationOutput")) CALL abort
     END IF
+    ! Keep baseline simulation for masked correlation, on the first core of each group
+    IF (group_rank.EQ.0.AND..NOT.LCheckpointLoaded.AND.ICorrelationFLAG.EQ.3) THEN
+      RImageBase=RImageSimi  
+      RImageAvi=RImageSimi 
+    END IF
     
+    CALL TimerStart(ITimeBroadcast)
     !===================================== ! Send the fit index to all cores
     CALL MPI_BCAST(RFigureofMerit,1,MPI_DOUBLE_PRECISION,0,MPI_COMM_WORLD,IErr)
     !=====================================
+    CALL TimerStop(ITimeBroadcast)
   
     !--------------------------------------------------------------------
     ! Iterations and refinement begin
@@ -706,8 +741,18 @@ PROGRAM Felixrefine
        
     END SELECT 
 
+    ! finished, so a later run should not resume from this one
+    CALL ClearCheckpoint(IErr)
+    IF(l_alert(IErr,"felixrefine","ClearCheckpoint")) CALL abort
+
   END IF
 
+  ! how well the pixels were shared out between the cores
+  CALL PixelScheduleSummary(IErr)
+  IF(l_alert(IErr,"felixrefine","PixelScheduleSummary")) CALL abort
+  CALL TimingFinish(IErr)
+  IF(l_alert(IErr,"felixrefine","TimingFinish")) CALL abort
+
   !--------------------------------------------------------------------
   ! deallocate Memory
   !--------------------------------------------------------------------
@@ -717,6 +762,7 @@ PROGRAM Felixrefine
   DEALLOCATE(CUgMatPrime,STAT=IErr)
   DEALLOCATE(ISymmetryRelations,STAT=IErr)
   DEALLOCATE(IEquivalentUgKey,STAT=IErr)
+  DEALLOCATE(IEquivalentUgLocation,STAT=IErr)
   DEALLOCATE(CUniqueUg,STAT=IErr)
   DEALLOCATE(RIndividualReflections,STAT=IErr)
   DEALLOCATE(IDisplacements,STAT=IErr)
@@ -731,6 +777,7 @@ PROGRAM Felixrefine
   DEALLOCATE(RIsoDW,STAT=IErr)
   DEALLOCATE(ROccupancy,STAT=IErr)
   DEALLOCATE(IAtomicNumber,STAT=IErr)
+  DEALLOCATE(IAtomSite,STAT=IErr)
   DEALLOCATE(IAnisoDW,STAT=IErr)
   DEALLOCATE(RAtomCoordinate,STAT=IErr)
   DEALLOCATE(CPseudoAtom,STAT=IErr)
@@ -804,31 +851,48 @@ CONTAINS
     !=====================================
 
     !--------------------------------------------------------------------
-    ! perform initial simplex simulations
+    ! perform initial simplex simulations, or resume from a checkpoint
     !--------------------------------------------------------------------
 
-    DO ind = 1,(INoOfVariables+1)
-      CALL message(LS,"--------------------------------")
-      CALL message(LS,no_tag,"Simplex ",ind, " of ", INoOfVariables+1)
-      CALL message(LS,"--------------------------------")
-      CALL SimulateAndFit(RSimplexVariable(ind,:),Iter,IThicknessIndex,IErr)! Working as iteration 0?
-      IF(l_alert(IErr,"SimplexRefinement","SimulateAndFit")) RETURN
-
-      RSimplexFoM(ind)=RFigureofMerit ! RFigureofMerit returned as global variable
-      ! For masked correlation, add to 'average' (extreme difference from baseline)?
-      IF(my_rank.EQ.0.AND.ICorrelationFLAG.EQ.3) THEN
-        ! replace pixels that are the most different from baseline
-        WHERE (ABS(RImageSimi-RImageBase).GT.ABS(RImageAvi-RImageBase))
-          RImageAvi=RImageSimi
-        END WHERE
-      END IF
-    END DO
+    IF (LCheckpointLoaded) THEN ! the simplex and its fits, with the mask on rank 0
+      RSimplexVariable=RCheckpointState
+      RSimplexFoM=RCheckpointValues
+      Iter=ICheckpointIter
+      IThicknessIndex=ICheckpointThickness
+    ELSE IF (n_groups.GT.1) THEN ! the vertices side by side, see vertex_group_mod
+      ALLOCATE(IVertexThickness(INoOfVariables+1),STAT=IErr)
+      IF(l_alert(IErr,"SimplexRefinement","allocate IVertexThickness")) RETURN
+      CALL SimulateVertices(TRANSPOSE(RSimplexVariable),(/ (Iter, ind=1,INoOfVariables+1) /),&
+            RSimplexFoM,IVertexThickness,ICorrelationFLAG.EQ.3,IErr)
+      IF(l_alert(IErr,"SimplexRefinement","SimulateVertices")) RETURN
+      IThicknessIndex=IVertexThickness(INoOfVariables+1)
+      DEALLOCATE(IVertexThickness)
+      Iter = 1
+    ELSE
+      DO ind = 1,(INoOfVariables+1)
+        CALL message(LS,"--------------------------------")
+        CALL message(LS,no_tag,"Simplex ",ind, " of ", INoOfVariables+1)
+        CALL message(LS,"--------------------------------")
+        CALL SimulateAndFit(RSimplexVariable(ind,:),Iter,IThicknessIndex,IErr)! Working as iteration 0?
+        IF(l_alert(IErr,"SimplexRefinement","SimulateAndFit")) RETURN
+
+        RSimplexFoM(ind)=RFigureofMerit ! RFigureofMerit returned as global variable
+        ! For masked correlation, add to 'average' (extreme difference from baseline)?
+        IF(my_rank.EQ.0.AND.ICorrelationFLAG.EQ.3) THEN
+          ! replace pixels that are the most different from baseline
+          WHERE (ABS(RImageSimi-RImageBase).GT.ABS(RImageAvi-RImageBase))
+            RImageAvi=RImageSimi
+          END WHERE
+        END IF
+      END DO
+      Iter = 1
+    END IF
 
     !--------------------------------------------------------------------
     ! set up masked fitting using the simplex setup
     !--------------------------------------------------------------------
 
-    IF (my_rank.EQ.0.AND.ICorrelationFLAG.EQ.3) THEN
+    IF (my_rank.EQ.0.AND.ICorrelationFLAG.EQ.3.AND..NOT.LCheckpointLoaded) THEN
       ! Simple start, just take thickness 1 
       RImageMask=RImageAvi(:,:,:,1)-RImageBase(:,:,:,1)
       DO ind = 1,INoOfLacbedPatterns ! mask each pattern individually
@@ -858,16 +922,26 @@ CONTAINS
         DEALLOCATE(RTestImage)
       END IF
     END IF
+    IF (n_groups.GT.1.AND.ICorrelationFLAG.EQ.3) THEN ! every group needs the mask
+      !===================================== ! send RImageMask OUT to all cores
+      CALL MPI_BCAST(RImageMask,SIZE(RImageMask),MPI_DOUBLE_PRECISION,0,MPI_COMM_WORLD,IErr)
+      !=====================================
+    END IF
     
     !--------------------------------------------------------------------
     ! Apply Simplex Method and iterate
     !--------------------------------------------------------------------
 
-    Iter = 1  
-    CALL NDimensionalDownhillSimplex(RSimplexVariable,RSimplexFoM,&
-          INoOfVariables+1,INoOfVariables,INoOfVariables,&
-          RExitCriteria,Iter,RStandardDeviation,RMean,IErr)
-    IF(l_alert(IErr,"SimplexRefinement","NDimensionalDownhillSimplex")) RETURN
+    IF (n_groups.GT.1) THEN
+      CALL ParallelDownhillSimplex(RSimplexVariable,RSimplexFoM,&
+            INoOfVariables+1,INoOfVariables,INoOfVariables,RExitCriteria,Iter,IErr)
+      IF(l_alert(IErr,"SimplexRefinement","ParallelDownhillSimplex")) RETURN
+    ELSE
+      CALL NDimensionalDownhillSimplex(RSimplexVariable,RSimplexFoM,&
+            INoOfVariables+1,INoOfVariables,INoOfVariables,&
+            RExitCriteria,Iter,RStandardDeviation,RMean,IErr)
+      IF(l_alert(IErr,"SimplexRefinement","NDimensionalDownhillSimplex")) RETURN
+    END IF
 
   END SUBROUTINE SimplexRefinement
 
@@ -904,6 +978,13 @@ CONTAINS
     Rdf=ONE
     RScale=RSimplexLengthScale
     nnd=0 ! max/min gradient flag
+    IF (LCheckpointLoaded) THEN ! carry on from the start of the checkpointed cycle
+      RIndependentVariable=RCheckpointState(:,1)
+      RCurrentVar=RCheckpointState(:,2)
+      RLastVar=RCheckpointState(:,3)
+      RPVec=RCheckpointState(:,4)
+      CALL RestoreRefinement(nnd)
+    END IF
 
     !--------------------------------------------------------------------
     ! iteratively refine until improvement in fit below exit criteria
@@ -912,6 +993,9 @@ CONTAINS
     !\/------------------------------------------------------------------
     DO WHILE (Rdf.GE.RExitCriteria)
 
+      CALL CheckpointRefinement(RESHAPE((/ RIndependentVariable,RCurrentVar,RLastVar,RPVec /),&
+            (/ INoOfVariables,4 /)),nnd)
+      IF(l_alert(IErr,"DownhillRefinement","CheckpointRefinement")) RETURN
       RVar0=RIndependentVariable ! incoming point in n-dimensional parameter space
       RFit0=RFigureofMerit ! incoming fit
       !See WriteIterationOutputWrapper for what IPrintFLAG does    
@@ -1198,6 +1282,13 @@ CONTAINS
     Rdf=ONE
     RScale=RSimplexLengthScale
     RIndependentDelta = ZERO
+    ICycle=0 ! not used by this method
+    IF (LCheckpointLoaded) THEN ! carry on from the start of the checkpointed cycle
+      RIndependentVariable=RCheckpointState(:,1)
+      RLastVec=RCheckpointState(:,2)
+      RIndependentDelta=RCheckpointState(:,3)
+      CALL RestoreRefinement(ICycle)
+    END IF
 
     !--------------------------------------------------------------------
     ! iteratively refine until improvement in fit below exit criteria
@@ -1205,6 +1296,9 @@ CONTAINS
 
     !\/------------------------------------------------------------------
     DO WHILE (Rdf.GE.RExitCriteria)
+      CALL CheckpointRefinement(RESHAPE((/ RIndependentVariable,RLastVec,RIndependentDelta /),&
+            (/ INoOfVariables,3 /)),ICycle)
+      IF(l_alert(IErr,"MaxGradientRefinement","CheckpointRefinement")) RETURN
       !put current best point in n-dimensional parameter space into workspace
       RCurrentVar=RIndependentVariable
       !running best fit during this refinement cycle goes in RVar0
@@ -1505,6 +1599,12 @@ CONTAINS
     ICycle=0 
     RScale=RSimplexLengthScale
     RMaxUgStep=0.005 ! maximum step in Ug is 0.5 nm^-2, 0.005 A^-2
+    IF (LCheckpointLoaded) THEN ! carry on from the start of the checkpointed cycle
+      RIndependentVariable=RCheckpointState(:,1)
+      RCurrentVar=RCheckpointState(:,2)
+      RLastVar=RCheckpointState(:,3)
+      CALL RestoreRefinement(ICycle)
+    END IF
 
     !--------------------------------------------------------------------
     ! iteratively refine until improvement in fit below exit criteria
@@ -1514,6 +1614,9 @@ CONTAINS
 
     !\/\/------------------------------------------------------------------
     DO WHILE (Rdf.GE.RExitCriteria)
+      CALL CheckpointRefinement(RESHAPE((/ RIndependentVariable,RCurrentVar,RLastVar /),&
+            (/ INoOfVariables,3 /)),ICycle)
+      IF(l_alert(IErr,"PairwiseRefinement","CheckpointRefinement")) RETURN
       IPrintFLAG=0
       
       !--------------------------------------------------------------------
@@ -1798,6 +1901,44 @@ CONTAINS
 
   !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+  !>
+  !! Procedure-description: Checkpoint at the start of a cycle of a gradient refinement,
+  !! the columns of RState are the vectors the method carries from one cycle to the next
+  !! and ICounter its cycle counter (nnd or ICycle)
+  !!
+  SUBROUTINE CheckpointRefinement(RState,ICounter)
+
+    REAL(RKIND),DIMENSION(:,:) :: RState
+    INTEGER(IKIND) :: ICounter
+
+    CALL WriteCheckpoint(Iter,IThicknessIndex,RState,(/ RFigureofMerit,RBestFit,&
+          RLastFit,Rdf,RScale,REAL(ICounter,RKIND) /),IErr)
+
+  END SUBROUTINE CheckpointRefinement
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: The scalars of a gradient refinement from the checkpoint
+  !! CheckpointRefinement wrote, the vectors are copied by the method itself
+  !!
+  SUBROUTINE RestoreRefinement(ICounter)
+
+    INTEGER(IKIND) :: ICounter
+
+    Iter=ICheckpointIter
+    IThicknessIndex=ICheckpointThickness
+    RFigureofMerit=RCheckpointValues(1)
+    RBestFit=RCheckpointValues(2)
+    RLastFit=RCheckpointValues(3)
+    Rdf=RCheckpointValues(4)
+    RScale=RCheckpointValues(5)
+    ICounter=NINT(RCheckpointValues(6),IKIND)
+
+  END SUBROUTINE RestoreRefinement
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
   !>
   !! Procedure-description: Setup atomic vector movements
   !!
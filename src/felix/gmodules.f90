@@ -129,6 +129,9 @@ MODULE MyMPI !?? grants MPI, so use of both in the code is unnecessary
 
   INTEGER(IKIND) :: my_rank, p, srce, dest
   INTEGER, PARAMETER :: root = 0
+  ! the cores that simulate together, rank in and size of group_comm: MPI_COMM_WORLD,
+  ! unless IVertexGroups splits it into n_groups groups (see vertex_group_mod)
+  INTEGER(IKIND) :: group_comm, group_rank, group_p, my_group = 0, n_groups = 1
   INTEGER, DIMENSION(MPI_STATUS_SIZE) :: status_info
   
 END MODULE MyMPI
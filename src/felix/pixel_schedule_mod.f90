@@ -0,0 +1,351 @@
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+! Felix
+!
+! Richard Beanland, Keith Evans & Rudolf A Roemer
+!
+! (C) 2013-19, all rights reserved
+!
+! Version: :VERSION:
+! Date:    :DATE:
+! Time:    :TIME:
+! Status:  :RLSTATUS:
+! Build:   :BUILD:
+! Author:  :AUTHOR:
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+!  Felix is free software: you can redistribute it and/or modify
+!  it under the terms of the GNU General Public License as published by
+!  the Free Software Foundation, either version 3 of the License, or
+!  (at your option) any later version.
+!
+!  Felix is distributed in the hope that it will be useful,
+!  but WITHOUT ANY WARRANTY; without even the implied warranty of
+!  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+!  GNU General Public License for more details.
+!
+!  You should have received a copy of the GNU General Public License
+!  along with Felix.  If not, see <http://www.gnu.org/licenses/>.
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+!>
+!! Module-description:
+!!
+!! Which pixels of the LACBED patterns each core calculates in Simulate, IPixelScheduleFLAG
+!! in felix.inp.  The cost of a pixel goes as the cube of its number of strong beams, so
+!! contiguous blocks of pixels (0, as felix always did) leave the cores with the edge of
+!! the disc waiting at MPI_GATHERV for those with its centre.  1 deals the pixels out in
+!! turn, and 2 starts that way and then shares them out again after every simulation by
+!! the time each one took, largest first to the least loaded core.  Every simulation the
+!! time each core spent on its pixels and waiting for the slowest is added up, and
+!! PixelScheduleSummary prints it at the end.  The cores are those of group_comm, all of
+!! them unless IVertexGroups splits them into groups (see vertex_group_mod).
+!!
+MODULE pixel_schedule_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND, ZERO, TINY
+
+  IMPLICIT NONE
+  PRIVATE
+  PUBLIC :: SetPixelSchedule, BalancePixelSchedule, PixelBusyReport, PixelScheduleSummary
+  PUBLIC :: ILocalPixels, IPixelOrder, RLocalPixelTime
+
+  ! the pixels (numbers in IPixelLocations) this core calculates, in order
+  INTEGER(IKIND), DIMENSION(:), ALLOCATABLE, SAVE :: ILocalPixels
+  ! every pixel in the order MPI_GATHERV puts them into RSimulatedPatterns
+  INTEGER(IKIND), DIMENSION(:), ALLOCATABLE, SAVE :: IPixelOrder
+  ! number of pixels of each core and where they start in IPixelOrder
+  INTEGER(IKIND), DIMENSION(:), ALLOCATABLE, SAVE :: IPixelCounts, IPixelDispls
+  ! seconds each of ILocalPixels took in the last simulation
+  REAL(RKIND), DIMENSION(:), ALLOCATABLE, SAVE :: RLocalPixelTime
+  ! seconds each core has been busy and idle in all simulations so far, on rank 0
+  REAL(RKIND), DIMENSION(:), ALLOCATABLE, SAVE :: RBusyTotal, RIdleTotal
+  INTEGER(IKIND), SAVE :: ISimulationCount = 0
+
+  CONTAINS
+
+  !>
+  !! Procedure-description: Shares the pixels out between the cores as IPixelScheduleFLAG
+  !! says and allocates RIndividualReflections to match.  ICount and IDisplacements must
+  !! already be allocated, one element per core.
+  !!
+  SUBROUTINE SetPixelSchedule(IErr)
+
+    USE l_alert_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelTotal, IPixelScheduleFLAG
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,jnd
+    INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IOwner
+
+    IErr=0
+    ALLOCATE(IOwner(IPixelTotal),STAT=IErr)
+    IF(l_alert(IErr,"SetPixelSchedule","allocate IOwner")) RETURN
+    SELECT CASE(IPixelScheduleFLAG)
+    CASE(1,2) ! dealt out in turn, 2 is balanced once there are timings
+      DO ind = 1,IPixelTotal
+        IOwner(ind) = MOD(ind-1,group_p)
+      END DO
+    CASE DEFAULT ! contiguous blocks
+      DO ind = 1,group_p
+        DO jnd = (IPixelTotal*(ind-1)/group_p)+1,IPixelTotal*ind/group_p
+          IOwner(jnd) = ind-1
+        END DO
+      END DO
+    END SELECT
+    CALL AssignPixels(IOwner,IErr)
+    IF(l_alert(IErr,"SetPixelSchedule","AssignPixels")) RETURN
+    DEALLOCATE(IOwner)
+
+  END SUBROUTINE SetPixelSchedule
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Shares the pixels out again by the time each took in the
+  !! last simulation (RLocalPixelTime), the most expensive first, each to the core with
+  !! least to do so far.  Every core gets all the timings and does the same sums, so they
+  !! all arrive at the same schedule without any more messages.
+  !!
+  SUBROUTINE BalancePixelSchedule(IErr)
+
+    USE MPI
+    USE l_alert_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelTotal
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,jnd
+    INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IOwner,IByCost
+    REAL(RKIND), DIMENSION(:), ALLOCATABLE :: RGathered,RPixelCost,RLoad
+
+    IErr=0
+    ALLOCATE(IOwner(IPixelTotal),IByCost(IPixelTotal),RGathered(IPixelTotal),&
+          RPixelCost(IPixelTotal),RLoad(group_p),STAT=IErr)
+    IF(l_alert(IErr,"BalancePixelSchedule","allocate")) RETURN
+    !===================================== ! everyone's timings, in IPixelOrder
+    CALL MPI_ALLGATHERV(RLocalPixelTime,SIZE(RLocalPixelTime),MPI_DOUBLE_PRECISION,&
+          RGathered,IPixelCounts,IPixelDispls,MPI_DOUBLE_PRECISION,group_comm,IErr)
+    !=====================================
+    IF(l_alert(IErr,"BalancePixelSchedule","MPI_ALLGATHERV")) RETURN
+    RPixelCost(IPixelOrder) = RGathered
+
+    CALL SortByCost(RPixelCost,IByCost)
+    RLoad = ZERO
+    DO ind = IPixelTotal,1,-1 ! most expensive first
+      jnd = MINLOC(RLoad,1)
+      IOwner(IByCost(ind)) = jnd-1
+      RLoad(jnd) = RLoad(jnd)+RPixelCost(IByCost(ind))
+    END DO
+    CALL AssignPixels(IOwner,IErr)
+    IF(l_alert(IErr,"BalancePixelSchedule","AssignPixels")) RETURN
+    DEALLOCATE(IOwner,IByCost,RGathered,RPixelCost,RLoad)
+
+  END SUBROUTINE BalancePixelSchedule
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Collects the seconds every core spent calculating its pixels
+  !! in one simulation on rank 0, adds them to the totals and reports the slowest core
+  !! and how much of the time the others waited for it.
+  !!
+  SUBROUTINE PixelBusyReport(RBusy,IErr)
+
+    USE MPI
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE SPARA, ONLY : SPrintString
+
+    IMPLICIT NONE
+
+    REAL(RKIND), INTENT(IN) :: RBusy
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+    REAL(RKIND) :: RBusyAll(group_p)
+
+    IErr=0
+    !=====================================
+    CALL MPI_GATHER(RBusy,1,MPI_DOUBLE_PRECISION,RBusyAll,1,MPI_DOUBLE_PRECISION,&
+          root,group_comm,IErr)
+    !=====================================
+    IF(l_alert(IErr,"PixelBusyReport","MPI_GATHER")) RETURN
+    IF (group_rank.NE.root) RETURN
+
+    IF (.NOT.ALLOCATED(RBusyTotal)) THEN
+      ALLOCATE(RBusyTotal(group_p),RIdleTotal(group_p),STAT=IErr)
+      IF(l_alert(IErr,"PixelBusyReport","allocate RBusyTotal")) RETURN
+      RBusyTotal = ZERO
+      RIdleTotal = ZERO
+    END IF
+    ISimulationCount = ISimulationCount+1
+    RBusyTotal = RBusyTotal+RBusyAll
+    RIdleTotal = RIdleTotal+MAXVAL(RBusyAll)-RBusyAll
+    WRITE(SPrintString,FMT='(A,F10.3,A,F10.3,A,F6.1,A)') "Pixels took ",MAXVAL(RBusyAll),&
+          " s on the slowest core, ",MINVAL(RBusyAll)," s on the fastest, ",&
+          100.0*SUM(RBusyAll)/MAX(group_p*MAXVAL(RBusyAll),TINY),"% busy"
+    CALL message(LM,SPrintString)
+    DO ind = 1,group_p
+      WRITE(SPrintString,FMT='(A,I5,A,F10.3,A,F10.3,A)') "core ",ind-1,": busy ",&
+            RBusyAll(ind)," s, idle ",MAXVAL(RBusyAll)-RBusyAll(ind)," s"
+      CALL message(LL,SPrintString)
+    END DO
+
+  END SUBROUTINE PixelBusyReport
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Prints the time every core spent busy and idle in the pixel
+  !! calculations of all the simulations, on rank 0.
+  !!
+  SUBROUTINE PixelScheduleSummary(IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelScheduleFLAG
+    USE SPARA, ONLY : SPrintString
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+
+    IErr=0
+    IF (group_rank.NE.root.OR.ISimulationCount.EQ.0) RETURN
+    WRITE(SPrintString,FMT='(A,I2,A,I6,A,F6.1,A,F10.1,A)') "Pixel schedule ",&
+          IPixelScheduleFLAG,": ",ISimulationCount," simulations, cores ",&
+          100.0*SUM(RBusyTotal)/MAX(SUM(RBusyTotal+RIdleTotal),TINY),&
+          "% busy, up to ",MAXVAL(RIdleTotal)," s idle"
+    CALL message(LS,SPrintString)
+    DO ind = 1,group_p
+      WRITE(SPrintString,FMT='(A,I5,A,F12.2,A,F12.2,A)') "core ",ind-1,": busy ",&
+            RBusyTotal(ind)," s, idle ",RIdleTotal(ind)," s"
+      CALL message(LM,SPrintString)
+    END DO
+
+  END SUBROUTINE PixelScheduleSummary
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Sets IPixelOrder, ILocalPixels, the gather counts and
+  !! displacements and RIndividualReflections from the core (0 to group_p-1) of every pixel.
+  !! Each core's pixels are kept in the order of IPixelLocations.
+  !!
+  SUBROUTINE AssignPixels(IOwner,IErr)
+
+    USE l_alert_mod
+    USE MyMPI
+
+    ! global outputs
+    USE IPARA, ONLY : ICount, IDisplacements
+    USE RPARA, ONLY : RIndividualReflections
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelTotal, INoOfLacbedPatterns, IThicknessCount
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), DIMENSION(:), INTENT(IN) :: IOwner
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+    INTEGER(IKIND) :: INext(group_p)
+
+    IErr=0
+    IF (.NOT.ALLOCATED(IPixelOrder)) THEN
+      ALLOCATE(IPixelOrder(IPixelTotal),IPixelCounts(group_p),IPixelDispls(group_p),STAT=IErr)
+      IF(l_alert(IErr,"AssignPixels","allocate IPixelOrder")) RETURN
+    END IF
+    IPixelCounts = 0
+    DO ind = 1,IPixelTotal
+      IPixelCounts(IOwner(ind)+1) = IPixelCounts(IOwner(ind)+1)+1
+    END DO
+    IPixelDispls(1) = 0
+    DO ind = 2,group_p
+      IPixelDispls(ind) = IPixelDispls(ind-1)+IPixelCounts(ind-1)
+    END DO
+    INext = IPixelDispls
+    DO ind = 1,IPixelTotal
+      INext(IOwner(ind)+1) = INext(IOwner(ind)+1)+1
+      IPixelOrder(INext(IOwner(ind)+1)) = ind
+    END DO
+    ICount = IPixelCounts*INoOfLacbedPatterns*IThicknessCount
+    IDisplacements = IPixelDispls*INoOfLacbedPatterns*IThicknessCount
+
+    IF (ALLOCATED(ILocalPixels)) DEALLOCATE(ILocalPixels,RLocalPixelTime)
+    IF (ALLOCATED(RIndividualReflections)) DEALLOCATE(RIndividualReflections)
+    ALLOCATE(ILocalPixels(IPixelCounts(group_rank+1)),&
+          RLocalPixelTime(IPixelCounts(group_rank+1)),RIndividualReflections(INoOfLacbedPatterns,IThicknessCount,&
+          IPixelCounts(group_rank+1)),STAT=IErr)
+    IF(l_alert(IErr,"AssignPixels","allocate RIndividualReflections")) RETURN
+    ILocalPixels = IPixelOrder(IPixelDispls(group_rank+1)+1:&
+          IPixelDispls(group_rank+1)+IPixelCounts(group_rank+1))
+    RLocalPixelTime = ZERO
+
+  END SUBROUTINE AssignPixels
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Heapsort of the indices of RCost, cheapest first
+  !!
+  SUBROUTINE SortByCost(RCost,IIndex)
+
+    IMPLICIT NONE
+
+    REAL(RKIND), DIMENSION(:), INTENT(IN) :: RCost
+    INTEGER(IKIND), DIMENSION(:), INTENT(OUT) :: IIndex
+    INTEGER(IKIND) :: ind,jnd,knd,INum,ITop
+
+    INum = SIZE(RCost)
+    DO ind = 1,INum
+      IIndex(ind) = ind
+    END DO
+    ! build the heap, then take the largest off the top one at a time
+    DO ind = INum/2,1,-1
+      CALL SiftDown(ind,INum)
+    END DO
+    DO ind = INum,2,-1
+      ITop = IIndex(1)
+      IIndex(1) = IIndex(ind)
+      IIndex(ind) = ITop
+      CALL SiftDown(1_IKIND,ind-1)
+    END DO
+
+  CONTAINS
+
+    SUBROUTINE SiftDown(IStart,IEnd)
+      INTEGER(IKIND), INTENT(IN) :: IStart,IEnd
+      jnd = IStart
+      DO WHILE (2*jnd.LE.IEnd)
+        knd = 2*jnd
+        IF (knd.LT.IEnd) THEN
+          IF (RCost(IIndex(knd+1)).GT.RCost(IIndex(knd))) knd = knd+1
+        END IF
+        IF (RCost(IIndex(jnd)).GE.RCost(IIndex(knd))) EXIT
+        ITop = IIndex(jnd)
+        IIndex(jnd) = IIndex(knd)
+        IIndex(knd) = ITop
+        jnd = knd
+      END DO
+    END SUBROUTINE SiftDown
+
+  END SUBROUTINE SortByCost
+
+END MODULE pixel_schedule_mod
@@ -56,7 +56,9 @@ MODULE read_files_mod
           IAbsorbFLAG, IAnisoDebyeWallerFactorFlag, IByteSize, IMinReflectionPool, &
           IMinStrongBeams, IMinWeakBeams, ISimFLAG, IRefineMode, &
           IWeightingFLAG, IRefineMethodFLAG, ICorrelationFLAG, IImageProcessingFLAG, &
-          INoofUgs, IPrint, IPixelCount, IBlochMethodFLAG
+          INoofUgs, IPrint, IPixelCount, IBlochMethodFLAG, IUnblurredFLAG, &
+          IResultFileFLAG, ICheckpointFLAG, IPixelScheduleFLAG, ITimingFLAG, IEigenCacheMB, &
+          IVertexGroups
     USE RPARA, ONLY : RDebyeWallerConstant, RAbsorptionPercentage, RConvergenceAngle, &
           RZDirC, RXDirC, RNormDirC, RAcceleratingVoltage, RAcceptanceAngle, &
           RInitialThickness, RFinalThickness, RDeltaThickness, RBlurRadius, &
@@ -270,11 +272,37 @@ MODULE read_files_mod
     ! RExitCriteria
     ILine= ILine+1; READ(IChInp,'(27X,F18.9)',ERR=20,END=30) RExitCriteria
 
+    !--------------------------------------------------------------------
+    ! optional lines, added later: older felix.inp files end before them
+    !--------------------------------------------------------------------
+
+    ! IUnblurredFLAG: 1=also write simulations before the Gaussian blur
+    IUnblurredFLAG=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) IUnblurredFLAG
+    ! IResultFileFLAG: 0=.bin directories, 1=one results file instead, 2=both
+    IResultFileFLAG=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) IResultFileFLAG
+    ! ICheckpointFLAG: 1=write felix_checkpoint.bin, 2=also resume from it
+    ICheckpointFLAG=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) ICheckpointFLAG
+    ! IPixelScheduleFLAG: 0=contiguous pixels per core, 1=interleaved, 2=balanced by cost
+    IPixelScheduleFLAG=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) IPixelScheduleFLAG
+    ! ITimingFLAG: 1=phase timings of every rank in felix_timing.<rank>.jsonl
+    ITimingFLAG=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) ITimingFLAG
+    ! IEigenCacheMB: MB per core to keep eigensystems between simulations, 0=none
+    IEigenCacheMB=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) IEigenCacheMB
+    ! IVertexGroups: groups of cores simulating simplex points side by side, 0 or 1=none
+    IVertexGroups=0
+    ILine= ILine+1; READ(IChInp,'(27X,I15.1)',ERR=20,END=40) IVertexGroups
+
     !--------------------------------------------------------------------
     ! finish reading, close felix.inp
     !--------------------------------------------------------------------
     
-    CLOSE(IChInp, IOSTAT=IErr)
+ 40 CLOSE(IChInp, IOSTAT=IErr)
     IF(l_alert(IErr,"ReadInpFile","CLOSE() felix.inp")) RETURN
     RETURN
 
@@ -38,6 +38,11 @@ MODULE refinementcontrol_mod
   IMPLICIT NONE
   PRIVATE
   PUBLIC :: SimulateAndFit, Simulate, FigureOfMeritAndThickness
+  PUBLIC :: LLogIterations
+
+  ! SimulateAndFit adds each simulation to iteration_log.txt unless this is .FALSE.,
+  ! as it is while vertex_group_mod simulates several points at once and logs them itself
+  LOGICAL, SAVE :: LLogIterations = .TRUE.
 
   CONTAINS
 
@@ -66,6 +71,7 @@ MODULE refinementcontrol_mod
     USE ug_matrix_mod
     USE crystallography_mod
     USE write_output_mod
+    USE timing_mod
 
     ! global inputs
     USE IPARA, ONLY : INoOfVariables, INhkl, IAbsorbFLAG, INoofUgs, &
@@ -93,6 +99,9 @@ MODULE refinementcontrol_mod
     REAL(RKIND) :: RCurrentG(3), RScatteringFactor
     COMPLEX(CKIND),DIMENSION(:,:),ALLOCATABLE :: CTempMat
 
+    CALL TimingIteration(Iter,IErr)
+    IF(l_alert(IErr,"SimulateAndFit","TimingIteration")) RETURN
+
     IF (IRefineMode(1).EQ.1) THEN  ! Ug refinement; update structure factors 
       ALLOCATE (CTempMat(INhkl,INhkl),STAT=IErr)
       IF(l_alert(IErr,"SimulateAndFit","allocate CTempMat")) RETURN
@@ -132,7 +141,9 @@ MODULE refinementcontrol_mod
         CUgMatNoAbs = CTempMat
       END WHERE
       DEALLOCATE(CTempMat)
+      CALL TimerStart(ITimeAbsorption)
       CALL Absorption(IErr)
+      CALL TimerStop(ITimeAbsorption)
       IF(l_alert(IErr,"SimulateAndFit","Absorption")) RETURN
       IF (IAbsorbFLAG.EQ.1) THEN ! proportional absorption
         RAbsorptionPercentage = RIndependentVariable(jnd)
@@ -142,9 +153,13 @@ MODULE refinementcontrol_mod
       CALL UpdateVariables(RIndependentVariable,IErr)
       IF(l_alert(IErr,"SimulateAndFit","UpdateVariables")) RETURN
       !recalculate Ug matrix
+      CALL TimerStart(ITimeUgMatrix)
       CALL UgMatrix(IErr)
+      CALL TimerStop(ITimeUgMatrix)
       IF(l_alert(IErr,"SimulateAndFit","UgMatrix")) RETURN
+      CALL TimerStart(ITimeAbsorption)
       CALL Absorption(IErr)! calculates CUgMat = CUgMatNoAbs + CUgMatPrime
+      CALL TimerStop(ITimeAbsorption)
       IF(l_alert(IErr,"SimulateAndFit","Absorption")) RETURN
     END IF
     
@@ -167,20 +182,28 @@ MODULE refinementcontrol_mod
     CALL Simulate(IErr) ! simulate 
     IF(l_alert(IErr,"SimulateAndFit","Simulate")) RETURN
 
-    IF(my_rank.EQ.0) THEN
+    IF(group_rank.EQ.0) THEN
       ! Only calculate figure of merit if we are refining
       IF (ISimFLAG.EQ.0) THEN
+        CALL TimerStart(ITimeFigureOfMerit)
         CALL FigureOfMeritAndThickness(Iter,IThicknessIndex,IErr)
+        CALL TimerStop(ITimeFigureOfMerit)
         IF(l_alert(IErr,"SimulateAndFit","FigureOfMeritAndThickness")) RETURN
       END IF
       ! Write current variable list and fit to IterationLog.txt
-      CALL WriteOutVariables(Iter,IErr)
-      IF(l_alert(IErr,"SimulateAndFit","WriteOutVariables")) RETURN
+      IF (my_rank.EQ.0.AND.LLogIterations) THEN
+        CALL TimerStart(ITimeOutput)
+        CALL WriteOutVariables(Iter,IErr)
+        CALL TimerStop(ITimeOutput)
+        IF(l_alert(IErr,"SimulateAndFit","WriteOutVariables")) RETURN
+      END IF
     END IF
 
+    CALL TimerStart(ITimeBroadcast)
     !===================================== ! Send the fit index to all cores
-    CALL MPI_BCAST(RFigureofMerit,1,MPI_DOUBLE_PRECISION,0,MPI_COMM_WORLD,IErr)
+    CALL MPI_BCAST(RFigureofMerit,1,MPI_DOUBLE_PRECISION,0,group_comm,IErr)
     !=====================================
+    CALL TimerStop(ITimeBroadcast)
 
   END SUBROUTINE SimulateAndFit
 
@@ -201,6 +224,9 @@ MODULE refinementcontrol_mod
     USE message_mod
 
     USE bloch_mod
+    USE eigen_cache_mod
+    USE pixel_schedule_mod
+    USE timing_mod
 
     !global outputs
     USE RPara, ONLY : RImageSimi, &       
@@ -208,38 +234,61 @@ MODULE refinementcontrol_mod
     ! RImageSimi(x_coordinate, y_coordinate y, LACBED_pattern_ID , thickness_ID )
     ! RSimulatedPatterns( Pixel_ID, LACBED_pattern_ID , thickness_ID )
     ! RSimulatedPatterns has a long list of pixel instead of a 2D image matrix
-    USE RPARA, ONLY : RIndividualReflections
+    USE RPARA, ONLY : RIndividualReflections, RImageSimiUnblurred
     USE IPara, ONLY : IInitialSimulationFLAG, IPixelComputed
     
     !global inputs
     USE RPARA, ONLY : RBlurRadius
-    USE IPARA, ONLY : ICount,IDisplacements,ILocalPixelCountMax,INoOfLacbedPatterns,&
-          ILocalPixelCountMin,IPixelLocations,IPixelCount,IThicknessCount
+    USE IPARA, ONLY : IUnblurredFLAG, IPixelScheduleFLAG
+    USE IPARA, ONLY : ICount,IDisplacements,INoOfLacbedPatterns,&
+          IPixelLocations,IPixelCount,IThicknessCount
 
     IMPLICIT NONE
 
     INTEGER(IKIND) :: IErr, ind,jnd,knd,pnd,IIterationFLAG
+    REAL(RKIND) :: RStartTime,RPixelStartTime
 !    REAL(RKIND),DIMENSION(:,:),ALLOCATABLE :: RTempImage 
 
     ! Reset simuation   
     RIndividualReflections = ZERO
 
-    ! Simulation (different local pixels for each core)
+    ! Simulation (different local pixels for each core, see pixel_schedule_mod)
     CALL message(LS,"Bloch wave calculation...")
-    DO knd = ILocalPixelCountMin,ILocalPixelCountMax,1
-      jnd = IPixelLocations(knd,1)
-      ind = IPixelLocations(knd,2)
+    ! eigensystems kept from the last simulation are reused if nothing they depend on changed
+    CALL EigenCacheValidate(IErr)
+    IF(l_alert(IErr,"Simulate","EigenCacheValidate")) RETURN
+    RStartTime = MPI_Wtime()
+    DO knd = 1,SIZE(ILocalPixels)
+      jnd = IPixelLocations(ILocalPixels(knd),1)
+      ind = IPixelLocations(ILocalPixels(knd),2)
       ! fills array for each pixel number not x & y coordinates
-      CALL BlochCoefficientCalculation(ind,jnd,knd,ILocalPixelCountMin,IErr)
+      RPixelStartTime = MPI_Wtime()
+      CALL TimerStart(ITimeBloch)
+      CALL BlochCoefficientCalculation(ind,jnd,knd,1,IErr)
+      CALL TimerStop(ITimeBloch)
       IF(l_alert(IErr,"Simulate","BlochCoefficientCalculation")) RETURN
+      RLocalPixelTime(knd) = MPI_Wtime()-RPixelStartTime
     END DO
+    CALL EigenCacheReport
+    CALL PixelBusyReport(MPI_Wtime()-RStartTime,IErr)
+    IF(l_alert(IErr,"Simulate","PixelBusyReport")) RETURN
 
+    CALL TimerStart(ITimeGather)
     !===================================== ! MPI gatherv into RSimulatedPatterns
     CALL MPI_GATHERV(RIndividualReflections,SIZE(RIndividualReflections),MPI_DOUBLE_PRECISION,&
          RSimulatedPatterns,ICount,IDisplacements,MPI_DOUBLE_PRECISION,&
-         root,MPI_COMM_WORLD,IErr)
+         root,group_comm,IErr)
     !=====================================
+    CALL TimerStop(ITimeGather)
     IF(l_alert(IErr,"SimulateAndFit","MPI_GATHERV")) RETURN
+    ! the pixels arrive core by core, put them back in order
+    IF (IPixelScheduleFLAG.NE.0.AND.group_rank.EQ.root) &
+          RSimulatedPatterns(:,:,IPixelOrder) = RSimulatedPatterns
+    ! and share them out again by what they cost this time
+    IF (IPixelScheduleFLAG.EQ.2) THEN
+      CALL BalancePixelSchedule(IErr)
+      IF(l_alert(IErr,"Simulate","BalancePixelSchedule")) RETURN
+    END IF
 
     ! put 1D array RSimulatedPatterns into 2D image RImageSimi
     ! remember dimensions of RSimulatedPatterns(INoOfLacbedPatterns,IThicknessCount,IPixelTotal)
@@ -252,13 +301,17 @@ MODULE refinementcontrol_mod
         RImageSimi(jnd,knd,:,:) = RSimulatedPatterns(:,:,ind)
       END DO
     END DO
+    ! keep the images as calculated, the blur can then be re-fitted afterwards
+    IF (my_rank.EQ.0.AND.IUnblurredFLAG.EQ.1) RImageSimiUnblurred = RImageSimi
     ! Gaussian blur to match experiment using global variable RBlurRadius
     IF (RBlurRadius.GT.TINY) THEN
+      CALL TimerStart(ITimeBlur)
       DO ind=1,INoOfLacbedPatterns
         DO jnd=1,IThicknessCount
           CALL BlurG(RImageSimi(:,:,ind,jnd),IPixelCount,RBlurRadius,IErr)
         END DO
       END DO
+      CALL TimerStop(ITimeBlur)
     END IF
 
     ! We have done at least one simulation now
@@ -609,8 +662,8 @@ MODULE refinementcontrol_mod
         
         CASE(8) ! G: convergence angle
           ! recalculate resolution in k space
-          IF (my_rank.EQ.0) RDeltaK = TWOPI*RConvergenceAngle/REAL(IPixelCount,RKIND)
-          CALL MPI_BCAST(RDeltaK,1,MPI_DOUBLE_PRECISION,0,MPI_COMM_WORLD,IErr)        
+          IF (group_rank.EQ.0) RDeltaK = TWOPI*RConvergenceAngle/REAL(IPixelCount,RKIND)
+          CALL MPI_BCAST(RDeltaK,1,MPI_DOUBLE_PRECISION,0,group_comm,IErr)        
 
         END SELECT
       END IF
@@ -36,7 +36,7 @@
 MODULE simplex_mod
   IMPLICIT NONE
   PRIVATE
-  PUBLIC :: NDimensionalDownhillSimplex
+  PUBLIC :: NDimensionalDownhillSimplex, ParallelDownhillSimplex
 
   CONTAINS
 
@@ -54,6 +54,7 @@ MODULE simplex_mod
     USE MPI
     USE refinementcontrol_mod
     USE write_output_mod
+    USE checkpoint_mod
 
     ! global inputs
     USE RPARA, ONLY : RFigureofMerit
@@ -74,6 +75,7 @@ MODULE simplex_mod
     INTEGER(IKIND) :: i, ihi, ilo, inhi, j, m, n, IExitFlag, IThicknessIndex
     
     Rytry=ZERO ! initial value, has no significance
+    IThicknessIndex=0 ! until the first simulation here
 
     IF(my_rank.EQ.0) THEN !why is this here, should be outside the subroutine?
 1     DO n=1,ndim ! enter here when starting or have just overall contracted
@@ -85,6 +87,9 @@ MODULE simplex_mod
       ENDDO
 2     ilo=1 ! enter here when have just changed a single point
       ysave=Rytry
+      ! the simplex and its figures of merit are all a restart needs
+      CALL WriteCheckpoint(iter,IThicknessIndex,RSimplexVariable,y,IErr)
+      IF(l_alert(IErr,"NDimensionalDownhillSimplex","WriteCheckpoint")) RETURN
       IF (y(1).GT.y(2)) THEN ! Determine which point is highest (worst)
         ! determine next highest, and lowest (best)
         ihi=1
@@ -277,4 +282,177 @@ MODULE simplex_mod
     RETURN
   END FUNCTION SimplexExtrapolate
 
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: NDimensionalDownhillSimplex for groups of cores
+  !! (IVertexGroups), run alike on every core since all of them get every fit back from
+  !! SimulateVertices.  Each step tries the reflection, expansion and outer and inner
+  !! contractions through the face opposite the worst point side by side, as many as there
+  !! are groups, before it knows which one it needs; a contraction about the best point
+  !! simulates all the others at once.  Every simulation is an iteration of its own.
+  !!
+  SUBROUTINE ParallelDownhillSimplex(RSimplexVariable,y,mp,np,ndim,ftol,iter,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    USE MyMPI
+    USE refinementcontrol_mod
+    USE write_output_mod
+    USE checkpoint_mod
+    USE vertex_group_mod
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: mp, np, ndim
+    REAL(RKIND), INTENT(INOUT) :: RSimplexVariable(mp,np), y(mp)
+    REAL(RKIND), INTENT(IN) :: ftol
+    INTEGER(IKIND), INTENT(INOUT) :: iter
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND), PARAMETER :: ITMAX=50000, IReflect=1, IExpand=2, IOutside=3, IInside=4
+    ! where each trial point is along the line from the centroid of the others to the worst
+    REAL(RKIND), PARAMETER :: RTrialFactor(4) = (/ -ONE, -TWO, -HALF, HALF /)
+    REAL(RKIND) :: rtol, RCentroid(ndim), RTrial(ndim,4), RTrialFit(4), RBest(ndim)
+    INTEGER(IKIND) :: i, j, ihi, ilo, inhi, IThicknessIndex, INoOfTrials, ITrialThickness(4), &
+          IShrinkThickness(ndim)
+    REAL(RKIND) :: RShrink(ndim,ndim), RShrinkFit(ndim)
+    LOGICAL :: LTried(4)
+
+    IErr=0
+    IThicknessIndex=0 ! until the first simulation here
+    INoOfTrials=MIN(n_groups,4_IKIND)
+
+    DO
+      ! the worst (highest) point, the next worst and the best (lowest)
+      ilo=MINLOC(y,1)
+      ihi=MAXLOC(y,1)
+      inhi=ilo
+      DO i=1,ndim+1
+        IF (i.NE.ihi.AND.y(i).GE.y(inhi)) inhi=i
+      END DO
+      rtol=2.*ABS(y(ihi)-y(ilo))/(ABS(y(ihi))+ABS(y(ilo)))
+      IF (rtol.LT.ftol) EXIT
+      IF (iter.GE.ITMAX) THEN
+        CALL message( LS, "Simplex halted after  iterations = ",iter )
+        EXIT
+      END IF
+      ! the simplex and its figures of merit are all a restart needs
+      CALL WriteCheckpoint(iter,IThicknessIndex,RSimplexVariable,y,IErr)
+      IF(l_alert(IErr,"ParallelDownhillSimplex","WriteCheckpoint")) RETURN
+
+      CALL message( LM, "------------------------------------------")
+      CALL message( LM, "Iteration = ",iter)
+      CALL message( LM, "  current best fit = ",y(ilo) )
+      CALL message( LM, "Simplex range ",rtol)
+      CALL message( LM, "    will end at ",ftol)
+      CALL message( LM, "------------------------------------------")
+
+      RCentroid=(SUM(RSimplexVariable(1:ndim+1,:),DIM=1)-RSimplexVariable(ihi,:))/REAL(ndim,RKIND)
+      DO i=1,4
+        RTrial(:,i)=RCentroid+RTrialFactor(i)*(RSimplexVariable(ihi,:)-RCentroid)
+      END DO
+      LTried=.FALSE.
+      CALL TryPoints(1_IKIND,INoOfTrials)
+      IF(l_alert(IErr,"ParallelDownhillSimplex","TryPoints")) RETURN
+
+      IF (RTrialFit(IReflect).LE.y(ilo)) THEN ! better than the best, so try going further
+        CALL message( LM, "Simplex reflection and extrapolation:" )
+        CALL TryPoints(IExpand,IExpand)
+        IF(l_alert(IErr,"ParallelDownhillSimplex","TryPoints")) RETURN
+        IF (RTrialFit(IExpand).LT.RTrialFit(IReflect)) THEN
+          CALL ReplaceWorst(IExpand)
+        ELSE
+          CALL ReplaceWorst(IReflect)
+        END IF
+      ELSE IF (RTrialFit(IReflect).LT.y(inhi)) THEN
+        CALL message( LM, "Simplex reflection:" )
+        CALL ReplaceWorst(IReflect)
+      ELSE ! no better than the second worst, look for an intermediate lower point
+        CALL message( LM, "Interpolation:" )
+        IF (RTrialFit(IReflect).LT.y(ihi)) THEN ! contract the reflected point
+          CALL ReplaceWorst(IReflect)
+          CALL TryPoints(IOutside,IOutside)
+          IF(l_alert(IErr,"ParallelDownhillSimplex","TryPoints")) RETURN
+          i=IOutside
+        ELSE ! contract the worst point
+          CALL TryPoints(IInside,IInside)
+          IF(l_alert(IErr,"ParallelDownhillSimplex","TryPoints")) RETURN
+          i=IInside
+        END IF
+        IF (RTrialFit(i).LT.y(ihi)) THEN
+          CALL ReplaceWorst(i)
+        ELSE ! can't get rid of the highest point, so contract about the best point
+          CALL message( LM, "-----------------------------------------------------")
+          CALL message( LM, "Entering Contraction Phase, Expect number Simulations = ",ndim )
+          CALL message( LM, "-----------------------------------------------------")
+          j=0
+          DO i=1,ndim+1
+            IF (i.EQ.ilo) CYCLE
+            j=j+1
+            RSimplexVariable(i,:)=HALF*(RSimplexVariable(i,:)+RSimplexVariable(ilo,:))
+            RShrink(:,j)=RSimplexVariable(i,:)
+          END DO
+          CALL SimulateVertices(RShrink,(/ (iter+j, j=1,ndim) /),RShrinkFit,&
+                IShrinkThickness,.FALSE.,IErr)
+          IF(l_alert(IErr,"ParallelDownhillSimplex","SimulateVertices")) RETURN
+          iter=iter+ndim
+          j=0
+          DO i=1,ndim+1
+            IF (i.EQ.ilo) CYCLE
+            j=j+1
+            y(i)=RShrinkFit(j)
+          END DO
+        END IF
+      END IF
+    END DO
+
+    ! finish with the best point, simulated by every group so its output is on rank 0
+    ilo=MINLOC(y,1)
+    RBest=RSimplexVariable(ilo,:)
+    CALL message( LS, "Simplex finished, simulating the best point")
+    iter=iter+1
+    CALL SimulateAndFit(RBest,iter,IThicknessIndex,IErr)
+    IF(l_alert(IErr,"ParallelDownhillSimplex","SimulateAndFit")) RETURN
+    CALL WriteIterationOutputWrapper(iter,IThicknessIndex,1_IKIND,IErr)
+    IF(l_alert(IErr,"ParallelDownhillSimplex","WriteIterationOutputWrapper")) RETURN
+
+    CONTAINS
+
+    ! simulates the trial points ifirst to ilast not yet tried
+    SUBROUTINE TryPoints(ifirst,ilast)
+
+      INTEGER(IKIND), INTENT(IN) :: ifirst,ilast
+      INTEGER(IKIND) :: k,n,ITry(4),IThick(4)
+      REAL(RKIND) :: RFit(4)
+
+      n=0
+      DO k=ifirst,ilast
+        IF (LTried(k)) CYCLE
+        n=n+1
+        ITry(n)=k
+      END DO
+      IF (n.EQ.0) RETURN
+      CALL SimulateVertices(RTrial(:,ITry(1:n)),(/ (iter+k, k=1,n) /),RFit(1:n),&
+            IThick(1:n),.FALSE.,IErr)
+      iter=iter+n
+      RTrialFit(ITry(1:n))=RFit(1:n)
+      ITrialThickness(ITry(1:n))=IThick(1:n)
+      LTried(ITry(1:n))=.TRUE.
+
+    END SUBROUTINE TryPoints
+
+    ! the trial point itry takes the place of the worst point
+    SUBROUTINE ReplaceWorst(itry)
+
+      INTEGER(IKIND), INTENT(IN) :: itry
+
+      RSimplexVariable(ihi,:)=RTrial(:,itry)
+      y(ihi)=RTrialFit(itry)
+      IThicknessIndex=ITrialThickness(itry)
+
+    END SUBROUTINE ReplaceWorst
+
+  END SUBROUTINE ParallelDownhillSimplex
+
 END MODULE simplex_mod
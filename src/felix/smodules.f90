@@ -161,7 +161,8 @@ MODULE IPara
        IImageFLAG,IBeamConvergenceFLAG,IDevFLAG, &
        IRefineModeFLAG,IHKLSelectFLAG,IPrint,IRefineSwitch,&
        IWeightingFLAG,IRefineMethodFLAG,ICorrelationFLAG,IImageProcessingFLAG,&
-       IByteSize
+       IByteSize,IUnblurredFLAG,IResultFileFLAG,ICheckpointFLAG,IPixelScheduleFLAG,ITimingFLAG,&
+       IEigenCacheMB,IVertexGroups
   !Minimum Reflections etc
   INTEGER(IKIND) :: IMinReflectionPool,IMinStrongBeams,IMinWeakBeams
   !OtherFLAGS
@@ -174,6 +175,8 @@ MODULE IPara
   INTEGER(IKIND) :: IMaxPossibleNAtomsUnitCell
   !Name2Atom index
   INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IBasisAtomicNumber,IAtomicNumber
+  !basis atom each atom in the unit cell was generated from
+  INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IAtomSite
   !Microscope Settings
   INTEGER(IKIND) :: IIncidentBeamDirectionX, IIncidentBeamDirectionY, &
        IIncidentBeamDirectionZ, &
@@ -192,7 +195,8 @@ MODULE IPara
   !Refinement FLAGS
   INTEGER(IKIND) :: IImageOutputFLAG
   !LACBED
-  INTEGER(IKIND),DIMENSION(:,:), ALLOCATABLE :: ILACBEDStrongBeamList, IPixelLocation, ISymmetryRelations
+  INTEGER(IKIND),DIMENSION(:,:), ALLOCATABLE :: ILACBEDStrongBeamList, IPixelLocation, ISymmetryRelations, &
+        IEquivalentUgLocation
   INTEGER(IKIND),DIMENSION(:), ALLOCATABLE :: InBeams,IOutputReflections,IEquivalentUgKey
   !LACBED mask
   INTEGER(IKIND),DIMENSION(:,:), ALLOCATABLE :: IMask
@@ -216,7 +220,7 @@ MODULE IPara
   !List of Atomic Sites for Refinement
   INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IAtomsToRefine
   !Simplex Variables
-  INTEGER(IKIND) :: INoOfVariables,ILocalPixelCountMin,ILocalPixelCountMax,IUgOffset
+  INTEGER(IKIND) :: INoOfVariables,IUgOffset
   INTEGER(IKIND), DIMENSION(:), ALLOCATABLE :: IDisplacements,ICount
   !Refinement Vectors
   INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IAtomMoveList
@@ -305,6 +309,8 @@ MODULE RPara
   REAL(RKIND),DIMENSION(:,:,:),ALLOCATABLE :: RSimulatedPatterns
   ! Simulated Images as images (width,height, no.of patterns, no of thicknesses)
   REAL(RKIND),DIMENSION(:,:,:,:),ALLOCATABLE :: RImageSimi
+  ! Simulated Images before the Gaussian blur, kept on core 0 if IUnblurredFLAG=1
+  REAL(RKIND),DIMENSION(:,:,:,:),ALLOCATABLE :: RImageSimiUnblurred
   ! Average simulated Images (width,height, no.of patterns, no of thicknesses)
   REAL(RKIND),DIMENSION(:,:,:,:),ALLOCATABLE :: RImageAvi,RImageBase
   ! Image masks (width,height, no.of patterns)
@@ -372,7 +378,8 @@ MODULE IChannels
        IChInImage = 51
   INTEGER :: IChOutWF_MPI,IChOutWI_MPI,IChOutES_MPI,IChOutUM_MPI,IChOut_MPI 
   INTEGER, PARAMETER :: IChOutWFImageReal= 47, IChOutWFImagePhase= 48, &
-       IChOutWIImage= 49, MontageOut = 50,IChOutSimplex = 52
+       IChOutWIImage= 49, MontageOut = 50,IChOutSimplex = 52, &
+       IChOutResults = 53, IChOutTiming = 54
 END MODULE IChannels
 !--------------------------------------------------------------------
 
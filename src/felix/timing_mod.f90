@@ -0,0 +1,209 @@
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+! Felix
+!
+! Richard Beanland, Keith Evans & Rudolf A Roemer
+!
+! (C) 2013-19, all rights reserved
+!
+! Version: :VERSION:
+! Date:    :DATE:
+! Time:    :TIME:
+! Status:  :RLSTATUS:
+! Build:   :BUILD:
+! Author:  :AUTHOR:
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+!  Felix is free software: you can redistribute it and/or modify
+!  it under the terms of the GNU General Public License as published by
+!  the Free Software Foundation, either version 3 of the License, or
+!  (at your option) any later version.
+!
+!  Felix is distributed in the hope that it will be useful,
+!  but WITHOUT ANY WARRANTY; without even the implied warranty of
+!  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+!  GNU General Public License for more details.
+!
+!  You should have received a copy of the GNU General Public License
+!  along with Felix.  If not, see <http://www.gnu.org/licenses/>.
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+!>
+!! Module-description:
+!!
+!! Machine-readable timings of the phases of a simulation, ITimingFLAG in felix.inp.
+!! Every rank adds up the time it spends in each phase between TimerStart and TimerStop
+!! and, when the iteration changes, writes one JSON object per phase as a line of
+!! felix_timing.<rank>.jsonl, e.g.
+!!   {"rank": 3, "iter": 12, "phase": "Bloch", "calls": 1024, "seconds": 4.1234567E+00}
+!! Gather and Broadcast are mostly time spent waiting for the other ranks.
+!! gui/timingreport.py adds the files of all the ranks up.
+!!
+MODULE timing_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND, ZERO
+
+  IMPLICIT NONE
+  PRIVATE
+  PUBLIC :: TimingInit, TimingIteration, TimerStart, TimerStop, TimingFinish
+  PUBLIC :: ITimeUgMatrix, ITimeAbsorption, ITimeBloch, ITimeGather, ITimeBlur, &
+        ITimeFigureOfMerit, ITimeOutput, ITimeBroadcast, ITimeUgSetup
+
+  INTEGER(IKIND), PARAMETER :: ITimeUgMatrix = 1, ITimeAbsorption = 2, ITimeBloch = 3, &
+        ITimeGather = 4, ITimeBlur = 5, ITimeFigureOfMerit = 6, ITimeOutput = 7, &
+        ITimeBroadcast = 8, ITimeUgSetup = 9, INoOfPhases = 9
+  CHARACTER(13), PARAMETER :: SPhaseName(INoOfPhases) = (/ 'UgMatrix     ', &
+        'Absorption   ', 'Bloch        ', 'Gather       ', 'BlurG        ', &
+        'FigureOfMerit', 'Output       ', 'Broadcast    ', 'UgSetup      ' /)
+
+  LOGICAL, SAVE :: LTiming = .FALSE.
+  INTEGER(IKIND), SAVE :: ITimingIter = 0
+  INTEGER(IKIND), SAVE :: IPhaseCalls(INoOfPhases) = 0
+  REAL(RKIND), SAVE :: RPhaseSeconds(INoOfPhases) = ZERO, RPhaseStart(INoOfPhases) = ZERO
+
+  CONTAINS
+
+  !>
+  !! Procedure-description: Opens felix_timing.<rank>.jsonl on every rank if ITimingFLAG
+  !! is set, after felix.inp has been read
+  !!
+  SUBROUTINE TimingInit(IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : ITimingFLAG
+    USE IChannels, ONLY : IChOutTiming
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    CHARACTER(40) :: SFilename
+
+    IErr=0
+    IF (ITimingFLAG.EQ.0) RETURN
+    WRITE(SFilename,FMT='(A,I4.4,A)') "felix_timing.",my_rank,".jsonl"
+    OPEN(UNIT=IChOutTiming,FILE=TRIM(SFilename),STATUS='REPLACE',ACTION='WRITE',IOSTAT=IErr)
+    IF(l_alert(IErr,"TimingInit","OPEN() "//TRIM(SFilename))) RETURN
+    LTiming = .TRUE.
+    CALL message(LM,"Writing phase timings to felix_timing.<rank>.jsonl")
+
+  END SUBROUTINE TimingInit
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Starts the clock of one phase, ITime... above
+  !!
+  SUBROUTINE TimerStart(IPhase)
+
+    USE MyMPI
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IPhase
+
+    IF (.NOT.LTiming) RETURN
+    RPhaseStart(IPhase) = MPI_Wtime()
+
+  END SUBROUTINE TimerStart
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Adds the time since TimerStart to one phase
+  !!
+  SUBROUTINE TimerStop(IPhase)
+
+    USE MyMPI
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: IPhase
+
+    IF (.NOT.LTiming) RETURN
+    RPhaseSeconds(IPhase) = RPhaseSeconds(IPhase)+MPI_Wtime()-RPhaseStart(IPhase)
+    IPhaseCalls(IPhase) = IPhaseCalls(IPhase)+1
+
+  END SUBROUTINE TimerStop
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Called at the start of each simulation of a refinement; when
+  !! Iter differs from the last one, writes the timings of the last iteration and
+  !! starts adding up again.  Output written after a simulation is thereby counted with
+  !! the iteration it belongs to.
+  !!
+  SUBROUTINE TimingIteration(Iter,IErr)
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: Iter
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+
+    IErr=0
+    IF (.NOT.LTiming.OR.Iter.EQ.ITimingIter) RETURN
+    CALL WriteTimings(IErr)
+    ITimingIter = Iter
+
+  END SUBROUTINE TimingIteration
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Writes the last timings and closes the file
+  !!
+  SUBROUTINE TimingFinish(IErr)
+
+    USE IChannels, ONLY : IChOutTiming
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+
+    IErr=0
+    IF (.NOT.LTiming) RETURN
+    CALL WriteTimings(IErr)
+    CLOSE(IChOutTiming,IOSTAT=IErr)
+    LTiming = .FALSE.
+
+  END SUBROUTINE TimingFinish
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: One JSON line per phase used since the last call, flushed so
+  !! the timings of a job that is killed are not lost
+  !!
+  SUBROUTINE WriteTimings(IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    USE IChannels, ONLY : IChOutTiming
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+
+    IErr=0
+    DO ind = 1,INoOfPhases
+      IF (IPhaseCalls(ind).EQ.0) CYCLE
+      WRITE(IChOutTiming,FMT='(A,I0,A,I0,A,A,A,I0,A,ES15.7E3,A)',IOSTAT=IErr) &
+            '{"rank": ',my_rank,', "iter": ',ITimingIter,', "phase": "', &
+            TRIM(SPhaseName(ind)),'", "calls": ',IPhaseCalls(ind),', "seconds": ', &
+            RPhaseSeconds(ind),'}'
+      IF(l_alert(IErr,"WriteTimings","WRITE() felix_timing")) RETURN
+    END DO
+    FLUSH(IChOutTiming)
+    IPhaseCalls = 0
+    RPhaseSeconds = ZERO
+
+  END SUBROUTINE WriteTimings
+
+END MODULE timing_mod
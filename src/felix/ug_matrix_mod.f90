@@ -33,10 +33,37 @@
 !>
 !! Module-description: 
 !!
+!! UgMatrix keeps the contribution of each basis atom (with all the atoms symmetry
+!! generates from it) to each distinct g-vector of the Ug matrix.  When a refinement
+!! changes the coordinates, occupancy or Debye-Waller factor of some basis atoms only
+!! their contributions are recalculated and the differences added to the total, so
+!! the cost goes with the number of atoms that moved rather than the whole unit cell.
+!! Everything is recalculated if the g-vectors, unit cell volume or accelerating
+!! voltage change, with anisotropic Debye-Waller factors, and every IUgRebuildInterval
+!! updates so that rounding errors in the running total cannot build up.
+!!
 MODULE ug_matrix_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND, CKIND
+
   IMPLICIT NONE
   PRIVATE
   PUBLIC :: UgMatrix, Absorption, GetVgContributionij, StructureFactorInitialisation
+
+  INTEGER(IKIND), PARAMETER :: IUgRebuildInterval = 20
+  ! the distinct g-vector of each element of the lower triangle of the Ug matrix,
+  ! and an element that each distinct g-vector is found at
+  INTEGER(IKIND), SAVE :: INg = 0, IUgUpdates = 0
+  INTEGER(IKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: IgDistinct, IgFirst
+  ! Ug of each distinct g-vector, in total and from each basis atom
+  COMPLEX(CKIND), DIMENSION(:), ALLOCATABLE, SAVE :: CUgDistinct
+  COMPLEX(CKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: CUgSite
+  ! what they were calculated from: g-vectors, prefactor and for each atom in the unit
+  ! cell its coordinate, occupancy, Debye-Waller factor, Z, IAnisoDW and basis atom
+  REAL(RKIND), DIMENSION(:,:), ALLOCATABLE, SAVE :: RgCached, RAtomCached
+  REAL(RKIND), SAVE :: RPreFactorCached = 0.0
+  INTEGER(IKIND), SAVE :: INAtomsCached = 0
+
   CONTAINS
 
   !>
@@ -52,10 +79,8 @@ MODULE ug_matrix_mod
   USE MyMPI
 
   ! global inputs
-  USE IPARA, ONLY : INhkl,IAtomicNumber,INAtomsUnitCell,ICurrentZ,IAnisoDebyeWallerFactorFlag,IAnisoDW,IWriteFLAG
-  USE RPARA, ONLY : RCurrentGMagnitude,RIsoDW,RDebyeWallerConstant,RVolume,&
-    RRelativisticCorrection,Rhkl,ROccupancy,RAtomCoordinate,RgMatrix,RAnisotropicDebyeWallerFactorTensor
-    !,RElectronMass,RAngstromConversion,RScattFacToVolts,RElectronCharge,RPlanckConstant,RgMatrixMagnitude
+  USE IPARA, ONLY : INhkl,IWriteFLAG
+  USE RPARA, ONLY : RVolume,RRelativisticCorrection,Rhkl
   USE CPARA, ONLY : CUgMatNoAbs,CUgMatPrime
   USE SPARA, ONLY : SPrintString
   ! global outputs
@@ -63,48 +88,22 @@ MODULE ug_matrix_mod
 
   IMPLICIT NONE
     
-  INTEGER(IKIND) :: ind,jnd,knd,IErr
-  REAL(RKIND) :: RScatteringFactor,RPreFactor
+  INTEGER(IKIND) :: ind,jnd,IErr
+  REAL(RKIND) :: RPreFactor
   COMPLEX(CKIND),DIMENSION(:,:),ALLOCATABLE :: CTempMat!to avoid problems with transpose
 
     
-  IF (my_rank.EQ.0) THEN!There may be a bug when individual cores calculate UgMat, make it the responsibility of core 0 and broadcast it
+  IF (group_rank.EQ.0) THEN!There may be a bug when individual cores calculate UgMat, make it the responsibility of core 0 and broadcast it
     !conversion factor from f to Ug  
     RPreFactor=RRelativisticCorrection/(PI*RVolume)
+    ! bring the Ug of each distinct g-vector up to date with the atoms
+    CALL UgDistinctUpdate(RPreFactor,IErr)
+    IF(l_alert(IErr,"UgMatrix","UgDistinctUpdate")) RETURN
     CUgMatNoAbs = CZERO
     ! fill lower diagonal of Ug matrix(excluding absorption) with Fourier components of the potential Vg
     DO ind=2,INhkl
       DO jnd=1,ind-1
-        RCurrentGMagnitude = SQRT(DOT_PRODUCT(RgMatrix(ind,jnd,:),RgMatrix(ind,jnd,:)))!RgMatrixMagnitude(ind,jnd)
-        ! Old version, CVgij contribution from each atom and pseudoatom in Volts
-        !CALL GetVgContributionij(RScatteringFactor,ind,jnd,CVgij,IErr) version with pseudoatoms
-        DO knd=1,INAtomsUnitCell
-          ICurrentZ = IAtomicNumber(knd) ! atomic number, Z, NB passed as a global variable for absorption
-          ! Get scattering factor
-          CALL AtomicScatteringFactor(RScatteringFactor,IErr)        
-          ! Occupancy
-          RScatteringFactor = RScatteringFactor*ROccupancy(knd)
-          ! Debye-Waller factor
-          IF (IAnisoDebyeWallerFactorFlag.EQ.0) THEN 
-            IF(RIsoDW(knd).GT.10.OR.RIsoDW(knd).LT.0) RIsoDW(knd) = RDebyeWallerConstant!use default in felix.inp for unrealistic values in the cif
-            ! Isotropic D-W factor
-            ! exp(-B sin(theta)^2/lamda^2) = exp(-Bs^2) = exp(-Bg^2/16pi^2), see e.g. Bird&King
-            RScatteringFactor = RScatteringFactor*EXP(-RIsoDW(knd)*(RCurrentGMagnitude**2)/(FOUR*TWOPI**2) )
-          ELSE ! anisotropic Debye-Waller factor
-            !?? this will need sorting out, may not work
-            RScatteringFactor = RScatteringFactor * &
-                EXP( -DOT_PRODUCT( RgMatrix(ind,jnd,:), &
-                MATMUL(RAnisotropicDebyeWallerFactorTensor(IAnisoDW(knd),:,:),&
-                RgMatrix(ind,jnd,:)) ) )
-          END IF
-          ! Here we go directly to Ug's, missing out the Fourier components of the potential Vg
-          ! (formerly calculated as CVgij).  If the Vg's are desired they can be obtained from 
-          ! multiplying RScatteringFactor by RScattFacToVolts,
-          ! or by multiplying Ug's by (RScattFacToVolts/RPreFactor)
-          ! The structure factor equation, complex Ug(ind,jnd)=sum(f*exp(-ig.r)) in Volts
-          CUgMatNoAbs(ind,jnd)=CUgMatNoAbs(ind,jnd)+RPreFactor*RScatteringFactor*&
-              EXP(-CIMAGONE*DOT_PRODUCT(RgMatrix(ind,jnd,:),RAtomCoordinate(knd,:)) )
-        END DO
+        CUgMatNoAbs(ind,jnd)=CUgDistinct(IgDistinct(ind,jnd))
       END DO
     END DO
     ! Only the lower half of the Ug matrix was calculated, this completes the upper half
@@ -116,7 +115,7 @@ MODULE ug_matrix_mod
   END IF
   ind=INhkl*INhkl
   !===================================== ! Send UgMat to all cores
-  CALL MPI_BCAST(CUgMatNoAbs,ind,MPI_DOUBLE_PRECISION,0,MPI_COMM_WORLD,IErr)
+  CALL MPI_BCAST(CUgMatNoAbs,ind,MPI_DOUBLE_PRECISION,0,group_comm,IErr)
   !=====================================
   
   CALL message( LM,dbg3, "Ug matrix, without absorption (nm^-2)" )!LM, dbg3
@@ -127,6 +126,260 @@ MODULE ug_matrix_mod
 
   END SUBROUTINE UgMatrix
 
+  !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  !>
+  !! Procedure-description: Brings CUgDistinct up to date with the atoms in the unit
+  !! cell, recalculating only the basis atoms that have changed since the last call
+  !! unless a full recalculation is needed (see the module description)
+  !!
+  SUBROUTINE UgDistinctUpdate(RPreFactor,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    ! global inputs
+    USE IPARA, ONLY : INhkl,INAtomsUnitCell,IAtomicNumber,IAnisoDW,IAtomSite,&
+          IAnisoDebyeWallerFactorFlag,IMaxPossibleNAtomsUnitCell
+    USE RPARA, ONLY : RgMatrix,RAtomCoordinate,ROccupancy,RDebyeWallerConstant,&
+          RBasisAtomPosition
+    ! global outputs
+    USE RPARA, ONLY : RIsoDW
+
+    IMPLICIT NONE
+
+    REAL(RKIND),INTENT(IN) :: RPreFactor
+    INTEGER(IKIND),INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,INSites,IChanged,IChangedAtoms
+    REAL(RKIND),DIMENSION(:,:),ALLOCATABLE :: Rg,RAtom
+    COMPLEX(CKIND),DIMENSION(:),ALLOCATABLE :: CUgNew
+    LOGICAL :: LFull
+
+    IErr=0
+    INSites=SIZE(RBasisAtomPosition,1)
+    LFull=.FALSE.
+    IF (.NOT.ALLOCATED(IgDistinct)) THEN
+      CALL DistinctgVectors(IErr)
+      IF(l_alert(IErr,"UgDistinctUpdate","DistinctgVectors")) RETURN
+      ALLOCATE(CUgDistinct(INg),CUgSite(INg,INSites),RgCached(INg,ITHREE),&
+            RAtomCached(IMaxPossibleNAtomsUnitCell,8),STAT=IErr)
+      IF(l_alert(IErr,"UgDistinctUpdate","allocate CUgDistinct")) RETURN
+      LFull=.TRUE.
+    END IF
+
+    ALLOCATE(Rg(INg,ITHREE),RAtom(INAtomsUnitCell,8),CUgNew(INg),STAT=IErr)
+    IF(l_alert(IErr,"UgDistinctUpdate","allocations")) RETURN
+    DO ind=1,INg
+      Rg(ind,:)=RgMatrix(IgFirst(1,ind),IgFirst(2,ind),:)
+    END DO
+    ! use default in felix.inp for unrealistic values in the cif
+    IF (IAnisoDebyeWallerFactorFlag.EQ.0) THEN
+      WHERE(RIsoDW(1:INAtomsUnitCell).GT.10.OR.RIsoDW(1:INAtomsUnitCell).LT.0) &
+            RIsoDW(1:INAtomsUnitCell) = RDebyeWallerConstant
+    END IF
+    DO ind=1,INAtomsUnitCell
+      RAtom(ind,:)=(/ RAtomCoordinate(ind,:),ROccupancy(ind),RIsoDW(ind),&
+            REAL(IAtomicNumber(ind),RKIND),REAL(IAnisoDW(ind),RKIND),&
+            REAL(IAtomSite(ind),RKIND) /)
+    END DO
+
+    IF (.NOT.LFull) LFull = IAnisoDebyeWallerFactorFlag.NE.0 .OR. &
+          IUgUpdates.GE.IUgRebuildInterval .OR. RPreFactor.NE.RPreFactorCached .OR. &
+          ANY(Rg.NE.RgCached)
+    IF (LFull) THEN
+      DO ind=1,INSites
+        CALL SiteUg(ind,Rg,RPreFactor,CUgSite(:,ind),IErr)
+        IF(l_alert(IErr,"UgDistinctUpdate","SiteUg")) RETURN
+      END DO
+      CUgDistinct=SUM(CUgSite,DIM=2)
+      IUgUpdates=0
+      CALL message(LL,dbg3,"Ug matrix calculated for all basis atoms, distinct g-vectors = ",INg)
+    ELSE
+      IChanged=0
+      IChangedAtoms=0
+      DO ind=1,INSites
+        IF (.NOT.SiteChanged(ind,RAtom)) CYCLE
+        CALL SiteUg(ind,Rg,RPreFactor,CUgNew,IErr)
+        IF(l_alert(IErr,"UgDistinctUpdate","SiteUg")) RETURN
+        CUgDistinct=CUgDistinct+(CUgNew-CUgSite(:,ind))
+        CUgSite(:,ind)=CUgNew
+        IChanged=IChanged+1
+        IChangedAtoms=IChangedAtoms+COUNT(IAtomSite(1:INAtomsUnitCell).EQ.ind)
+      END DO
+      IUgUpdates=IUgUpdates+1
+      CALL message(LL,dbg3,"Ug matrix updated for basis atoms, unit cell atoms changed = ",&
+            (/ IChanged,IChangedAtoms /))
+    END IF
+
+    RgCached=Rg
+    RPreFactorCached=RPreFactor
+    INAtomsCached=INAtomsUnitCell
+    RAtomCached(1:INAtomsUnitCell,:)=RAtom
+    DEALLOCATE(Rg,RAtom,CUgNew)
+
+  END SUBROUTINE UgDistinctUpdate
+
+  !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  !>
+  !! Procedure-description: Finds the distinct g-vectors (differences of hkl) in the
+  !! lower triangle of the Ug matrix, IgDistinct and IgFirst
+  !!
+  SUBROUTINE DistinctgVectors(IErr)
+
+    USE MyNumbers
+    USE message_mod
+    USE utilities_mod, ONLY : SortIndex
+
+    ! global inputs
+    USE IPARA, ONLY : INhkl
+    USE RPARA, ONLY : Rhkl
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,jnd,knd,INPairs,IMaxhkl,IBase
+    INTEGER(IKIND),DIMENSION(3) :: Idhkl
+    INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IOrder
+    INTEGER(IKIND),DIMENSION(:,:),ALLOCATABLE :: IPair
+    REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RKey
+
+    INPairs=INhkl*(INhkl-1)/2
+    ALLOCATE(IgDistinct(INhkl,INhkl),RKey(INPairs),IOrder(INPairs),IPair(2,INPairs),&
+          STAT=IErr)
+    IF(l_alert(IErr,"DistinctgVectors","allocations")) RETURN
+    ! each g-vector g(ind)-g(jnd) as one number, exact in a REAL(RKIND)
+    IMaxhkl=2*MAXVAL(ABS(NINT(Rhkl(1:INhkl,:))))
+    IBase=2*IMaxhkl+1
+    knd=0
+    DO ind=2,INhkl
+      DO jnd=1,ind-1
+        knd=knd+1
+        Idhkl=NINT(Rhkl(ind,:))-NINT(Rhkl(jnd,:))+IMaxhkl
+        RKey(knd)=REAL((Idhkl(1)*IBase+Idhkl(2))*IBase+Idhkl(3),RKIND)
+        IPair(:,knd)=(/ ind,jnd /)
+      END DO
+    END DO
+    CALL SortIndex(RKey,IOrder,INPairs)
+
+    IgDistinct=0
+    INg=0
+    DO knd=1,INPairs
+      IF (knd.EQ.1) THEN
+        INg=1
+      ELSE IF (RKey(IOrder(knd)).NE.RKey(IOrder(knd-1))) THEN
+        INg=INg+1
+      END IF
+      IgDistinct(IPair(1,IOrder(knd)),IPair(2,IOrder(knd)))=INg
+    END DO
+    ALLOCATE(IgFirst(2,INg),STAT=IErr)
+    IF(l_alert(IErr,"DistinctgVectors","allocate IgFirst")) RETURN
+    DO knd=INPairs,1,-1
+      IgFirst(:,IgDistinct(IPair(1,knd),IPair(2,knd)))=IPair(:,knd)
+    END DO
+    DEALLOCATE(RKey,IOrder,IPair)
+
+  END SUBROUTINE DistinctgVectors
+
+  !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  !>
+  !! Procedure-description: Ug of each distinct g-vector from the atoms in the unit
+  !! cell generated by basis atom ISite
+  !!
+  SUBROUTINE SiteUg(ISite,Rg,RPreFactor,CUgSiteOut,IErr)
+
+    USE MyNumbers
+
+    ! global inputs
+    USE IPARA, ONLY : INAtomsUnitCell,IAtomicNumber,IAnisoDW,IAtomSite,&
+          IAnisoDebyeWallerFactorFlag
+    USE RPARA, ONLY : RIsoDW,ROccupancy,RAtomCoordinate,RAnisotropicDebyeWallerFactorTensor
+    ! global should be local to Ug.f90
+    USE IPARA, ONLY : ICurrentZ
+    USE RPARA, ONLY : RCurrentGMagnitude
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(IN) :: ISite
+    REAL(RKIND),INTENT(IN) :: Rg(INg,ITHREE),RPreFactor
+    COMPLEX(CKIND),INTENT(OUT) :: CUgSiteOut(INg)
+    INTEGER(IKIND),INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,knd
+    REAL(RKIND) :: RScatteringFactor
+
+    IErr=0
+    CUgSiteOut=CZERO
+    DO knd=1,INAtomsUnitCell
+      IF (IAtomSite(knd).NE.ISite) CYCLE
+      ICurrentZ = IAtomicNumber(knd) ! atomic number, Z, NB passed as a global variable for absorption
+      DO ind=1,INg
+        RCurrentGMagnitude = SQRT(DOT_PRODUCT(Rg(ind,:),Rg(ind,:)))
+        ! Get scattering factor
+        CALL AtomicScatteringFactor(RScatteringFactor,IErr)
+        ! Occupancy
+        RScatteringFactor = RScatteringFactor*ROccupancy(knd)
+        ! Debye-Waller factor
+        IF (IAnisoDebyeWallerFactorFlag.EQ.0) THEN
+          ! Isotropic D-W factor
+          ! exp(-B sin(theta)^2/lamda^2) = exp(-Bs^2) = exp(-Bg^2/16pi^2), see e.g. Bird&King
+          RScatteringFactor = RScatteringFactor*EXP(-RIsoDW(knd)*(RCurrentGMagnitude**2)/(FOUR*TWOPI**2) )
+        ELSE ! anisotropic Debye-Waller factor
+          !?? this will need sorting out, may not work
+          RScatteringFactor = RScatteringFactor * &
+              EXP( -DOT_PRODUCT( Rg(ind,:), &
+              MATMUL(RAnisotropicDebyeWallerFactorTensor(IAnisoDW(knd),:,:),Rg(ind,:)) ) )
+        END IF
+        ! Here we go directly to Ug's, missing out the Fourier components of the potential Vg
+        ! (formerly calculated as CVgij).  If the Vg's are desired they can be obtained from 
+        ! multiplying RScatteringFactor by RScattFacToVolts,
+        ! or by multiplying Ug's by (RScattFacToVolts/RPreFactor)
+        ! The structure factor equation, complex Ug(ind,jnd)=sum(f*exp(-ig.r)) in Volts
+        CUgSiteOut(ind)=CUgSiteOut(ind)+RPreFactor*RScatteringFactor*&
+            EXP(-CIMAGONE*DOT_PRODUCT(Rg(ind,:),RAtomCoordinate(knd,:)) )
+      END DO
+    END DO
+
+  END SUBROUTINE SiteUg
+
+  !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  !>
+  !! Procedure-description: True if the atoms generated by basis atom ISite differ
+  !! from when CUgSite was calculated, in number, order or any of RAtom
+  !!
+  LOGICAL FUNCTION SiteChanged(ISite,RAtom)
+
+    USE MyNumbers
+
+    ! global inputs
+    USE IPARA, ONLY : INAtomsUnitCell
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(IN) :: ISite
+    REAL(RKIND),INTENT(IN) :: RAtom(:,:)
+    INTEGER(IKIND) :: ind,jnd
+
+    SiteChanged=.TRUE.
+    ind=0
+    jnd=0
+    DO
+      ! next atom of this site now and when cached, 8 is the basis atom
+      ind=ind+1
+      DO WHILE (ind.LE.INAtomsUnitCell)
+        IF (NINT(RAtom(ind,8)).EQ.ISite) EXIT
+        ind=ind+1
+      END DO
+      jnd=jnd+1
+      DO WHILE (jnd.LE.INAtomsCached)
+        IF (NINT(RAtomCached(jnd,8)).EQ.ISite) EXIT
+        jnd=jnd+1
+      END DO
+      IF (ind.GT.INAtomsUnitCell.AND.jnd.GT.INAtomsCached) EXIT
+      IF (ind.GT.INAtomsUnitCell.OR.jnd.GT.INAtomsCached) RETURN
+      IF (ANY(RAtom(ind,1:7).NE.RAtomCached(jnd,1:7))) RETURN
+    END DO
+    SiteChanged=.FALSE.
+
+  END FUNCTION SiteChanged
+
   !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
   !>
   !! Procedure-description: Select case using IAbsorbFLAG and calculate U'g prime in parallel
@@ -152,7 +405,7 @@ MODULE ug_matrix_mod
     USE CPARA, ONLY : CUgMatNoAbs
     USE SPARA, ONLY : SPrintString
     USE IPARA, ONLY : IAbsorbFLAG, INAtomsUnitCell, ISymmetryRelations, IEquivalentUgKey, &
-          IAtomicNumber
+          IAtomicNumber, IEquivalentUgLocation, INhkl
     USE RPARA, ONLY : RAbsorptionPercentage, RAngstromConversion, RElectronCharge, &
           RElectronMass, RElectronVelocity, RPlanckConstant, RRelativisticCorrection, &
           RVolume,RIsoDW,ROccupancy,RgMatrix,Rhkl,RAtomCoordinate,RScattFacToVolts !&
@@ -167,7 +420,7 @@ MODULE ug_matrix_mod
     REAL(RKIND),DIMENSION(3) :: RCurrentG
     COMPLEX(CKIND),DIMENSION(:),ALLOCATABLE :: CLocalUgPrime,CUgPrime
     REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RLocalUgReal,RLocalUgImag,RUgReal,RUgImag
-    INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: Ipos,Inum
+    INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: Ipos,Inum,IUgPosition
     
     !--------------------------------------------------------------------  
     !  select absorption model
@@ -196,9 +449,9 @@ MODULE ug_matrix_mod
       ! work through unique Ug's
       IUniqueUgs = SIZE(IEquivalentUgKey)
       ! allocations for the U'g to be calculated by this core  
-      ILocalMin = (IUniqueUgs*(my_rank)/p)+1
-      ILocalMax = (IUniqueUgs*(my_rank+1)/p)
-      ALLOCATE(Ipos(p),Inum(p),STAT=IErr)
+      ILocalMin = (IUniqueUgs*(group_rank)/group_p)+1
+      ILocalMax = (IUniqueUgs*(group_rank+1)/group_p)
+      ALLOCATE(Ipos(group_p),Inum(group_p),STAT=IErr)
       IF(l_alert(IErr,"Absorption","allocate Ipos")) RETURN
       ! U'g list for this core [Re,Im]
       ALLOCATE(CLocalUgPrime(ILocalMax-ILocalMin+1),STAT=IErr)
@@ -217,9 +470,9 @@ MODULE ug_matrix_mod
       IF(l_alert(IErr,"Absorption","allocate RUgImag")) RETURN
 
       ! setup position and number for each core
-      DO ind = 1,p ! p is the number of cores
-        Ipos(ind) = IUniqueUgs*(ind-1)/p ! position in the MPI buffer
-        Inum(ind) = IUniqueUgs*(ind)/p - IUniqueUgs*(ind-1)/p ! number of U'g components
+      DO ind = 1,group_p ! group_p is the number of cores simulating together
+        Ipos(ind) = IUniqueUgs*(ind-1)/group_p ! position in the MPI buffer
+        Inum(ind) = IUniqueUgs*(ind)/group_p - IUniqueUgs*(ind-1)/group_p ! number of U'g components
       END DO
 
       !--------------------------------------------------------------------  
@@ -232,7 +485,7 @@ MODULE ug_matrix_mod
         ! number of this Ug
         jnd=IEquivalentUgKey(ind)
         ! find the position of this Ug in the matrix
-        ILoc = MINLOC(ABS(ISymmetryRelations-jnd))
+        ILoc = IEquivalentUgLocation(:,jnd)
         RCurrentG = RgMatrix(ILoc(1),ILoc(2),:) ! g-vector, local variable
         RCurrentGMagnitude = SQRT(DOT_PRODUCT(RgMatrix(ILoc(1),ILoc(2),:),RgMatrix(ILoc(1),ILoc(2),:)))!RgMatrixMagnitude(ILoc(1),ILoc(2)) ! g-vector magnitude
         lnd=0 ! pseudoatom counter
@@ -285,17 +538,17 @@ MODULE ug_matrix_mod
       ! NB MPI_GATHERV(BufferToSend,No.of elements,datatype,ReceivingArray,No.of elements,)
       CALL MPI_GATHERV(RLocalUgReal,SIZE(RLocalUgReal),MPI_DOUBLE_PRECISION,&
                      RUgReal,Inum,Ipos,MPI_DOUBLE_PRECISION,&
-                     root,MPI_COMM_WORLD,IErr)
+                     root,group_comm,IErr)
       IF(l_alert(IErr,"Absorption","MPI_GATHERV RLocalUgReal")) RETURN
       CALL MPI_GATHERV(RLocalUgImag,SIZE(RLocalUgImag),MPI_DOUBLE_PRECISION,&
                      RUgImag,Inum,Ipos,MPI_DOUBLE_PRECISION,&
-                     root,MPI_COMM_WORLD,IErr)
+                     root,group_comm,IErr)
       IF(l_alert(IErr,"Absorption","MPI_GATHERV RLocalUgImag")) RETURN
       !===================================== send out the full list to all cores
       CALL MPI_BCAST(RUgReal,IUniqueUgs,MPI_DOUBLE_PRECISION,&
-                     root,MPI_COMM_WORLD,IErr)
+                     root,group_comm,IErr)
       CALL MPI_BCAST(RUgImag,IUniqueUgs,MPI_DOUBLE_PRECISION,&
-                     root,MPI_COMM_WORLD,IErr)
+                     root,group_comm,IErr)
       !=====================================
 
       DO ind=1,IUniqueUgs
@@ -306,18 +559,25 @@ MODULE ug_matrix_mod
       ! construct CUgMatPrime
       !--------------------------------------------------------------------
 
+      ! where the U'g of each Ug number is in CUgPrime
+      ALLOCATE(IUgPosition(IUniqueUgs),STAT=IErr)
+      IF(l_alert(IErr,"Absorption","allocate IUgPosition")) RETURN
       DO ind=1,IUniqueUgs
-        ! number of this Ug
-        jnd=IEquivalentUgKey(ind)
-        ! Fill CUgMatPrime
-        WHERE(ISymmetryRelations.EQ.jnd)
-          CUgMatPrime = CUgPrime(ind)
-        END WHERE
-        ! NB for imaginary potential U'(g)=-U'(-g)*
-        WHERE(ISymmetryRelations.EQ.-jnd)
-          CUgMatPrime = -CONJG(CUgPrime(ind))
-        END WHERE
+        IUgPosition(IEquivalentUgKey(ind)) = ind
+      END DO
+      ! Fill CUgMatPrime in one pass
+      DO jnd=1,INhkl
+        DO ind=1,INhkl
+          knd=ISymmetryRelations(ind,jnd)
+          IF (knd.GT.0) THEN
+            CUgMatPrime(ind,jnd) = CUgPrime(IUgPosition(knd))
+          ELSE
+            ! NB for imaginary potential U'(g)=-U'(-g)*
+            CUgMatPrime(ind,jnd) = -CONJG(CUgPrime(IUgPosition(-knd)))
+          END IF
+        END DO
       END DO
+      DEALLOCATE(IUgPosition)
 
     CASE DEFAULT ! Default case is no absorption, do nothing
       CALL message( LS,dbg3, "No absorption correction" )
@@ -444,7 +704,7 @@ MODULE ug_matrix_mod
 
     ! global outputs
     USE CPARA, ONLY : CUgMatNoAbs,CUgMatPrime,CUniqueUg,CPseudoAtom,CPseudoScatt
-    USE IPARA, ONLY : ICurrentZ, ISymmetryRelations
+    USE IPARA, ONLY : ICurrentZ, ISymmetryRelations, IEquivalentUgLocation
     USE RPARA, ONLY : RMeanInnerPotential,RgSumMat
     USE SPARA, ONLY : SPrintString
     USE BlochPara, ONLY : RBigK
@@ -467,7 +727,7 @@ MODULE ug_matrix_mod
 
     INTEGER(IKIND) :: ind,jnd,knd,lnd,mnd,oddindlorentz,evenindlorentz,&
           oddindgauss,evenindgauss,currentatom,IErr,Iuid,Iplan_forward,IPseudo
-    INTEGER(IKIND),DIMENSION(2) :: IPos,ILoc
+    INTEGER(IKIND),DIMENSION(2) :: IPos
     COMPLEX(CKIND) :: CVgij,CFpseudo
     REAL(RKIND) :: RMeanInnerPotentialVolts,RScatteringFactor,&
           RPMag,Rx,Ry,Rr,RPalpha,RTheta,Rfold
@@ -621,24 +881,13 @@ MODULE ug_matrix_mod
         CALL message ( LL, dbg3, SPrintString )!LM, dbg3
       END DO
 
-      ISymmetryRelations = 0_IKIND 
-      Iuid = 0_IKIND 
-      DO jnd = 1,INhkl
-        DO ind = 1,INhkl
-          IF(ISymmetryRelations(ind,jnd).NE.0) THEN
-            CYCLE
-          ELSE
-            Iuid = Iuid + 1_IKIND
-            ! fill the symmetry relation matrix with incrementing numbers
-            ! that have the sign of the imaginary part
-            WHERE (ABS(RgSumMat-RgSumMat(ind,jnd)).LE.RTolerance)
-              ISymmetryRelations = Iuid*SIGN(1_IKIND,NINT(AIMAG(CUgMatNoAbs)/(TINY)))
-            END WHERE
-          END IF
-        END DO
-      END DO
+      ! fill the symmetry relation matrix with incrementing numbers
+      ! that have the sign of the imaginary part, and IEquivalentUgLocation
+      CALL SymmetryRelations(RgSumMat,Iuid,IErr)
+      IF(l_alert(IErr,"StructureFactorInitialisation","SymmetryRelations")) RETURN
       DEALLOCATE (RgSumMat)
-      WRITE(SPrintString,FMT='(I5,A25)') Iuid," unique structure factors"
+      WRITE(SPrintString,FMT='(I5,A29,I5,A12)') Iuid," unique structure factors of ",&
+            INhkl," reflections"
       SPrintString=TRIM(ADJUSTL(SPrintString))
       CALL message ( LS, SPrintString )
       CALL message ( LM, dbg3, "hkl: symmetry matrix" )
@@ -654,9 +903,8 @@ MODULE ug_matrix_mod
       IF(l_alert(IErr,"StructureFactorInitialisation","allocate CUniqueUg")) RETURN
 
       DO ind = 1,Iuid
-        ILoc = MINLOC(ABS(ISymmetryRelations-ind))
         IEquivalentUgKey(ind) = ind
-        CUniqueUg(ind) = CUgMatNoAbs(ILoc(1),ILoc(2))
+        CUniqueUg(ind) = CUgMatNoAbs(IEquivalentUgLocation(1,ind),IEquivalentUgLocation(2,ind))
       END DO
 
       ! put them in descending order of magnitude
@@ -669,6 +917,92 @@ MODULE ug_matrix_mod
 
   END SUBROUTINE StructureFactorInitialisation
 
+  !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Numbers the equivalent Ug's, those with the same g sum
+  !! within RTolerance, in ISymmetryRelations, with the sign of the imaginary part of
+  !! each Ug.  Sorting the g sums puts equivalent ones next to each other, so one
+  !! pass through the sorted list finds them all; they are numbered in the order they
+  !! first appear, column by column.  IEquivalentUgLocation is where each number is
+  !! first found, with a positive sign if it has one.
+  !!
+  SUBROUTINE SymmetryRelations(RgSumMat,Iuid,IErr)
+
+    USE MyNumbers
+    USE message_mod
+    USE utilities_mod, ONLY : SortIndex
+
+    ! global outputs
+    USE IPARA, ONLY : ISymmetryRelations, IEquivalentUgLocation
+
+    ! global inputs
+    USE IPARA, ONLY : INhkl
+    USE RPARA, ONLY : RTolerance
+    USE CPARA, ONLY : CUgMatNoAbs
+
+    IMPLICIT NONE
+
+    REAL(RKIND),INTENT(IN) :: RgSumMat(INhkl,INhkl)
+    INTEGER(IKIND),INTENT(OUT) :: Iuid,IErr
+    INTEGER(IKIND) :: ind,jnd,knd,lnd,INSums,IGroups
+    INTEGER(IKIND),DIMENSION(:),ALLOCATABLE :: IOrder,IGroup,IGroupNumber
+    REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RgSums
+    REAL(RKIND) :: RFirst
+
+    INSums = INhkl*INhkl
+    ALLOCATE(RgSums(INSums),IOrder(INSums),IGroup(INSums),STAT=IErr)
+    IF(l_alert(IErr,"SymmetryRelations","allocate RgSums")) RETURN
+    RgSums = RESHAPE(RgSumMat,(/INSums/))
+    CALL SortIndex(RgSums,IOrder,INSums)
+
+    ! a group is every g sum within RTolerance of its smallest
+    IGroups = 0
+    RFirst = ZERO
+    DO knd = 1,INSums
+      IF (knd.EQ.1.OR.RgSums(IOrder(knd))-RFirst.GT.RTolerance) THEN
+        IGroups = IGroups+1
+        RFirst = RgSums(IOrder(knd))
+      END IF
+      IGroup(IOrder(knd)) = IGroups
+    END DO
+    DEALLOCATE(RgSums,IOrder)
+
+    ! number the groups in the order they first appear
+    ALLOCATE(IGroupNumber(IGroups),STAT=IErr)
+    IF(l_alert(IErr,"SymmetryRelations","allocate IGroupNumber")) RETURN
+    IGroupNumber = 0
+    Iuid = 0
+    DO knd = 1,INSums
+      IF (IGroupNumber(IGroup(knd)).EQ.0) THEN
+        Iuid = Iuid+1
+        IGroupNumber(IGroup(knd)) = Iuid
+      END IF
+    END DO
+
+    IF (ALLOCATED(IEquivalentUgLocation)) DEALLOCATE(IEquivalentUgLocation)
+    ALLOCATE(IEquivalentUgLocation(2,Iuid),STAT=IErr)
+    IF(l_alert(IErr,"SymmetryRelations","allocate IEquivalentUgLocation")) RETURN
+    IEquivalentUgLocation = 0
+    knd = 0
+    DO jnd = 1,INhkl
+      DO ind = 1,INhkl
+        knd = knd+1
+        ISymmetryRelations(ind,jnd) = IGroupNumber(IGroup(knd))*&
+              SIGN(1_IKIND,NINT(AIMAG(CUgMatNoAbs(ind,jnd))/(TINY)))
+        lnd = ABS(ISymmetryRelations(ind,jnd))
+        IF (IEquivalentUgLocation(1,lnd).EQ.0) THEN
+          IEquivalentUgLocation(:,lnd) = (/ ind,jnd /)
+        ELSE IF (ISymmetryRelations(ind,jnd).GT.0.AND.ISymmetryRelations(&
+              IEquivalentUgLocation(1,lnd),IEquivalentUgLocation(2,lnd)).LT.0) THEN
+          IEquivalentUgLocation(:,lnd) = (/ ind,jnd /)
+        END IF
+      END DO
+    END DO
+    DEALLOCATE(IGroup,IGroupNumber)
+
+  END SUBROUTINE SymmetryRelations
+
   !!$%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
   
   !>
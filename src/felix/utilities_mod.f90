@@ -186,6 +186,71 @@ MODULE utilities_mod
 
   END SUBROUTINE ReSortUgs
 
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+  !>
+  !! Procedure-description: Heapsort of an index, so that RValues(IIndex) is in
+  !! ascending order; equal values keep their original order.  N*log(N), for long
+  !! lists such as every element of the Ug matrix
+  !!
+  SUBROUTINE SortIndex(RValues,IIndex,N)
+
+    USE MyNumbers
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(IN) :: N
+    REAL(RKIND),INTENT(IN) :: RValues(N)
+    INTEGER(IKIND),INTENT(OUT) :: IIndex(N)
+    INTEGER(IKIND) :: ind,IDummy
+
+    DO ind = 1,N
+      IIndex(ind) = ind
+    END DO
+    ! make a heap, the last in order at the top
+    DO ind = N/2,1,-1
+      CALL SiftDown(ind,N)
+    END DO
+    ! then move the top to the end of the shrinking heap
+    DO ind = N,2,-1
+      IDummy = IIndex(1)
+      IIndex(1) = IIndex(ind)
+      IIndex(ind) = IDummy
+      CALL SiftDown(1_IKIND,ind-1)
+    END DO
+
+  CONTAINS
+
+    SUBROUTINE SiftDown(IStart,IEnd)
+
+      INTEGER(IKIND),INTENT(IN) :: IStart,IEnd
+      INTEGER(IKIND) :: IRoot,IChild,ISwap
+
+      IRoot = IStart
+      DO WHILE (2*IRoot.LE.IEnd)
+        IChild = 2*IRoot
+        IF (IChild.LT.IEnd) THEN
+          IF (Before(IIndex(IChild),IIndex(IChild+1))) IChild = IChild+1
+        END IF
+        IF (.NOT.Before(IIndex(IRoot),IIndex(IChild))) RETURN
+        ISwap = IIndex(IRoot)
+        IIndex(IRoot) = IIndex(IChild)
+        IIndex(IChild) = ISwap
+        IRoot = IChild
+      END DO
+
+    END SUBROUTINE SiftDown
+
+    ! element I comes before element J, ties by position
+    LOGICAL FUNCTION Before(I,J)
+
+      INTEGER(IKIND),INTENT(IN) :: I,J
+
+      Before = RValues(I).LT.RValues(J).OR.(RValues(I).EQ.RValues(J).AND.I.LT.J)
+
+    END FUNCTION Before
+
+  END SUBROUTINE SortIndex
+
   !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
   !>
   !! Procedure-description: 
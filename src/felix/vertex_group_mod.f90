@@ -0,0 +1,215 @@
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+! Felix
+!
+! Richard Beanland, Keith Evans & Rudolf A Roemer
+!
+! (C) 2013-19, all rights reserved
+!
+! Version: :VERSION:
+! Date:    :DATE:
+! Time:    :TIME:
+! Status:  :RLSTATUS:
+! Build:   :BUILD:
+! Author:  :AUTHOR:
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+!
+!  Felix is free software: you can redistribute it and/or modify
+!  it under the terms of the GNU General Public License as published by
+!  the Free Software Foundation, either version 3 of the License, or
+!  (at your option) any later version.
+!
+!  Felix is distributed in the hope that it will be useful,
+!  but WITHOUT ANY WARRANTY; without even the implied warranty of
+!  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+!  GNU General Public License for more details.
+!
+!  You should have received a copy of the GNU General Public License
+!  along with Felix.  If not, see <http://www.gnu.org/licenses/>.
+!
+!%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+!>
+!! Module-description:
+!!
+!! Groups of cores that simulate several points of parameter space side by side,
+!! IVertexGroups in felix.inp.  Pixel parallelism stops paying once each core has only a
+!! few pixels, so SetVertexGroups splits MPI_COMM_WORLD into IVertexGroups groups of
+!! consecutive ranks and everything a simulation does (Ug matrix, absorption, pixel
+!! schedule, gathering the patterns and the figure of merit) uses group_comm instead.
+!! SimulateVertices then shares a list of points out between the groups and returns the
+!! fit of every point on every core.  Rank 0 leads group 0, so output written by rank 0
+!! only is unchanged.  Used by simplex refinement, see ParallelDownhillSimplex.
+!!
+MODULE vertex_group_mod
+
+  USE MyNumbers, ONLY : IKIND, RKIND, ZERO
+
+  IMPLICIT NONE
+  PRIVATE
+  PUBLIC :: SetVertexGroups, SimulateVertices
+
+  CONTAINS
+
+  !>
+  !! Procedure-description: Splits the cores into IVertexGroups groups for a simplex
+  !! refinement, after felix.inp has been read.  Otherwise group_comm stays MPI_COMM_WORLD.
+  !!
+  SUBROUTINE SetVertexGroups(IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    ! global inputs
+    USE IPARA, ONLY : IVertexGroups, ISimFLAG, IRefineMethodFLAG
+    USE SPARA, ONLY : SPrintString
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+
+    IErr=0
+    IF (IVertexGroups.LE.1.OR.ISimFLAG.NE.0) RETURN
+    IF (IRefineMethodFLAG.NE.1) THEN
+      CALL message(LS,"IVertexGroups is only used by simplex refinement, ignoring it")
+      RETURN
+    END IF
+    n_groups = MIN(IVertexGroups,p)
+    my_group = my_rank*n_groups/p
+    ! ordered by rank, so rank 0 is rank 0 of group 0
+    CALL MPI_Comm_split(MPI_COMM_WORLD,my_group,my_rank,group_comm,IErr)
+    IF(l_alert(IErr,"SetVertexGroups","MPI_Comm_split")) RETURN
+    CALL MPI_Comm_rank(group_comm,group_rank,IErr)
+    IF(l_alert(IErr,"SetVertexGroups","MPI_Comm_rank")) RETURN
+    CALL MPI_Comm_size(group_comm,group_p,IErr)
+    IF(l_alert(IErr,"SetVertexGroups","MPI_Comm_size")) RETURN
+    WRITE(SPrintString,FMT='(I0,A,I0,A)') n_groups," groups of ",p/n_groups,&
+          " or more cores will simulate simplex points side by side"
+    CALL message(LS,SPrintString)
+
+  END SUBROUTINE SetVertexGroups
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Simulates the points RPoints(:,ind) as iterations IIters(ind),
+  !! point ind by group MOD(ind-1,n_groups), and returns the figure of merit and best
+  !! thickness of every point on every core.  Rank 0 then adds them all to
+  !! iteration_log.txt in the order of RPoints.  With LMask the first core of each group
+  !! keeps the pixels most different from the baseline in RImageAvi, as SimplexRefinement
+  !! does for masked correlation, and rank 0 ends up with those of all the groups.
+  !!
+  SUBROUTINE SimulateVertices(RPoints,IIters,RFits,IThicknesses,LMask,IErr)
+
+    USE message_mod
+    USE MyMPI
+
+    USE refinementcontrol_mod, ONLY : SimulateAndFit, LLogIterations
+    USE write_output_mod, ONLY : OutputVariables, WriteLogRow
+
+    ! global inputs
+    USE RPARA, ONLY : RFigureofMerit, RImageSimi, RImageBase
+    USE SPARA, ONLY : SPrintString
+    ! global outputs
+    USE RPARA, ONLY : RImageAvi
+
+    IMPLICIT NONE
+
+    REAL(RKIND), DIMENSION(:,:), INTENT(IN) :: RPoints
+    INTEGER(IKIND), DIMENSION(:), INTENT(IN) :: IIters
+    REAL(RKIND), DIMENSION(:), INTENT(OUT) :: RFits
+    INTEGER(IKIND), DIMENSION(:), INTENT(OUT) :: IThicknesses
+    LOGICAL, INTENT(IN) :: LMask
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,INoOfPoints,Iter,IThicknessIndex,IShape(4)
+    INTEGER(IKIND), DIMENSION(SIZE(IIters)) :: IGroupThicknesses
+    REAL(RKIND), DIMENSION(SIZE(RPoints,1)) :: RPoint
+    REAL(RKIND), DIMENSION(SIZE(RFits)) :: RGroupFits
+    REAL(RKIND), DIMENSION(:), ALLOCATABLE :: RDataOut
+    REAL(RKIND), DIMENSION(:,:), ALLOCATABLE :: RGroupRows, RRows
+    REAL(RKIND), DIMENSION(:,:,:,:), ALLOCATABLE :: RDifference, RHighest, RLowest
+
+    IErr=0
+    INoOfPoints = SIZE(RPoints,2)
+    WRITE(SPrintString,FMT='(A,I0,A,I0,A)') "Simulating ",INoOfPoints," points, ",&
+          MIN(n_groups,INoOfPoints)," at a time"
+    CALL message(LS,SPrintString)
+    ! the log rows are the same length whatever the point
+    CALL OutputVariables(RDataOut,IErr)
+    IF(l_alert(IErr,"SimulateVertices","OutputVariables")) RETURN
+    ALLOCATE(RGroupRows(SIZE(RDataOut),INoOfPoints),RRows(SIZE(RDataOut),INoOfPoints),&
+          STAT=IErr)
+    IF(l_alert(IErr,"SimulateVertices","allocate RGroupRows")) RETURN
+    RGroupFits = ZERO
+    IGroupThicknesses = 0
+    RGroupRows = ZERO
+
+    ! each group simulates its own points, rank 0 logs them all afterwards
+    LLogIterations = .FALSE.
+    DO ind = 1,INoOfPoints
+      IF (MOD(ind-1,n_groups).NE.my_group) CYCLE
+      RPoint = RPoints(:,ind)
+      Iter = IIters(ind)
+      CALL SimulateAndFit(RPoint,Iter,IThicknessIndex,IErr)
+      IF(l_alert(IErr,"SimulateVertices","SimulateAndFit")) RETURN
+      IF (group_rank.NE.0) CYCLE ! the fit and thickness are on the first core only
+      RGroupFits(ind) = RFigureofMerit
+      IGroupThicknesses(ind) = IThicknessIndex
+      CALL OutputVariables(RDataOut,IErr)
+      IF(l_alert(IErr,"SimulateVertices","OutputVariables")) RETURN
+      RGroupRows(:,ind) = RDataOut
+      IF (LMask) THEN ! replace pixels that are the most different from baseline
+        WHERE (ABS(RImageSimi-RImageBase).GT.ABS(RImageAvi-RImageBase))
+          RImageAvi=RImageSimi
+        END WHERE
+      END IF
+    END DO
+    LLogIterations = .TRUE.
+
+    !===================================== ! every point was simulated by one group only
+    CALL MPI_ALLREDUCE(RGroupFits,RFits,INoOfPoints,MPI_DOUBLE_PRECISION,MPI_SUM,&
+          MPI_COMM_WORLD,IErr)
+    IF(l_alert(IErr,"SimulateVertices","MPI_ALLREDUCE RFits")) RETURN
+    CALL MPI_ALLREDUCE(IGroupThicknesses,IThicknesses,INoOfPoints,MPI_INTEGER,MPI_SUM,&
+          MPI_COMM_WORLD,IErr)
+    IF(l_alert(IErr,"SimulateVertices","MPI_ALLREDUCE IThicknesses")) RETURN
+    CALL MPI_REDUCE(RGroupRows,RRows,SIZE(RRows),MPI_DOUBLE_PRECISION,MPI_SUM,root,&
+          MPI_COMM_WORLD,IErr)
+    IF(l_alert(IErr,"SimulateVertices","MPI_REDUCE RRows")) RETURN
+    !=====================================
+    IF (my_rank.EQ.0) THEN
+      DO ind = 1,INoOfPoints
+        CALL WriteLogRow(IIters(ind),RFits(ind),RRows(:,ind),IErr)
+        IF(l_alert(IErr,"SimulateVertices","WriteLogRow")) RETURN
+      END DO
+    END IF
+
+    IF (LMask.AND.n_groups.GT.1) THEN
+      ! the differences from the baseline furthest above and below it, over all the groups
+      IShape = SHAPE(RImageAvi)
+      ALLOCATE(RDifference(IShape(1),IShape(2),IShape(3),IShape(4)),&
+            RHighest(IShape(1),IShape(2),IShape(3),IShape(4)),&
+            RLowest(IShape(1),IShape(2),IShape(3),IShape(4)),STAT=IErr)
+      IF(l_alert(IErr,"SimulateVertices","allocate RDifference")) RETURN
+      RDifference = ZERO
+      IF (group_rank.EQ.0) RDifference = RImageAvi-RImageBase
+      CALL MPI_REDUCE(RDifference,RHighest,SIZE(RDifference),MPI_DOUBLE_PRECISION,&
+            MPI_MAX,root,MPI_COMM_WORLD,IErr)
+      IF(l_alert(IErr,"SimulateVertices","MPI_REDUCE RHighest")) RETURN
+      CALL MPI_REDUCE(RDifference,RLowest,SIZE(RDifference),MPI_DOUBLE_PRECISION,&
+            MPI_MIN,root,MPI_COMM_WORLD,IErr)
+      IF(l_alert(IErr,"SimulateVertices","MPI_REDUCE RLowest")) RETURN
+      IF (my_rank.EQ.0) THEN
+        WHERE (ABS(RHighest).GE.ABS(RLowest))
+          RImageAvi = RImageBase+RHighest
+        ELSEWHERE
+          RImageAvi = RImageBase+RLowest
+        END WHERE
+      END IF
+      DEALLOCATE(RDifference,RHighest,RLowest)
+    END IF
+
+  END SUBROUTINE SimulateVertices
+
+END MODULE vertex_group_mod
@@ -41,7 +41,12 @@ MODULE write_output_mod
   IMPLICIT NONE
   PRIVATE
   PUBLIC :: WriteIterationOutputWrapper, WriteIterationOutput, WriteOutVariables, &
-        NormaliseExperimentalImagesAndWriteOut,WriteDifferenceImages,UncertBrak
+        NormaliseExperimentalImagesAndWriteOut,WriteDifferenceImages,UncertBrak,&
+        WriteUnblurredStack,WriteResultImages,WriteResultLogRow,OutputVariables,WriteLogRow
+
+  ! IResultFileFLAG: the results file is replaced by the first write of a run
+  LOGICAL, SAVE :: LResultFileStarted = .FALSE.
+  INTEGER(4), PARAMETER :: IResultFileVersion = 1, IResultImages = 1, IResultLogRow = 2
 
   CONTAINS
 
@@ -158,6 +163,7 @@ MODULE write_output_mod
     ! global inputs/outputs
     USE IPARA, ONLY : IPrint, IPreviousPrintedIteration
     USE SPARA, ONLY : SPrintString
+    USE timing_mod, ONLY : TimerStart, TimerStop, ITimeOutput
     
     IMPLICIT NONE
     INTEGER(IKIND),INTENT(IN) :: Iter,IThicknessIndex,IPrintFLAG
@@ -167,6 +173,7 @@ MODULE write_output_mod
     IF(l_alert(IErr,"WriteIterationOutputWrapper","Unexpectedly recieved Iter = 0")) RETURN
 
     IF(my_rank.EQ.0) THEN
+      CALL TimerStart(ITimeOutput)
       ! use IPrint and IPrintFLAG to specify how often to write Iteration output
       SELECT CASE(IPrintFLAG)
       
@@ -188,6 +195,7 @@ MODULE write_output_mod
           CALL WriteIterationOutput(Iter,IThicknessIndex,IErr)
           
       END SELECT
+      CALL TimerStop(ITimeOutput)
       IF(l_alert(IErr,"WriteIterationOutputWrapper","WriteIterationOutput")) RETURN
 
     END IF
@@ -305,7 +313,8 @@ MODULE write_output_mod
     USE message_mod
     
     ! global inputs
-    USE IPARA, ONLY : ILN,IPixelCount,ISimFLAG,IOutPutReflections,INoOfLacbedPatterns,INhkl,IByteSize
+    USE IPARA, ONLY : ILN,IPixelCount,ISimFLAG,IOutPutReflections,INoOfLacbedPatterns,INhkl,IByteSize,&
+          IUnblurredFLAG,IResultFileFLAG
     USE CPARA, ONLY : CUgMat
     USE RPARA, ONLY : Rhkl,RgPool, RImageSimi, RInitialThickness, RDeltaThickness
     USE SPARA, ONLY : SChemicalFormula
@@ -334,8 +343,15 @@ MODULE write_output_mod
     path = SChemicalFormula(1:ILN) // "_" // path ! This adds chemical to folder name
     CALL system('mkdir ' // path)
 
+    ! IResultFileFLAG=1 puts the images in the results file instead of .bin files
+    IF (IResultFileFLAG.GE.1) THEN
+      CALL WriteResultImages(Iter,IThicknessIndex,IErr)
+      IF(l_alert(IErr,"WriteIterationOutput","WriteResultImages")) RETURN
+    END IF
+
     ! Write Images to disk
     DO ind = 1,INoOfLacbedPatterns
+      IF (IResultFileFLAG.EQ.1) EXIT
       ! Make the hkl string e.g. -2-2+10
       jnd=NINT(Rhkl(IOutPutReflections(ind),1))
       IF (ABS(jnd).LT.10) THEN
@@ -393,6 +409,12 @@ MODULE write_output_mod
     END DO
 
     CLOSE(IChOut)    
+
+    ! the unblurred stack holds every thickness, so a simulation writes it once
+    IF (IUnblurredFLAG.EQ.1.AND.(ISimFLAG.EQ.0.OR.IThicknessIndex.EQ.1)) THEN
+      CALL WriteUnblurredStack(Iter,TRIM(ADJUSTL(path))//"_unblurred.fxu",IErr)
+      IF(l_alert(IErr,"WriteIterationOutput","WriteUnblurredStack")) RETURN
+    END IF
     
     RETURN  
     
@@ -400,6 +422,206 @@ MODULE write_output_mod
 
   !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
+  !>
+  !! Procedure-description: Writes the simulated images of every pattern and thickness
+  !! as they were before the Gaussian blur, so that RBlurRadius can be re-fitted
+  !! afterwards (gui/blurscan.py) without repeating the Bloch wave calculation.
+  !! One little-endian stream file: a 48-byte header
+  !!   'FXUB', version, 2*IPixelCount, INoOfLacbedPatterns, IThicknessCount, Iter
+  !!   (4-byte integers), RInitialThickness, RDeltaThickness, RBlurRadius (8-byte reals)
+  !! then the hkl of each pattern (4-byte integers) and the images as 4-byte reals
+  !! in the order of RImageSimiUnblurred(x,y,pattern,thickness).
+  !!
+  SUBROUTINE WriteUnblurredStack(Iter,SFilePath,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelCount,IOutPutReflections,INoOfLacbedPatterns,IThicknessCount
+    USE RPARA, ONLY : Rhkl,RInitialThickness,RDeltaThickness,RBlurRadius,RImageSimiUnblurred
+    USE IChannels, ONLY : IChOutWIImage
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: Iter
+    CHARACTER(*), INTENT(IN) :: SFilePath
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(4), PARAMETER :: IUnblurredVersion = 1
+
+    CALL message ( LL, dbg6, SFilePath )
+    OPEN(UNIT=IChOutWIImage,STATUS='REPLACE',FILE=SFilePath,FORM='UNFORMATTED',&
+          ACCESS='STREAM',CONVERT='LITTLE_ENDIAN',IOSTAT=IErr)
+    IF(l_alert(IErr,"WriteUnblurredStack","OPEN() "//SFilePath)) RETURN
+    WRITE(IChOutWIImage,IOSTAT=IErr) 'FXUB', IUnblurredVersion, INT(2*IPixelCount,4), &
+          INT(INoOfLacbedPatterns,4), INT(IThicknessCount,4), INT(Iter,4), &
+          REAL(RInitialThickness,8), REAL(RDeltaThickness,8), REAL(RBlurRadius,8), &
+          INT(NINT(TRANSPOSE(Rhkl(IOutPutReflections(1:INoOfLacbedPatterns),:))),4)
+    IF(l_alert(IErr,"WriteUnblurredStack","WRITE() header of "//SFilePath)) RETURN
+    WRITE(IChOutWIImage,IOSTAT=IErr) REAL(RImageSimiUnblurred,4)
+    IF(l_alert(IErr,"WriteUnblurredStack","WRITE() images of "//SFilePath)) RETURN
+    CLOSE(IChOutWIImage,IOSTAT=IErr)
+    IF(l_alert(IErr,"WriteUnblurredStack","CLOSE() "//SFilePath)) RETURN
+
+  END SUBROUTINE WriteUnblurredStack
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Opens the results file of IResultFileFLAG, <formula>_results.fxr,
+  !! for appending a block (gui/resultfile.py reads it).  The first call of a run replaces
+  !! any old file and writes the 40-byte file header
+  !!   'FXRC', version (4-byte integer), chemical formula (32 characters)
+  !! The file is little-endian and closed after every block, so it is readable while
+  !! felix runs and holds every complete block if felix stops.  A refinement resumed
+  !! from a checkpoint appends to the file of the run it carries on from.
+  !!
+  SUBROUTINE OpenResultFile(IErr)
+
+    USE MyNumbers
+    USE message_mod
+    USE checkpoint_mod, ONLY : LCheckpointLoaded
+
+    ! global inputs
+    USE IPARA, ONLY : ILN
+    USE SPARA, ONLY : SChemicalFormula
+    USE IChannels, ONLY : IChOutResults
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    CHARACTER(32) :: SFormula
+    CHARACTER(200) :: SFilePath
+
+    SFilePath = SChemicalFormula(1:ILN)//"_results.fxr"
+    IF (LCheckpointLoaded.AND..NOT.LResultFileStarted) THEN
+      INQUIRE(FILE=TRIM(SFilePath),EXIST=LResultFileStarted)
+    END IF
+    IF (LResultFileStarted) THEN
+      OPEN(UNIT=IChOutResults,STATUS='OLD',FILE=TRIM(SFilePath),FORM='UNFORMATTED',&
+            ACCESS='STREAM',CONVERT='LITTLE_ENDIAN',POSITION='APPEND',IOSTAT=IErr)
+      IF(l_alert(IErr,"OpenResultFile","OPEN() "//TRIM(SFilePath))) RETURN
+    ELSE
+      CALL message ( LL, dbg6, "Starting results file "//TRIM(SFilePath) )
+      OPEN(UNIT=IChOutResults,STATUS='REPLACE',FILE=TRIM(SFilePath),FORM='UNFORMATTED',&
+            ACCESS='STREAM',CONVERT='LITTLE_ENDIAN',IOSTAT=IErr)
+      IF(l_alert(IErr,"OpenResultFile","OPEN() "//TRIM(SFilePath))) RETURN
+      SFormula = SChemicalFormula(1:ILN)
+      WRITE(IChOutResults,IOSTAT=IErr) 'FXRC', IResultFileVersion, SFormula
+      IF(l_alert(IErr,"OpenResultFile","WRITE() header of "//TRIM(SFilePath))) RETURN
+      LResultFileStarted = .TRUE.
+    END IF
+
+  END SUBROUTINE OpenResultFile
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Appends one block to the results file.  A block is a 48-byte
+  !! header
+  !!   'FXB1', kind, iteration, size (4-byte integers), thickness in A (8-byte real),
+  !!   chunk count, codec, bytes per value, 0 (4-byte integers), payload bytes (8-byte)
+  !! then the hkl of each chunk (3 4-byte integers each), the byte length of each chunk
+  !! (8-byte integers) and the chunks.  felix writes codec 0, raw 8-byte reals;
+  !! resultfile.py can rewrite a file with zlib-compressed chunks (codec 1).
+  !!
+  SUBROUTINE WriteResultBlock(IBlockKind,Iter,ISize,RThickness,IChunkhkl,RChunks,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    ! global inputs
+    USE IChannels, ONLY : IChOutResults
+
+    IMPLICIT NONE
+
+    INTEGER(4), INTENT(IN) :: IBlockKind
+    INTEGER(IKIND), INTENT(IN) :: Iter,ISize
+    REAL(RKIND), INTENT(IN) :: RThickness
+    INTEGER(IKIND), DIMENSION(:,:), INTENT(IN) :: IChunkhkl ! (3,chunks)
+    REAL(RKIND), DIMENSION(:,:), INTENT(IN) :: RChunks ! (values,chunks)
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+    INTEGER(8) :: IChunkBytes
+
+    CALL OpenResultFile(IErr)
+    IF(l_alert(IErr,"WriteResultBlock","OpenResultFile")) RETURN
+    IChunkBytes = 8_8*SIZE(RChunks,DIM=1)
+    WRITE(IChOutResults,IOSTAT=IErr) 'FXB1', IBlockKind, INT(Iter,4), INT(ISize,4), &
+          REAL(RThickness,8), INT(SIZE(RChunks,DIM=2),4), 0_4, 8_4, 0_4, &
+          IChunkBytes*SIZE(RChunks,DIM=2), INT(IChunkhkl,4), &
+          (IChunkBytes, ind=1,SIZE(RChunks,DIM=2))
+    IF(l_alert(IErr,"WriteResultBlock","WRITE() block header")) RETURN
+    WRITE(IChOutResults,IOSTAT=IErr) REAL(RChunks,8)
+    IF(l_alert(IErr,"WriteResultBlock","WRITE() block")) RETURN
+    CLOSE(IChOutResults,IOSTAT=IErr)
+    IF(l_alert(IErr,"WriteResultBlock","CLOSE() results file")) RETURN
+
+  END SUBROUTINE WriteResultBlock
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Appends the simulated images of one thickness to the results
+  !! file, one chunk per pattern holding its rows as they would be in the .bin file.
+  !!
+  SUBROUTINE WriteResultImages(Iter,IThicknessIndex,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    ! global inputs
+    USE IPARA, ONLY : IPixelCount,IOutPutReflections,INoOfLacbedPatterns
+    USE RPARA, ONLY : Rhkl,RImageSimi,RInitialThickness,RDeltaThickness
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: Iter,IThicknessIndex
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind
+    REAL(RKIND),DIMENSION(4*IPixelCount**2,INoOfLacbedPatterns) :: RChunks
+
+    DO ind = 1,INoOfLacbedPatterns
+      ! a .bin record is RImageSimi(jnd,:), so the rows are those of the transpose
+      RChunks(:,ind) = RESHAPE(TRANSPOSE(RImageSimi(:,:,ind,IThicknessIndex)),&
+            [4*IPixelCount**2])
+    END DO
+    CALL WriteResultBlock(IResultImages,Iter,2*IPixelCount,&
+          RInitialThickness+(IThicknessIndex-1)*RDeltaThickness,&
+          NINT(TRANSPOSE(Rhkl(IOutPutReflections(1:INoOfLacbedPatterns),:))),RChunks,IErr)
+    IF(l_alert(IErr,"WriteResultImages","WriteResultBlock")) RETURN
+
+  END SUBROUTINE WriteResultImages
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Appends the line WriteLogRow adds to iteration_log.txt
+  !! to the results file, as one chunk of Iter, the figure of merit and the variables.
+  !!
+  SUBROUTINE WriteResultLogRow(Iter,RFit,RDataOut,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND), INTENT(IN) :: Iter
+    REAL(RKIND), INTENT(IN) :: RFit
+    REAL(RKIND), DIMENSION(:), INTENT(IN) :: RDataOut
+    INTEGER(IKIND), INTENT(OUT) :: IErr
+    INTEGER(IKIND), DIMENSION(3,1) :: IZerohkl = 0
+    REAL(RKIND), DIMENSION(SIZE(RDataOut)+2,1) :: RRow
+
+    RRow(:,1) = [REAL(Iter,RKIND), RFit, RDataOut]
+    CALL WriteResultBlock(IResultLogRow,Iter,SIZE(RRow,DIM=1,KIND=IKIND),ZERO,&
+          IZerohkl,RRow,IErr)
+    IF(l_alert(IErr,"WriteResultLogRow","WriteResultBlock")) RETURN
+
+  END SUBROUTINE WriteResultLogRow
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
   !>
   !! Procedure-description: Write out structure.cif containing non symmetrically relate
   !! atomic positions.
@@ -533,23 +755,48 @@ MODULE write_output_mod
     USE MyNumbers
     USE message_mod
 
+    ! global inputs
+    USE RPARA, ONLY : RFigureofMerit
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(IN) :: Iter
+    INTEGER(IKIND) :: IErr
+    REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RDataOut
+
+    CALL OutputVariables(RDataOut,IErr)
+    IF(l_alert(IErr,"WriteOutVariables","OutputVariables")) RETURN
+    CALL WriteLogRow(Iter,RFigureofMerit,RDataOut,IErr)
+    IF(l_alert(IErr,"WriteOutVariables","WriteLogRow")) RETURN
+
+  END SUBROUTINE WriteOutVariables
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: The current values of the refined types of variable, in the
+  !! order they go in IterationLog.txt
+  !!
+  SUBROUTINE OutputVariables(RDataOut,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
     ! global inputs
     USE IPARA, ONLY : IAbsorbFLAG, IRefineMode, INoofUgs, IUgOffset, &
                       IRefinementVariableTypes
     USE RPARA, ONLY : RBasisAtomPosition, RBasisOccupancy, RBasisIsoDW, &
-                      RAnisotropicDebyeWallerFactorTensor, RFigureofMerit, &
+                      RAnisotropicDebyeWallerFactorTensor, &
                       RAbsorptionPercentage, RLengthX, RLengthY, RLengthZ, RAlpha, RBeta, &
                       RGamma, RConvergenceAngle, RAcceleratingVoltage                    
     USE CPARA, ONLY : CUniqueUg
-    USE IChannels, ONLY : IChOutSimplex     
 
     IMPLICIT NONE
 
-    INTEGER(IKIND),INTENT(IN) :: Iter
-    INTEGER(IKIND) :: IErr,ind,IStart,IEnd,jnd,ITotalOutputVariables
-    CHARACTER(200) :: SFormat, STotalOutputVariables
+    REAL(RKIND),DIMENSION(:),ALLOCATABLE,INTENT(OUT) :: RDataOut
+    INTEGER(IKIND),INTENT(OUT) :: IErr
+    INTEGER(IKIND) :: ind,IStart,IEnd,jnd,ITotalOutputVariables
     INTEGER(IKIND),DIMENSION(IRefinementVariableTypes) :: IOutputVariables
-    REAL(RKIND),DIMENSION(:),ALLOCATABLE :: RDataOut
 
     ! Need to Determine total no. of variables to be written out
     ! this is different from the no. of refinement variables
@@ -578,6 +825,7 @@ MODULE write_output_mod
     ITotalOutputVariables = SUM(IOutputVariables) ! Total Output
 
     ALLOCATE(RDataOut(ITotalOutputVariables),STAT=IErr)
+    IF(l_alert(IErr,"OutputVariables","allocate RDataOut")) RETURN
     DO jnd = 1,IRefinementVariableTypes
       IF(IRefineMode(jnd).EQ.0) THEN
         CYCLE ! The refinement variable type is not being refined, skip
@@ -620,15 +868,46 @@ MODULE write_output_mod
       END SELECT
     END DO
 
-    WRITE(STotalOutputVariables,*) ITotalOutputVariables
+  END SUBROUTINE OutputVariables
+
+  !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+
+  !>
+  !! Procedure-description: Appends a line of Iter, the figure of merit RFit and the
+  !! variables from OutputVariables to IterationLog.txt
+  !!
+  SUBROUTINE WriteLogRow(Iter,RFit,RDataOut,IErr)
+
+    USE MyNumbers
+    USE message_mod
+
+    ! global inputs
+    USE IPARA, ONLY : IResultFileFLAG
+    USE IChannels, ONLY : IChOutSimplex     
+
+    IMPLICIT NONE
+
+    INTEGER(IKIND),INTENT(IN) :: Iter
+    REAL(RKIND),INTENT(IN) :: RFit
+    REAL(RKIND),DIMENSION(:),INTENT(IN) :: RDataOut
+    INTEGER(IKIND),INTENT(OUT) :: IErr
+    CHARACTER(200) :: SFormat, STotalOutputVariables
+
+    IErr=0
+    WRITE(STotalOutputVariables,*) SIZE(RDataOut)
     WRITE(SFormat,*) "(I5.1,1X,F13.9,1X,"//TRIM(ADJUSTL(STotalOutputVariables))//"(F13.9,1X))"
 
     OPEN(UNIT=IChOutSimplex,FILE='iteration_log.txt',FORM='formatted',STATUS='unknown',&
           POSITION='append')
-    WRITE(UNIT=IChOutSimplex,FMT=SFormat) Iter,RFigureofMerit,RDataOut
+    WRITE(UNIT=IChOutSimplex,FMT=SFormat) Iter,RFit,RDataOut
     CLOSE(IChOutSimplex)
 
-  END SUBROUTINE WriteOutVariables
+    IF (IResultFileFLAG.GE.1) THEN
+      CALL WriteResultLogRow(Iter,RFit,RDataOut,IErr)
+      IF(l_alert(IErr,"WriteLogRow","WriteResultLogRow")) RETURN
+    END IF
+
+  END SUBROUTINE WriteLogRow
 
   !%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 
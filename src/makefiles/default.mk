@@ -27,6 +27,7 @@ $(DIRFELIX)$(PRECISION)smodules.o \
 $(DIRFELIX)$(PRECISION)test_koch_mod.o \
 $(DIRFELIX)$(PRECISION)l_alert_mod.o \
 $(DIRFELIX)$(PRECISION)message_mod.o \
+$(DIRFELIX)$(PRECISION)timing_mod.o \
 $(DIRFELIX)$(PRECISION)utilities_mod.o \
 $(DIRFELIX)$(PRECISION)read_cif_mod.o \
 $(DIRFELIX)$(PRECISION)read_files_mod.o \
@@ -34,11 +35,15 @@ $(DIRFELIX)$(PRECISION)setup_reflections_mod.o \
 $(DIRFELIX)$(PRECISION)set_scatter_factors_mod.o \
 $(DIRFELIX)$(PRECISION)crystallography_mod.o \
 $(DIRFELIX)$(PRECISION)ug_matrix_mod.o \
+$(DIRFELIX)$(PRECISION)eigen_cache_mod.o \
 $(DIRFELIX)$(PRECISION)bloch_mod.o \
 $(DIRFELIX)$(PRECISION)image_initialisation_mod.o \
 $(DIRFELIX)$(PRECISION)setup_space_group_mod.o \
+$(DIRFELIX)$(PRECISION)checkpoint_mod.o \
+$(DIRFELIX)$(PRECISION)pixel_schedule_mod.o \
 $(DIRFELIX)$(PRECISION)write_output_mod.o \
 $(DIRFELIX)$(PRECISION)refinementcontrol_mod.o \
+$(DIRFELIX)$(PRECISION)vertex_group_mod.o \
 $(DIRFELIX)$(PRECISION)simplex_mod.o \
 $(DIRFELIX)$(PRECISION)felixrefine.o \
 